@@ -35,6 +35,107 @@ import logging
 logger = logging.getLogger('newfies.filelog')
 
 
+def answercall(obj_callrequest, post):
+    """Mark the call request in progress and return the commands of its
+    voice application
+
+    **Attributes**:
+
+        * ``obj_callrequest`` - Callrequest of the ALegRequestUUID
+        * ``post`` - Parameters of the Plivo callback
+
+    Return the result to render in RESTXML.
+    """
+    opt_CallUUID = post.get('CallUUID')
+
+    #TODO: If we update the Call to success here we should
+    # not do it in hangup url
+
+    #TODO : use constant
+    obj_callrequest.status = 8  # IN-PROGRESS
+    obj_callrequest.aleg_uuid = opt_CallUUID
+    Callrequest.objects.filter(id=obj_callrequest.id)\
+        .update(status=8, aleg_uuid=opt_CallUUID)
+
+    # check if Voice App
+    if obj_callrequest.content_object.__class__.__name__ != 'VoiceApp':
+        object_list = []
+        logger.error('Error with App type, not a VoiceApp!')
+    else:
+        data = obj_callrequest.content_object.data
+        tts_language = obj_callrequest.content_object.tts_language
+
+        extra_data = obj_callrequest.campaign.extra_data
+        if extra_data and len(extra_data) > 1:
+            #check if we have a voice_app_data tag to replace
+            voice_app_data = search_tag_string(extra_data,
+                            'voice_app_data')
+            if voice_app_data:
+                data = voice_app_data
+
+        if obj_callrequest.content_object.type == 1:
+            #Dial
+            timelimit = obj_callrequest.timelimit
+            callerid = obj_callrequest.callerid
+            gatewaytimeouts = obj_callrequest.timeout
+            gateways = obj_callrequest.content_object.gateway.gateways
+            dial_command = 'Dial timeLimit="%s" ' \
+                           'callerId="%s" ' \
+                           'callbackUrl="%s"' % \
+                           (timelimit,
+                            callerid,
+                            PLIVO_DEFAULT_DIALCALLBACK_URL)
+            number_command = 'Number gateways="%s" ' \
+                             'gatewayTimeouts="%s"' % \
+                             (gateways, gatewaytimeouts)
+
+            object_list = [{dial_command: {number_command: data}}]
+            logger.debug('Dial command')
+
+        elif obj_callrequest.content_object.type == 2:
+            #PlayAudio
+            object_list = [{'Play': data}]
+            logger.debug('PlayAudio')
+
+        elif obj_callrequest.content_object.type == 3:
+            #Conference
+            object_list = [{'Conference': data}]
+            logger.debug('Conference')
+
+        elif obj_callrequest.content_object.type == 4:
+            #Speak
+            if settings.TTS_ENGINE != 'ACAPELA':
+                object_list = [{'Speak': data}]
+                logger.debug('Speak')
+            else:
+                import acapela
+                DIRECTORY = settings.MEDIA_ROOT + '/tts/'
+                domain = Site.objects.get_current().domain
+                tts_acapela = acapela.Acapela(
+                    settings.TTS_ENGINE,
+                    settings.ACCOUNT_LOGIN,
+                    settings.APPLICATION_LOGIN,
+                    settings.APPLICATION_PASSWORD,
+                    settings.SERVICE_URL,
+                    settings.QUALITY,
+                    DIRECTORY)
+                tts_acapela.prepare(
+                    data,
+                    tts_language,
+                    settings.ACAPELA_GENDER,
+                    settings.ACAPELA_INTONATION)
+                output_filename = tts_acapela.run()
+
+                audiofile_url = domain + settings.MEDIA_URL +\
+                                'tts/' + output_filename
+                object_list = [{'Play': audiofile_url}]
+                logger.debug('PlayAudio-TTS')
+        else:
+            object_list = []
+            logger.error('Error with Voice App type!')
+    return object_list
+
+
 class AnswercallValidation(Validation):
     """
     Answercall Validation Class
@@ -132,94 +233,9 @@ class AnswercallResource(ModelResource):
         if not errors:
             logger.debug('Answercall API get called!')
 
-            opt_ALegRequestUUID = request.POST.get('ALegRequestUUID')
-            opt_CallUUID = request.POST.get('CallUUID')
-
-            #TODO: If we update the Call to success here we should
-            # not do it in hangup url
             obj_callrequest = Callrequest.objects\
-                .get(request_uuid=opt_ALegRequestUUID)
-
-            #TODO : use constant
-            obj_callrequest.status = 8  # IN-PROGRESS
-            obj_callrequest.aleg_uuid = opt_CallUUID
-            obj_callrequest.save()
-
-            # check if Voice App
-            if obj_callrequest.content_object.__class__.__name__ != 'VoiceApp':
-                object_list = []
-                logger.error('Error with App type, not a VoiceApp!')
-            else:
-                data = obj_callrequest.content_object.data
-                tts_language = obj_callrequest.content_object.tts_language
-
-                extra_data = obj_callrequest.campaign.extra_data
-                if extra_data and len(extra_data) > 1:
-                    #check if we have a voice_app_data tag to replace
-                    voice_app_data = search_tag_string(extra_data,
-                                    'voice_app_data')
-                    if voice_app_data:
-                        data = voice_app_data
-
-                if obj_callrequest.content_object.type == 1:
-                    #Dial
-                    timelimit = obj_callrequest.timelimit
-                    callerid = obj_callrequest.callerid
-                    gatewaytimeouts = obj_callrequest.timeout
-                    gateways = obj_callrequest.content_object.gateway.gateways
-                    dial_command = 'Dial timeLimit="%s" ' \
-                                   'callerId="%s" ' \
-                                   'callbackUrl="%s"' % \
-                                   (timelimit,
-                                    callerid,
-                                    PLIVO_DEFAULT_DIALCALLBACK_URL)
-                    number_command = 'Number gateways="%s" ' \
-                                     'gatewayTimeouts="%s"' % \
-                                     (gateways, gatewaytimeouts)
-
-                    object_list = [{dial_command: {number_command: data}}]
-                    logger.debug('Dial command')
-
-                elif obj_callrequest.content_object.type == 2:
-                    #PlayAudio
-                    object_list = [{'Play': data}]
-                    logger.debug('PlayAudio')
-
-                elif obj_callrequest.content_object.type == 3:
-                    #Conference
-                    object_list = [{'Conference': data}]
-                    logger.debug('Conference')
-
-                elif obj_callrequest.content_object.type == 4:
-                    #Speak
-                    if settings.TTS_ENGINE != 'ACAPELA':
-                        object_list = [{'Speak': data}]
-                        logger.debug('Speak')
-                    else:
-                        import acapela
-                        DIRECTORY = settings.MEDIA_ROOT + '/tts/'
-                        domain = Site.objects.get_current().domain
-                        tts_acapela = acapela.Acapela(
-                            settings.TTS_ENGINE,
-                            settings.ACCOUNT_LOGIN,
-                            settings.APPLICATION_LOGIN,
-                            settings.APPLICATION_PASSWORD,
-                            settings.SERVICE_URL,
-                            settings.QUALITY,
-                            DIRECTORY)
-                        tts_acapela.prepare(
-                            data,
-                            tts_language,
-                            settings.ACAPELA_GENDER,
-                            settings.ACAPELA_INTONATION)
-                        output_filename = tts_acapela.run()
-
-                        audiofile_url = domain + settings.MEDIA_URL +\
-                                        'tts/' + output_filename
-                        object_list = [{'Play': audiofile_url}]
-                        logger.debug('PlayAudio-TTS')
-                else:
-                    logger.error('Error with Voice App type!')
+                .get(request_uuid=request.POST.get('ALegRequestUUID'))
+            object_list = answercall(obj_callrequest, request.POST)
 
             obj = CustomXmlEmitter()
             return self.create_response(request,
@@ -14,72 +14,100 @@
 # Arezqui Belaid <info@star2billing.com>
 #
 
+from django.conf.urls.defaults import url
+from django.http import HttpResponse
+from django.utils import simplejson
+
 from tastypie.resources import ModelResource
 from tastypie.authentication import BasicAuthentication
 from tastypie.authorization import Authorization
-from tastypie.validation import Validation
 from tastypie.throttle import BaseThrottle
-from tastypie.exceptions import BadRequest
+from tastypie.exceptions import ImmediateHttpResponse
+from tastypie import http
 
-from dialer_campaign.models import Contact, Phonebook
+from dialer_campaign.models import Contact, Phonebook, contact_batch
 from dialer_campaign.function_def import check_dialer_setting, \
                                     dialer_setting_limit
+from dialer_campaign.contact_import import CONTACT_FIELD, \
+                                    CONTACT_IMPORT_CHUNK, \
+                                    clean_contact_data, insert_contact_chunk
 
+from StringIO import StringIO
+import csv
 import logging
 
 logger = logging.getLogger('newfies.filelog')
 
+# Contacts accepted per call
+BULK_CONTACT_MAX_ROW = 50000
 
-class BulkContactValidation(Validation):
-    """BulkContact Validation Class"""
-    def is_valid(self, bundle, request=None):
-        errors = {}
 
-        if not bundle.data:
-            errors['Data'] = ['Data set is empty']
-        if check_dialer_setting(request, check_for="contact"):
-            errors['contact_dialer_setting'] = ["You have too many contacts \
-                per campaign. You are allowed a maximum of %s" %\
-                            dialer_setting_limit(request, limit_for="contact")]
-
-        phonebook_id = bundle.data.get('phonebook_id')
-        if phonebook_id:
-            try:
-                Phonebook.objects.get(id=phonebook_id)
-            except Phonebook.DoesNotExist:
-                errors['phonebook_error'] = ["Phonebook is not selected!"]
-        else:
-            errors['phonebook_error'] = ["Phonebook is not selected!"]
+def parse_bulk_contact(request):
+    """Return the phonebook id and the list of contacts of the request
 
-        return errors
+    The body is either JSON, a dict with ``phonebook_id`` and ``contacts``
+    (list of contact records or numbers) or ``phoneno_list`` (numbers
+    separated by commas), or a list of contact records with the
+    ``phonebook_id`` in the query string; or CSV, one contact per line
+    with the columns of the contact import, only the number is required.
+    """
+    phonebook_id = request.GET.get('phonebook_id')
+    content_type = request.META.get('CONTENT_TYPE', '')
+    if content_type.startswith('application/json'):
+        data = simplejson.loads(request.body)
+        if isinstance(data, dict):
+            phonebook_id = data.get('phonebook_id', phonebook_id)
+            if data.get('phoneno_list'):
+                contact_list = data['phoneno_list'].split(',')
+            else:
+                contact_list = data.get('contacts') or []
+        else:
+            contact_list = data
+        contact_list = [isinstance(item, dict) and item or {'contact': item}
+                        for item in contact_list]
+    else:
+        contact_list = [dict(zip(CONTACT_FIELD, row))
+                        for row in csv.reader(StringIO(request.body))
+                        if row]
+    return phonebook_id, contact_list
 
 
 class BulkContactResource(ModelResource):
     """API to bulk create contacts
 
+    Up to 50000 contacts are created per call, the contacts already in the
+    phonebook or repeated in the call are skipped and the result of each
+    contact is returned.
+
     **Attributes**
 
-        * ``contact`` - contact number of the Subscriber
         * ``phonebook_id`` - the phonebook Id to which we want to add\
-        the contact
-
-    **Validation**:
-
-        * BulkContactValidation()
+        the contacts
+        * ``contacts`` - list of contacts, with the fields contact,\
+        last_name, first_name, email, description, status and\
+        additional_vars, only the contact number is required
+        * ``phoneno_list`` - contact numbers separated by commas
 
     **CURL Usage**::
 
         curl -u username:password --dump-header - -H "Content-Type:application/json" -X POST --data '{"phonebook_id": "1", "phoneno_list" : "12345,54344"}' http://localhost:8000/api/v1/bulkcontact/
 
+        curl -u username:password --dump-header - -H "Content-Type:application/json" -X POST --data '{"phonebook_id": "1", "contacts" : [{"contact": "12345", "last_name": "Belaid", "email": "areski@gmail.com"}, {"contact": "54344", "status": 0}]}' http://localhost:8000/api/v1/bulkcontact/
+
+        curl -u username:password --dump-header - -H "Content-Type:text/csv" -X POST --data-binary @contact.csv http://localhost:8000/api/v1/bulkcontact/?phonebook_id=1
+
     **Response**::
 
         HTTP/1.0 201 CREATED
         Date: Thu, 13 Oct 2011 11:42:44 GMT
         Server: WSGIServer/0.1 Python/2.7.1+
         Vary: Accept-Language, Cookie
-        Content-Type: text/html; charset=utf-8
-        Location: http://localhost:8000/api/v1/bulkcontact/None/
+        Content-Type: application/json; charset=utf-8
         Content-Language: en-us
+
+        {"created": 1, "duplicate": 1, "invalid": 0,
+         "result": [{"row": 1, "contact": "12345", "status": "created"},
+                    {"row": 2, "contact": "12345", "status": "duplicate"}]}
     """
     class Meta:
         queryset = Contact.objects.all()
@@ -87,35 +115,88 @@ class BulkContactResource(ModelResource):
         authorization = Authorization()
         authentication = BasicAuthentication()
         allowed_methods = ['post']
-        validation = BulkContactValidation()
         throttle = BaseThrottle(throttle_at=1000, timeframe=3600)
 
-    def obj_create(self, bundle, request=None, **kwargs):
-        """
-        A ORM-specific implementation of ``obj_create``.
-        """
+    def override_urls(self):
+        """Override urls"""
+        return [
+            url(r'^(?P<resource_name>%s)/$' %\
+                self._meta.resource_name, self.wrap_view('bulk_create')),
+            ]
+
+    def error_response(self, error_msg):
+        logger.error(error_msg)
+        raise ImmediateHttpResponse(response=http.HttpBadRequest(
+            content=simplejson.dumps({'error': error_msg}),
+            content_type='application/json'))
+
+    def bulk_create(self, request=None, **kwargs):
+        """POST method of BulkContact API"""
         logger.debug('BulkContact API get called')
+        if request.method != 'POST':
+            raise ImmediateHttpResponse(response=http.HttpMethodNotAllowed())
+        auth_result = self._meta.authentication.is_authenticated(request)
+        if not auth_result is True:
+            raise ImmediateHttpResponse(response=http.HttpUnauthorized())
+        self.throttle_check(request)
+        self.log_throttled_access(request)
 
-        bundle.obj = self._meta.object_class()
-        bundle = self.full_hydrate(bundle)
-
-        phoneno_list = bundle.data.get('phoneno_list')
-        phonebook_id = bundle.data.get('phonebook_id')
-        phonenolist = list(phoneno_list.split(","))
+        if check_dialer_setting(request, check_for="contact"):
+            self.error_response("You have too many contacts per campaign. "
+                "You are allowed a maximum of %s" %
+                dialer_setting_limit(request, limit_for="contact"))
 
+        try:
+            phonebook_id, contact_list = parse_bulk_contact(request)
+        except ValueError:
+            self.error_response("Data set is not valid!")
+        if not contact_list:
+            self.error_response("Data set is empty")
+        if len(contact_list) > BULK_CONTACT_MAX_ROW:
+            self.error_response("Too many contacts, the maximum is %d "
+                                "per call" % BULK_CONTACT_MAX_ROW)
         try:
             obj_phonebook = Phonebook.objects.get(id=phonebook_id)
-            new_contact_count = 0
-            for phoneno in phonenolist:
-                new_contact = Contact.objects.create(
-                    phonebook=obj_phonebook,
-                    contact=phoneno,)
-                new_contact_count = new_contact_count + 1
-                new_contact.save()
-        except:
-            error_msg = "The contact duplicated (%s)!\n" % phoneno
-            logger.error(error_msg)
-            raise BadRequest(error_msg)
-
-        logger.debug('BulkContact API : result ok 200')
-        return bundle
+        except (Phonebook.DoesNotExist, ValueError, TypeError):
+            self.error_response("Phonebook is not selected!")
+
+        result = []
+        count = {'created': 0, 'duplicate': 0, 'invalid': 0}
+        data_list = []
+        #The contacts are added to the campaigns at the end
+        with contact_batch() as phonebook_set:
+            phonebook_set.add(obj_phonebook.id)
+            for row, item in enumerate(contact_list):
+                try:
+                    data = clean_contact_data(item)
+                except (ValueError, TypeError, AttributeError), e:
+                    result.append({'row': row + 1, 'status': 'invalid',
+                                   'contact': item.get('contact'),
+                                   'error': str(e)})
+                    count['invalid'] += 1
+                    continue
+                result.append({'row': row + 1, 'status': 'duplicate',
+                               'contact': data['contact']})
+                data_list.append((len(result) - 1, data))
+                if len(data_list) >= CONTACT_IMPORT_CHUNK:
+                    self.insert_chunk(obj_phonebook.id, data_list, result)
+                    data_list = []
+            if data_list:
+                self.insert_chunk(obj_phonebook.id, data_list, result)
+
+        for item in result:
+            if item['status'] != 'invalid':
+                count[item['status']] += 1
+        count['result'] = result
+        logger.debug('BulkContact API : result ok 201')
+        return HttpResponse(simplejson.dumps(count),
+                            content_type='application/json', status=201)
+
+    def insert_chunk(self, phonebook_id, data_list, result):
+        """Insert a chunk of (index in result, data) and mark the contacts
+        created in the result"""
+        inserted = set([id(data) for data in insert_contact_chunk(
+                        phonebook_id, [data for index, data in data_list])])
+        for index, data in data_list:
+            if id(data) in inserted:
+                result[index]['status'] = 'created'
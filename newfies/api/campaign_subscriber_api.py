@@ -172,43 +172,8 @@ class CampaignSubscriberResource(ModelResource):
         # Assign new contact object
         bundle.obj = new_contact
 
-        # Insert the contact to the campaignsubscriber also for
-        # each campaign using this phonebook
-
-        campaign_obj = Campaign.objects.filter(
-            phonebook=obj_phonebook,
-            user=request.user)
-        for c_campaign in campaign_obj:
-            imported_phonebook = []
-            if c_campaign.imported_phonebook:
-                # for example:- c_campaign.imported_phonebook = 1,2,3
-                # So convert imported_phonebook string into int list
-                imported_phonebook = map(int,
-                    c_campaign.imported_phonebook.split(','))
-
-            phonebook_list = c_campaign.phonebook\
-                                .values_list('id', flat=True)\
-                                .all()
-            phonebook_list = map(int, phonebook_list)
-
-            common_phonebook_list = []
-            if phonebook_list:
-                common_phonebook_list = list(set(imported_phonebook) &\
-                                            set(phonebook_list))
-                if common_phonebook_list:
-                    contact_list = Contact.objects\
-                                .filter(phonebook__in=common_phonebook_list,
-                                    status=1)
-                    for con_obj in contact_list:
-                        try:
-                            CampaignSubscriber.objects.create(
-                                contact=con_obj,
-                                duplicate_contact=con_obj.contact,
-                                status=1,  # START
-                                campaign=c_campaign)
-                        except:
-                            #TODO Catching duplicate error
-                            pass
+        # The campaigns using this phonebook which are not running get the
+        # contact on their next spool, see CampaignPhonebookImport
 
         logger.debug('CampaignSubscriber POST API : result ok 200')
         return bundle
@@ -0,0 +1,259 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+"""
+CDR ingestion
+
+The XML CDRs of FreeSWITCH are stored by batches : the <cdr> elements of a
+bulk POST, or the files written by mod_xml_cdr in its log-dir, are parsed
+with iterparse, their call requests are read with one IN query per chunk
+and the VoIPCalls are inserted with bulk_create. The CDRs without call
+request are reported to the superusers in one digest, at most every
+CDR_NOT_FOUND_DIGEST_INTERVAL seconds.
+"""
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.encoding import smart_str
+from notification import models as notification
+from dialer_cdr.models import Callrequest, VoIPCall
+from api.resources import build_voipcall, CDR_VARIABLES
+from common_functions import chunk_list, bulk_create_chunk
+from itertools import islice
+from time import time
+import xml.etree.cElementTree as ET
+import urllib
+import os
+import logging
+
+logger = logging.getLogger('newfies.filelog')
+
+CDR_VARIABLE_SET = frozenset(CDR_VARIABLES)
+CDR_NOT_FOUND_COUNT_KEY = 'cdr_not_found_count'
+CDR_NOT_FOUND_COUNT_EXPIRE = 60 * 60 * 24
+CDR_NOT_FOUND_DIGEST_KEY = 'cdr_not_found_digest'
+# callrequest_not_found, see user_profile.management
+CALLREQUEST_NOT_FOUND_NOTICE = 8
+
+
+def parse_variables(cdr):
+    """Return the CDR_VARIABLES of the <cdr> element, None when missing"""
+    data = dict.fromkeys(CDR_VARIABLES)
+    variables = cdr.find('variables')
+    if variables is not None:
+        for element in variables:
+            if element.tag in CDR_VARIABLE_SET and element.text:
+                # the values are urlencoded by FreeSWITCH
+                data[element.tag] = urllib.unquote(smart_str(element.text))\
+                                        .decode('utf-8', 'replace')
+    return data
+
+
+def iter_cdr(source):
+    """Yield the variables of each <cdr> element of source, a file name or
+    a file object, the elements are freed once they are read
+
+    Raise SyntaxError when the XML is not well-formed.
+    """
+    for event, element in ET.iterparse(source):
+        if element.tag == 'cdr':
+            yield parse_variables(element)
+            element.clear()
+
+
+def request_uuid_of(data):
+    """Return the RequestUUID of the CDR, Plivo adds "a_" in front of the
+    uuid of the A-Leg"""
+    request_uuid = data['plivo_request_uuid']
+    if request_uuid and request_uuid.startswith('a_'):
+        return request_uuid[2:]
+    return request_uuid
+
+
+@transaction.commit_on_success
+def store_cdr_list(data_list):
+    """Create the A-Leg VoIPCalls of the CDRs of data_list
+
+    Return the count of stored CDRs and the list of the RequestUUIDs
+    without call request. The CDRs not related to Plivo, or invalid, are
+    skipped, a CDR repeated in data_list, or whose call request already
+    has its A-Leg VoIPCall, is stored once.
+    """
+    data_dict = {}
+    for data in data_list:
+        request_uuid = request_uuid_of(data)
+        if request_uuid:
+            data_dict[request_uuid] = data
+        else:
+            logger.error('CDR not related to Newfies/Plivo!')
+
+    callrequest_dict = {}
+    for uuid_chunk in chunk_list(data_dict.keys()):
+        for obj_callrequest in Callrequest.objects\
+                .filter(request_uuid__in=uuid_chunk)\
+                .only('id', 'request_uuid', 'user', 'aleg_gateway'):
+            callrequest_dict[obj_callrequest.request_uuid] = obj_callrequest
+        # stored by a batch sent again, or before a crash of the spool
+        for request_uuid in VoIPCall.objects\
+                .filter(request_uuid__in=uuid_chunk, leg_type=1)\
+                .values_list('request_uuid', flat=True):
+            data_dict.pop(request_uuid, None)
+
+    voipcall_list = []
+    not_found_list = []
+    for request_uuid, data in data_dict.iteritems():
+        obj_callrequest = callrequest_dict.get(request_uuid)
+        if obj_callrequest is None:
+            not_found_list.append(request_uuid)
+            continue
+        try:
+            voipcall_list.append(build_voipcall(obj_callrequest,
+                                                request_uuid, data,
+                                                data_prefix='', leg='a'))
+        except ValueError, e:
+            logger.error('Invalid CDR - uuid:%s : %s' % (request_uuid, e))
+    bulk_create_chunk(VoIPCall, voipcall_list)
+    return len(voipcall_list), not_found_list
+
+
+def notify_callrequest_not_found(request_uuid_list):
+    """Notify the superusers of the CDRs without call request
+
+    One notification holds the count of these CDRs since the previous one,
+    it's sent at most every CDR_NOT_FOUND_DIGEST_INTERVAL seconds.
+    """
+    if not request_uuid_list:
+        return
+    logger.error("Error, there is no callrequest for the uuids %s" % \
+                    ', '.join(request_uuid_list))
+    cache.add(CDR_NOT_FOUND_COUNT_KEY, 0, CDR_NOT_FOUND_COUNT_EXPIRE)
+    try:
+        count = cache.incr(CDR_NOT_FOUND_COUNT_KEY, len(request_uuid_list))
+    except ValueError:
+        count = len(request_uuid_list)
+    if not cache.add(CDR_NOT_FOUND_DIGEST_KEY, 1,
+                     settings.CDR_NOT_FOUND_DIGEST_INTERVAL):
+        return
+    try:
+        # the CDRs counted meanwhile go to the next digest
+        cache.decr(CDR_NOT_FOUND_COUNT_KEY, count)
+    except ValueError:
+        pass
+
+    try:
+        note_label = notification.NoticeType.objects\
+                        .get(default=CALLREQUEST_NOT_FOUND_NOTICE)
+    except notification.NoticeType.DoesNotExist:
+        return
+    # send to all admin user
+    for recipient in User.objects.filter(is_superuser=1, is_active=1):
+        notification.send([recipient],
+                          note_label.label,
+                          {"from_user": recipient,
+                           "count": count},
+                          sender=recipient)
+
+
+def ingest_cdr(source, batch_size=None):
+    """Store the CDRs of source, see iter_cdr, by batches of batch_size
+
+    Return the counts of stored CDRs and of CDRs without call request.
+    """
+    batch_size = batch_size or settings.CDR_INGEST_BATCH
+    stored = not_found = 0
+    cdr_iter = iter_cdr(source)
+    while True:
+        data_list = list(islice(cdr_iter, batch_size))
+        if not data_list:
+            break
+        count, not_found_list = store_cdr_list(data_list)
+        notify_callrequest_not_found(not_found_list)
+        stored += count
+        not_found += len(not_found_list)
+    return stored, not_found
+
+
+class CdrSpool(object):
+    """Store the CDR files written by mod_xml_cdr in its log-dir
+
+    The files of a batch are stored in one transaction, then removed, or
+    moved to the done directory. The files which can't be parsed are moved
+    to the failed directory.
+
+    **Attributes**:
+
+        * ``spool_dir`` - log-dir of mod_xml_cdr
+        * ``batch_size`` - Files stored in one batch
+        * ``done_dir`` - Directory of the stored files, None to remove them
+        * ``min_age`` - Seconds since the last write of a file before it's
+          read, mod_xml_cdr may not have finished it
+    """
+
+    def __init__(self, spool_dir, batch_size=None, done_dir=None, min_age=1):
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size or settings.CDR_INGEST_BATCH
+        self.done_dir = done_dir
+        self.failed_dir = os.path.join(spool_dir, 'failed')
+        self.min_age = min_age
+        self.stored = 0
+        self.not_found = 0
+        self.failed = 0
+
+    def list_files(self):
+        """Return the paths of the CDR files ready to be read"""
+        ready = time() - self.min_age
+        path_list = []
+        for name in os.listdir(self.spool_dir):
+            path = os.path.join(self.spool_dir, name)
+            if name.endswith('.xml') and os.path.isfile(path) \
+                and os.path.getmtime(path) <= ready:
+                path_list.append(path)
+        return path_list
+
+    def move(self, path, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        os.rename(path, os.path.join(directory, os.path.basename(path)))
+
+    def ingest_batch(self, path_list):
+        data_list = []
+        for path in path_list:
+            try:
+                data_list += list(iter_cdr(path))
+            except (SyntaxError, IOError), e:
+                logger.error('Error parse XML - %s : %s' % (path, e))
+                self.move(path, self.failed_dir)
+                self.failed += 1
+        count, not_found_list = store_cdr_list(data_list)
+        notify_callrequest_not_found(not_found_list)
+        self.stored += count
+        self.not_found += len(not_found_list)
+        # removed after the commit, a crash in between reads them again
+        # and the CDRs already stored are skipped
+        for path in path_list:
+            if not os.path.exists(path):
+                continue
+            if self.done_dir:
+                self.move(path, self.done_dir)
+            else:
+                os.remove(path)
+
+    def ingest(self):
+        """Store the CDR files of the spool, return their count"""
+        path_list = self.list_files()
+        for path_chunk in chunk_list(path_list, self.batch_size):
+            self.ingest_batch(path_chunk)
+        return len(path_list)
@@ -34,6 +34,39 @@ import logging
 logger = logging.getLogger('newfies.filelog')
 
 
+def dialcallback(callrequest, post):
+    """Record the CDR of the B-Leg of a call request when it hangs up
+
+    **Attributes**:
+
+        * ``callrequest`` - Callrequest of the DialALegUUID
+        * ``post`` - Parameters of the Plivo callback
+
+    Return the result to render in RESTXML.
+    """
+    #We are just analyzing the hangup
+    if post.get('DialBLegStatus') != 'hangup':
+        return [{'result': 'OK - Bleg status is not Hangup'}]
+    data = {}
+    for element in CDR_VARIABLES:
+        if not post.get('variable_%s' % element):
+            data[element] = None
+        else:
+            data[element] = post.get('variable_%s' % element)
+
+    from_plivo = post.get('From')
+    to_plivo = post.get('To')
+
+    create_voipcall(obj_callrequest=callrequest,
+        plivo_request_uuid=callrequest.request_uuid,
+        data=data,
+        data_prefix='',
+        leg='b',
+        from_plivo=from_plivo,
+        to_plivo=to_plivo)
+    return [{'result': 'OK'}]
+
+
 class DialCallbackValidation(Validation):
     """
     DialCallback Validation Class
@@ -129,36 +162,9 @@ class DialCallbackResource(ModelResource):
 
         if not errors:
             logger.debug('DialCallback API get called!')
-            opt_aleg_uuid = request.POST.get('DialALegUUID')
-            opt_dial_bleg_uuid = request.POST.get('DialBLegUUID')
-            opt_dial_bleg_status = request.POST.get('DialBLegStatus')
-            #We are just analyzing the hangup
-            if opt_dial_bleg_status != 'hangup':
-                object_list = [{'result': 'OK - Bleg status is not Hangup'}]
-                logger.debug('DialCallback API : Result 200!')
-                obj = CustomXmlEmitter()
-                return self.create_response(
-                    request,
-                    obj.render(request, object_list))
-            callrequest = Callrequest.objects.get(aleg_uuid=opt_aleg_uuid)
-            data = {}
-            for element in CDR_VARIABLES:
-                if not request.POST.get('variable_%s' % element):
-                    data[element] = None
-                else:
-                    data[element] = request.POST.get('variable_%s' % element)
-
-            from_plivo = request.POST.get('From')
-            to_plivo = request.POST.get('To')
-
-            create_voipcall(obj_callrequest=callrequest,
-                plivo_request_uuid=callrequest.request_uuid,
-                data=data,
-                data_prefix='',
-                leg='b',
-                from_plivo=from_plivo,
-                to_plivo=to_plivo)
-            object_list = [{'result': 'OK'}]
+            callrequest = Callrequest.objects\
+                .get(aleg_uuid=request.POST.get('DialALegUUID'))
+            object_list = dialcallback(callrequest, request.POST)
             logger.debug('DialCallback API : Result 200!')
             obj = CustomXmlEmitter()
 
@@ -15,6 +15,7 @@
 #
 
 from django.conf.urls.defaults import url
+from django.db import transaction
 from django.http import HttpResponse
 
 from tastypie.resources import ModelResource
@@ -23,22 +24,187 @@ from tastypie.throttle import BaseThrottle
 from tastypie.exceptions import ImmediateHttpResponse
 from tastypie import http
 
-from dialer_cdr.models import Callrequest
-from dialer_cdr.tasks import init_callrequest
+from dialer_cdr.models import Callrequest, VoIPCall
+from dialer_cdr.retry import schedule_retry_list
 from dialer_campaign.models import CampaignSubscriber
-from dialer_campaign.function_def import user_dialer_setting
+from dialer_gateway.capacity import release_gateway
+from survey.results import flush_survey_session
 from api.resources import CustomXmlEmitter, \
                           IpAddressAuthorization, \
                           IpAddressAuthentication,\
-                          create_voipcall,\
+                          build_voipcall,\
                           CDR_VARIABLES
-from datetime import datetime, timedelta
+from common_functions import chunk_list, bulk_create_chunk
+from random import randint
 import logging
-from uuid import uuid1
 
 logger = logging.getLogger('newfies.filelog')
 
 
+# Status of the call requests a hangup can be applied to, once
+HANGUP_PENDING_STATUS = [1, 7, 8]
+
+
+def hangup_status(hangup_cause):
+    """Return the status of the call request and of its subscriber after a
+    hangup"""
+    # 2 / FAILURE ; 3 / RETRY ; 4 / SUCCESS
+    if hangup_cause == 'NORMAL_CLEARING':
+        return 4, 5  # Success ; Complete
+    return 2, 4  # Failure ; Fail
+
+
+def hangup_voipcall(callrequest, post):
+    """Return the unsaved CDR of the A-Leg of a hangup"""
+    data = {}
+    for element in CDR_VARIABLES:
+        if not post.get('variable_%s' % element):
+            data[element] = None
+        else:
+            data[element] = post.get('variable_%s' % element)
+    return build_voipcall(obj_callrequest=callrequest,
+        plivo_request_uuid=post.get('RequestUUID'),
+        data=data,
+        data_prefix='',
+        leg='a',
+        hangup_cause=post.get('HangupCause'),
+        from_plivo=post.get('From'),
+        to_plivo=post.get('To'))
+
+
+def hangupcall(callrequest, post):
+    """Record the hangup of a call request, its CDR and its retry
+
+    **Attributes**:
+
+        * ``callrequest`` - Callrequest of the RequestUUID
+        * ``post`` - Parameters of the Plivo callback
+
+    A call request is hung up once, a repeated callback of Plivo doesn't
+    create another CDR. Return the result to render in RESTXML.
+    """
+    #Store the survey results kept with the call, before the hangup is
+    #recorded, so a callback sent again stores them on an error
+    flush_survey_session([callrequest.aleg_uuid])
+    recorded, gateway_id = record_hangup(callrequest, post)
+    if not recorded:
+        logger.info('Hangupcall already recorded - uuid:%s' % \
+                        callrequest.request_uuid)
+        return [{'result': 'OK'}]
+    #Give back the line of the gateway, once the hangup is committed
+    release_gateway(gateway_id)
+
+    #We will manage the retry directly from the API
+    if callrequest.status == 2 and callrequest.call_type == 1:  # Allow retry
+        schedule_retry_list([callrequest])
+    return [{'result': 'OK'}]
+
+
+@transaction.commit_on_success
+def record_hangup(callrequest, post):
+    """Apply the hangup of a call request, return whether it was recorded
+    and the gateway whose line is given back, None when it holds none"""
+    opt_hangup_cause = post.get('HangupCause')
+    status, subscriber_status = hangup_status(opt_hangup_cause)
+    if not Callrequest.objects\
+            .filter(id=callrequest.id, status__in=HANGUP_PENDING_STATUS)\
+            .update(status=status, hangup_cause=opt_hangup_cause):
+        return False, None
+    gateway_id = None
+    if callrequest.status in (7, 8):  # Process ; In-Progress
+        gateway_id = callrequest.aleg_gateway_id
+    callrequest.status = status
+    callrequest.hangup_cause = opt_hangup_cause
+    if callrequest.campaign_subscriber_id:
+        CampaignSubscriber.objects\
+            .filter(id=callrequest.campaign_subscriber_id)\
+            .update(status=subscriber_status)
+    hangup_voipcall(callrequest, post).save()
+    return True, gateway_id
+
+
+@transaction.commit_on_success
+def record_hangup_list(post_list):
+    """Apply the hangups of post_list, return the number of hangups
+    recorded, the call requests to retry and the gateways whose lines are
+    given back, once per call
+
+    The call requests are claimed with a temporary status, so a hangup
+    queued twice, or handled by two consumers, is applied once. Their
+    status and the subscribers are updated per status, and the CDRs are
+    inserted together.
+    """
+    post_dict = dict((post.get('RequestUUID'), post) for post in post_list)
+    callrequest_list = []
+    for uuid_chunk in chunk_list(post_dict.keys()):
+        callrequest_list += list(Callrequest.objects.filter(
+            request_uuid__in=uuid_chunk, status__in=HANGUP_PENDING_STATUS))
+    token = -randint(1000, 2 ** 30)
+    for callrequest_chunk in chunk_list(callrequest_list):
+        Callrequest.objects\
+            .filter(id__in=[obj.id for obj in callrequest_chunk],
+                    status__in=HANGUP_PENDING_STATUS)\
+            .update(status=token)
+    claimed_set = set(Callrequest.objects.filter(status=token)\
+        .values_list('id', flat=True))
+
+    status_dict = {}
+    subscriber_dict = {}
+    voipcall_list = []
+    retry_list = []
+    release_list = []
+    for callrequest in callrequest_list:
+        if callrequest.id not in claimed_set:
+            continue
+        post = post_dict[callrequest.request_uuid]
+        opt_hangup_cause = post.get('HangupCause')
+        status, subscriber_status = hangup_status(opt_hangup_cause)
+        if callrequest.status in (7, 8):  # Process ; In-Progress
+            release_list.append(callrequest.aleg_gateway_id)
+        callrequest.status = status
+        callrequest.hangup_cause = opt_hangup_cause
+        status_dict.setdefault((status, opt_hangup_cause), [])\
+            .append(callrequest.id)
+        if callrequest.campaign_subscriber_id:
+            subscriber_dict.setdefault(subscriber_status, [])\
+                .append(callrequest.campaign_subscriber_id)
+        voipcall_list.append(hangup_voipcall(callrequest, post))
+        if status == 2 and callrequest.call_type == 1:  # Allow retry
+            retry_list.append(callrequest)
+
+    for (status, hangup_cause), id_list in status_dict.items():
+        for id_chunk in chunk_list(id_list):
+            Callrequest.objects.filter(id__in=id_chunk)\
+                .update(status=status, hangup_cause=hangup_cause)
+    for subscriber_status, id_list in subscriber_dict.items():
+        for id_chunk in chunk_list(id_list):
+            CampaignSubscriber.objects.filter(id__in=id_chunk)\
+                .update(status=subscriber_status)
+    bulk_create_chunk(VoIPCall, voipcall_list)
+    return len(voipcall_list), retry_list, release_list
+
+
+def hangupcall_list(post_list):
+    """Record a batch of hangups queued by the hangupcall webhook, see
+    record_hangup_list, then give back the lines of the gateways and
+    schedule the retries once the batch is committed. The survey results
+    of the calls are stored before, so a batch queued again stores them on
+    an error. Return the number of hangups recorded."""
+    call_uuid_list = []
+    for uuid_chunk in chunk_list([post.get('RequestUUID')
+                                  for post in post_list]):
+        call_uuid_list += Callrequest.objects\
+            .filter(request_uuid__in=uuid_chunk,
+                    status__in=HANGUP_PENDING_STATUS)\
+            .values_list('aleg_uuid', flat=True)
+    flush_survey_session(call_uuid_list)
+    count, retry_list, release_list = record_hangup_list(post_list)
+    for gateway_id in release_list:
+        release_gateway(gateway_id)
+    schedule_retry_list(retry_list)
+    return count
+
+
 class HangupcallValidation(Validation):
     """
     Hangupcall Validation Class
@@ -127,94 +293,11 @@ class HangupcallResource(ModelResource):
         errors = self._meta.validation.is_valid(request)
         if not errors:
             opt_request_uuid = request.POST.get('RequestUUID')
-            opt_hangup_cause = request.POST.get('HangupCause')
-            try:
-                callrequest = Callrequest.objects.get(
-                    request_uuid=opt_request_uuid)
-            except:
-                logger.debug('Hangupcall Error cannot find the Callrequest!')
-            try:
-                obj_subscriber = CampaignSubscriber.objects.get(
-                    id=callrequest.campaign_subscriber.id)
-                if opt_hangup_cause == 'NORMAL_CLEARING':
-                    obj_subscriber.status = 5  # Complete
-                else:
-                    obj_subscriber.status = 4  # Fail
-                obj_subscriber.save()
-            except:
-                logger.debug('Hangupcall Error cannot find the '
-                             'Campaignsubscriber!')
-
-            # 2 / FAILURE ; 3 / RETRY ; 4 / SUCCESS
-            if opt_hangup_cause == 'NORMAL_CLEARING':
-                callrequest.status = 4  # Success
-            else:
-                callrequest.status = 2  # Failure
-            callrequest.hangup_cause = opt_hangup_cause
-            #save callrequest & campaignsubscriber
-            callrequest.save()
-            data = {}
-            for element in CDR_VARIABLES:
-                if not request.POST.get('variable_%s' % element):
-                    data[element] = None
-                else:
-                    data[element] = request.POST.get('variable_%s' % element)
-            from_plivo = request.POST.get('From')
-            to_plivo = request.POST.get('To')
-
-            create_voipcall(obj_callrequest=callrequest,
-                plivo_request_uuid=opt_request_uuid,
-                data=data,
-                data_prefix='',
-                leg='a',
-                hangup_cause=opt_hangup_cause,
-                from_plivo=from_plivo,
-                to_plivo=to_plivo)
-            object_list = [{'result': 'OK'}]
+            callrequest = Callrequest.objects.get(
+                request_uuid=opt_request_uuid)
+            object_list = hangupcall(callrequest, request.POST)
             logger.debug('Hangupcall API : Result 200!')
             obj = CustomXmlEmitter()
-
-            #We will manage the retry directly from the API
-            if opt_hangup_cause != 'NORMAL_CLEARING'\
-            and callrequest.call_type == 1:  # Allow retry
-                #Update to Retry Done
-                callrequest.call_type = 3
-                callrequest.save()
-
-                dialer_set = user_dialer_setting(callrequest.user)
-                if callrequest.num_attempt >= callrequest.campaign.maxretry\
-                or callrequest.num_attempt >= dialer_set.maxretry:
-                    logger.error("Not allowed retry - Maxretry (%d)" %\
-                                 callrequest.campaign.maxretry)
-                else:
-                    #Allowed Retry
-
-                    # TODO : Review Logic
-                    # Create new callrequest, Assign parent_callrequest,
-                    # Change callrequest_type & num_attempt
-                    new_callrequest = Callrequest(
-                        request_uuid=uuid1(),
-                        parent_callrequest_id=callrequest.id,
-                        call_type=1,
-                        num_attempt=callrequest.num_attempt + 1,
-                        user=callrequest.user,
-                        campaign_id=callrequest.campaign_id,
-                        aleg_gateway_id=callrequest.aleg_gateway_id,
-                        content_type=callrequest.content_type,
-                        object_id=callrequest.object_id,
-                        phone_number=callrequest.phone_number)
-                    new_callrequest.save()
-                    #Todo Check if it's a good practice
-                    #implement a PID algorithm
-                    second_towait = callrequest.campaign.intervalretry
-                    launch_date = datetime.now() + \
-                                  timedelta(seconds=second_towait)
-                    logger.info("Init Retry CallRequest at %s" %\
-                                (launch_date.strftime("%b %d %Y %I:%M:%S")))
-                    init_callrequest.apply_async(
-                        args=[new_callrequest.id, callrequest.campaign.id],
-                        eta=launch_date)
-
             return self.create_response(request,
                 obj.render(request, object_list))
         else:
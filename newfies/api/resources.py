@@ -33,6 +33,8 @@ import logging
 
 seed()
 
+# checked on each callback of the media servers
+API_ALLOWED_IP_SET = frozenset(API_ALLOWED_IP)
 
 logger = logging.getLogger('newfies.filelog')
 
@@ -60,7 +62,17 @@ class CustomJSONSerializer(Serializer):
 def create_voipcall(obj_callrequest, plivo_request_uuid, data, data_prefix='',
     leg='a', hangup_cause='', from_plivo='', to_plivo=''):
     """
-    Common function to create CDR / VoIP Call
+    Common function to create CDR / VoIP Call, see build_voipcall
+    """
+    new_voipcall = build_voipcall(obj_callrequest, plivo_request_uuid, data,
+        data_prefix, leg, hangup_cause, from_plivo, to_plivo)
+    new_voipcall.save()
+
+
+def build_voipcall(obj_callrequest, plivo_request_uuid, data, data_prefix='',
+    leg='a', hangup_cause='', from_plivo='', to_plivo=''):
+    """
+    Return the unsaved CDR / VoIP Call, for a bulk_create of CDRs
 
     **Attributes**:
 
@@ -83,11 +95,11 @@ def create_voipcall(obj_callrequest, plivo_request_uuid, data, data_prefix='',
     if leg == 'a':
         #A-Leg
         leg_type = 1
-        used_gateway = obj_callrequest.aleg_gateway
+        used_gateway_id = obj_callrequest.aleg_gateway_id
     else:
         #B-Leg
         leg_type = 2
-        used_gateway = obj_callrequest.content_object.gateway
+        used_gateway_id = obj_callrequest.content_object.gateway_id
 
     #check the right variable for hangup cause
     data_hangup_cause = data["%s%s" % (data_prefix, 'hangup_cause')]
@@ -106,11 +118,11 @@ def create_voipcall(obj_callrequest, plivo_request_uuid, data, data_prefix='',
                     (plivo_request_uuid, leg_type, cdr_hangup_cause))
 
     new_voipcall = VoIPCall(
-                    user=obj_callrequest.user,
+                    user_id=obj_callrequest.user_id,
                     request_uuid=plivo_request_uuid,
                     leg_type=leg_type,
-                    used_gateway=used_gateway,
-                    callrequest=obj_callrequest,
+                    used_gateway_id=used_gateway_id,
+                    callrequest_id=obj_callrequest.id,
                     callid=data["%s%s" % (data_prefix, 'call_uuid')] or '',
                     callerid=from_plivo,
                     phone_number=to_plivo,
@@ -125,8 +137,7 @@ def create_voipcall(obj_callrequest, plivo_request_uuid, data, data_prefix='',
                     hangup_cause=cdr_hangup_cause,
                     hangup_cause_q850=data["%s%s" % \
                                     (data_prefix, 'hangup_cause_q850')] or '',)
-
-    new_voipcall.save()
+    return new_voipcall
 
 
 def get_attribute(attrs, attr_name):
@@ -153,7 +164,7 @@ def save_if_set(record, fproperty, value):
 
 class IpAddressAuthorization(Authorization):
     def is_authorized(self, request, object=None):
-        if request.META['REMOTE_ADDR'] in API_ALLOWED_IP:
+        if request.META['REMOTE_ADDR'] in API_ALLOWED_IP_SET:
             return True
         else:
             raise ImmediateHttpResponse(response=http.HttpUnauthorized())
@@ -162,7 +173,7 @@ class IpAddressAuthorization(Authorization):
 
 class IpAddressAuthentication(Authentication):
     def is_authorized(self, request, object=None):
-        if request.META['REMOTE_ADDR'] in API_ALLOWED_IP:
+        if request.META['REMOTE_ADDR'] in API_ALLOWED_IP_SET:
             return True
         else:
             raise ImmediateHttpResponse(response=http.HttpUnauthorized())
@@ -16,6 +16,7 @@
 
 from django.conf.urls.defaults import url
 from django.http import HttpResponse
+from django.utils.encoding import smart_str
 
 from tastypie.resources import ModelResource
 from tastypie.validation import Validation
@@ -24,15 +25,13 @@ from tastypie.exceptions import ImmediateHttpResponse, \
                                 BadRequest
 from tastypie import http
 
-from dialer_cdr.models import Callrequest
 from api.resources import CustomXmlEmitter, \
                           IpAddressAuthorization, \
-                          IpAddressAuthentication,\
-                          create_voipcall,\
-                          CDR_VARIABLES
-
+                          IpAddressAuthentication
+from api.cdr_ingest import iter_cdr, request_uuid_of, store_cdr_list, \
+                           notify_callrequest_not_found
+from cStringIO import StringIO
 import logging
-import urllib
 
 logger = logging.getLogger('newfies.filelog')
 
@@ -119,69 +118,29 @@ class CdrResource(ModelResource):
             opt_cdr = request.POST.get('cdr')
             #XML parsing doesn't work if you urldecode first
             #decoded_cdr = urllib.unquote(opt_cdr.decode("utf8"))
-            decoded_cdr = opt_cdr
-            data = {}
             try:
-                import xml.etree.ElementTree as ET
-                tree = ET.fromstring(decoded_cdr)
-                lst = tree.find("variables")
-            except:
+                data_list = list(iter_cdr(StringIO(smart_str(opt_cdr))))
+            except SyntaxError:
                 logger.debug('Error parse XML')
-                raise
-
-            for j in lst:
-                if j.tag in CDR_VARIABLES:
-                    data[j.tag] = urllib.unquote(j.text.decode("utf8"))
-            for element in CDR_VARIABLES:
-                if element in data:
-                    data[element] = None
-                else:
-                    logger.debug("%s :> %s" % (element, data[element]))
+                raise BadRequest('Error parse XML')
 
             #TODO: Add tag for newfies in outbound call
-            if not 'plivo_request_uuid' in data\
-            or not data['plivo_request_uuid']:
+            if not data_list or not request_uuid_of(data_list[0]):
                 # CDR not related to plivo
                 error_msg = 'CDR not related to Newfies/Plivo!'
                 logger.error(error_msg)
                 raise BadRequest(error_msg)
 
+            # CREATE CDR - VOIP CALL
             #TODO : delay if not find callrequest
-            try:
-                # plivo add "a_" in front of the uuid
-                # for the aleg so we remove the "a_"
-                if data['plivo_request_uuid'][1:2] == 'a_':
-                    plivo_request_uuid = data['plivo_request_uuid'][2:]
-                else:
-                    plivo_request_uuid = data['plivo_request_uuid']
-                obj_callrequest = Callrequest.objects.get(
-                    request_uuid=plivo_request_uuid)
-            except:
+            count, not_found_list = store_cdr_list(data_list[:1])
+            if not_found_list:
                 # Send notification to admin
-                from dialer_campaign.views import common_send_notification
-                from django.contrib.auth.models import User
-                recipient_list = User.objects.filter(
-                    is_superuser=1,
-                    is_active=1)
-                # send to all admin user
-                for recipient in recipient_list:
-                    # callrequest_not_found - notification id 8
-                    common_send_notification(request, 8, recipient)
-
+                notify_callrequest_not_found(not_found_list)
                 error_msg = "Error, there is no callrequest for "\
-                            "this uuid %s " % data['plivo_request_uuid']
-                logger.error(error_msg, extra={'stack': True})
-
+                            "this uuid %s " % not_found_list[0]
                 raise BadRequest(error_msg)
 
-            # CREATE CDR - VOIP CALL
-            create_voipcall(
-                obj_callrequest,
-                plivo_request_uuid,
-                data,
-                data_prefix='',
-                leg='a')
-
             # List of HttpResponse :
             # https://github.com/toastdriven/django-tastypie/blob/master/tastypie/http.py
             logger.debug('CDR API : Result 200')
@@ -0,0 +1,181 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+"""
+Callbacks of Plivo
+
+The answercall, hangupcall and dialcallback URLs of the API are served by
+these views instead of the tastypie resources : the call request is read
+once by its indexed UUID and the media servers of API_ALLOWED_IP are not
+throttled. The answer is the same RESTXML, the work is done by the
+functions shared with the resources.
+
+With HANGUP_QUEUE, the hangupcall view only queues the callback for the
+hangupcall_batch task, once per RequestUUID, and answers at once.
+
+The store_cdr_bulk view stores the many XML CDRs of one POST by batches,
+see api.cdr_ingest.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseBadRequest, \
+                        HttpResponseNotAllowed
+from django.utils import simplejson as json
+from django.views.decorators.csrf import csrf_exempt
+from dialer_cdr.models import Callrequest
+from dialer_cdr.tasks import hangupcall_batch
+from api.resources import CustomXmlEmitter, API_ALLOWED_IP_SET
+from api.answercall_api import answercall as answercall_result
+from api.hangupcall_api import hangupcall as hangupcall_result
+from api.dialcallback_api import dialcallback as dialcallback_result
+from api.cdr_ingest import ingest_cdr
+from cStringIO import StringIO
+import logging
+
+logger = logging.getLogger('newfies.filelog')
+
+HANGUP_QUEUE_KEY = 'hangup_queue_%s'
+# Plivo repeats a callback within minutes
+HANGUP_QUEUE_KEY_EXPIRE = 60 * 60
+
+
+def check_callback(request, required_list):
+    """Return the response refusing the callback, None if it's valid"""
+    response = check_media_server(request)
+    if response is not None:
+        return response
+    errors = dict((name, ["Wrong parameters - missing %s!" % name])
+                  for name in required_list if not request.POST.get(name))
+    if errors:
+        return error_response(errors)
+    return None
+
+
+def check_media_server(request):
+    """Return the response refusing the request, None if it's a POST of a
+    media server"""
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    if request.META.get('REMOTE_ADDR') not in API_ALLOWED_IP_SET:
+        return HttpResponse(status=401)
+    return None
+
+
+def error_response(errors):
+    logger.debug('ERROR : ' + str(errors))
+    return HttpResponseBadRequest(json.dumps(errors),
+                                  content_type='application/json')
+
+
+def xml_response(request, object_list):
+    return HttpResponse(CustomXmlEmitter().render(request, object_list),
+                        content_type='text/xml')
+
+
+@csrf_exempt
+def answercall(request):
+    """Answer URL of Plivo, return the commands of the voice application"""
+    response = check_callback(request, ['ALegRequestUUID', 'CallUUID'])
+    if response is not None:
+        return response
+    try:
+        obj_callrequest = Callrequest.objects.select_related('campaign')\
+            .get(request_uuid=request.POST['ALegRequestUUID'])
+    except Callrequest.DoesNotExist:
+        return error_response(
+            {'ALegRequestUUID': ['Call Request cannot be found!']})
+    if not obj_callrequest.content_type_id:
+        return error_response(
+            {'Attached App': ['Not attached to Voice App/Survey']})
+    return xml_response(request, answercall_result(obj_callrequest,
+                                                   request.POST))
+
+
+@csrf_exempt
+def hangupcall(request):
+    """Hangup URL of Plivo, record the end of the call"""
+    response = check_callback(request, ['RequestUUID', 'HangupCause'])
+    if response is not None:
+        return response
+    if settings.HANGUP_QUEUE:
+        return queue_hangupcall(request)
+    try:
+        callrequest = Callrequest.objects\
+            .get(request_uuid=request.POST['RequestUUID'])
+    except Callrequest.DoesNotExist:
+        return error_response({'CallRequest': [
+            "CallRequest not found - uuid:%s" % request.POST['RequestUUID']]})
+    return xml_response(request, hangupcall_result(callrequest,
+                                                   request.POST))
+
+
+def queue_hangupcall(request):
+    """Queue the hangup for hangupcall_batch, unless it's already queued"""
+    key = HANGUP_QUEUE_KEY % request.POST['RequestUUID']
+    if cache.add(key, 1, HANGUP_QUEUE_KEY_EXPIRE):
+        try:
+            hangupcall_batch.delay(dict(request.POST.items()))
+        except:
+            # Plivo sends the callback again on an error
+            cache.delete(key)
+            raise
+    else:
+        logger.info('Hangupcall already queued - uuid:%s' % \
+                        request.POST['RequestUUID'])
+    return xml_response(request, [{'result': 'OK'}])
+
+
+@csrf_exempt
+def dialcallback(request):
+    """Callback URL of the Dial command, record the CDR of the B-Leg"""
+    response = check_callback(request, ['DialALegUUID', 'DialBLegUUID',
+                                        'DialBLegStatus'])
+    if response is not None:
+        return response
+    try:
+        callrequest = Callrequest.objects\
+            .get(aleg_uuid=request.POST['DialALegUUID'])
+    except Callrequest.DoesNotExist:
+        return error_response({'CallRequest': [
+            "Call request not found - uuid:%s" % \
+                request.POST['DialBLegUUID']]})
+    return xml_response(request, dialcallback_result(callrequest,
+                                                     request.POST))
+
+
+@csrf_exempt
+def store_cdr_bulk(request):
+    """Store the CDRs of the POST, return the counts of stored CDRs and of
+    CDRs without call request
+
+    The body is an XML document holding the <cdr> elements, it's parsed as
+    it's read. A form POST holds the document in its cdr parameter.
+    """
+    response = check_media_server(request)
+    if response is not None:
+        return response
+    if request.META.get('CONTENT_TYPE', '').startswith(
+            ('application/x-www-form-urlencoded', 'multipart/form-data')):
+        if not request.POST.get('cdr'):
+            return error_response({'CDR': ["Wrong parameters - missing CDR!"]})
+        source = StringIO(request.POST['cdr'].encode('utf-8'))
+    else:
+        source = request
+    try:
+        stored, not_found = ingest_cdr(source)
+    except SyntaxError, e:
+        return error_response({'CDR': ['Error parse XML - %s' % e]})
+    return xml_response(request, [{'result': 'OK'}, {'stored': stored},
+                                  {'not_found': not_found}])
@@ -154,3 +154,119 @@ def search_tag_string(mstring, tag):
         return sval[tag]
     else:
         return False
+
+
+def bulk_create_chunk(model, obj_list, chunk_size=500):
+    """Insert obj_list with bulk_create, by chunks of chunk_size rows
+
+    sqlite does not allow more than 999 variables in one statement, the
+    chunks are reduced accordingly.
+    """
+    from django.db import connection
+    if connection.vendor == 'sqlite':
+        chunk_size = min(chunk_size, 999 / len(model._meta.fields))
+    for i in range(0, len(obj_list), chunk_size):
+        model.objects.bulk_create(obj_list[i:i + chunk_size])
+    return len(obj_list)
+
+
+def chunk_list(item_list, chunk_size=500):
+    """Split item_list in lists of chunk_size items"""
+    return [item_list[i:i + chunk_size]
+            for i in range(0, len(item_list), chunk_size)]
+
+
+def iter_values_chunk(queryset, field_list, chunk_size=2000):
+    """Yield the values of field_list of the rows of queryset, in lists of
+    chunk_size rows, the latest id first
+
+    A chunk is read after the id of the previous one, with a query on the
+    primary key, so the rows are never all held in memory, by the process
+    or by the database driver.
+    """
+    last_id = None
+    while True:
+        chunk_qs = queryset.order_by('-id')
+        if last_id is not None:
+            chunk_qs = chunk_qs.filter(id__lt=last_id)
+        chunk = list(chunk_qs.values_list('id', *field_list)[:chunk_size])
+        if not chunk:
+            return
+        last_id = chunk[-1][0]
+        yield [row[1:] for row in chunk]
+
+
+def csv_stream(header, row_iter, buffer_size=64 * 1024):
+    """Yield the CSV of header and of the rows of row_iter, by pieces of
+    about buffer_size bytes, to stream it in a HttpResponse"""
+    import csv
+    from cStringIO import StringIO
+    from django.utils.encoding import smart_str
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for row in row_iter:
+        writer.writerow(['' if value is None else smart_str(value)
+                         for value in row])
+        if buffer.tell() >= buffer_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# Lifetime of the versions of the objects kept per process, see VersionedCache
+VERSION_EXPIRE = 60 * 60 * 24 * 30
+
+
+def reset_version(version_key_list):
+    """Give a new version to the cache keys of version_key_list, the
+    processes load again the objects they keep for them"""
+    from django.core.cache import cache
+    from uuid import uuid1
+    version = str(uuid1())
+    cache.set_many(dict((version_key, version)
+                        for version_key in version_key_list),
+                   VERSION_EXPIRE)
+
+
+class VersionedCache(object):
+    """Objects kept per process, loaded again when their version changes
+
+    The version of the object of a key is read in the cache at
+    version_key % key, it's changed by reset_version when the object is
+    saved, so a warm process reads the version and doesn't query the
+    database.
+
+    **Attributes**:
+
+        * ``version_key`` - Cache key of the version, formatted with a key
+        * ``loader`` - Function loading the object of a key
+    """
+
+    def __init__(self, version_key, loader):
+        self.version_key = version_key
+        self.loader = loader
+        self.cached = {}
+
+    def get_version(self, key, version):
+        """Return the object of key, loaded again if it's not at version"""
+        cached = self.cached.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, self.loader(key))
+            self.cached[key] = cached
+        return cached[1]
+
+    def get_version_dict(self, key_list):
+        """Return the versions of the keys of key_list, in one cache
+        request"""
+        from django.core.cache import cache
+        version_dict = cache.get_many([self.version_key % key
+                                       for key in key_list])
+        return dict((key, version_dict.get(self.version_key % key))
+                    for key in key_list)
+
+    def get(self, key):
+        """Return the object of key"""
+        from django.core.cache import cache
+        return self.get_version(key, cache.get(self.version_key % key))
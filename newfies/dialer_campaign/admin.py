@@ -18,7 +18,8 @@ from django.utils.translation import ugettext as _
 from django.template import RequestContext
 from django.http import HttpResponseRedirect
 from django.shortcuts import render_to_response
-from dialer_campaign.models import Phonebook, Contact, Campaign, CampaignSubscriber
+from dialer_campaign.models import Phonebook, Contact, Campaign, CampaignSubscriber, \
+                                   contact_batch
 from common.common_functions import striplist
 from dialer_campaign.forms import Contact_fileImport
 from dialer_campaign.function_def import check_dialer_setting
@@ -37,8 +38,8 @@ class CampaignAdmin(GenericAdminModelAdmin):
         (_('Standard options'), {
             'fields': ('campaign_code', 'name', 'description', 'callerid',
                        'user', 'status', 'startingdate', 'expirationdate',
-                       'aleg_gateway', 'content_type', 'object_id',
-                       'extra_data', 'phonebook',
+                       'aleg_gateway', 'aleg_gatewaygroup', 'content_type',
+                       'object_id', 'extra_data', 'phonebook',
                        ),
         }),
         (_('Advanced options'), {
@@ -210,44 +211,45 @@ class ContactAdmin(admin.ModelAdmin):
                 rdr = csv.reader(request.FILES['csv_file'],
                                  delimiter=',', quotechar='"')
                 contact_record_count = 0
-                # Read each Row
-                for row in rdr:
-                    if (row and str(row[0]) > 0):
-                        row = striplist(row)
-                        try:
-                            # check field type
-                            int(row[5])
-
-                            phonebook = \
-                            Phonebook.objects.get(pk=request.POST['phonebook'])
+                # Read each Row, the campaigns get the contacts at the end
+                with contact_batch():
+                    for row in rdr:
+                        if (row and str(row[0]) > 0):
+                            row = striplist(row)
                             try:
-                                # check if prefix is already
-                                # existing in the retail plan or not
-                                contact = Contact.objects.get(
-                                        phonebook_id=phonebook.id,
-                                        contact=row[0])
-                                msg = _('Contact already exists !!')
-                                error_import_list.append(row)
+                                # check field type
+                                int(row[5])
+
+                                phonebook = \
+                                Phonebook.objects.get(pk=request.POST['phonebook'])
+                                try:
+                                    # check if prefix is already
+                                    # existing in the retail plan or not
+                                    contact = Contact.objects.get(
+                                            phonebook_id=phonebook.id,
+                                            contact=row[0])
+                                    msg = _('Contact already exists !!')
+                                    error_import_list.append(row)
+                                except:
+                                    # if not, insert record
+                                    Contact.objects.create(
+                                          phonebook=phonebook,
+                                          contact=row[0],
+                                          last_name=row[1],
+                                          first_name=row[2],
+                                          email=row[3],
+                                          description=row[4],
+                                          status=int(row[5]),
+                                          additional_vars=row[6])
+                                    contact_record_count = \
+                                        contact_record_count + 1
+                                    msg = _('%(contact_record_count)s Contact(s) are uploaded, out of %(total_rows)s row(s) !!')\
+                                        % {'contact_record_count': contact_record_count,
+                                            'total_rows': total_rows}
+                                    success_import_list.append(row)
                             except:
-                                # if not, insert record
-                                Contact.objects.create(
-                                      phonebook=phonebook,
-                                      contact=row[0],
-                                      last_name=row[1],
-                                      first_name=row[2],
-                                      email=row[3],
-                                      description=row[4],
-                                      status=int(row[5]),
-                                      additional_vars=row[6])
-                                contact_record_count = \
-                                    contact_record_count + 1
-                                msg = _('%(contact_record_count)s Contact(s) are uploaded, out of %(total_rows)s row(s) !!')\
-                                    % {'contact_record_count': contact_record_count,
-                                        'total_rows': total_rows}
-                                success_import_list.append(row)
-                        except:
-                            msg = _("Error : invalid value for import! Check import samples.")
-                            type_error_import_list.append(row)
+                                msg = _("Error : invalid value for import! Check import samples.")
+                                type_error_import_list.append(row)
         else:
             form = Contact_fileImport(request.user)
 
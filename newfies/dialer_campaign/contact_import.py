@@ -0,0 +1,249 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+"""
+Streaming import of the contacts of a CSV file
+
+The uploaded file is saved in CONTACT_IMPORT_DIR and imported by a celery
+task, chunk by chunk: the rows of a chunk are checked against the contacts
+of the phonebook with one query and the new ones are inserted with
+bulk_create. The progress is kept in the cache and the rows rejected are
+written to an error file the user can download. The web server and the
+celery workers have to share CONTACT_IMPORT_DIR, see settings.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from dialer_campaign.models import Contact, contact_batch
+from common_functions import bulk_create_chunk
+from uuid import uuid1
+from time import time
+import csv
+import logging
+import os
+
+logger = logging.getLogger('newfies.filelog')
+
+CONTACT_IMPORT_KEY = 'contact_import_%s'
+CONTACT_IMPORT_EXPIRE = 60 * 60 * 24  # progress and files kept 1 day
+CONTACT_IMPORT_CHUNK = 1000
+
+# col_no - field name
+CONTACT_FIELD = ['contact',  # 0
+                 'last_name',  # 1
+                 'first_name',  # 2
+                 'email',  # 3
+                 'description',  # 4
+                 'status',  # 5
+                 'additional_vars']  # 6
+
+
+def contact_import_path(import_id):
+    return os.path.join(settings.CONTACT_IMPORT_DIR, '%s.csv' % import_id)
+
+
+def contact_error_path(import_id):
+    return os.path.join(settings.CONTACT_IMPORT_DIR,
+                        '%s_error.csv' % import_id)
+
+
+def purge_contact_import():
+    """Remove the files of the imports older than CONTACT_IMPORT_EXPIRE"""
+    expired = time() - CONTACT_IMPORT_EXPIRE
+    for name in os.listdir(settings.CONTACT_IMPORT_DIR):
+        path = os.path.join(settings.CONTACT_IMPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < expired:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def spool_contact_file(uploaded_file, user_id, phonebook_id):
+    """Save an uploaded CSV file to be imported in the phonebook, return
+    the id of the import"""
+    if not os.path.isdir(settings.CONTACT_IMPORT_DIR):
+        os.makedirs(settings.CONTACT_IMPORT_DIR)
+    purge_contact_import()
+    import_id = uuid1().hex
+    path = contact_import_path(import_id)
+    destination = open(path, 'wb')
+    try:
+        for chunk in uploaded_file.chunks():
+            destination.write(chunk)
+    finally:
+        destination.close()
+
+    cache.set(CONTACT_IMPORT_KEY % import_id, {
+        'user_id': user_id,
+        'phonebook_id': int(phonebook_id),
+        'status': 'pending',
+        'size': os.path.getsize(path),
+        'position': 0,
+        'row': 0,
+        'imported': 0,
+        'duplicate': 0,
+        'invalid': 0,
+        'error_file': False,
+    }, CONTACT_IMPORT_EXPIRE)
+    return import_id
+
+
+def get_import_progress(import_id, user_id=None):
+    """Return the progress of an import, None if it doesn't exist or
+    belongs to another user"""
+    progress = cache.get(CONTACT_IMPORT_KEY % import_id)
+    if progress is None:
+        return None
+    if user_id is not None and progress['user_id'] != user_id:
+        return None
+    return progress
+
+
+def clean_contact_data(data):
+    """Return the fields of a Contact from a dict, ValueError if they are
+    invalid, the number is required and the status defaults to active"""
+    result = {}
+    for name in CONTACT_FIELD:
+        value = data.get(name)
+        if value is None:
+            value = ''
+        elif not isinstance(value, basestring):
+            value = str(value)
+        value = value.strip()
+        if name == 'status':
+            # active by default
+            result[name] = int(value or 1)
+            continue
+        max_length = Contact._meta.get_field(name).max_length
+        if len(value) > max_length:
+            raise ValueError('%s too long' % name)
+        result[name] = value
+    if not result['contact']:
+        raise ValueError('contact missing')
+    return result
+
+
+def parse_contact_row(row):
+    """Return the fields of a Contact from a row of a CSV file, ValueError
+    if the row is invalid"""
+    if len(row) < len(CONTACT_FIELD):
+        raise ValueError('field missing')
+    return clean_contact_data(dict(zip(CONTACT_FIELD, row)))
+
+
+def insert_contact_chunk(phonebook_id, data_list):
+    """Insert the contacts of data_list missing from the phonebook, with
+    one query to find the numbers already in the phonebook
+
+    Return the list of the data inserted, the other ones are duplicate
+    of a contact of the phonebook or of a previous data of the list.
+    """
+    existing = set(Contact.objects\
+        .filter(phonebook=phonebook_id,
+                contact__in=[data['contact'] for data in data_list])\
+        .values_list('contact', flat=True))
+    inserted_list = []
+    for data in data_list:
+        if data['contact'] in existing:
+            continue
+        existing.add(data['contact'])
+        inserted_list.append(data)
+    bulk_create_chunk(Contact, [Contact(phonebook_id=phonebook_id, **data)
+                                for data in inserted_list])
+    transaction.commit_unless_managed()
+    return inserted_list
+
+
+class ContactFileImport(object):
+    """Import of a CSV file spooled by spool_contact_file
+
+    **Attributes**:
+
+        * import_id - Id of the import
+        * chunk_size - Rows checked and inserted at once
+    """
+
+    def __init__(self, import_id, chunk_size=CONTACT_IMPORT_CHUNK):
+        self.import_id = import_id
+        self.chunk_size = chunk_size
+        self.progress = get_import_progress(import_id)
+        self.error_file = None
+        self.error_writer = None
+
+    def save_progress(self):
+        cache.set(CONTACT_IMPORT_KEY % self.import_id, self.progress,
+                  CONTACT_IMPORT_EXPIRE)
+
+    def reject(self, row, reason):
+        """Write a rejected row and the reason to the error file"""
+        if self.error_writer is None:
+            self.error_file = open(contact_error_path(self.import_id), 'wb')
+            self.error_writer = csv.writer(self.error_file)
+        self.error_writer.writerow(row + [reason])
+
+    def import_chunk(self, row_list):
+        """Insert the new contacts of a chunk of (row, data)"""
+        inserted_list = insert_contact_chunk(self.progress['phonebook_id'],
+                                             [data for row, data in row_list])
+        inserted = set([id(data) for data in inserted_list])
+        for row, data in row_list:
+            if not id(data) in inserted:
+                self.progress['duplicate'] += 1
+                self.reject(row, 'duplicate')
+        self.progress['imported'] += len(inserted_list)
+
+    def run(self):
+        """Import the file, return the progress at the end"""
+        if self.progress is None:
+            return None
+        self.progress['status'] = 'running'
+        self.save_progress()
+        csv_file = open(contact_import_path(self.import_id), 'rb')
+        try:
+            # the running campaigns of the phonebook get the contacts at
+            # the end of the import
+            with contact_batch() as phonebook_set:
+                phonebook_set.add(self.progress['phonebook_id'])
+                row_list = []
+                for row in csv.reader(csv_file, delimiter=',', quotechar='"'):
+                    if not row:
+                        continue
+                    self.progress['row'] += 1
+                    try:
+                        row_list.append((row, parse_contact_row(row)))
+                    except (ValueError, TypeError):
+                        self.progress['invalid'] += 1
+                        self.reject(row, 'invalid')
+                    if len(row_list) >= self.chunk_size:
+                        self.import_chunk(row_list)
+                        row_list = []
+                        self.progress['position'] = csv_file.tell()
+                        self.save_progress()
+                if row_list:
+                    self.import_chunk(row_list)
+            self.progress['status'] = 'done'
+        except Exception, e:
+            logger.error("Contact import %s failed : %s" % \
+                            (self.import_id, e))
+            self.progress['status'] = 'error'
+        finally:
+            csv_file.close()
+            if self.error_file is not None:
+                self.error_file.close()
+            os.remove(contact_import_path(self.import_id))
+        self.progress['position'] = self.progress['size']
+        self.progress['error_file'] = self.error_file is not None
+        self.save_progress()
+        return self.progress
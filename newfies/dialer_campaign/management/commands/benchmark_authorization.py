@@ -0,0 +1,74 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext_lazy as _
+from dialer_campaign.models import ContactAuthorization
+from random import Random
+from time import time
+import re
+
+
+def legacy_authorization(whitelist, blacklist, str_contact):
+    """Former check : the raw patterns are searched for every contact"""
+    if whitelist and re.search(whitelist, str_contact):
+        return True
+    if blacklist and re.search(blacklist, str_contact):
+        return False
+    return True
+
+
+class Command(BaseCommand):
+    help = _("Measure the whitelist / blacklist check of a list of numbers, "
+             "contact by contact and with the compiled authorization")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--count', type='int', dest='count', default=100000,
+                    help=_('Number of phone numbers to check')),
+        make_option('--whitelist', dest='whitelist', default='^34[6-7]',
+                    help=_('Whitelist regular expression')),
+        make_option('--blacklist', dest='blacklist',
+                    default='^(33|34|44)|666$',
+                    help=_('Blacklist regular expression')),
+    )
+
+    def handle(self, *args, **options):
+        rand = Random(1)
+        number_list = ['%d%09d' % (rand.choice([33, 34, 44, 1]),
+                                   rand.randint(0, 999999999))
+                       for i in range(options['count'])]
+        whitelist = options['whitelist']
+        blacklist = options['blacklist']
+
+        start = time()
+        legacy_list = [number for number in number_list
+                       if legacy_authorization(whitelist, blacklist, number)]
+        legacy_time = time() - start
+
+        start = time()
+        authorization = ContactAuthorization(whitelist, blacklist)
+        authorized_list = authorization.filter_authorized(number_list)
+        compiled_time = time() - start
+
+        assert legacy_list == authorized_list
+        print _("%(count)d numbers, %(authorized)d authorized") % \
+            {'count': len(number_list), 'authorized': len(authorized_list)}
+        print "%-22s %10s %14s" % ('check', 'seconds', 'numbers/sec')
+        for name, elapsed in (('per contact re.search', legacy_time),
+                              ('filter_authorized', compiled_time)):
+            print "%-22s %10.3f %14.0f" % (name, elapsed,
+                                           len(number_list) / elapsed)
+        print _("The former check also ran 2 queries per contact to "
+                "reload the UserProfile and the DialerSetting.")
@@ -0,0 +1,119 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.translation import gettext_lazy as _
+from dialer_campaign.models import Campaign, CampaignSubscriber, Contact, \
+                                   Phonebook, contact_batch
+from common_functions import bulk_create_chunk
+from time import time
+
+
+def create_per_save(phonebook_id, no_contact):
+    """Former creation : post_save_add_contact adds each contact to each
+    running campaign"""
+    for i in xrange(no_contact):
+        Contact.objects.create(phonebook_id=phonebook_id, contact='%09d' % i)
+
+
+def create_batch(phonebook_id, no_contact):
+    """One save per contact, the campaigns get the contacts at the end"""
+    with contact_batch():
+        for i in xrange(no_contact):
+            Contact.objects.create(phonebook_id=phonebook_id,
+                                   contact='%09d' % i)
+
+
+def create_bulk_batch(phonebook_id, no_contact):
+    """bulk_create of the contacts, the campaigns get them at the end"""
+    with contact_batch() as phonebook_set:
+        for start_id in xrange(0, no_contact, 5000):
+            bulk_create_chunk(Contact, [
+                Contact(phonebook_id=phonebook_id, status=1,
+                        contact='%09d' % i)
+                for i in xrange(start_id, min(start_id + 5000, no_contact))])
+        phonebook_set.add(phonebook_id)
+
+
+class Command(BaseCommand):
+    # Use : benchmark_contact_fanout 1,2,3,4,5 100000
+    args = _('<campaign_id,campaign_id,...> <no_of_contact>')
+    help = _("Compare the time spent to create contacts in a phonebook "
+             "used by running campaigns, with a signal per contact and "
+             "batched. The campaigns are set running during the benchmark, "
+             "the phonebooks created are removed at the end.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--skip-legacy', action='store_true',
+                    dest='skip_legacy', default=False,
+                    help=_('Only measure the batched creations')),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError(_('Usage : benchmark_contact_fanout %s' %
+                                 self.args))
+        campaign_id_list = [int(item) for item in args[0].split(',')]
+        no_contact = int(args[1])
+        list_campaign = list(Campaign.objects.filter(id__in=campaign_id_list))
+        if len(list_campaign) != len(campaign_id_list):
+            raise CommandError(_('Can\'t find these Campaigns : %s' %
+                                 args[0]))
+        campaign_status = dict([(obj.id, obj.status) for obj in list_campaign])
+
+        create_list = [('contact_batch', create_batch),
+                       ('bulk_create batch', create_bulk_batch)]
+        if not options['skip_legacy']:
+            create_list.insert(0, ('per save signal', create_per_save))
+
+        print _("%(contact)d contacts, %(campaign)d running campaigns") % \
+            {'contact': no_contact, 'campaign': len(list_campaign)}
+        print "%-18s %12s %10s %14s" % ('creation', 'subscribers',
+                                        'seconds', 'contacts/sec')
+        Campaign.objects.filter(id__in=campaign_id_list).update(status=1)
+        try:
+            for name, create in create_list:
+                obj_phonebook = Phonebook.objects.create(
+                    name='benchmark_contact_fanout',
+                    user=list_campaign[0].user)
+                for obj_campaign in list_campaign:
+                    obj_campaign.phonebook.add(obj_phonebook)
+                try:
+                    start = time()
+                    create(obj_phonebook.id, no_contact)
+                    transaction.commit_unless_managed()
+                    elapsed = time() - start
+                    count = CampaignSubscriber.objects\
+                        .filter(contact__phonebook=obj_phonebook.id).count()
+                    print "%-18s %12d %10.3f %14.0f" % (name, count, elapsed,
+                        no_contact / elapsed)
+                finally:
+                    self.delete_phonebook(obj_phonebook)
+        finally:
+            for campaign_id, status in campaign_status.items():
+                Campaign.objects.filter(id=campaign_id).update(status=status)
+
+    def delete_phonebook(self, obj_phonebook):
+        """Remove the phonebook, its contacts and their subscribers"""
+        # the ORM would load the contacts to delete them
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM dialer_campaign_subscriber \
+            WHERE contact_id IN \
+            (SELECT id FROM dialer_contact WHERE phonebook_id = %s)',
+            [obj_phonebook.id])
+        cursor.execute('DELETE FROM dialer_contact \
+            WHERE phonebook_id = %s', [obj_phonebook.id])
+        transaction.commit_unless_managed()
+        obj_phonebook.delete()
@@ -0,0 +1,148 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.translation import gettext_lazy as _
+from dialer_campaign.models import Campaign, CampaignSubscriber, Contact
+from dialer_campaign import tasks
+from dialer_cdr.models import Callrequest
+from dialer_cdr.tasks import init_callrequest, init_callrequest_batch
+from common_functions import bulk_create_chunk
+from datetime import datetime, timedelta
+from math import ceil
+from time import time
+import logging
+
+logger = logging.getLogger('newfies.filelog')
+
+
+def legacy_dispatch(obj_campaign, limit, call_type, logger):
+    """Former dispatch : one save per subscriber, one Callrequest saved and
+    one ETA message per call"""
+    list_subscriber = CampaignSubscriber.objects\
+        .filter(campaign=obj_campaign.id, status=1)[:limit]
+    for elem_subscriber in list_subscriber:
+        elem_subscriber.status = 6
+        elem_subscriber.save()
+
+    time_to_wait = 60.0 / len(list_subscriber)
+    count = 0
+    for elem_camp_subscriber in list_subscriber:
+        count = count + 1
+        if not obj_campaign.is_authorized_contact(
+                        elem_camp_subscriber.contact.contact):
+            continue
+        new_callrequest = Callrequest(status=1,
+                            call_type=call_type,
+                            call_time=datetime.now(),
+                            timeout=obj_campaign.calltimeout,
+                            callerid=obj_campaign.callerid,
+                            phone_number=elem_camp_subscriber.contact.contact,
+                            campaign=obj_campaign,
+                            aleg_gateway=obj_campaign.aleg_gateway,
+                            content_type=obj_campaign.content_type,
+                            object_id=obj_campaign.object_id,
+                            user=obj_campaign.user,
+                            extra_data=obj_campaign.extra_data,
+                            timelimit=obj_campaign.callmaxduration,
+                            campaign_subscriber=elem_camp_subscriber)
+        new_callrequest.save()
+        launch_date = datetime.now() + \
+                      timedelta(seconds=ceil(count * time_to_wait))
+        init_callrequest.apply_async(
+                    args=[new_callrequest.id, obj_campaign.id],
+                    eta=launch_date)
+    return count
+
+
+class Command(BaseCommand):
+    # Use : benchmark_dispatch 1 1000
+    args = _('<campaign_id> <no_of_subscriber>')
+    help = _("Compare the queries, broker messages and time spent to "
+             "dispatch the subscribers of a campaign, per subscriber and "
+             "batched. The contacts created are removed at the end.")
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError(_('Usage : benchmark_dispatch %s' % self.args))
+        campaign_id, no_subscriber = args[0], int(args[1])
+        try:
+            obj_campaign = Campaign.objects.get(id=campaign_id)
+        except Campaign.DoesNotExist:
+            raise CommandError(_('Can\'t find this Campaign : %s' %
+                                 campaign_id))
+        phonebook_id = obj_campaign.phonebook.all()[0].id
+
+        # count the broker messages instead of sending them
+        message_count = {'count': 0}
+
+        def count_message(*args, **kwargs):
+            message_count['count'] += 1
+
+        sent_apply_async = (init_callrequest.apply_async,
+                            init_callrequest_batch.apply_async)
+        init_callrequest.apply_async = count_message
+        init_callrequest_batch.apply_async = count_message
+        connection.use_debug_cursor = True
+
+        print "%-16s %8s %8s %10s %10s" % ('dispatch', 'calls', 'queries',
+                                           'messages', 'seconds')
+        # the pending subscribers of the campaign are kept aside
+        pending_list = list(CampaignSubscriber.objects\
+            .filter(campaign=obj_campaign.id, status=1)\
+            .values_list('id', flat=True))
+        CampaignSubscriber.objects.filter(id__in=pending_list)\
+            .update(status=2)
+        try:
+            for name, dispatch in (('per subscriber', legacy_dispatch),
+                                   ('batched', tasks.dispatch_campaign_call)):
+                prefix = str(int(time() * 1000))
+                try:
+                    self.create_subscriber(obj_campaign, phonebook_id,
+                                           no_subscriber, prefix)
+                    message_count['count'] = 0
+                    connection.queries = []
+                    start = time()
+                    count = dispatch(obj_campaign, no_subscriber, 1, logger)
+                    elapsed = time() - start
+                    print "%-16s %8d %8d %10d %10.3f" % (name, count,
+                        len(connection.queries), message_count['count'],
+                        elapsed)
+                finally:
+                    Contact.objects.filter(phonebook=phonebook_id,
+                                           contact__startswith=prefix)\
+                        .delete()
+        finally:
+            CampaignSubscriber.objects.filter(id__in=pending_list)\
+                .update(status=1)
+            init_callrequest.apply_async = sent_apply_async[0]
+            init_callrequest_batch.apply_async = sent_apply_async[1]
+            connection.use_debug_cursor = None
+
+    def create_subscriber(self, obj_campaign, phonebook_id, no_subscriber,
+                          prefix):
+        """Add no_subscriber pending subscribers to the campaign"""
+        bulk_create_chunk(Contact, [
+            Contact(phonebook_id=phonebook_id, status=1,
+                    contact='%s%06d' % (prefix, i))
+            for i in range(no_subscriber)])
+        contact_list = Contact.objects\
+            .filter(phonebook=phonebook_id, contact__startswith=prefix)\
+            .values_list('id', 'contact')
+        bulk_create_chunk(CampaignSubscriber, [
+            CampaignSubscriber(contact_id=contact_id, status=1,
+                               duplicate_contact=contact,
+                               campaign_id=obj_campaign.id)
+            for contact_id, contact in contact_list])
@@ -0,0 +1,193 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext_lazy as _
+from dialer_campaign.pacing import CampaignPacer
+import random
+
+
+class DictStore(object):
+    """In-memory replacement of the cache for the simulation"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value, timeout=None):
+        self.data[key] = value
+
+    def add(self, key, value, timeout=None):
+        if key in self.data:
+            return False
+        self.data[key] = value
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class Simulation(object):
+    """Second by second simulation of a campaign
+
+    The originate messages wait in the broker until their ETA, then a free
+    worker sends them to the media server, which takes ``latency`` seconds.
+    During the ``slow`` window, the media server answers 50 times slower.
+    """
+
+    def __init__(self, options, paced):
+        self.options = options
+        self.paced = paced
+        self.rand = random.Random(options['seed'])
+        self.broker = []  # ETA of the messages waiting in the broker
+        self.workers = [0] * options['workers']  # time each worker is free
+        self.originating = []  # time the originate of a call completes
+        self.calls = []  # time the live calls hang up
+        self.per_minute = [0] * options['minutes']
+        self.depth = []
+        self.peak_calls = 0
+        self.rejected = 0
+        self.answered = 0
+        self.completed = 0
+        self.billsec = 0
+
+    def latency(self, now):
+        slow_start, slow_stop = self.options['slow']
+        if slow_start * 60 <= now < slow_stop * 60:
+            return self.options['latency'] * 50
+        return self.options['latency']
+
+    def start_call(self, now):
+        if len(self.calls) >= self.options['maximum_call']:
+            self.rejected += 1
+            return
+        self.per_minute[int(now / 60)] += 1
+        if self.rand.random() < self.options['answer_rate']:
+            billsec = self.rand.randint(10, 2 * self.options['billsec'])
+            self.answered += 1
+            self.billsec += billsec
+            self.calls.append(now + self.rand.randint(5, 20) + billsec)
+        else:
+            self.calls.append(now + self.options['calltimeout'])
+        self.completed += 1
+        self.peak_calls = max(self.peak_calls, len(self.calls))
+
+    def dispatch(self, now, pacer):
+        frequency = self.options['frequency']
+        if self.paced:
+            if now % self.options['tick'] != 0:
+                return
+            answer_rate = billsec = None
+            if self.completed:
+                answer_rate = float(self.answered) / self.completed
+            if self.answered:
+                billsec = self.billsec / self.answered
+            inflight = len(self.broker) + len(self.originating) \
+                       + len(self.calls)
+            budget = pacer.compute(inflight, answer_rate, billsec, now=now)
+            self.broker.extend([now] * budget)
+            pacer.commit(budget)
+        elif now % 60 == 0:
+            # Former behaviour, spread frequency calls over the next minute
+            for count in range(1, frequency + 1):
+                self.broker.append(now + count * 60.0 / frequency)
+
+    def run(self):
+        options = self.options
+        pacer = CampaignPacer(1, options['frequency'], options['tick'],
+                              calltimeout=options['calltimeout'],
+                              callmaxduration=options['callmaxduration'],
+                              maximum_call=options['maximum_call'],
+                              store=DictStore())
+        for now in range(options['minutes'] * 60):
+            self.calls = [end for end in self.calls if end > now]
+            for end in [end for end in self.originating if end <= now]:
+                self.start_call(now)
+            self.originating = [end for end in self.originating if end > now]
+
+            self.dispatch(now, pacer)
+
+            self.broker.sort()
+            for index, free_at in enumerate(self.workers):
+                if free_at > now or not self.broker or self.broker[0] > now:
+                    continue
+                self.broker.pop(0)
+                done = now + self.latency(now)
+                self.workers[index] = done
+                self.originating.append(done)
+            self.depth.append(len(self.broker))
+
+        # the first minute is the warm-up of both behaviours
+        minutes = self.per_minute[1:]
+        target = float(options['frequency'])
+        error = sum([abs(count - target) for count in minutes]) \
+                / len(minutes) / target * 100
+        return {
+            'cpm': float(sum(minutes)) / len(minutes),
+            'error': error,
+            'max_depth': max(self.depth),
+            'avg_depth': float(sum(self.depth)) / len(self.depth),
+            'peak_calls': self.peak_calls,
+            'rejected': self.rejected,
+        }
+
+
+class Command(BaseCommand):
+    help = _("Simulate the load of a campaign and compare the campaign "
+             "pacer with the former fixed 60 seconds fan-out")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--frequency', type='int', dest='frequency',
+                    default=120, help=_('Target calls per minute')),
+        make_option('--minutes', type='int', dest='minutes', default=15,
+                    help=_('Duration of the simulation')),
+        make_option('--tick', type='int', dest='tick', default=10,
+                    help=_('Pacing tick in seconds')),
+        make_option('--workers', type='int', dest='workers', default=8,
+                    help=_('Celery worker processes')),
+        make_option('--latency', type='float', dest='latency', default=0.2,
+                    help=_('Seconds taken by an originate')),
+        make_option('--maximum_call', type='int', dest='maximum_call',
+                    default=200, help=_('Max concurrent calls on gateway')),
+        make_option('--answer_rate', type='float', dest='answer_rate',
+                    default=0.6, help=_('Rate of answered calls')),
+        make_option('--billsec', type='int', dest='billsec', default=60,
+                    help=_('Average billsec of the answered calls')),
+        make_option('--seed', type='int', dest='seed', default=1),
+    )
+
+    def handle(self, *args, **options):
+        options['calltimeout'] = 45
+        options['callmaxduration'] = 1800
+        scenarios = [
+            ('nominal', {}),
+            ('slow media server', {'slow': (4, 9)}),
+            ('saturated gateway',
+                {'maximum_call': options['maximum_call'] / 4}),
+        ]
+        print "%-18s %-9s %8s %8s %10s %10s %8s %9s" % (
+            'scenario', 'engine', 'cpm', 'error %', 'max queue',
+            'avg queue', 'peak ch', 'rejected')
+        for name, scenario in scenarios:
+            scenario_options = dict(options, slow=(0, 0))
+            scenario_options.update(scenario)
+            for engine, paced in (('fan-out', False), ('pacer', True)):
+                result = Simulation(scenario_options, paced).run()
+                print "%-18s %-9s %8.1f %8.1f %10d %10.1f %8d %9d" % (
+                    name, engine, result['cpm'], result['error'],
+                    result['max_depth'], result['avg_depth'],
+                    result['peak_calls'], result['rejected'])
@@ -0,0 +1,117 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+from django.utils.translation import gettext_lazy as _
+from dialer_campaign.models import Campaign, CampaignSubscriber, Contact, \
+                                   Phonebook
+from dialer_campaign.tasks import spool_subscriber_sql
+from common_functions import bulk_create_chunk
+from time import time
+
+
+def legacy_spool(obj_campaign):
+    """Former spool : one NOT IN query then one INSERT per contact"""
+    count = 0
+    for elem_contact in obj_campaign.get_active_contact_no_subscriber():
+        try:
+            CampaignSubscriber.objects.create(
+                        contact=elem_contact,
+                        status=1,
+                        duplicate_contact=elem_contact.contact,
+                        campaign=obj_campaign)
+            count += 1
+        except IntegrityError:
+            pass
+    return count
+
+
+class Command(BaseCommand):
+    # Use : benchmark_spool 1 1000000
+    args = _('<campaign_id> <no_of_contact>')
+    help = _("Compare the time spent to spool the contacts of a phonebook "
+             "in the subscribers of a campaign, contact by contact and set "
+             "based. The phonebook created is removed at the end.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk', type='int', dest='chunk', default=None,
+                    help=_('Contacts per INSERT ... SELECT')),
+        make_option('--skip-legacy', action='store_true',
+                    dest='skip_legacy', default=False,
+                    help=_('Only measure the set based spool')),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError(_('Usage : benchmark_spool %s' % self.args))
+        campaign_id, no_contact = args[0], int(args[1])
+        try:
+            obj_campaign = Campaign.objects.get(id=campaign_id)
+        except Campaign.DoesNotExist:
+            raise CommandError(_('Can\'t find this Campaign : %s' %
+                                 campaign_id))
+
+        # only the phonebook of the benchmark is attached to the campaign
+        list_phonebook = list(obj_campaign.phonebook.all())
+        obj_phonebook = Phonebook.objects.create(name='benchmark_spool',
+                                                 user=obj_campaign.user)
+        obj_campaign.phonebook.clear()
+        obj_campaign.phonebook.add(obj_phonebook)
+        try:
+            start = time()
+            for start_id in xrange(0, no_contact, 5000):
+                bulk_create_chunk(Contact, [
+                    Contact(phonebook_id=obj_phonebook.id, status=1,
+                            contact='%09d' % i)
+                    for i in xrange(start_id,
+                                    min(start_id + 5000, no_contact))])
+            transaction.commit_unless_managed()
+            print _("%(count)d contacts created in %(seconds).1f seconds") % \
+                {'count': no_contact, 'seconds': time() - start}
+
+            spool_list = [('set based', lambda: spool_subscriber_sql(
+                obj_campaign, options['chunk']))]
+            if not options['skip_legacy']:
+                spool_list.insert(0, ('per contact',
+                                      lambda: legacy_spool(obj_campaign)))
+
+            print "%-12s %10s %10s %14s" % ('spool', 'added', 'seconds',
+                                            'contacts/sec')
+            for name, spool in spool_list:
+                start = time()
+                count = spool()
+                elapsed = time() - start
+                print "%-12s %10d %10.3f %14.0f" % (name, count, elapsed,
+                                                    count / elapsed)
+                self.delete_subscriber(obj_campaign.id, obj_phonebook.id)
+        finally:
+            obj_campaign.phonebook.clear()
+            obj_campaign.phonebook.add(*list_phonebook)
+            self.delete_subscriber(obj_campaign.id, obj_phonebook.id)
+            # the ORM would load the contacts to delete them
+            cursor = connection.cursor()
+            cursor.execute('DELETE FROM dialer_contact \
+                WHERE phonebook_id = %s', [obj_phonebook.id])
+            transaction.commit_unless_managed()
+            obj_phonebook.delete()
+
+    def delete_subscriber(self, campaign_id, phonebook_id):
+        """Remove the subscribers added by the benchmark"""
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM dialer_campaign_subscriber \
+            WHERE campaign_id = %s AND contact_id IN \
+            (SELECT id FROM dialer_contact WHERE phonebook_id = %s)',
+            [campaign_id, phonebook_id])
+        transaction.commit_unless_managed()
@@ -12,20 +12,28 @@
 # Arezqui Belaid <info@star2billing.com>
 #
 
-from django.db import models
+from django.db import models, connection, transaction, IntegrityError
 from django.utils.translation import ugettext_lazy as _
 from django.core.urlresolvers import reverse
 from django.core.cache import cache
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, m2m_changed
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 from dateutil.relativedelta import relativedelta
 from django_countries import CountryField
-from dialer_gateway.models import Gateway
+from dialer_gateway.models import Gateway, GatewayGroup
 from user_profile.models import UserProfile
+from dialer_settings.models import DialerSetting
 from datetime import datetime
 from common.intermediate_model_base_class import Model
-from random import choice, seed
+from common_functions import VersionedCache, reset_version
+from random import choice, randint, seed
+from contextlib import contextmanager
+from threading import local
+import logging
+import re
+
+logger = logging.getLogger('newfies.filelog')
 
 seed()
 
@@ -196,45 +204,106 @@ class CampaignManager(models.Manager):
         return Campaign.objects.filter(**kwargs).exclude(status=4)
 
 
-def common_contact_authorization(user, str_contact):
-    """Common Function to check contact no is authorized or not.
-    For this we will check the dialer settings : whitelist and blacklist
+AUTHORIZATION_VERSION_KEY = 'contact_authorization_version_user_id_%s'
+
+
+class ContactAuthorization(object):
+    """Whitelist and blacklist of a user, compiled once
+
+    A contact matching the whitelist is authorized, otherwise a contact
+    matching the blacklist is not. '*' stands for an empty list. A user
+    without dialer settings has no contact authorized.
     """
+
+    def __init__(self, whitelist='', blacklist='', enabled=True):
+        self.enabled = enabled
+        self.whitelist = self.compile(whitelist, 'whitelist')
+        self.blacklist = self.compile(blacklist, 'blacklist')
+
+    def compile(self, pattern, name):
+        if not pattern or pattern == '*':
+            return None
+        try:
+            return re.compile(pattern)
+        except re.error:
+            logger.error("Error to identify the %s : %s" % (name, pattern))
+            return None
+
+    def is_authorized(self, str_contact):
+        """Check if a contact is authorized"""
+        if not self.enabled:
+            return False
+        if self.whitelist and self.whitelist.search(str_contact):
+            return True
+        if self.blacklist and self.blacklist.search(str_contact):
+            return False
+        return True
+
+    def filter_authorized(self, number_list):
+        """Return the authorized numbers of number_list, in order"""
+        if not self.enabled:
+            return []
+        if not self.blacklist:
+            return list(number_list)
+        blacklist_search = self.blacklist.search
+        if not self.whitelist:
+            return [number for number in number_list
+                    if not blacklist_search(number)]
+        whitelist_search = self.whitelist.search
+        return [number for number in number_list
+                if whitelist_search(number) or not blacklist_search(number)]
+
+
+def load_contact_authorization(user_id):
+    """Compile the ContactAuthorization of a user"""
     try:
-        obj_userprofile = UserProfile.objects.get(user=user)
+        dialersetting = UserProfile.objects.select_related('dialersetting')\
+            .get(user=user_id).dialersetting
     except UserProfile.DoesNotExist:
-        return False
+        dialersetting = None
 
-    if not obj_userprofile.dialersetting:
-        return False
+    if dialersetting:
+        return ContactAuthorization(dialersetting.whitelist,
+                                    dialersetting.blacklist)
+    return ContactAuthorization(enabled=False)
 
-    whitelist = obj_userprofile.dialersetting.whitelist
-    blacklist = obj_userprofile.dialersetting.blacklist
+# Compiled ContactAuthorization per user_id, for the running process
+_contact_authorization = VersionedCache(AUTHORIZATION_VERSION_KEY,
+                                        load_contact_authorization)
 
-    if whitelist == '*':
-        whitelist = ''
-    if blacklist == '*':
-        blacklist = ''
 
-    import re
+def get_contact_authorization(user):
+    """Return the ContactAuthorization of a user
 
-    if whitelist and len(whitelist) > 0:
-        try:
-            result = re.search(whitelist, str_contact)
-            if result:
-                return True
-        except ValueError:
-            print _("Error to identify the whitelist")
+    The authorizations are kept per process and rebuilt when a
+    DialerSetting or a UserProfile is saved, see
+    reset_contact_authorization.
+    """
+    return _contact_authorization.get(getattr(user, 'id', user))
+
+
+def reset_contact_authorization(sender, **kwargs):
+    """A ``post_save`` signal sent by DialerSetting and UserProfile, it
+    invalidates the ContactAuthorization of its users in all the
+    processes"""
+    instance = kwargs['instance']
+    if sender == UserProfile:
+        user_list = [instance.user_id]
+    else:
+        user_list = UserProfile.objects.filter(dialersetting=instance.id)\
+            .values_list('user', flat=True)
+    reset_version([AUTHORIZATION_VERSION_KEY % user_id
+                   for user_id in user_list])
+
+post_save.connect(reset_contact_authorization, sender=DialerSetting)
+post_save.connect(reset_contact_authorization, sender=UserProfile)
 
-    if blacklist and len(blacklist) > 0:
-        try:
-            result = re.search(blacklist, str_contact)
-            if result:
-                return False
-        except ValueError:
-            print _("Error to identify the blacklist")
 
-    return True
+def common_contact_authorization(user, str_contact):
+    """Common Function to check contact no is authorized or not.
+    For this we will check the dialer settings : whitelist and blacklist
+    """
+    return get_contact_authorization(user).is_authorized(str_contact)
 
 
 class Campaign(Model):
@@ -259,6 +328,8 @@ class Campaign(Model):
         * ``intervalretry`` - Time to wait between retries in seconds
         * ``calltimeout`` - Number of seconds to timeout on calls
         * ``aleg_gateway`` - Gateway to use to reach the contact
+        * ``aleg_gatewaygroup`` - Gateways to spread the calls over, \
+        instead of the aleg_gateway
         * ``extra_data`` - Additional data to pass to the application
 
     **Relationships**:
@@ -334,6 +405,10 @@ class Campaign(Model):
     aleg_gateway = models.ForeignKey(Gateway, verbose_name=_("A-Leg Gateway"),
                     related_name="A-Leg Gateway",
                     help_text=_("Select outbound gateway"))
+    aleg_gatewaygroup = models.ForeignKey(GatewayGroup, null=True,
+                    blank=True, verbose_name=_("A-Leg Gateway Group"),
+                    help_text=_("Spread the calls over the gateways of the "
+                                "group, the least loaded first"))
     content_type = models.ForeignKey(ContentType, verbose_name=_("Type"),
                 limit_choices_to={"model__in": ("surveyapp", "voiceapp")})
     object_id = models.PositiveIntegerField(verbose_name=_("Application"))
@@ -348,9 +423,6 @@ class Campaign(Model):
 
     phonebook = models.ManyToManyField(Phonebook, blank=True, null=True)
 
-    imported_phonebook = models.CharField(max_length=500, default='',
-                                verbose_name=_('List of Imported Phonebook'))
-
     objects = CampaignManager()
 
     def __unicode__(self):
@@ -456,6 +528,18 @@ class Campaign(Model):
 
         return self.callmaxduration
 
+    def get_maximum_call(self):
+        """Get the max concurrent calls of the campaign's gateways, None
+        when one of them has no maximum"""
+        if self.aleg_gatewaygroup_id:
+            maximum_list = list(self.aleg_gatewaygroup.gateway\
+                .filter(status=1).values_list('maximum_call', flat=True))
+        else:
+            maximum_list = [self.aleg_gateway.maximum_call]
+        if not maximum_list or not all(maximum_list):
+            return None
+        return sum(maximum_list)
+
     def get_active_contact(self):
         """Get all the active Contacts from the phonebook"""
         list_contact =\
@@ -559,19 +643,77 @@ class Campaign(Model):
         return list_subscriber
 
     def get_pending_subscriber_update(self, limit=1000, status=6):
-        """Get all the pending subscribers from the campaign"""
-        #TODO in django 1.4 : replace by SELECT FOR UPDATE
-        list_subscriber = CampaignSubscriber.objects\
-            .filter(campaign=self.id, status=1)\
-            .all()[:limit]
-
-        if not list_subscriber:
+        """Get all the pending subscribers from the campaign and move them
+        to ``status``, see claim_pending_subscriber"""
+        claimed_list = self.claim_pending_subscriber(limit, status)
+        if not claimed_list:
             return False
-        for elem_subscriber in list_subscriber:
-            elem_subscriber.status = status
-            elem_subscriber.save()
 
-        return list_subscriber
+        return CampaignSubscriber.objects.filter(id__in=claimed_list)
+
+    def claim_pending_subscriber(self, limit=1000, status=6):
+        """Move up to ``limit`` pending subscribers of the campaign to
+        ``status`` in one set-based statement and return their ids
+
+        The claim is atomic, several workers claiming at the same time
+        never get the same subscriber.
+
+          * PostgreSQL : ``UPDATE ... RETURNING`` on the rows selected
+            with ``FOR UPDATE SKIP LOCKED`` (9.5+) or ``FOR UPDATE``
+          * Other backends : the rows are first marked with a token unique
+            to the claim, then read back and moved to ``status``
+        """
+        if connection.vendor == 'postgresql':
+            return claim_subscriber_returning(self.id, limit, status)
+        return claim_subscriber_token(self.id, limit, status)
+
+
+def claim_subscriber_returning(campaign_id, limit, status):
+    """Claim pending subscribers with UPDATE ... RETURNING (PostgreSQL)"""
+    cursor = connection.cursor()
+    lock = 'FOR UPDATE'
+    if cursor.connection.server_version >= 90500:
+        lock = 'FOR UPDATE SKIP LOCKED'
+    cursor.execute('UPDATE dialer_campaign_subscriber \
+        SET status = %%s, updated_date = NOW() \
+        WHERE id IN (SELECT id FROM dialer_campaign_subscriber \
+            WHERE campaign_id = %%s AND status = 1 \
+            ORDER BY id LIMIT %%s %s) \
+        AND status = 1 \
+        RETURNING id' % lock, [status, campaign_id, limit])
+    claimed_list = [row[0] for row in cursor.fetchall()]
+    transaction.commit_unless_managed()
+    return claimed_list
+
+
+def claim_subscriber_token(campaign_id, limit, status):
+    """Claim pending subscribers by marking them with a claim token"""
+    candidate_list = list(CampaignSubscriber.objects\
+        .filter(campaign=campaign_id, status=1)\
+        .order_by('id')\
+        .values_list('id', flat=True)[:limit])
+    if not candidate_list:
+        return []
+    return claim_subscriber_candidate(campaign_id, candidate_list, status)
+
+
+@transaction.commit_on_success
+def claim_subscriber_candidate(campaign_id, candidate_list, status):
+    """Claim the candidates still pending, return the ids really claimed
+
+    Each row is moved from PENDING to a negative token unique to this claim,
+    a row taken meanwhile by another worker is no longer PENDING and is
+    left out.
+    """
+    token = -randint(1000, 2 ** 30)
+    CampaignSubscriber.objects\
+        .filter(id__in=candidate_list, status=1)\
+        .update(status=token)
+    subscriber_claimed = CampaignSubscriber.objects\
+        .filter(campaign=campaign_id, status=token)
+    claimed_list = list(subscriber_claimed.values_list('id', flat=True))
+    subscriber_claimed.update(status=status, updated_date=datetime.now())
+    return claimed_list
 
 
 class CampaignSubscriber(Model):
@@ -638,6 +780,115 @@ class CampaignSubscriber(Model):
     """
 
 
+class CampaignPhonebookImport(models.Model):
+    """This defines how far the contacts of a phonebook are imported in the
+    subscribers of a campaign
+
+    The contacts are imported by increasing id, each spool of the campaign
+    only imports the contacts added to the phonebook since the last one.
+
+    **Attributes**:
+
+        * ``last_contact_id`` - Highest contact id imported
+        * ``imported_date`` - Date of the last import
+
+    **Relationships**:
+
+        * ``campaign`` - Foreign key relationship to the Campaign model.
+        * ``phonebook`` - Foreign key relationship to the Phonebook model.
+
+    **Name of DB table**: dialer_campaign_phonebook_import
+    """
+    campaign = models.ForeignKey(Campaign)
+    phonebook = models.ForeignKey(Phonebook)
+    last_contact_id = models.IntegerField(default=0)
+    imported_date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = u'dialer_campaign_phonebook_import'
+        unique_together = ['campaign', 'phonebook']
+
+    def __unicode__(self):
+            return u"%s - %s" % (self.campaign_id, self.phonebook_id)
+
+
+# Phonebooks of the contacts created in the contact batch of the thread
+_contact_batch = local()
+
+
+@contextmanager
+def contact_batch():
+    """Create many contacts and add them to the running campaigns at once
+
+    In the block, ``post_save_add_contact`` only notes the phonebook of the
+    contacts created, the contacts created with bulk_create have to add
+    their phonebook to the set given by the block. At the end of the block,
+    the new contacts are added to the running campaigns of these phonebooks
+    with one INSERT ... SELECT per campaign and phonebook.
+
+    **Usage**:
+
+        with contact_batch() as phonebook_set:
+            Contact.objects.bulk_create(contact_list)
+            phonebook_set.add(phonebook_id)
+    """
+    phonebook_set = getattr(_contact_batch, 'phonebook_set', None)
+    if phonebook_set is not None:
+        # nested block, the outer block adds the contacts
+        yield phonebook_set
+        return
+
+    phonebook_set = _contact_batch.phonebook_set = set()
+    try:
+        yield phonebook_set
+    finally:
+        _contact_batch.phonebook_set = None
+    # after an error, the next spool of the campaigns adds the contacts
+    fan_out_contact(phonebook_set)
+
+
+def fan_out_contact(phonebook_list):
+    """Add the new contacts of the phonebooks to their running campaigns"""
+    from dialer_campaign.tasks import spool_phonebook
+    if not phonebook_list:
+        return
+    list_campaign_phonebook = Campaign.phonebook.through.objects\
+        .filter(phonebook__in=list(phonebook_list), campaign__status=1)\
+        .select_related('campaign')
+    for campaign_phonebook in list_campaign_phonebook:
+        spool_phonebook(campaign_phonebook.campaign,
+                        campaign_phonebook.phonebook_id)
+
+
+def spool_activated_contact(obj):
+    """Add an active contact to the campaigns whose import of its phonebook
+    went past it, the contact was inactive or not committed then, return
+    the number of subscribers added"""
+    campaign_list = list(CampaignPhonebookImport.objects\
+        .filter(phonebook=obj.phonebook_id, last_contact_id__gte=obj.id,
+                campaign__status__in=[1, 2])\
+        .values_list('campaign', flat=True))
+    if not campaign_list:
+        return 0
+    subscribed = set(CampaignSubscriber.objects\
+        .filter(contact=obj.id, campaign__in=campaign_list)\
+        .values_list('campaign', flat=True))
+    count = 0
+    for campaign_id in campaign_list:
+        if campaign_id in subscribed:
+            continue
+        try:
+            CampaignSubscriber.objects.create(contact=obj,
+                                              duplicate_contact=obj.contact,
+                                              status=1,  # START
+                                              campaign_id=campaign_id)
+            count += 1
+        except IntegrityError:
+            # added meanwhile by the spool of the campaign
+            pass
+    return count
+
+
 def post_save_add_contact(sender, **kwargs):
     """A ``post_save`` signal is sent by the Contact model instance whenever
     it is going to save.
@@ -649,13 +900,24 @@ def post_save_add_contact(sender, **kwargs):
         * If the active campaign list count is more than one & the contact
           is active, the contact will be added into ``CampaignSubscriber``
           model.
+        * In a ``contact_batch`` block, the contacts are added to the
+          campaigns at the end of the block.
+        * An active contact saved again is added to the campaigns which
+          imported its phonebook past it, see spool_activated_contact.
     """
     obj = kwargs['instance']
+    if not kwargs['created']:
+        if obj.status == 1 and not kwargs.get('raw'):
+            spool_activated_contact(obj)
+        return
+    phonebook_set = getattr(_contact_batch, 'phonebook_set', None)
+    if phonebook_set is not None:
+        phonebook_set.add(obj.phonebook_id)
+        return
     active_campaign_list = \
     Campaign.objects.filter(phonebook__contact__id=obj.id, status=1)
     # created instance = True + active contact + active_campaign
-    if kwargs['created'] and obj.status == 1 \
-       and active_campaign_list.count() >= 1:
+    if obj.status == 1 and active_campaign_list.count() >= 1:
         for elem_campaign in active_campaign_list:
             try:
                 CampaignSubscriber.objects.create(
@@ -667,3 +929,22 @@ def post_save_add_contact(sender, **kwargs):
                 pass
 
 post_save.connect(post_save_add_contact, sender=Contact)
+
+
+def phonebook_changed_campaign(sender, **kwargs):
+    """A ``m2m_changed`` signal is sent when the phonebooks of a campaign
+    change, a phonebook removed from the campaign forgets its import so
+    that all its contacts are imported if it is added back"""
+    if kwargs['action'] not in ('post_remove', 'post_clear'):
+        return
+    field = kwargs['reverse'] and 'phonebook' or 'campaign'
+    list_import = CampaignPhonebookImport.objects\
+        .filter(**{field: kwargs['instance'].id})
+    if kwargs['action'] == 'post_remove':
+        other_field = kwargs['reverse'] and 'campaign' or 'phonebook'
+        list_import = list_import\
+            .filter(**{other_field + '__in': kwargs['pk_set']})
+    list_import.delete()
+
+m2m_changed.connect(phonebook_changed_campaign,
+                    sender=Campaign.phonebook.through)
@@ -0,0 +1,195 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.core.cache import cache
+from django.db.models import Count, Avg
+from dialer_cdr.models import Callrequest, VoIPCall
+from datetime import datetime, timedelta
+from math import floor
+from time import time
+
+
+PACING_STATE_KEY = 'dialer_pacing_campaign_id_%s'
+PACING_LOCK_KEY = 'dialer_pacing_lock_campaign_id_%s'
+PACING_STATE_EXPIRE = 60 * 60  # forget a campaign idle for an hour
+
+# Window used to measure the answer rate and the call duration
+PACING_STATS_WINDOW = 60 * 10
+
+# Callrequest status counted as calls in flight : PENDING, PROCESS &
+# IN-PROGRESS, so the pacer slows down when the workers lag behind
+INFLIGHT_STATUS = [1, 7, 8]
+
+
+def campaign_pacing_stats(obj_campaign):
+    """Return the live figures the pacer needs for a campaign
+
+    **Return**:
+
+        * ``inflight`` - Callrequests PENDING, in PROCESS or IN-PROGRESS
+        * ``answer_rate`` - Rate of answered calls on the stats window
+        * ``billsec`` - Average billsec of the answered calls
+    """
+    now = datetime.now()
+    # callrequests older than a full call are lost, don't count them
+    max_call_time = (obj_campaign.calltimeout or 0) + \
+                    (obj_campaign.callmaxduration or 0)
+    inflight = Callrequest.objects.filter(campaign=obj_campaign.id,
+            status__in=INFLIGHT_STATUS,
+            updated_date__gte=now - timedelta(seconds=max_call_time)).count()
+
+    start_date = now - timedelta(seconds=PACING_STATS_WINDOW)
+    disposition_list = VoIPCall.objects\
+        .filter(callrequest__campaign=obj_campaign.id,
+                starting_date__gte=start_date)\
+        .values('disposition')\
+        .annotate(count=Count('id'), avg_billsec=Avg('billsec'))
+
+    total = answered = 0
+    billsec = None
+    for item in disposition_list:
+        total += item['count']
+        if item['disposition'] == 'ANSWER':
+            answered = item['count']
+            billsec = item['avg_billsec']
+
+    answer_rate = None
+    if total:
+        answer_rate = float(answered) / total
+
+    return {'inflight': inflight,
+            'answer_rate': answer_rate,
+            'billsec': billsec}
+
+
+class CampaignPacer(object):
+    """Closed-loop controller deciding how many calls a campaign
+    originates on each tick
+
+    The pacer replaces the fixed fan-out of ``frequency`` calls over the
+    next minute. On each tick it computes the calls owed since the last
+    tick and corrects the rounding and pacing error with a PI term. The
+    budget is then bounded by :
+
+        * the free channels of the gateway (``maximum_call``)
+        * the number of calls expected in flight at the target speed,
+          given by Little's law from the answer rate and the billsec,
+          so the dialer backs off when calls stack up
+
+    The controller state is stored in the cache so all the workers share
+    it, and a lock ensures one tick per campaign runs at a time.
+
+    **Attributes**:
+
+        * ``campaign_id`` - Campaign ID
+        * ``frequency`` - Target speed, in calls per minute
+        * ``tick`` - Seconds between two ticks
+        * ``calltimeout`` - Seconds an unanswered call stays in flight
+        * ``callmaxduration`` - Maximum duration of an answered call
+        * ``maximum_call`` - Max concurrent calls allowed on the gateway
+        * ``store`` - Cache backend holding the state, default cache
+    """
+    # Gains of the controller
+    kp = 1.0
+    ki = 0.5
+    # Tolerated overshoot of the expected calls in flight
+    inflight_slack = 1.5
+
+    def __init__(self, campaign_id, frequency, tick, calltimeout=45,
+                 callmaxduration=1800, maximum_call=None, store=None):
+        self.campaign_id = campaign_id
+        self.frequency = frequency or 0
+        self.tick = tick
+        self.calltimeout = calltimeout or 0
+        self.callmaxduration = callmaxduration or 0
+        self.maximum_call = maximum_call
+        if store is None:
+            store = cache
+        self.store = store
+        self.state_key = PACING_STATE_KEY % campaign_id
+        self.lock_key = PACING_LOCK_KEY % campaign_id
+        self.state = None
+        self.desired = 0
+        self.budget = 0
+        self.limited = False
+
+    def acquire(self):
+        """Lock the campaign for the tick, return False if another worker
+        is already running it"""
+        return self.store.add(self.lock_key, 'true', self.tick)
+
+    def release(self):
+        self.store.delete(self.lock_key)
+
+    def load_state(self):
+        state = self.store.get(self.state_key)
+        if not state:
+            state = {'last_tick': None, 'backlog': 0.0}
+        return state
+
+    def expected_inflight(self, answer_rate=None, billsec=None):
+        """Number of calls in flight at the target speed (Little's law)"""
+        if answer_rate is None:
+            # Nothing measured yet, be optimistic on the answer rate
+            answer_rate = 1.0
+        if billsec is None:
+            billsec = self.callmaxduration
+        hold_time = answer_rate * (self.calltimeout + billsec) \
+                    + (1 - answer_rate) * self.calltimeout
+        return self.frequency / 60.0 * hold_time
+
+    def capacity(self, inflight, answer_rate=None, billsec=None):
+        """Number of calls that can still be originated"""
+        per_tick = self.frequency / 60.0 * self.tick
+        limit = max(self.expected_inflight(answer_rate, billsec)
+                    * self.inflight_slack, per_tick) - inflight
+        if self.maximum_call:
+            limit = min(limit, self.maximum_call - inflight)
+        return max(limit, 0)
+
+    def compute(self, inflight=0, answer_rate=None, billsec=None, now=None):
+        """Return the number of calls to originate on this tick"""
+        if now is None:
+            now = time()
+        self.state = self.load_state()
+        last_tick = self.state['last_tick']
+        if last_tick is None:
+            elapsed = self.tick
+        else:
+            # a missed tick is not caught up beyond one extra tick
+            elapsed = min(max(now - last_tick, 0), 2 * self.tick)
+        self.state['last_tick'] = now
+
+        self.desired = self.frequency / 60.0 * elapsed
+        output = self.kp * self.desired + self.ki * self.state['backlog']
+        limit = self.capacity(inflight, answer_rate, billsec)
+        self.limited = limit < output
+        self.budget = int(floor(max(min(output, limit), 0)))
+        return self.budget
+
+    def commit(self, dispatched):
+        """Record the calls really dispatched on this tick
+
+        When the budget was cut by the capacity, or not used for lack of
+        pending subscribers, the shortfall is not carried to the next ticks.
+        """
+        if self.state is None:
+            return
+        backlog = self.state['backlog'] + self.desired - dispatched
+        if self.limited or dispatched < self.budget:
+            backlog = min(backlog, 1.0)
+        # anti-windup : never owe more than a minute of calls
+        max_backlog = max(self.frequency, 1)
+        self.state['backlog'] = max(min(backlog, max_backlog), -max_backlog)
+        self.store.set(self.state_key, self.state, PACING_STATE_EXPIRE)
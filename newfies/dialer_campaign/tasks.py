@@ -13,15 +13,22 @@
 #
 
 from celery.task import PeriodicTask
-from dialer_campaign.models import Campaign, CampaignSubscriber
+from dialer_campaign.models import Campaign, CampaignSubscriber, \
+                                   CampaignPhonebookImport, \
+                                   get_contact_authorization
 from dialer_campaign.function_def import user_dialer_setting
 from dialer_cdr.models import Callrequest
-from dialer_cdr.tasks import init_callrequest
+from dialer_cdr.tasks import init_callrequest_batch
+from dialer_campaign.pacing import CampaignPacer, campaign_pacing_stats
+from dialer_campaign.contact_import import ContactFileImport
+from dnc.store import get_dnc_store
 from celery.decorators import task
-from django.db import IntegrityError
+from django.db import connection, transaction
+from common_functions import bulk_create_chunk, chunk_list
 from datetime import datetime, timedelta
 from django.conf import settings
-from math import ceil
+from django.core.cache import cache
+from uuid import uuid1
 #from celery.task.http import HttpDispatchTask
 #from common_functions import isint
 
@@ -29,7 +36,10 @@ from math import ceil
 if settings.DIALERDEBUG:
     Timelaps = 5
 else:
-    Timelaps = 60
+    Timelaps = settings.PACING_TICK
+
+IMPORT_LOCK_KEY = 'import_phonebook_lock_campaign_id_%s_phonebook_id_%s'
+IMPORT_LOCK_EXPIRE = 60 * 10  # Lock expires in 10 minutes
 
 
 #TODO: Put a priority on this task
@@ -37,6 +47,10 @@ else:
 def check_campaign_pendingcall(campaign_id):
     """This will execute the outbound calls in the campaign
 
+    The number of calls sent on each tick is given by the campaign pacer,
+    the calls are sent right away instead of being spread with an ETA.
+    The retries which are due are sent before the new subscribers.
+
     **Attributes**:
 
         * ``campaign_id`` - Campaign ID
@@ -50,8 +64,6 @@ def check_campaign_pendingcall(campaign_id):
         logger.error('Can\'t find this campaign')
         return False
 
-    #TODO: Control the Speed
-    #if there is many task pending we should slow down
     frequency = obj_campaign.frequency  # default 10 calls per minutes
 
     dialer_set = user_dialer_setting(obj_campaign.user)
@@ -68,81 +80,155 @@ def check_campaign_pendingcall(campaign_id):
             call_type = 2
 
         # check frequency to control the Speed
-        #if dialer_set.frequency:
-        #    frequency = 20
-
-    #Speed
-    #check if the other tasks send for this campaign finished to be ran
-
-    #Get the subscriber of this campaign
-    # get_pending_subscriber get Max 1000 records
-    list_subscriber = obj_campaign.get_pending_subscriber_update(
-                            frequency,
-                            6  # Update to In Process
-                            )
-    if list_subscriber:
-        logger.debug("Number of subscriber found : %d" % len(list_subscriber))
+        if dialer_set.max_frequency \
+            and dialer_set.max_frequency < frequency:
+            frequency = dialer_set.max_frequency
+
+    pacer = CampaignPacer(obj_campaign.id, frequency, Timelaps,
+                calltimeout=obj_campaign.calltimeout,
+                callmaxduration=obj_campaign.callmaxduration,
+                maximum_call=obj_campaign.get_maximum_call())
+    if not pacer.acquire():
+        logger.info("Pacing tick already running for this campaign")
+        return False
 
     try:
-        no_subscriber = list_subscriber.count()
-    except AttributeError:
-        no_subscriber = 0
-
-    if no_subscriber == 0:
+        stats = campaign_pacing_stats(obj_campaign)
+        budget = pacer.compute(stats['inflight'], stats['answer_rate'],
+                               stats['billsec'])
+        logger.debug("Pacing : inflight=%d answer_rate=%s budget=%d" % \
+                (stats['inflight'], stats['answer_rate'], budget))
+
+        count = 0
+        if budget > 0:
+            #the retries which are due go first
+            count = dispatch_retry_call(obj_campaign, budget, logger)
+        if budget > count:
+            count += dispatch_campaign_call(obj_campaign, budget - count,
+                                            call_type, logger)
+        pacer.commit(count)
+    finally:
+        pacer.release()
+
+    if count == 0:
         logger.info("No Subscriber to proceed on this campaign")
         return False
+    return True
 
-    #find how to dispatch them in the current minutes
-    time_to_wait = 60.0 / no_subscriber
-    count = 0
 
-    for elem_camp_subscriber in list_subscriber:
-        """Loop on Subscriber and start the initcall task"""
-        count = count + 1
-        logger.info("Add CallRequest for Subscriber (%s) & wait (%s) " %
-                        (str(elem_camp_subscriber.id), str(time_to_wait)))
-
-        #Check if the contact is authorized
-        if not obj_campaign.is_authorized_contact(
-                        elem_camp_subscriber.contact.contact):
-            logger.error("Error : Contact not authorized")
-            elem_camp_subscriber.status = 7  # Update to Not Authorized
-            elem_camp_subscriber.save()
-            return True
-
-        #Create a Callrequest Instance to track the call task
-        new_callrequest = Callrequest(status=1,  # PENDING
+def dispatch_campaign_call(obj_campaign, limit, call_type, logger):
+    """Claim up to ``limit`` pending subscribers of the campaign and start
+    their calls, return the number of calls started
+
+    The subscribers are loaded with their contact, the Callrequests are
+    inserted with bulk_create and the broker receives one batch message
+    per time slot of the tick. No subscriber is claimed until the DNC
+    store of the user is built on the host.
+    """
+    dnc_store = get_dnc_store(obj_campaign.user_id)
+    if not dnc_store.ready:
+        logger.info("DNC store of the user not built yet on this host")
+        return 0
+
+    #Get the subscriber of this campaign
+    claimed_list = obj_campaign.claim_pending_subscriber(
+                            limit,
+                            6  # Update to In Process
+                            )
+    if not claimed_list:
+        return 0
+    logger.debug("Number of subscriber found : %d" % len(claimed_list))
+
+    authorization = get_contact_authorization(obj_campaign.user_id)
+    list_callrequest = []
+    list_unauthorized = []
+    for claimed_chunk in chunk_list(claimed_list):
+        list_subscriber = list(CampaignSubscriber.objects\
+            .filter(id__in=claimed_chunk)\
+            .select_related('contact'))
+        #Check the contacts authorized and not in the DNC list at once
+        authorized_contact = set(dnc_store.filter_allowed(
+            authorization.filter_authorized(
+                [elem.contact.contact for elem in list_subscriber])))
+        for elem_camp_subscriber in list_subscriber:
+            phone_number = elem_camp_subscriber.contact.contact
+            if not phone_number in authorized_contact:
+                logger.error("Error : Contact not authorized (%s)" % \
+                                phone_number)
+                list_unauthorized.append(elem_camp_subscriber.id)
+                continue
+
+            #Create a Callrequest Instance to track the call task
+            list_callrequest.append(Callrequest(
+                            request_uuid=str(uuid1()),
+                            status=1,  # PENDING
                             call_type=call_type,
                             call_time=datetime.now(),
                             timeout=obj_campaign.calltimeout,
                             callerid=obj_campaign.callerid,
-                            phone_number=elem_camp_subscriber.contact.contact,
-                            campaign=obj_campaign,
-                            aleg_gateway=obj_campaign.aleg_gateway,
-                            content_type=obj_campaign.content_type,
+                            phone_number=phone_number,
+                            campaign_id=obj_campaign.id,
+                            aleg_gateway_id=obj_campaign.aleg_gateway_id,
+                            content_type_id=obj_campaign.content_type_id,
                             object_id=obj_campaign.object_id,
-                            user=obj_campaign.user,
+                            user_id=obj_campaign.user_id,
                             extra_data=obj_campaign.extra_data,
                             timelimit=obj_campaign.callmaxduration,
-                            campaign_subscriber=elem_camp_subscriber)
-        new_callrequest.save()
-
-        #Todo Check if it's a good practice / implement a PID algorithm
-        second_towait = ceil(count * time_to_wait)
-        launch_date = datetime.now() + timedelta(seconds=second_towait)
-
-        logger.info("Init CallRequest at %s" % \
-                        (launch_date.strftime("%b %d %Y %I:%M:%S")))
-        init_callrequest.apply_async(
-                    args=[new_callrequest.id, obj_campaign.id],
-                    eta=launch_date)
-        #Shell_plus
-        # from dialer_cdr.tasks import init_callrequest
-        # from datetime import datetime
-        # new_callrequest_id = 112
-        # obj_campaign_id = 3
-        # launch_date = datetime.now()
-        # init_callrequest.apply_async(args=[new_callrequest_id, obj_campaign_id], eta=launch_date)
+                            campaign_subscriber_id=elem_camp_subscriber.id))
+
+    for unauthorized_chunk in chunk_list(list_unauthorized):
+        CampaignSubscriber.objects.filter(id__in=unauthorized_chunk)\
+            .update(status=7)  # Update to Not Authorized
+
+    if not list_callrequest:
+        return 0
+    if settings.ORIGINATE_WORKER:
+        #The originate worker claims the call requests when they are due
+        no_slot = min(int(Timelaps), len(list_callrequest))
+        for index, new_callrequest in enumerate(list_callrequest):
+            new_callrequest.call_time += timedelta(
+                seconds=(index % no_slot) * Timelaps / float(no_slot))
+        bulk_create_chunk(Callrequest, list_callrequest)
+        return len(list_callrequest)
+    bulk_create_chunk(Callrequest, list_callrequest)
+
+    # bulk_create doesn't give back the ids, read them by request_uuid
+    callrequest_id_list = []
+    for uuid_chunk in chunk_list([obj.request_uuid
+                                  for obj in list_callrequest]):
+        callrequest_id_list += Callrequest.objects\
+            .filter(request_uuid__in=uuid_chunk)\
+            .values_list('id', flat=True)
+
+    send_callrequest_batch(obj_campaign, callrequest_id_list, logger)
+    return len(callrequest_id_list)
+
+
+def dispatch_retry_call(obj_campaign, limit, logger):
+    """Send up to ``limit`` retries of the campaign which are due, return
+    the number of retries sent, see dialer_cdr.retry"""
+    callrequest_id_list = Callrequest.objects.claim_due_retry(
+                                            obj_campaign.id, limit)
+    if not callrequest_id_list:
+        return 0
+    logger.debug("Number of retries due : %d" % len(callrequest_id_list))
+    if not settings.ORIGINATE_WORKER:
+        #The originate worker claims them, they are pending
+        send_callrequest_batch(obj_campaign, callrequest_id_list, logger)
+    return len(callrequest_id_list)
+
+
+def send_callrequest_batch(obj_campaign, callrequest_id_list, logger):
+    """Send the call requests to init_callrequest_batch, one batch
+    message per time slot of the tick"""
+    no_slot = min(int(Timelaps), len(callrequest_id_list))
+    for slot in range(no_slot):
+        callrequest_slot = callrequest_id_list[slot::no_slot]
+        logger.info("Init CallRequest batch of %d calls in %d seconds" % \
+                        (len(callrequest_slot), slot))
+        init_callrequest_batch.apply_async(
+                    args=[callrequest_slot, obj_campaign.id],
+                    countdown=slot * Timelaps / float(no_slot))
 
 
 class campaign_running(PeriodicTask):
@@ -152,13 +238,9 @@ class campaign_running(PeriodicTask):
 
         campaign_running.delay()
     """
+    #The number of calls sent on each tick is controlled by the
+    #CampaignPacer, see dialer_campaign.pacing
     run_every = timedelta(seconds=Timelaps)
-    #NOTE : until we implement a PID Controller :
-    #http://en.wikipedia.org/wiki/PID_controller
-
-    #The campaign have to run every minutes in order to control the number
-    # of calls per minute. Cons : new calls might delay 60seconds
-    #run_every = timedelta(seconds=60)
 
     def run(self, **kwargs):
         logger = self.get_logger(**kwargs)
@@ -192,84 +274,126 @@ class campaign_spool_contact(PeriodicTask):
             logger.debug("=> Spool Contact : Campaign name %s (id:%s)" % \
                 (campaign.name, str(campaign.id)))
 
-            #IF mysql
-            if settings.DATABASES['default']['ENGINE'] == 'django.db.backends.mysql':
-                #INSERT IGNORE WORK FOR MYSQL / Check for other DB Engine
-                collect_subscriber_optimized.delay(campaign.id)
-            else:
-                #TODO: Make optimization for Postgresql
-                collect_subscriber.delay(campaign.id)
-
-
-@task()
-def collect_subscriber_optimized(campaign_id):
-    """This task will collect all the subscribers
-
-    **Attributes**:
-
-        * ``campaign_id`` - Campaign ID
+            #Only the contacts added since the last spool are imported
+            collect_subscriber.delay(campaign.id)
+
+
+def spool_subscriber_sql(obj_campaign, phonebook_import, chunk_size=None):
+    """Add the active contacts of a phonebook added since the last import
+    in the subscribers of the campaign, return the number of subscribers
+    added
+
+    The database does the job with one INSERT ... SELECT per range of
+    ``chunk_size`` contact ids above the watermark of the import, the
+    contacts already subscribed are left out by an anti-join, and by
+    INSERT IGNORE on MySQL, ON CONFLICT DO NOTHING on PostgreSQL 9.5+ or
+    INSERT OR IGNORE on sqlite if they are added meanwhile.
+    The SPOOL_RESCAN_MARGIN ids below the watermark are read again, for the
+    contacts committed after a higher id, the missing ids are not tracked
+    further behind. The watermark moves on after each range and the new
+    subscribers in the DNC list are set to Not Authorized. The contacts
+    activated after the import are added by post_save_add_contact.
     """
-    logger = collect_subscriber_optimized.get_logger()
-    logger.debug("Collect subscribers for the campaign = %s" % \
-                str(campaign_id))
-
-    #Retrieve the list of active contact
-    obj_campaign = Campaign.objects.get(id=campaign_id)
-
-    list_phonebook = obj_campaign.phonebook.all()
-
-    for item_phonebook in list_phonebook:
-        phonebook_id = item_phonebook.id
-
-        # check if phonebook_id is missing in imported_phonebook list
-        if not str(phonebook_id) in obj_campaign.imported_phonebook.split(','):
-            #Run import
-            import_phonebook.delay(obj_campaign.id, phonebook_id)
-
-
-def importcontact_custom_sql(campaign_id, phonebook_id):
-    from django.db import connection, transaction
+    chunk_size = chunk_size or settings.SPOOL_CHUNK_SIZE
     cursor = connection.cursor()
-
-    # Call PL-SQL stored procedure
-    #CampaignSubscriber.importcontact_pl_sql(campaign_id, phonebook_id)
-
-    # Data insert operation - commit required
-    sqlimport = "INSERT IGNORE INTO dialer_campaign_subscriber (contact_id, "\
-        "campaign_id, duplicate_contact, status, created_date, updated_date) "\
-        "SELECT id, %d, contact, 1, NOW(), NOW() FROM dialer_contact "\
-        "WHERE phonebook_id=%d AND dialer_contact.status=1" % \
-        (campaign_id, phonebook_id)
-
-    cursor.execute(sqlimport)
-    transaction.commit_unless_managed()
-
-    return True
+    cursor.execute('SELECT MAX(id) FROM dialer_contact \
+        WHERE phonebook_id = %s', [phonebook_import.phonebook_id])
+    max_id = cursor.fetchone()[0]
+    first_id = max(phonebook_import.last_contact_id - \
+                   settings.SPOOL_RESCAN_MARGIN, 0)
+    if max_id is None or max_id <= first_id:
+        return 0
+
+    insert, conflict = 'INSERT', ''
+    if connection.vendor == 'sqlite':
+        insert = 'INSERT OR IGNORE'
+    elif connection.vendor == 'mysql':
+        insert = 'INSERT IGNORE'
+    elif connection.vendor == 'postgresql' \
+        and cursor.connection.server_version >= 90500:
+        conflict = 'ON CONFLICT (contact_id, campaign_id) DO NOTHING'
+    sqlspool = '%s INTO dialer_campaign_subscriber (contact_id, \
+        campaign_id, duplicate_contact, status, created_date, updated_date) \
+        SELECT dc.id, %%s, dc.contact, 1, %%s, %%s \
+        FROM dialer_contact dc \
+        LEFT JOIN dialer_campaign_subscriber cs \
+        ON (cs.contact_id = dc.id AND cs.campaign_id = %%s) \
+        WHERE dc.phonebook_id = %%s AND dc.status = 1 \
+        AND dc.id > %%s AND dc.id <= %%s AND cs.id IS NULL %s' % \
+        (insert, conflict)
+
+    dnc_store = get_dnc_store(obj_campaign.user_id)
+    count = 0
+    for start_id in xrange(first_id, max_id, chunk_size):
+        stop_id = min(start_id + chunk_size, max_id)
+        now = datetime.now()
+        cursor.execute(sqlspool, [obj_campaign.id, now, now, obj_campaign.id,
+                                  phonebook_import.phonebook_id,
+                                  start_id, stop_id])
+        added = cursor.rowcount
+        if stop_id > phonebook_import.last_contact_id:
+            CampaignPhonebookImport.objects\
+                .filter(id=phonebook_import.id)\
+                .update(last_contact_id=stop_id, imported_date=now)
+            phonebook_import.last_contact_id = stop_id
+        transaction.commit_unless_managed()
+        if added <= 0:
+            continue
+        count += added
+        if len(dnc_store):
+            exclude_dnc_subscriber(obj_campaign, CampaignSubscriber.objects\
+                .filter(campaign=obj_campaign.id, status=1,
+                        contact__gt=start_id, contact__lte=stop_id))
+    return count
+
+
+def exclude_dnc_subscriber(obj_campaign, list_subscriber):
+    """Set the subscribers of list_subscriber whose number is in the DNC
+    list of the user to Not Authorized"""
+    dnc_store = get_dnc_store(obj_campaign.user_id)
+    if not len(dnc_store):
+        return 0
+    list_subscriber = list_subscriber.values_list('id', 'duplicate_contact')
+    list_blocked = [subscriber_id for subscriber_id, phone_number
+                    in list_subscriber.iterator()
+                    if dnc_store.is_blocked(phone_number)]
+    for blocked_chunk in chunk_list(list_blocked):
+        CampaignSubscriber.objects.filter(id__in=blocked_chunk)\
+            .update(status=7)  # Update to Not Authorized
+    return len(list_blocked)
+
+
+def spool_phonebook(obj_campaign, phonebook_id, chunk_size=None):
+    """Import the new contacts of a phonebook in the campaign, return the
+    number of subscribers added or None if an import of this phonebook in
+    the campaign is already running"""
+    lock_id = IMPORT_LOCK_KEY % (obj_campaign.id, phonebook_id)
+    if not cache.add(lock_id, 'true', IMPORT_LOCK_EXPIRE):
+        return None
+    try:
+        phonebook_import, created = CampaignPhonebookImport.objects\
+            .get_or_create(campaign_id=obj_campaign.id,
+                           phonebook_id=phonebook_id)
+        return spool_subscriber_sql(obj_campaign, phonebook_import,
+                                    chunk_size)
+    finally:
+        cache.delete(lock_id)
 
 
 @task()
 def import_phonebook(campaign_id, phonebook_id):
     """
-    Read all the contact from phonebook_id and insert into campaignsubscriber
+    Read the new contacts from phonebook_id and insert into
+    campaignsubscriber
     """
     logger = import_phonebook.get_logger()
     logger.info("\nTASK :: import_phonebook")
 
-    #TODO: Add a semafore
-
     obj_campaign = Campaign.objects.get(id=campaign_id)
-
-    #Faster method, ask the Database to do the job
-    importcontact_custom_sql(campaign_id, phonebook_id)
-
-    #Add the phonebook id to the imported list
-    if obj_campaign.imported_phonebook == '':
-        sep = ''
-    else:
-        sep = ','
-    obj_campaign.imported_phonebook = obj_campaign.imported_phonebook + \
-            '%s%d' % (sep, phonebook_id)
-    obj_campaign.save()
+    count = spool_phonebook(obj_campaign, phonebook_id)
+    if count is None:
+        logger.info("Import of the phonebook already running")
+    return count
 
 
 @task()
@@ -284,31 +408,39 @@ def collect_subscriber(campaign_id):
     logger.debug("Collect subscribers for the campaign = %s" % \
                         str(campaign_id))
 
-    #Retrieve the list of active contact
     obj_campaign = Campaign.objects.get(id=campaign_id)
-    list_contact = obj_campaign.get_active_contact_no_subscriber()
-
-    if not list_contact:
+    #Create CampaignSubscribers for each new active contact
+    count = 0
+    for phonebook_id in obj_campaign.phonebook.values_list('id', flat=True):
+        count += spool_phonebook(obj_campaign, phonebook_id) or 0
+    if not count:
         logger.debug("No new contact or phonebook to import into \
             this campaign.")
-        return True
     else:
-        #Create CampaignSubscribers for each new active contact
-        for elem_contact in list_contact:
-            try:
-                CampaignSubscriber.objects.create(
-                            contact=elem_contact,
-                            status=1,  # START
-                            duplicate_contact=elem_contact.contact,
-                            campaign=obj_campaign)
-            except IntegrityError, e:
-                #We don't stop if it fails to add a subscriber to one campaign
-                logger.error("IntegrityError to create CampaignSubscriber "\
-                    "contact_id=%s - Error:%s" % (elem_contact.id, e))
-
+        logger.info("%d subscribers added to the campaign" % count)
     return True
 
 
+@task()
+def import_contact(import_id):
+    """Import the contacts of a CSV file spooled by spool_contact_file
+
+    **Attributes**:
+
+        * ``import_id`` - Id of the contact import
+    """
+    logger = import_contact.get_logger()
+    logger.info("TASK :: import_contact = %s" % import_id)
+
+    progress = ContactFileImport(import_id).run()
+    if progress is None:
+        logger.error("Can't find this contact import")
+        return False
+    logger.info("Contact import %(status)s : %(imported)d imported, "
+                "%(duplicate)d duplicate, %(invalid)d invalid" % progress)
+    return progress['status'] == 'done'
+
+
 class campaign_expire_check(PeriodicTask):
     """A periodic task that checks the campaign expiration
 
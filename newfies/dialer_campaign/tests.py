@@ -0,0 +1,483 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.core.cache import cache, get_cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from common.test_utils import build_test_suite_from
+from dialer_campaign.models import Campaign, CampaignSubscriber, Contact, \
+                                   CampaignPhonebookImport, \
+                                   claim_subscriber_candidate, contact_batch, \
+                                   ContactAuthorization, \
+                                   get_contact_authorization, \
+                                   common_contact_authorization
+from dialer_campaign import tasks
+from dialer_campaign.pacing import CampaignPacer
+from dialer_campaign.contact_import import ContactFileImport, \
+                                           spool_contact_file, \
+                                           get_import_progress, \
+                                           contact_error_path
+from dialer_campaign.tasks import spool_phonebook, IMPORT_LOCK_KEY, \
+                                  dispatch_campaign_call
+from dialer_cdr.models import Callrequest
+from dialer_settings.models import DialerSetting
+from dnc.models import DNC_VERSION_KEY
+from dnc.store import get_dnc_store
+from django.utils.unittest import skipIf
+from tempfile import mkdtemp
+from threading import Thread
+import csv
+import logging
+import shutil
+
+
+class CampaignPacerTestCase(TestCase):
+    """Test cases for the campaign pacer"""
+
+    def setUp(self):
+        self.store = get_cache(
+            'django.core.cache.backends.locmem.LocMemCache')
+        self.store.clear()
+
+    def test_pacer_rate(self):
+        """Test the pacer sends the target calls per minute"""
+        pacer = CampaignPacer(1, 20, 10, store=self.store)
+        total = 0
+        for now in range(0, 600, 10):
+            budget = pacer.compute(inflight=0, now=now)
+            pacer.commit(budget)
+            total += budget
+        # 20 calls per minute during 10 minutes
+        self.assertTrue(198 <= total <= 202)
+
+    def test_pacer_gateway_capacity(self):
+        """Test the pacer never exceeds the gateway capacity"""
+        pacer = CampaignPacer(1, 600, 10, maximum_call=30, store=self.store)
+        self.assertEqual(pacer.compute(inflight=25, now=0), 5)
+        pacer.commit(5)
+        self.assertEqual(pacer.compute(inflight=30, now=10), 0)
+        pacer.commit(0)
+        # the shortfall due to the gateway is not caught up later
+        self.assertEqual(pacer.compute(inflight=0, now=20), 30)
+
+    def test_pacer_lock(self):
+        """Test only one worker runs the tick of a campaign"""
+        pacer = CampaignPacer(1, 20, 10, store=self.store)
+        self.assertTrue(pacer.acquire())
+        self.assertFalse(CampaignPacer(1, 20, 10, store=self.store).acquire())
+        pacer.release()
+        self.assertTrue(pacer.acquire())
+
+
+class ContactAuthorizationTestCase(TestCase):
+    """Test cases for the compiled whitelist and blacklist"""
+    fixtures = ['auth_user', 'dialer_setting']
+
+    def test_is_authorized(self):
+        """Test the whitelist wins over the blacklist"""
+        authorization = ContactAuthorization('^3412', '^34')
+        self.assertTrue(authorization.is_authorized('34120000'))
+        self.assertFalse(authorization.is_authorized('34000000'))
+        self.assertTrue(authorization.is_authorized('33000000'))
+        # '*' or an invalid pattern is an empty list
+        authorization = ContactAuthorization('*', '[34')
+        self.assertTrue(authorization.is_authorized('34000000'))
+        # no dialer settings, no contact authorized
+        authorization = ContactAuthorization(enabled=False)
+        self.assertFalse(authorization.is_authorized('33000000'))
+
+    def test_filter_authorized(self):
+        """Test the numbers are filtered in order, like is_authorized"""
+        number_list = ['34000000', '33000000', '34120000', '34000001']
+        for whitelist, blacklist in (('', ''), ('', '^34'),
+                                     ('^3412', '^34'), ('^33', '')):
+            authorization = ContactAuthorization(whitelist, blacklist)
+            self.assertEqual(authorization.filter_authorized(number_list),
+                             [number for number in number_list
+                              if authorization.is_authorized(number)])
+        self.assertEqual(ContactAuthorization('^3412', '^34')\
+                            .filter_authorized(number_list),
+                         ['33000000', '34120000'])
+        self.assertEqual(ContactAuthorization(enabled=False)\
+                            .filter_authorized(number_list), [])
+
+    def test_authorization_invalidation(self):
+        """Test a saved dialer setting is reloaded by the workers"""
+        authorization = get_contact_authorization(1)
+        self.assertTrue(authorization.is_authorized('34000000'))
+        # the authorization is kept in the process
+        self.assertNumQueries(0, get_contact_authorization, 1)
+        dialer_setting = DialerSetting.objects.get(pk=1)
+        dialer_setting.blacklist = '^34'
+        dialer_setting.save()
+        self.assertFalse(
+            get_contact_authorization(1).is_authorized('34000000'))
+        self.assertTrue(common_contact_authorization(1, '33000000'))
+
+
+def create_pending_subscriber(campaign, count):
+    """Add ``count`` pending subscribers to the campaign"""
+    for i in range(count):
+        contact = Contact.objects.create(phonebook_id=1,
+                                         contact='3400%04d' % i)
+        CampaignSubscriber.objects.create(contact=contact,
+                                          duplicate_contact=contact.contact,
+                                          status=1,
+                                          campaign=campaign)
+
+
+class ClaimSubscriberTestCase(TestCase):
+    """Test cases for the claim of pending subscribers"""
+    fixtures = ['gateway.json', 'auth_user', 'voiceapp', 'phonebook',
+                'campaign']
+
+    def setUp(self):
+        self.campaign = Campaign.objects.get(pk=1)
+        create_pending_subscriber(self.campaign, 20)
+
+    def test_claim_pending_subscriber(self):
+        """Test successive claims return distinct subscribers"""
+        first_list = self.campaign.claim_pending_subscriber(8)
+        second_list = self.campaign.claim_pending_subscriber(8)
+        third_list = self.campaign.claim_pending_subscriber(8)
+        self.assertEqual(len(first_list), 8)
+        self.assertEqual(len(second_list), 8)
+        self.assertEqual(len(third_list), 4)
+        self.assertEqual(len(set(first_list + second_list + third_list)), 20)
+        self.assertEqual(CampaignSubscriber.objects\
+            .filter(campaign=self.campaign, status=6).count(), 20)
+        self.assertEqual(self.campaign.claim_pending_subscriber(8), [])
+
+    def test_interleaved_claim(self):
+        """Test a claim racing with another one on the same candidates"""
+        candidate_list = list(CampaignSubscriber.objects\
+            .filter(campaign=self.campaign, status=1)\
+            .values_list('id', flat=True)[:10])
+        # another worker claims half of the candidates meanwhile
+        other_list = self.campaign.claim_pending_subscriber(5)
+        claimed_list = claim_subscriber_candidate(self.campaign.id,
+                                                  candidate_list, 6)
+        self.assertEqual(len(claimed_list), 5)
+        self.assertFalse(set(claimed_list) & set(other_list))
+
+    def test_claim_token_conflict(self):
+        """Test claims run inside the claim window of another one"""
+        from dialer_campaign import models
+        randint = models.randint
+        datetime = models.datetime
+        campaign_id = self.campaign.id
+        other_list = []
+
+        def other_randint(low, high):
+            # the other worker claims the same candidates first
+            models.randint = randint
+            other_list.extend(models.claim_subscriber_token(campaign_id,
+                                                            10, 6))
+            return randint(low, high)
+
+        class OtherDatetime(object):
+            @staticmethod
+            def now():
+                # the rows marked with the token are no longer pending
+                models.datetime = datetime
+                other_list.extend(models.claim_subscriber_token(campaign_id,
+                                                                4, 6))
+                return datetime.now()
+
+        models.randint = other_randint
+        try:
+            self.assertEqual(models.claim_subscriber_token(campaign_id,
+                                                           10, 6), [])
+            models.datetime = OtherDatetime
+            claimed_list = models.claim_subscriber_token(campaign_id, 6, 6)
+        finally:
+            models.randint = randint
+            models.datetime = datetime
+        self.assertEqual(len(other_list), 14)
+        self.assertEqual(len(claimed_list), 6)
+        self.assertEqual(len(set(claimed_list + other_list)), 20)
+        self.assertEqual(CampaignSubscriber.objects\
+            .filter(campaign=self.campaign, status=6).count(), 20)
+
+
+class TaskRecorder(object):
+    """Stand-in of a celery task, keeps the messages sent to it"""
+
+    def __init__(self):
+        self.message_list = []
+
+    def apply_async(self, args=None, kwargs=None, **options):
+        self.message_list.append((args, options))
+
+
+class DispatchCampaignCallTestCase(TestCase):
+    """Test cases for the batched dispatch of the subscribers"""
+    fixtures = ['gateway.json', 'auth_user', 'dialer_setting', 'voiceapp',
+                'phonebook', 'campaign']
+
+    def setUp(self):
+        self.campaign = Campaign.objects.get(pk=1)
+        create_pending_subscriber(self.campaign, 12)
+        # the user has no DNC list to build
+        cache.delete(DNC_VERSION_KEY % self.campaign.user_id)
+        # the broker is replaced, the batch messages are kept
+        self.init_callrequest_batch = tasks.init_callrequest_batch
+        tasks.init_callrequest_batch = TaskRecorder()
+        self.settings = override_settings(ORIGINATE_WORKER=False)
+        self.settings.enable()
+
+    def tearDown(self):
+        tasks.init_callrequest_batch = self.init_callrequest_batch
+        self.settings.disable()
+
+    def test_dispatch_campaign_call(self):
+        """Test a tick inserts the call requests at once and sends their
+        ids in one message per time slot"""
+        logger = logging.getLogger('newfies.filelog')
+        # the authorizations and the DNC store are loaded once per process
+        get_contact_authorization(self.campaign.user_id)
+        get_dnc_store(self.campaign.user_id)
+        # the claim, the read of the subscribers with their contact, the
+        # insert of the call requests and the read of their ids
+        claim_query = connection.vendor == 'postgresql' and 1 or 4
+        with self.assertNumQueries(claim_query + 3):
+            count = dispatch_campaign_call(self.campaign, 10, 1, logger)
+        self.assertEqual(count, 10)
+
+        callrequest_list = list(Callrequest.objects\
+            .filter(campaign=self.campaign)\
+            .values_list('id', 'campaign_subscriber'))
+        self.assertEqual(len(callrequest_list), 10)
+        message_list = tasks.init_callrequest_batch.message_list
+        self.assertEqual(len(message_list), min(int(tasks.Timelaps), 10))
+        self.assertEqual(sorted([callrequest_id
+                                 for args, options in message_list
+                                 for callrequest_id in args[0]]),
+                         sorted([row[0] for row in callrequest_list]))
+        self.assertEqual(sorted([row[1] for row in callrequest_list]),
+            sorted(CampaignSubscriber.objects\
+                .filter(campaign=self.campaign, status=6)\
+                .values_list('id', flat=True)))
+
+        # the blacklisted subscribers are set to Not Authorized at once
+        dialer_setting = DialerSetting.objects.get(pk=1)
+        dialer_setting.blacklist = '^340000(10|11)$'
+        dialer_setting.save()
+        self.assertEqual(dispatch_campaign_call(self.campaign, 10, 1, logger),
+                         0)
+        self.assertEqual(CampaignSubscriber.objects\
+            .filter(campaign=self.campaign, status=7).count(), 2)
+        self.assertEqual(len(message_list), min(int(tasks.Timelaps), 10))
+
+
+class SpoolSubscriberTestCase(TestCase):
+    """Test cases for the set based spool of the subscribers"""
+    fixtures = ['gateway.json', 'auth_user', 'voiceapp', 'phonebook',
+                'campaign']
+
+    def create_contact(self, prefix, count):
+        """Add contacts without the post_save signal, 1 in 5 inactive"""
+        Contact.objects.bulk_create([
+            Contact(phonebook_id=1, contact='%s%04d' % (prefix, i),
+                    status=(i % 5 and 1 or 2))
+            for i in range(count)])
+
+    def spooled(self, prefix):
+        return CampaignSubscriber.objects\
+            .filter(campaign=1, duplicate_contact__startswith=prefix).count()
+
+    def test_spool_phonebook(self):
+        """Test the active contacts are spooled once, from the watermark"""
+        campaign = Campaign.objects.get(pk=1)
+        campaign.phonebook.add(1)
+        self.create_contact('3500', 25)
+        # chunks smaller than the contacts
+        self.assertTrue(spool_phonebook(campaign, 1, 7) >= 20)
+        self.assertEqual(self.spooled('3500'), 20)
+        phonebook_import = CampaignPhonebookImport.objects\
+            .get(campaign=1, phonebook=1)
+        self.assertEqual(phonebook_import.last_contact_id,
+            Contact.objects.filter(phonebook=1).order_by('-id')[0].id)
+        self.assertEqual(spool_phonebook(campaign, 1, 7), 0)
+
+        # only the contacts added since the last spool are imported
+        self.create_contact('3600', 10)
+        self.assertEqual(spool_phonebook(campaign, 1, 7), 8)
+        self.assertEqual(self.spooled('3600'), 8)
+
+        # a phonebook removed from the campaign forgets its import
+        campaign.phonebook.remove(1)
+        self.assertFalse(CampaignPhonebookImport.objects\
+            .filter(campaign=1).exists())
+
+    def test_spool_late_contact(self):
+        """Test the contacts committed or activated after the import of
+        their ids are spooled"""
+        campaign = Campaign.objects.get(pk=1)
+        campaign.phonebook.add(1)
+        self.create_contact('4000', 10)
+        self.assertEqual(spool_phonebook(campaign, 1), 8)
+
+        # a contact committed after the import of a higher id
+        self.create_contact('4100', 2)
+        late_id = Contact.objects.get(contact='41000001').id
+        CampaignPhonebookImport.objects.filter(campaign=1, phonebook=1)\
+            .update(last_contact_id=late_id + 10)
+        self.assertEqual(spool_phonebook(campaign, 1), 1)
+        self.assertEqual(self.spooled('4100'), 1)
+
+        # an inactive contact activated after the import
+        contact = Contact.objects.get(contact='40000000')
+        contact.status = 1
+        contact.save()
+        self.assertEqual(self.spooled('4000'), 9)
+        contact.save()
+        self.assertEqual(self.spooled('4000'), 9)
+        self.assertEqual(spool_phonebook(campaign, 1), 0)
+
+    def test_spool_phonebook_lock(self):
+        """Test an import running for the phonebook is not run twice"""
+        campaign = Campaign.objects.get(pk=1)
+        lock_id = IMPORT_LOCK_KEY % (campaign.id, 1)
+        cache.add(lock_id, 'true', 60)
+        try:
+            self.assertEqual(spool_phonebook(campaign, 1), None)
+        finally:
+            cache.delete(lock_id)
+        self.assertNotEqual(spool_phonebook(campaign, 1), None)
+
+
+class ContactBatchTestCase(TestCase):
+    """Test cases for the batched fan-out of the new contacts"""
+    fixtures = ['gateway.json', 'auth_user', 'voiceapp', 'phonebook',
+                'campaign']
+
+    def test_contact_batch(self):
+        """Test the contacts are added to the campaigns at the end"""
+        Campaign.objects.filter(pk=1).update(status=1)
+        Campaign.objects.get(pk=1).phonebook.add(1)
+        with contact_batch() as phonebook_set:
+            for i in range(3):
+                Contact.objects.create(phonebook_id=1,
+                                       contact='3700%04d' % i)
+            Contact.objects.bulk_create([
+                Contact(phonebook_id=1, contact='3800%04d' % i)
+                for i in range(4)])
+            phonebook_set.add(1)
+            self.assertEqual(CampaignSubscriber.objects\
+                .filter(campaign=1).count(), 0)
+        self.assertEqual(CampaignSubscriber.objects\
+            .filter(campaign=1, duplicate_contact__startswith='3700')\
+            .count(), 3)
+        self.assertEqual(CampaignSubscriber.objects\
+            .filter(campaign=1, duplicate_contact__startswith='3800')\
+            .count(), 4)
+
+        # a single contact is still added by its post_save signal
+        Contact.objects.create(phonebook_id=1, contact='39000000')
+        self.assertEqual(CampaignSubscriber.objects\
+            .filter(campaign=1, duplicate_contact='39000000').count(), 1)
+
+
+class ContactFileImportTestCase(TestCase):
+    """Test cases for the streaming import of a CSV file of contacts"""
+    fixtures = ['auth_user', 'phonebook']
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.settings = override_settings(CONTACT_IMPORT_DIR=self.directory)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def test_contact_file_import(self):
+        """Test the new contacts are imported and the others rejected"""
+        Contact.objects.create(phonebook_id=1, contact='650784355')
+        csv_file = SimpleUploadedFile('contact.csv',
+            '650784355,Belaid,Arezqui,areski@gmail.com,test,1,test\n'
+            '650723032,Fourth,John,john@gmail.com,test,0,test\n'
+            '650723032,Fourth,John,john@gmail.com,test,1,test\n'
+            '650723033,Fifth,John,john@gmail.com,test,active,test\n'
+            '650723034,Sixth\n'
+            '650723035,,,,,1,\n')
+        import_id = spool_contact_file(csv_file, 1, 1)
+        self.assertEqual(get_import_progress(import_id, 2), None)
+        self.assertEqual(get_import_progress(import_id, 1)['status'],
+                         'pending')
+
+        progress = ContactFileImport(import_id, chunk_size=2).run()
+        self.assertEqual(progress['status'], 'done')
+        self.assertEqual(progress['row'], 6)
+        self.assertEqual(progress['imported'], 2)
+        self.assertEqual(progress['duplicate'], 2)
+        self.assertEqual(progress['invalid'], 2)
+        self.assertEqual(Contact.objects.filter(phonebook=1,
+            contact__in=['650723032', '650723035']).count(), 2)
+
+        error_file = open(contact_error_path(import_id), 'rb')
+        reason_list = [row[-1] for row in csv.reader(error_file)]
+        error_file.close()
+        self.assertEqual(sorted(reason_list),
+                         ['duplicate', 'duplicate', 'invalid', 'invalid'])
+
+
+class ConcurrentClaimSubscriberTestCase(TransactionTestCase):
+    """Test cases for workers claiming subscribers at the same time"""
+    fixtures = ['gateway.json', 'auth_user', 'voiceapp', 'phonebook',
+                'campaign']
+
+    @skipIf(connection.vendor == 'sqlite',
+            'sqlite test database is not shared between threads')
+    def test_concurrent_claim(self):
+        """Test concurrent claims never overlap"""
+        campaign = Campaign.objects.get(pk=1)
+        create_pending_subscriber(campaign, 500)
+        result_list = []
+
+        def worker():
+            claimed_list = campaign.claim_pending_subscriber(20)
+            while claimed_list:
+                result_list.append(claimed_list)
+                claimed_list = campaign.claim_pending_subscriber(20)
+            connection.close()
+
+        thread_list = [Thread(target=worker) for i in range(8)]
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+
+        claimed_list = [item for result in result_list for item in result]
+        self.assertEqual(len(claimed_list), 500)
+        self.assertEqual(len(set(claimed_list)), 500)
+
+
+test_cases = [
+    CampaignPacerTestCase,
+    ContactAuthorizationTestCase,
+    ClaimSubscriberTestCase,
+    DispatchCampaignCallTestCase,
+    SpoolSubscriberTestCase,
+    ContactBatchTestCase,
+    ContactFileImportTestCase,
+    ConcurrentClaimSubscriberTestCase,
+]
+
+
+def suite():
+    return build_test_suite_from(test_cases)
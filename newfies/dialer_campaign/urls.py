@@ -42,6 +42,8 @@ urlpatterns = patterns('dialer_campaign.views',
     (r'^contact_grid/$', 'contact_grid'),
     (r'^contact/add/$', 'contact_add'),
     (r'^contact/import/$', 'contact_import'),
+    (r'^contact/import/(\w+)/$', 'contact_import_progress'),
+    (r'^contact/import/(\w+)/error/$', 'contact_import_error'),
     (r'^contact/del/(.+)/$', 'contact_del'),
     (r'^contact/(.+)/$', 'contact_change'),
 
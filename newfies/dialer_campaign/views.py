@@ -17,7 +17,7 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import password_reset, password_reset_done,\
                         password_reset_confirm, password_reset_complete
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponse, Http404
 from django.shortcuts import render_to_response
 from django.db.models import Sum, Avg, Count
 from django.core.urlresolvers import reverse
@@ -26,6 +26,7 @@ from django.conf import settings
 from django.template.context import RequestContext
 from django.utils.translation import ugettext as _
 from django.utils import simplejson
+from django.core.servers.basehttp import FileWrapper
 from django.db.models import Q
 from django.contrib.contenttypes.models import ContentType
 from notification import models as notification
@@ -39,16 +40,19 @@ from dialer_campaign.function_def import user_attached_with_dialer_settings, \
                         contact_search_common_fun,\
                         calculate_date, date_range, \
                         get_campaign_status_name, user_dialer_setting_msg
-from dialer_campaign.tasks import collect_subscriber
+from dialer_campaign.tasks import collect_subscriber, import_contact
+from dialer_campaign.contact_import import spool_contact_file, \
+                        get_import_progress, contact_error_path
 from dialer_cdr.models import VoIPCall
-from common.common_functions import variable_value, striplist, current_view
+from dialer_cdr.rollup import voipcall_rollup_report
+from common.common_functions import variable_value, current_view
 from datetime import datetime
 from dateutil import parser
 from dateutil.relativedelta import relativedelta
 import urllib
 import time
-import csv
 import ast
+import os
 import re
 
 # Define disposition color
@@ -178,22 +182,50 @@ def customer_dashboard(request, on_index=None):
         else:
             date_length = 10  # Last 30 days option
 
-        select_data = \
-            {"starting_date": "SUBSTR(CAST(starting_date as CHAR(30)),1," + \
-                              str(date_length) + ")"}
-
-        # This calls list is used by pie chart
-        calls = VoIPCall.objects\
-                     .filter(callrequest__campaign=selected_campaign,
-                             duration__isnull=False,
-                             user=request.user,
-                             starting_date__range=(start_date, end_date))\
-                     .extra(select=select_data)\
-                     .values('starting_date', 'disposition')\
-                     .annotate(Sum('duration'))\
-                     .annotate(Avg('duration'))\
-                     .annotate(Count('starting_date'))\
-                     .order_by('starting_date')
+        if date_length == 16:
+            # the calls per minute of the last hours come from the CDRs
+            select_data = \
+                {"starting_date": "SUBSTR(CAST(starting_date as CHAR(30)),1," + \
+                                  str(date_length) + ")"}
+
+            # This calls list is used by pie chart
+            calls = VoIPCall.objects\
+                         .filter(callrequest__campaign=selected_campaign,
+                                 duration__isnull=False,
+                                 user=request.user,
+                                 starting_date__range=(start_date, end_date))\
+                         .extra(select=select_data)\
+                         .values('starting_date', 'disposition')\
+                         .annotate(Sum('duration'))\
+                         .annotate(Avg('duration'))\
+                         .annotate(Count('starting_date'))\
+                         .order_by('starting_date')
+
+            # This part got from cdr-stats 'global report' used by
+            # humblefinance, following calls list is without dispostion &
+            # group by call date
+            date_calls = VoIPCall.objects\
+                         .filter(callrequest__campaign=selected_campaign,
+                                 duration__isnull=False,
+                                 user=request.user,
+                                 starting_date__range=(start_date, end_date))\
+                         .extra(select=select_data)\
+                         .values('starting_date').annotate(Sum('duration'))\
+                         .annotate(Avg('duration'))\
+                         .annotate(Count('starting_date'))\
+                         .order_by('starting_date')
+        else:
+            # the calls per day or per hour come from the rollups
+            period = 'hour'
+            if date_length == 10:
+                period = 'day'
+            calls = voipcall_rollup_report(period, start_date, end_date,
+                                           user=request.user,
+                                           campaign=selected_campaign,
+                                           by_disposition=True)
+            date_calls = voipcall_rollup_report(period, start_date, end_date,
+                                                user=request.user,
+                                                campaign=selected_campaign)
 
         final_calls = []
         for i in calls:
@@ -235,18 +267,7 @@ def customer_dashboard(request, on_index=None):
             else:
                 total_forbidden += i['starting_date__count']  # FORBIDDEN
 
-        # This part got from cdr-stats 'global report' used by humblefinance
-        # following calls list is without dispostion & group by call date
-        calls = VoIPCall.objects\
-                     .filter(callrequest__campaign=selected_campaign,
-                             duration__isnull=False,
-                             user=request.user,
-                             starting_date__range=(start_date, end_date))\
-                     .extra(select=select_data)\
-                     .values('starting_date').annotate(Sum('duration'))\
-                     .annotate(Avg('duration'))\
-                     .annotate(Count('starting_date'))\
-                     .order_by('starting_date')
+        calls = date_calls
 
         mintime = start_date
         maxtime = end_date
@@ -1471,14 +1492,14 @@ def contact_import(request):
 
         * Before adding contacts, check dialer setting limit if applicable
           to the user.
-        * Add new contacts which will belong to the logged in user
-          via csv file & get the result (upload success and failure
-          statistics)
+        * The CSV file is saved and its contacts are imported in background
+          by the import_contact task, the page follows the progress of the
+          import and links the file of the rows not imported.
 
     **Important variable**:
 
-        * total_rows - Total no. of records in the CSV file
-        * retail_record_count - No. of records imported from the CSV file
+        * import_id - Id of the import of the CSV file
+        * progress - Rows read, imported, duplicate and invalid
     """
     # Check dialer setting limit
     if request.user and request.method == 'POST':
@@ -1493,80 +1514,25 @@ def contact_import(request):
             return HttpResponseRedirect("/contact/")
 
     form = Contact_fileImport(request.user)
-    rdr = ''  # will contain CSV data
-    msg = ''
-    error_msg = ''
-    success_import_list = []
-    error_import_list = []
-    type_error_import_list = []
+    import_id = request.GET.get('import_id', '')
     if request.method == 'POST':
         form = Contact_fileImport(request.user, request.POST, request.FILES)
         if form.is_valid():
-            # col_no - field name
-            #  0     - contact
-            #  1     - last_name
-            #  2     - first_name
-            #  3     - email
-            #  4     - description
-            #  5     - status
-            #  6     - additional_vars
-            # To count total rows of CSV file
-            records = csv.reader(request.FILES['csv_file'],
-                             delimiter=',', quotechar='"')
-            total_rows = len(list(records))
-
-            rdr = csv.reader(request.FILES['csv_file'],
-                             delimiter=',', quotechar='"')
-            contact_record_count = 0
-            # Read each Row
-            for row in rdr:
-                row = striplist(row)
-                if (row and str(row[0]) > 0):
-                    try:
-                        # check field type
-                        int(row[5])
-                        phonebook = \
-                            Phonebook.objects\
-                            .get(pk=request.POST['phonebook'])
-                        try:
-                            # check if prefix is already
-                            # exist with retail plan or not
-                            contact = Contact.objects.get(
-                                 phonebook_id=phonebook.id,
-                                 contact=row[0])
-                            error_msg = _('Subscriber already exists!')
-                            error_import_list.append(row)
-                        except:
-                            # if not, insert record
-                            Contact.objects.create(
-                                  phonebook=phonebook,
-                                  contact=row[0],
-                                  last_name=row[1],
-                                  first_name=row[2],
-                                  email=row[3],
-                                  description=row[4],
-                                  status=int(row[5]),
-                                  additional_vars=row[6])
-                            contact_record_count = \
-                                contact_record_count + 1
-                            msg = _('%(contact_record_count)s Contact(s) are uploaded successfully out of %(total_rows)s row(s) !!') \
-                                % {'contact_record_count': contact_record_count,
-                                   'total_rows': total_rows}
-
-                            success_import_list.append(row)
-                    except:
-                        error_msg = \
-                            _("Invalid value for import! Please check the import samples.")
-                        type_error_import_list.append(row)
+            import_id = spool_contact_file(request.FILES['csv_file'],
+                                           request.user.id,
+                                           request.POST['phonebook'])
+            import_contact.delay(import_id)
+            return HttpResponseRedirect('/contact/import/?import_id=%s' %
+                                        import_id)
+
+    progress = None
+    if import_id:
+        progress = get_import_progress(import_id, request.user.id)
 
     data = RequestContext(request, {
     'form': form,
-    'rdr': rdr,
-    'msg': msg,
-    'error_msg': error_msg,
-    'success_import_list': success_import_list,
-    'error_import_list': error_import_list,
-    'type_error_import_list': type_error_import_list,
+    'import_id': import_id,
+    'progress': progress,
     'module': current_view(request),
     'notice_count': notice_count(request),
     'dialer_setting_msg': user_dialer_setting_msg(request.user),
@@ -1576,6 +1542,33 @@ def contact_import(request):
            context_instance=RequestContext(request))
 
 
+@login_required
+def contact_import_progress(request, import_id):
+    """Progress of a contact import of the logged in user, in json"""
+    progress = get_import_progress(import_id, request.user.id)
+    if progress is None:
+        raise Http404
+    data = dict(progress)
+    del data['user_id']
+    return HttpResponse(simplejson.dumps(data), mimetype='application/json',
+                        content_type="application/json")
+
+
+@login_required
+def contact_import_error(request, import_id):
+    """Download the rows not imported by a contact import of the logged in
+    user, with the reason in the last column"""
+    progress = get_import_progress(import_id, request.user.id)
+    path = contact_error_path(import_id)
+    if progress is None or not os.path.exists(path):
+        raise Http404
+    response = HttpResponse(FileWrapper(open(path, 'rb')),
+                            mimetype='text/csv')
+    response['Content-Disposition'] = \
+        'attachment;filename=contact_import_error.csv'
+    return response
+
+
 def count_contact_of_campaign(campaign_id):
     """Count no of Contacts from phonebook belonging to the campaign"""
     count_contact = \
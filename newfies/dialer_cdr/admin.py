@@ -22,16 +22,16 @@ from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import render_to_response
 from django.utils.translation import ugettext_lazy as _
 from django.utils.translation import ungettext
-from django.db.models import Sum, Avg, Count
 from dialer_cdr.models import Callrequest, VoIPCall
 from dialer_cdr.forms import VoipSearchForm
 from dialer_cdr.function_def import voipcall_record_common_fun, \
                                     voipcall_search_admin_form_fun, \
                                     get_disposition_name
+from dialer_cdr.rollup import voipcall_daily_report
 from common.common_functions import variable_value
+from common_functions import iter_values_chunk, csv_stream
 from genericadmin.admin import GenericAdminModelAdmin, GenericTabularInline
 from datetime import datetime
-import csv
 
 
 class CallrequestAdmin(GenericAdminModelAdmin):
@@ -173,8 +173,9 @@ class VoIPCallAdmin(admin.ModelAdmin):
 
         formset = cl.formset = None
 
-        # Session variable is used to get record set with searched option into export file
-        request.session['admin_voipcall_record_qs'] = cl.root_query_set
+        # Session variable is used to get record set with searched option into export file,
+        # the query is kept rather than the calls
+        request.session['admin_voipcall_record_query'] = cl.query_set.query
 
         selection_note_all = ungettext('%(total_count)s selected',
             'All %(total_count)s selected', cl.result_count)
@@ -214,42 +215,16 @@ class VoIPCallAdmin(admin.ModelAdmin):
                                                         tday.month,
                                                         tday.day, 0, 0, 0, 0)
 
-        select_data = \
-            {"starting_date": "SUBSTR(CAST(starting_date as CHAR(30)),1,10)"}
-
-        total_data = ''
-        # Get Total Records from VoIPCall Report table for Daily Call Report
-        total_data = VoIPCall.objects.extra(select=select_data)\
-                     .values('starting_date')\
-                     .filter(**kwargs).annotate(Count('starting_date'))\
-                     .annotate(Sum('duration'))\
-                     .annotate(Avg('duration'))\
-                     .order_by('-starting_date')
-
-        # Following code will count total voip calls, duration
-        if total_data.count() != 0:
-            max_duration = \
-                max([x['duration__sum'] for x in total_data])
-            total_duration = \
-                sum([x['duration__sum'] for x in total_data])
-            total_calls = \
-                sum([x['starting_date__count'] for x in total_data])
-            total_avg_duration = \
-                (sum([x['duration__avg']\
-                for x in total_data])) / total_data.count()
-        else:
-            max_duration = 0
-            total_duration = 0
-            total_calls = 0
-            total_avg_duration = 0
+        # Daily Call Report of all the users, from the rollups
+        daily_data = voipcall_daily_report(kwargs)
 
         ctx = RequestContext(request, {
             'form': form,
-            'total_data': total_data.reverse(),
-            'total_duration': total_duration,
-            'total_calls': total_calls,
-            'total_avg_duration': total_avg_duration,
-            'max_duration': max_duration,
+            'total_data': daily_data['total_data'],
+            'total_duration': daily_data['total_duration'],
+            'total_calls': daily_data['total_calls'],
+            'total_avg_duration': daily_data['total_avg_duration'],
+            'max_duration': daily_data['max_duration'],
             'opts': opts,
             'model_name': opts.object_name.lower(),
             'app_label': _('VoIP Report'),
@@ -264,35 +239,36 @@ class VoIPCallAdmin(admin.ModelAdmin):
 
         **Important variable**:
 
-            * request.session['admin_voipcall_record_qs'] - stores voipcall query set
+            * request.session['admin_voipcall_record_query'] - stores voipcall query
 
         **Exported fields**: [user, callid, callerid, phone_number,
                               starting_date, duration, disposition,
                               used_gateway]
+
+        The calls are read by chunks and the CSV is streamed as it's written.
         """
-        # get the response object, this can be used as a stream.
-        response = HttpResponse(mimetype='text/csv')
+        voipcall_qs = VoIPCall.objects.all()
+        if request.session.get('admin_voipcall_record_query') is not None:
+            voipcall_qs.query = request.session['admin_voipcall_record_query']
+
+        def voipcall_row_iter():
+            for chunk in iter_values_chunk(voipcall_qs,
+                    ['user__username', 'callid', 'callerid', 'phone_number',
+                     'starting_date', 'duration', 'disposition',
+                     'used_gateway__name']):
+                for row in chunk:
+                    row = list(row)
+                    row[6] = get_disposition_name(row[6])
+                    yield row
+
+        response = HttpResponse(csv_stream(['user', 'callid', 'callerid',
+                                            'phone_number', 'starting_date',
+                                            'duration', 'disposition',
+                                            'gateway'],
+                                           voipcall_row_iter()),
+                                mimetype='text/csv')
         # force download.
         response['Content-Disposition'] = 'attachment;filename=export.csv'
-        writer = csv.writer(response)
-
-        # super(VoIPCall_ReportAdmin, self).queryset(request)
-        qs = request.session['admin_voipcall_record_qs']
-
-        writer.writerow(['user', 'callid', 'callerid',
-                         'phone_number', 'starting_date', 'duration',
-                         'disposition', 'gateway'])
-        for i in qs:
-            gateway_used = i.used_gateway.name if i.used_gateway else ''
-            writer.writerow([i.user,
-                             i.callid,
-                             i.callerid,
-                             i.phone_number,
-                             i.starting_date,
-                             i.duration,
-                             get_disposition_name(i.disposition),
-                             gateway_used,
-                             ])
         return response
 
 admin.site.register(VoIPCall, VoIPCallAdmin)
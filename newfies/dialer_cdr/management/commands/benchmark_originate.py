@@ -0,0 +1,150 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.translation import gettext_lazy as _
+from dialer_campaign.models import Campaign
+from dialer_cdr.models import Callrequest
+from dialer_cdr.originate_worker import OriginateWorker
+from dialer_cdr.plivo_stub import PlivoStubServer
+from telefonyhelper import PlivoClient, AsyncPlivoClient, plivo_call_params
+from common_functions import bulk_create_chunk
+from multiprocessing import Process, Queue
+from datetime import datetime
+from time import time
+import logging
+
+logger = logging.getLogger('newfies.filelog')
+
+
+def serve_stub(url_queue, latency):
+    """Run the stub of Plivo in its own process, so the client being
+    measured has the core for itself"""
+    server = PlivoStubServer(latency=latency)
+    url_queue.put(server.url)
+    server.serve_forever()
+
+
+class Command(BaseCommand):
+    # Use : benchmark_originate --count 5000 --latency 0.05
+    help = _("Measure the originates per second of one process against a "
+             "local stub of Plivo : blocking calls as the celery tasks, "
+             "threads, and the asyncore client of the originate worker. "
+             "With --campaign, the originate worker also runs on call "
+             "requests of the campaign, removed at the end.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--count', type='int', dest='count', default=5000,
+                    help=_('Number of originates')),
+        make_option('--latency', type='float', dest='latency', default=0.05,
+                    help=_('Seconds taken by the stub to answer an '
+                           'originate')),
+        make_option('--concurrency', type='int', dest='concurrency',
+                    default=1000, help=_('Originates in flight of the '
+                                         'asyncore client')),
+        make_option('--campaign', type='int', dest='campaign',
+                    default=None, help=_('Campaign of the call requests '
+                                         'of the originate worker')),
+    )
+
+    def handle(self, *args, **options):
+        url_queue = Queue()
+        stub = Process(target=serve_stub,
+                       args=(url_queue, options['latency']))
+        stub.daemon = True
+        stub.start()
+        url = url_queue.get()
+        count = options['count']
+        call_params_list = [
+            plivo_call_params(callerid='1000', phone_number='3400%06d' % i,
+                              Gateways='user/',
+                              AnswerUrl='http://127.0.0.1/answercall/')
+            for i in range(count)]
+
+        print "%-20s %8s %10s %12s" % ('client', 'calls', 'seconds',
+                                       'calls/sec')
+        try:
+            # the blocking calls are measured on a sample, they are slow
+            sample = call_params_list[:max(count / 20, 50)]
+            client = PlivoClient(url)
+            self.measure('celery task', len(sample),
+                lambda: [client.call(call_params) for call_params in sample])
+            client = PlivoClient(url, concurrency=4)
+            self.measure('threads x4', count,
+                lambda: client.call_many(call_params_list))
+            client = AsyncPlivoClient(url,
+                                      concurrency=options['concurrency'])
+            self.measure('asyncore', count,
+                lambda: self.run_async(client, call_params_list))
+            if options['campaign']:
+                client = AsyncPlivoClient(url,
+                                          concurrency=options['concurrency'])
+                self.run_worker(client, options['campaign'], count)
+        finally:
+            stub.terminate()
+
+    def measure(self, name, count, run):
+        start = time()
+        run()
+        elapsed = time() - start
+        print "%-20s %8d %10.3f %12.0f" % (name, count, elapsed,
+                                           count / elapsed)
+
+    def run_async(self, client, call_params_list):
+        result = {'failed': 0}
+
+        def originated(request_uuid, error):
+            if error is not None:
+                result['failed'] += 1
+        for call_params in call_params_list:
+            client.originate(call_params, originated)
+        while client.in_flight():
+            client.poll()
+        if result['failed']:
+            print _("%d originates failed") % result['failed']
+
+    def run_worker(self, client, campaign_id, count):
+        """Originate count new call requests of the campaign with the
+        originate worker, the database writes included"""
+        try:
+            obj_campaign = Campaign.objects.get(id=campaign_id)
+        except Campaign.DoesNotExist:
+            raise CommandError(_('Can\'t find this Campaign : %s' %
+                                 campaign_id))
+        if Callrequest.objects.get_pending_callrequest().exists():
+            raise CommandError(_('There are pending call requests, they '
+                                 'would be originated'))
+        prefix = str(int(time() * 1000))
+        bulk_create_chunk(Callrequest, [
+            Callrequest(status=1, call_time=datetime.now(),
+                        phone_number='%s%06d' % (prefix, i),
+                        callerid=obj_campaign.callerid,
+                        campaign_id=obj_campaign.id,
+                        aleg_gateway_id=obj_campaign.aleg_gateway_id,
+                        content_type_id=obj_campaign.content_type_id,
+                        object_id=obj_campaign.object_id,
+                        user_id=obj_campaign.user_id,
+                        timelimit=obj_campaign.callmaxduration)
+            for i in range(count)])
+        worker = OriginateWorker(client, logger)
+        try:
+            self.measure('originate worker', count, lambda: worker.run(
+                lambda: worker.originated + worker.failed >= count))
+        finally:
+            cursor = connection.cursor()
+            cursor.execute("DELETE FROM dialer_callrequest "
+                           "WHERE phone_number LIKE %s", [prefix + '%'])
+            transaction.commit_unless_managed()
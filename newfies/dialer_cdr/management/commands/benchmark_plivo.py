@@ -0,0 +1,91 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext_lazy as _
+from dialer_cdr.plivo_stub import PlivoStubServer
+from telefonyhelper import PlivoClient, plivo_call_params
+from time import time
+
+
+class Command(BaseCommand):
+    # Use : benchmark_plivo --count 2000 --latency 0.005
+    help = _("Measure the originate throughput of the Plivo client against "
+             "a local stub of Plivo : a connection per call as before, "
+             "kept alive connections, parallel calls and BulkCall")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--count', type='int', dest='count', default=1000,
+                    help=_('Number of originates')),
+        make_option('--latency', type='float', dest='latency', default=0.0,
+                    help=_('Seconds taken by the stub to answer a request')),
+        make_option('--concurrency', type='int', dest='concurrency',
+                    default=4, help=_('Parallel requests of the client')),
+        make_option('--batch', type='int', dest='batch', default=100,
+                    help=_('Originates per BulkCall request')),
+    )
+
+    def handle(self, *args, **options):
+        server = PlivoStubServer(latency=options['latency'])
+        server.start()
+        call_params_list = [
+            plivo_call_params(callerid='1000', phone_number='3400%06d' % i,
+                              Gateways='user/',
+                              AnswerUrl='http://127.0.0.1/answercall/')
+            for i in range(options['count'])]
+        batch = options['batch']
+
+        def new_connection():
+            # former call_plivo : a new client, and connection, per call
+            for call_params in call_params_list:
+                client = PlivoClient(server.url)
+                client.call(call_params)
+                client.close()
+
+        def keep_alive(client):
+            for call_params in call_params_list:
+                client.call(call_params)
+
+        def parallel(client):
+            for i in range(0, len(call_params_list), batch):
+                client.call_many(call_params_list[i:i + batch])
+
+        def bulk_call(client):
+            for i in range(0, len(call_params_list), batch):
+                client.bulk_call(call_params_list[i:i + batch])
+
+        print "%-16s %8s %12s %10s %10s" % ('client', 'calls', 'connections',
+                                            'seconds', 'calls/sec')
+        try:
+            for name, run in (('new connection', new_connection),
+                              ('keep-alive', keep_alive),
+                              ('parallel', parallel),
+                              ('bulk call', bulk_call)):
+                client = PlivoClient(server.url,
+                                     concurrency=options['concurrency'])
+                server.counter = {}
+                start = time()
+                if run == new_connection:
+                    run()
+                else:
+                    run(client)
+                elapsed = time() - start
+                client.close()
+                print "%-16s %8d %12d %10.3f %10.0f" % (name,
+                    server.counter.get('call', 0),
+                    server.counter.get('connection', 0), elapsed,
+                    server.counter.get('call', 0) / elapsed)
+        finally:
+            server.stop()
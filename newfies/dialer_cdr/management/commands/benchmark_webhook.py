@@ -0,0 +1,166 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.client import RequestFactory
+from django.utils.translation import gettext_lazy as _
+from dialer_campaign.models import Campaign
+from dialer_cdr.models import Callrequest
+from api.hangupcall_api import HangupcallResource
+from api import webhooks
+from common_functions import bulk_create_chunk
+from threading import Thread, Lock
+from urllib import urlencode
+from urlparse import urlparse
+from time import time
+import httplib
+
+
+def percentile(latency_list, rate):
+    """Return the latency below which are rate of the requests"""
+    latency_list = sorted(latency_list)
+    return latency_list[min(int(len(latency_list) * rate),
+                            len(latency_list) - 1)]
+
+
+class Command(BaseCommand):
+    # Use : benchmark_webhook --campaign 1 --count 2000
+    #       benchmark_webhook --campaign 1 --url http://127.0.0.1:8000
+    help = _("Load test of the hangupcall callback on new call requests of "
+             "the campaign, removed at the end : in the process, the "
+             "tastypie resource against the webhook view, or with --url, "
+             "concurrent requests to a running server. Report the calls "
+             "per second and the p50 / p99 latency.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--campaign', type='int', dest='campaign',
+                    help=_('Campaign of the call requests')),
+        make_option('--count', type='int', dest='count', default=1000,
+                    help=_('Number of hangups per test')),
+        make_option('--url', dest='url', default=None,
+                    help=_('URL of a running server, ie '
+                           'http://127.0.0.1:8000')),
+        make_option('--concurrency', type='int', dest='concurrency',
+                    default=8, help=_('Concurrent requests with --url')),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            obj_campaign = Campaign.objects.get(id=options['campaign'])
+        except Campaign.DoesNotExist:
+            raise CommandError(_('Can\'t find this Campaign : %s' %
+                                 options['campaign']))
+        count = options['count']
+        self.prefix = 'benchmark-%d-' % int(time() * 1000)
+        print "%-12s %8s %10s %10s %10s %10s" % ('client', 'calls',
+            'seconds', 'calls/sec', 'p50 ms', 'p99 ms')
+        try:
+            if options['url']:
+                uuid_list = self.create_callrequest(obj_campaign, 'http',
+                                                    count)
+                self.measure('http', uuid_list, lambda: self.run_http(
+                    options['url'], uuid_list, options['concurrency']))
+            else:
+                for name, view in (
+                        ('tastypie', HangupcallResource().wrap_view('create')),
+                        ('webhook', webhooks.hangupcall)):
+                    uuid_list = self.create_callrequest(obj_campaign, name,
+                                                        count)
+                    self.measure(name, uuid_list,
+                        lambda: self.run_view(view, uuid_list))
+        finally:
+            cursor = connection.cursor()
+            cursor.execute("DELETE FROM dialer_cdr WHERE request_uuid "
+                           "LIKE %s", [self.prefix + '%'])
+            cursor.execute("DELETE FROM dialer_callrequest WHERE "
+                           "request_uuid LIKE %s", [self.prefix + '%'])
+            transaction.commit_unless_managed()
+
+    def create_callrequest(self, obj_campaign, name, count):
+        """Create count call requests in progress, without retry"""
+        uuid_list = ['%s%s-%06d' % (self.prefix, name, i)
+                     for i in range(count)]
+        bulk_create_chunk(Callrequest, [
+            Callrequest(status=8, call_type=2, request_uuid=request_uuid,
+                        phone_number='34000000',
+                        callerid=obj_campaign.callerid,
+                        campaign_id=obj_campaign.id,
+                        aleg_gateway_id=obj_campaign.aleg_gateway_id,
+                        content_type_id=obj_campaign.content_type_id,
+                        object_id=obj_campaign.object_id,
+                        user_id=obj_campaign.user_id)
+            for request_uuid in uuid_list])
+        transaction.commit_unless_managed()
+        return uuid_list
+
+    def measure(self, name, uuid_list, run):
+        start = time()
+        latency_list = run()
+        elapsed = time() - start
+        print "%-12s %8d %10.3f %10.0f %10.2f %10.2f" % (name,
+            len(uuid_list), elapsed, len(uuid_list) / elapsed,
+            percentile(latency_list, 0.5) * 1000,
+            percentile(latency_list, 0.99) * 1000)
+
+    def run_view(self, view, uuid_list):
+        factory = RequestFactory()
+        latency_list = []
+        for request_uuid in uuid_list:
+            request = factory.post('/api/v1/hangupcall/',
+                {'RequestUUID': request_uuid,
+                 'HangupCause': 'NORMAL_CLEARING'})
+            start = time()
+            response = view(request)
+            latency_list.append(time() - start)
+            if response.status_code != 200:
+                raise CommandError(response.content)
+        return latency_list
+
+    def run_http(self, url, uuid_list, concurrency):
+        """Post the hangups with concurrency kept alive connections"""
+        url = urlparse(url)
+        latency_list = []
+        error_list = []
+        lock = Lock()
+
+        def post(uuid_chunk):
+            http = httplib.HTTPConnection(url.hostname, url.port or 80)
+            for request_uuid in uuid_chunk:
+                start = time()
+                http.request('POST', url.path.rstrip('/') +
+                    '/api/v1/hangupcall/',
+                    urlencode({'RequestUUID': request_uuid,
+                               'HangupCause': 'NORMAL_CLEARING'}),
+                    {'Content-Type': 'application/x-www-form-urlencoded'})
+                response = http.getresponse()
+                response.read()
+                lock.acquire()
+                latency_list.append(time() - start)
+                if response.status != 200:
+                    error_list.append(response.status)
+                lock.release()
+            http.close()
+
+        thread_list = [Thread(target=post,
+                              args=(uuid_list[i::concurrency],))
+                       for i in range(concurrency)]
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+        if error_list:
+            print _("%d hangups failed") % len(error_list)
+        return latency_list
@@ -21,6 +21,7 @@ from dialer_campaign.models import Campaign
 from django.db import IntegrityError
 from dialer_cdr.models import Callrequest, VoIPCall
 from survey.models import SurveyCampaignResult
+from survey.results import add_call_result
 from random import choice
 from uuid import uuid1
 import random
@@ -89,6 +90,7 @@ class Command(BaseCommand):
                                             duration=random.randint(1, 100),
                                             disposition=choice(VOIPCALL_DISPOSITION))
                         
+                        result_list = []
                         for question in SURVEY_RESULT_QUE:
                             # for survey campaign result
                             if question == \
@@ -100,15 +102,15 @@ class Command(BaseCommand):
                                 record_file = ''
 
 
-                            survey_campaign_result = \
+                            result_list.append(
                                 SurveyCampaignResult.objects.create(
                                                      campaign=obj_campaign,
                                                      surveyapp_id=1,
                                                      question=question,
                                                      response=response,
                                                      record_file=record_file,
-                                                     callrequest=new_callrequest)
-
+                                                     callrequest=new_callrequest))
+                        add_call_result(result_list)
 
                     print _("No of Callrequest & CDR created :%(count)s" % {'count': no_of_record})
                 except IntegrityError:
@@ -0,0 +1,76 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import reset_queries
+from django.utils.translation import gettext_lazy as _
+from api.cdr_ingest import CdrSpool
+from time import time, sleep
+import os
+import signal
+
+
+class Command(BaseCommand):
+    # Use : ingest_cdr_spool --spool-dir /var/log/freeswitch/xml_cdr/
+    #       ingest_cdr_spool --once --done-dir /var/log/freeswitch/cdr_done/
+    help = _("Store the XML CDRs written by mod_xml_cdr in its log-dir, "
+             "by batches, then remove the files or move them to "
+             "--done-dir. Run until stopped, or with --once, only on the "
+             "files of the spool.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--spool-dir', dest='spool_dir',
+                    default=settings.CDR_SPOOL_DIR,
+                    help=_('log-dir of mod_xml_cdr')),
+        make_option('--done-dir', dest='done_dir', default=None,
+                    help=_('Directory of the stored files, they are '
+                           'removed by default')),
+        make_option('--batch', type='int', dest='batch',
+                    default=settings.CDR_INGEST_BATCH,
+                    help=_('Files stored in one batch')),
+        make_option('--interval', type='float', dest='interval', default=1,
+                    help=_('Seconds between two reads of the spool')),
+        make_option('--once', action='store_true', dest='once',
+                    default=False, help=_('Store the files of the spool '
+                                          'and stop')),
+    )
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['spool_dir']):
+            raise CommandError(_('Can\'t find the spool directory : %s' %
+                                 options['spool_dir']))
+        spool = CdrSpool(options['spool_dir'], batch_size=options['batch'],
+                         done_dir=options['done_dir'])
+        stop = {'stop': options['once']}
+
+        def shutdown(signum, frame):
+            stop['stop'] = True
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        start = time()
+        while True:
+            if not spool.ingest() and not stop['stop']:
+                sleep(options['interval'])
+            reset_queries()
+            if stop['stop']:
+                break
+        print _("%(stored)d CDRs stored, %(not_found)d without call "
+                "request, %(failed)d files failed in %(seconds).1f "
+                "seconds") % {'stored': spool.stored,
+                              'not_found': spool.not_found,
+                              'failed': spool.failed,
+                              'seconds': time() - start}
@@ -0,0 +1,82 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.translation import gettext_lazy as _
+from dialer_cdr.originate_worker import OriginateWorker
+from dialer_cdr.plivo_stub import PlivoStubServer
+from telefonyhelper import AsyncPlivoClient
+import logging
+import signal
+
+logger = logging.getLogger('newfies.filelog')
+
+
+class Command(BaseCommand):
+    # Use : originate_worker --concurrency 1000
+    help = _("Originate the pending call requests with many calls in "
+             "flight in one process, instead of the celery tasks, "
+             "ORIGINATE_WORKER has to be enabled")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--concurrency', type='int', dest='concurrency',
+                    default=settings.ORIGINATE_WORKER_CONCURRENCY,
+                    help=_('Originates in flight')),
+        make_option('--batch', type='int', dest='batch', default=200,
+                    help=_('Results written in one batch')),
+        make_option('--stub', action='store_true', dest='stub',
+                    default=False,
+                    help=_('Originate on a local stub of Plivo, as the '
+                           'dummy engine')),
+    )
+
+    def handle(self, *args, **options):
+        if not settings.ORIGINATE_WORKER:
+            raise CommandError(_('ORIGINATE_WORKER is not enabled, the call '
+                                 'requests are sent to celery'))
+        url = settings.PLIVO_REST_API_URL
+        if options['stub']:
+            server = PlivoStubServer()
+            server.start()
+            url = server.url
+        elif settings.NEWFIES_DIALER_ENGINE.lower() != 'plivo':
+            raise CommandError(_('The originate worker needs the plivo '
+                                 'engine, or --stub'))
+
+        client = AsyncPlivoClient(url, settings.PLIVO_SID,
+                                  settings.PLIVO_AUTH_TOKEN,
+                                  settings.PLIVO_API_VERSION,
+                                  timeout=settings.PLIVO_TIMEOUT,
+                                  concurrency=options['concurrency'],
+                                  failure_threshold=\
+                                      settings.PLIVO_CIRCUIT_FAILURE,
+                                  reset_timeout=settings.PLIVO_CIRCUIT_RESET)
+        worker = OriginateWorker(client, logger, batch_size=options['batch'])
+        stop = {'stop': False}
+
+        def shutdown(signum, frame):
+            stop['stop'] = True
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        print _("Originate worker started on %(url)s, %(concurrency)d calls "
+                "in flight") % {'url': url,
+                                'concurrency': options['concurrency']}
+        worker.run(lambda: stop['stop'])
+        print _("%(originated)d calls originated, %(failed)d failed, "
+                "%(postponed)d postponed") % \
+            {'originated': worker.originated, 'failed': worker.failed,
+             'postponed': worker.postponed}
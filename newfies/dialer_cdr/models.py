@@ -13,16 +13,21 @@
 #
 
 from django.db import models
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.utils.translation import ugettext_lazy as _
 
-from dialer_gateway.models import Gateway
+from dialer_gateway.models import Gateway, GatewayGroup
+from dialer_gateway.utils import DialPlan
 from dialer_campaign.models import Campaign, CampaignSubscriber
 from common.intermediate_model_base_class import Model
+from common_functions import VersionedCache, reset_version
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 from country_dialcode.models import Prefix
+from user_profile.models import UserProfile
 from uuid import uuid1
-from datetime import datetime
+from datetime import datetime, timedelta
+from random import randint
 
 
 CALLREQUEST_STATUS = (
@@ -76,6 +81,52 @@ class CallRequestManager(models.Manager):
         #return Callrequest.objects.all()
         return Callrequest.objects.filter(**kwargs)
 
+    def claim_pending_callrequest(self, limit):
+        """Claim up to limit pending callrequests which are due, for the
+        originate worker, return them
+
+        The rows are moved to a negative token unique to this claim then to
+        PROCESS, a row taken meanwhile by another worker is left out. The
+        claimed rows have no RequestUUID until their originate is recorded,
+        see release_stale_claim.
+        """
+        candidate_list = list(self.get_pending_callrequest()\
+            .order_by('call_time').values_list('id', flat=True)[:limit])
+        if not candidate_list:
+            return []
+        token = -randint(1000, 2 ** 30)
+        self.filter(id__in=candidate_list, status=1).update(status=token)
+        claimed_list = list(self.filter(status=token))
+        self.filter(status=token).update(status=7,  # Update to Process
+                                         request_uuid=None,
+                                         updated_date=datetime.now())
+        return claimed_list
+
+    def release_stale_claim(self, timeout):
+        """Move back to PENDING the call requests claimed more than timeout
+        seconds ago whose originate was never recorded, their originate
+        worker died, return their number"""
+        return self.filter(status=7, request_uuid__isnull=True,
+                           updated_date__lt=datetime.now() - \
+                               timedelta(seconds=timeout))\
+            .update(status=1)  # Update to Pending
+
+    def claim_due_retry(self, campaign_id, limit):
+        """Move up to limit retries of the campaign which are due to
+        PENDING, the oldest first, return their IDs, see dialer_cdr.retry"""
+        candidate_list = list(self.filter(campaign=campaign_id, status=3,
+                                          call_time__lte=datetime.now())\
+            .order_by('call_time').values_list('id', flat=True)[:limit])
+        if not candidate_list:
+            return []
+        token = -randint(1000, 2 ** 30)
+        self.filter(id__in=candidate_list, status=3).update(status=token)
+        claimed_list = list(self.filter(status=token)\
+            .values_list('id', flat=True))
+        self.filter(status=token).update(status=1,  # Update to Pending
+                                         call_time=datetime.now())
+        return claimed_list
+
 
 def str_uuid1():
     return str(uuid1())
@@ -134,7 +185,8 @@ class Callrequest(Model):
                         max_length=120, null=True, blank=True)
     aleg_uuid = models.CharField(max_length=120, help_text=_("A-Leg Call-ID"),
                         db_index=True, null=True, blank=True)
-    call_time = models.DateTimeField(default=(lambda: datetime.now()))
+    call_time = models.DateTimeField(default=(lambda: datetime.now()),
+                                     db_index=True)
     created_date = models.DateTimeField(auto_now_add=True, verbose_name='Date')
     updated_date = models.DateTimeField(auto_now=True)
     call_type = models.IntegerField(choices=CALLREQUEST_TYPE, default='1',
@@ -285,3 +337,209 @@ class VoIPCall(models.Model):
 
     def __unicode__(self):
             return u"%s" % self.callid
+
+
+class VoIPCallRollup(models.Model):
+    """Calls of a user, campaign and disposition over a period, counted by
+    the voipcall_rollup task, see dialer_cdr.rollup
+
+    **Attributes**:
+
+        * ``disposition`` - Disposition of the calls
+        * ``call_count`` - Number of calls
+        * ``duration_sum`` - Total duration of the calls
+        * ``billsec_sum`` - Total billsec of the calls
+
+    **Relationships**:
+
+        * ``user`` - Foreign key relationship to the User model.
+        * ``campaign`` - Foreign key relationship to the Campaign model.
+    """
+    user = models.ForeignKey('auth.User', related_name='+')
+    campaign = models.ForeignKey(Campaign, null=True, blank=True,
+                    related_name='+')
+    disposition = models.CharField(max_length=40, blank=True)
+    call_count = models.IntegerField(default=0)
+    duration_sum = models.BigIntegerField(default=0)
+    billsec_sum = models.BigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class VoIPCallHourly(VoIPCallRollup):
+    """Calls per hour, see VoIPCallRollup
+
+    **Name of DB table**: dialer_cdr_hourly
+    """
+    hour = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'dialer_cdr_hourly'
+
+
+class VoIPCallDaily(VoIPCallRollup):
+    """Calls per day, see VoIPCallRollup
+
+    **Name of DB table**: dialer_cdr_daily
+    """
+    day = models.DateField(db_index=True)
+
+    class Meta:
+        db_table = 'dialer_cdr_daily'
+
+
+class VoIPCallRollupState(models.Model):
+    """Last VoIPCall counted in the rollups
+
+    **Name of DB table**: dialer_cdr_rollup_state
+    """
+    last_voipcall_id = models.IntegerField(default=0)
+    updated_date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'dialer_cdr_rollup_state'
+
+
+class VoIPCallRollupGap(models.Model):
+    """ID missing from the VoIPCalls counted in the rollups, the VoIPCall
+    is counted if its transaction is committed later
+
+    **Name of DB table**: dialer_cdr_rollup_gap
+    """
+    voipcall_id = models.IntegerField(unique=True)
+    created_date = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = 'dialer_cdr_rollup_gap'
+
+
+CALL_CONTEXT_VERSION_KEY = 'call_context_version_%s_%s'
+
+
+def load_campaign_context(campaign_id):
+    """Dial settings of a campaign, the application is read in the same
+    query"""
+    return Campaign.objects.filter(id=campaign_id)\
+        .values('callmaxduration', 'content_type__app_label',
+                'aleg_gatewaygroup')[0]
+
+
+def load_gateway_context(gateway_id):
+    """Dial settings of a gateway, the gateways string is sanitized and the
+    prefix rules compiled once"""
+    context = Gateway.objects.filter(id=gateway_id)\
+        .values('status', 'addprefix', 'removeprefix', 'gateways',
+                'gateway_codecs', 'gateway_timeouts', 'gateway_retries',
+                'originate_dial_string', 'maximum_call', 'failover')[0]
+    gateways = context['gateways'].strip()
+    if gateways and gateways[-1] != '/':
+        gateways = gateways + '/'
+    context['gateways'] = gateways
+    context['dialplan'] = DialPlan(context['removeprefix'],
+                                   context['addprefix'], context['status'])
+    return context
+
+
+def load_user_context(user_id):
+    """Dial settings of a user, a user without profile has no accountcode"""
+    accountcode_list = UserProfile.objects.filter(user=user_id)\
+        .values_list('accountcode', flat=True)
+    return {'accountcode': accountcode_list and accountcode_list[0] or None}
+
+
+def load_gatewaygroup_context(gatewaygroup_id):
+    """Gateways of a gateway group"""
+    if not GatewayGroup.objects.filter(id=gatewaygroup_id).exists():
+        raise IndexError('No GatewayGroup %s' % gatewaygroup_id)
+    return {'gateway_list': list(GatewayGroup.gateway.through.objects\
+        .filter(gatewaygroup=gatewaygroup_id).order_by('gateway')\
+        .values_list('gateway_id', flat=True))}
+
+
+CALL_CONTEXT_LOADER = {
+    'campaign': load_campaign_context,
+    'gateway': load_gateway_context,
+    'gatewaygroup': load_gatewaygroup_context,
+    'user': load_user_context,
+}
+
+
+def load_call_context(key):
+    """Dial settings of a (kind, id)"""
+    return CALL_CONTEXT_LOADER[key[0]](key[1])
+
+# Dial settings per (kind, id) for the running process
+_call_context = VersionedCache(CALL_CONTEXT_VERSION_KEY, load_call_context)
+
+
+def get_context_list(key_list, skip_missing=False):
+    """Return the dial settings of the (kind, id) of key_list
+
+    The settings are kept per process and reloaded when their version in
+    the cache differs, the versions are reset by reset_call_context, so a
+    warm process reads the versions in one cache request and doesn't query
+    the database. A None id gives None. Raise IndexError when an object
+    doesn't exist, unless skip_missing, then it gives None.
+    """
+    version_dict = _call_context.get_version_dict(key_list)
+    context_list = []
+    for key in key_list:
+        context = None
+        if key[1] is not None:
+            try:
+                context = _call_context.get_version(key, version_dict[key])
+            except IndexError:
+                if not skip_missing:
+                    raise
+        context_list.append(context)
+    return context_list
+
+
+def get_call_context(campaign_id, gateway_id, user_id):
+    """Return the dial settings of the campaign, the gateway and the user
+    of a call request, see get_context_list"""
+    return get_context_list([('campaign', campaign_id),
+                             ('gateway', gateway_id), ('user', user_id)])
+
+
+def reset_call_context(sender, **kwargs):
+    """A ``post_save`` and ``post_delete`` signal sent by Campaign, Gateway,
+    GatewayGroup and UserProfile, it invalidates the dial settings of the
+    object in all the processes"""
+    instance = kwargs['instance']
+    if sender == UserProfile:
+        key = ('user', instance.user_id)
+    else:
+        key = (sender._meta.module_name, instance.id)
+    reset_version([CALL_CONTEXT_VERSION_KEY % key])
+
+post_save.connect(reset_call_context, sender=Campaign)
+post_save.connect(reset_call_context, sender=Gateway)
+post_save.connect(reset_call_context, sender=UserProfile)
+post_delete.connect(reset_call_context, sender=Campaign)
+post_delete.connect(reset_call_context, sender=Gateway)
+post_delete.connect(reset_call_context, sender=UserProfile)
+post_save.connect(reset_call_context, sender=GatewayGroup)
+post_delete.connect(reset_call_context, sender=GatewayGroup)
+
+
+def reset_gatewaygroup_context(sender, **kwargs):
+    """A ``m2m_changed`` signal sent when the gateways of a GatewayGroup
+    change, it invalidates the gateways of the groups"""
+    if kwargs['action'] not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    instance = kwargs['instance']
+    if not kwargs['reverse']:
+        gatewaygroup_list = [instance.id]
+    elif kwargs['pk_set']:
+        gatewaygroup_list = kwargs['pk_set']
+    else:
+        # a gateway left all its groups
+        gatewaygroup_list = instance.gatewaygroup_set\
+            .values_list('id', flat=True)
+    reset_version([CALL_CONTEXT_VERSION_KEY % ('gatewaygroup', group_id)
+                   for group_id in gatewaygroup_list])
+
+m2m_changed.connect(reset_gatewaygroup_context,
+                    sender=GatewayGroup.gateway.through)
@@ -0,0 +1,155 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+"""
+Originate worker
+
+With ORIGINATE_WORKER, the call requests are not sent to celery : one
+process claims the pending call requests which are due, keeps thousands
+of originates in flight through an AsyncPlivoClient and writes back their
+RequestUUID and status in batches. It shares the models and the dial
+settings cache of the celery workers, see the originate_worker command.
+The call requests claimed by a worker which died before recording them
+are pending again after ORIGINATE_CLAIM_TIMEOUT seconds.
+"""
+
+from django.conf import settings
+from django.db import reset_queries
+from dialer_cdr.models import Callrequest
+from dialer_cdr.tasks import prepare_callrequest, complete_callrequest_list, \
+                             fail_callrequest_list, count_subscriber_attempt
+from telefonyhelper import plivo_call_params, PlivoError
+from functools import partial
+from time import time
+
+
+class OriginateWorker(object):
+    """Claim, originate and record the call requests
+
+    **Attributes**:
+
+        * ``client`` - AsyncPlivoClient sending the originates
+        * ``batch_size`` - Results written in one batch
+        * ``flush_interval`` - Seconds a result waits at most to be written
+        * ``claim_interval`` - Seconds between two claims when there are
+          no more due call requests
+        * ``release_interval`` - Seconds between two releases of the stale
+          claims, see Callrequest.objects.release_stale_claim
+
+    The counters ``originated``, ``failed`` and ``postponed`` give the call
+    requests originated, failed and sent again later as their gateways
+    were saturated.
+    """
+
+    def __init__(self, client, logger, batch_size=200, flush_interval=0.5,
+                 claim_interval=0.5, release_interval=60):
+        self.client = client
+        self.logger = logger
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.claim_interval = claim_interval
+        self.release_interval = release_interval
+        self.success_list = []
+        self.failure_list = []
+        self.last_flush = time()
+        self.next_claim = 0
+        self.next_release = 0
+        self.originated = 0
+        self.failed = 0
+        self.postponed = 0
+
+    def release_stale_claim(self):
+        """Make the call requests of the dead workers pending again"""
+        count = Callrequest.objects.release_stale_claim(
+                                settings.ORIGINATE_CLAIM_TIMEOUT)
+        if count:
+            self.logger.warning("%d stale call requests pending again" % \
+                                    count)
+        self.next_release = time() + self.release_interval
+        return count
+
+    def claim(self):
+        """Originate the due call requests, as much as the free slots of
+        the client"""
+        limit = min(self.client.concurrency - self.client.in_flight(), 500)
+        if limit <= 0:
+            return 0
+        claimed_list = Callrequest.objects.claim_pending_callrequest(limit)
+        if len(claimed_list) < limit:
+            self.next_claim = time() + self.claim_interval
+        for obj_callrequest in claimed_list:
+            call_param = prepare_callrequest(obj_callrequest,
+                                             obj_callrequest.campaign_id,
+                                             self.logger)
+            if call_param is False:
+                self.postponed += 1
+                continue
+            if call_param is None:
+                self.failed += 1
+                continue
+            try:
+                call_params = plivo_call_params(**call_param)
+            except PlivoError, e:
+                self.originated_call(obj_callrequest, None, e)
+                continue
+            self.client.originate(call_params,
+                                  partial(self.originated_call,
+                                          obj_callrequest))
+        return len(claimed_list)
+
+    def originated_call(self, obj_callrequest, request_uuid, error):
+        if error is None:
+            self.success_list.append((obj_callrequest, request_uuid))
+        else:
+            self.logger.error("Error to init the callrequest %s : %s" % \
+                                (obj_callrequest.id, error))
+            self.failure_list.append(obj_callrequest)
+
+    def flush(self):
+        """Write the results of the originates"""
+        if self.success_list:
+            complete_callrequest_list([
+                (obj.id, request_uuid, obj.aleg_gateway_id)
+                for obj, request_uuid in self.success_list])
+            count_subscriber_attempt([obj.campaign_subscriber_id
+                for obj, request_uuid in self.success_list
+                if obj.campaign_subscriber_id])
+        if self.failure_list:
+            fail_callrequest_list(self.failure_list)
+        self.originated += len(self.success_list)
+        self.failed += len(self.failure_list)
+        self.success_list = []
+        self.failure_list = []
+        self.last_flush = time()
+        reset_queries()
+
+    def run_once(self):
+        if time() >= self.next_release:
+            self.release_stale_claim()
+        if time() >= self.next_claim:
+            self.claim()
+        self.client.poll()
+        if len(self.success_list) + len(self.failure_list) >= \
+            self.batch_size or time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def run(self, stop=None):
+        """Run until stop() is true, then wait for the calls in flight"""
+        try:
+            while stop is None or not stop():
+                self.run_once()
+        finally:
+            while self.client.in_flight():
+                self.client.poll()
+            self.flush()
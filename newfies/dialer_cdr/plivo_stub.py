@@ -0,0 +1,129 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+"""
+Local stub of the Plivo REST API, it answers the Call and BulkCall
+requests without calling anyone, for the tests and the benchmarks of the
+Plivo client
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from django.utils import simplejson as json
+from threading import Lock, Thread
+from urlparse import parse_qsl
+from time import sleep
+from uuid import uuid1
+import socket
+
+
+class PlivoStubHandler(BaseHTTPRequestHandler):
+    """Answer the originates like Plivo, the connections are kept alive"""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # the headers are written one by one, don't wait for the ACKs
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.getheader('content-length') or 0)
+        params = dict(parse_qsl(self.rfile.read(length)))
+        endpoint = self.path.rstrip('/').split('/')[-1]
+        server.count('request_' + endpoint)
+        if server.latency:
+            sleep(server.latency)
+
+        if endpoint == 'Call':
+            answer = {'Success': True, 'Message': 'Call Request Executed',
+                      'RequestUUID': str(uuid1())}
+        elif endpoint == 'BulkCall' and server.bulk:
+            count = len(params['To'].split(params.get('Delimiter', '>')))
+            answer = {'Success': True, 'Message': 'BulkCalls Executed',
+                      'RequestUUID': [str(uuid1()) for i in range(count)]}
+        else:
+            self.send_error(404)
+            return
+        server.count('call', len(params['To'].split('>')))
+
+        data = json.dumps(answer)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if server.framing == 'chunked':
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            half = len(data) / 2
+            for chunk in (data[:half], data[half:], ''):
+                self.wfile.write('%x\r\n%s\r\n' % (len(chunk), chunk))
+        elif server.framing == 'close':
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.wfile.write(data)
+            self.close_connection = 1
+        else:
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PlivoStubServer(ThreadingMixIn, HTTPServer):
+    """Plivo REST API stub listening on a free local port
+
+    **Attributes**:
+
+        * ``latency`` - Seconds taken to answer a request
+        * ``bulk`` - False to answer 404 to BulkCall, as an older Plivo
+        * ``framing`` - Framing of the bodies of the answers : 'length',
+          'chunked' or 'close'
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency=0, bulk=True, framing='length'):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), PlivoStubHandler)
+        self.latency = latency
+        self.bulk = bulk
+        self.framing = framing
+        self.counter = {}
+        self.counter_lock = Lock()
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def count(self, name, value=1):
+        self.counter_lock.acquire()
+        self.counter[name] = self.counter.get(name, 0) + value
+        self.counter_lock.release()
+
+    def handle_error(self, request, client_address):
+        # the client gave up on a slow answer
+        pass
+
+    def process_request(self, request, client_address):
+        self.count('connection')
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    def start(self):
+        thread = Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,133 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+"""
+Retry of the failed calls
+
+The retry of a failed call request is a new call request in RETRY status,
+due at its call_time : the retries wait in the database instead of the
+broker, and check_campaign_pendingcall sends the due retries of its
+campaign before the new calls, within the budget of the pacer.
+
+The delay and the number of retries depend on the hangup cause, see
+RETRY_POLICY, the intervalretry of the campaign is multiplied by the
+backoff at each attempt, up to RETRY_MAX_DELAY.
+"""
+
+from django.conf import settings
+from dialer_campaign.models import Campaign
+from dialer_campaign.function_def import user_dialer_setting
+from dialer_cdr.models import Callrequest
+from common_functions import chunk_list, bulk_create_chunk
+from datetime import datetime, timedelta
+from uuid import uuid1
+import logging
+
+logger = logging.getLogger('newfies.filelog')
+
+# Status of the call requests waiting for their retry
+RETRY_STATUS = 3
+
+
+def get_retry_policy(hangup_cause):
+    """Return the maxretry, intervalretry and backoff of a hangup cause,
+    None when the campaign decides"""
+    policy = {'maxretry': None,
+              'intervalretry': None,
+              'backoff': settings.RETRY_BACKOFF}
+    policy.update(settings.RETRY_POLICY.get(hangup_cause, {}))
+    return policy
+
+
+def get_maxretry(campaign, dialer_set, policy):
+    """Return the retries allowed by the campaign, the dialer settings of
+    its user, if any, and the policy of the hangup cause"""
+    maxretry_list = [campaign.maxretry or 0]
+    if dialer_set:
+        maxretry_list.append(dialer_set.maxretry or 0)
+    if policy['maxretry'] is not None:
+        maxretry_list.append(policy['maxretry'])
+    return min(maxretry_list)
+
+
+def retry_delay(intervalretry, num_attempt, policy):
+    """Return the seconds to wait before the retry num_attempt, from 1"""
+    if policy['intervalretry'] is not None:
+        intervalretry = policy['intervalretry']
+    delay = (intervalretry or 0) * \
+            policy['backoff'] ** max(num_attempt - 1, 0)
+    return int(min(delay, settings.RETRY_MAX_DELAY))
+
+
+def schedule_retry_list(callrequest_list):
+    """Queue the retries of the failed call requests of callrequest_list,
+    return the number of retries queued
+
+    The call requests are marked Retry Done, the retries of the ones which
+    have attempts left are inserted together, due after the delay of their
+    hangup cause.
+    """
+    if not callrequest_list:
+        return 0
+    campaign_dict = Campaign.objects.in_bulk(
+        set([obj.campaign_id for obj in callrequest_list]))
+    dialer_set_dict = {}
+    now = datetime.now()
+    retry_list = []
+    for callrequest in callrequest_list:
+        campaign = campaign_dict.get(callrequest.campaign_id)
+        if campaign is None:
+            continue
+        if campaign.user_id not in dialer_set_dict:
+            dialer_set_dict[campaign.user_id] = \
+                user_dialer_setting(campaign.user)
+        policy = get_retry_policy(callrequest.hangup_cause)
+        maxretry = get_maxretry(campaign,
+                                dialer_set_dict[campaign.user_id], policy)
+        if callrequest.num_attempt >= maxretry:
+            logger.error("Not allowed retry - Maxretry (%d) - %s" % \
+                            (maxretry, callrequest.hangup_cause))
+            continue
+
+        num_attempt = callrequest.num_attempt + 1
+        call_time = now + timedelta(seconds=retry_delay(
+            campaign.intervalretry, num_attempt, policy))
+        logger.info("Init Retry CallRequest at %s" % \
+                        call_time.strftime("%b %d %Y %I:%M:%S"))
+        retry_list.append(Callrequest(
+                        request_uuid=str(uuid1()),
+                        status=RETRY_STATUS,
+                        call_type=1,  # Allow Retry
+                        call_time=call_time,
+                        parent_callrequest_id=callrequest.id,
+                        num_attempt=num_attempt,
+                        timeout=callrequest.timeout,
+                        callerid=callrequest.callerid,
+                        phone_number=callrequest.phone_number,
+                        campaign_id=campaign.id,
+                        aleg_gateway_id=campaign.aleg_gateway_id,
+                        content_type_id=callrequest.content_type_id,
+                        object_id=callrequest.object_id,
+                        user_id=callrequest.user_id,
+                        extra_data=callrequest.extra_data,
+                        extra_dial_string=callrequest.extra_dial_string,
+                        timelimit=callrequest.timelimit,
+                        campaign_subscriber_id=\
+                            callrequest.campaign_subscriber_id))
+
+    for id_chunk in chunk_list([obj.id for obj in callrequest_list]):
+        Callrequest.objects.filter(id__in=id_chunk)\
+            .update(call_type=3)  # Retry Done
+    bulk_create_chunk(Callrequest, retry_list)
+    return len(retry_list)
@@ -0,0 +1,297 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+"""
+Report rollups
+
+The voipcall_rollup task counts the new VoIPCalls per hour and per day,
+per user, campaign and disposition, in VoIPCallHourly and VoIPCallDaily,
+from the last VoIPCall it counted. The reports read these tables, plus the
+VoIPCalls not counted yet, instead of grouping the CDRs on an expression
+of starting_date which can't use its index.
+
+The IDs missing below the last VoIPCall counted are kept in
+VoIPCallRollupGap, a VoIPCall whose transaction was committed after the
+rollup passed its ID is counted by the next rollup, once.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum, Max, F, Q
+from dialer_cdr.models import VoIPCall, VoIPCallHourly, VoIPCallDaily, \
+                              VoIPCallRollupState, VoIPCallRollupGap
+from common_functions import bulk_create_chunk, chunk_list
+from datetime import datetime, timedelta
+
+ROLLUP_LOCK_KEY = 'voipcall_rollup_lock'
+ROLLUP_LOCK_EXPIRE = 60 * 30
+
+# model, period field and format of the period in the reports, the format
+# of the former SUBSTR of starting_date
+ROLLUP_PERIOD = {
+    'hour': (VoIPCallHourly, 'hour', '%Y-%m-%d %H'),
+    'day': (VoIPCallDaily, 'day', '%Y-%m-%d'),
+}
+
+
+def truncate_date(date, period):
+    """Return the start of the hour, or the day, of date"""
+    if period == 'hour':
+        return date.replace(minute=0, second=0, microsecond=0)
+    return date.date()
+
+
+def count_voipcall(counter_dict, period, key, disposition, duration,
+                   billsec, starting_date):
+    counter = counter_dict.setdefault(
+        (truncate_date(starting_date, period), ) + key + \
+            (disposition or '', ), [0, 0, 0])
+    counter[0] += 1
+    counter[1] += duration or 0
+    counter[2] += billsec or 0
+
+
+def add_rollup(period, counter_dict):
+    """Add the counters of counter_dict, keyed by (period, user_id,
+    campaign_id, disposition), to the rollup of the period"""
+    model, field, date_format = ROLLUP_PERIOD[period]
+    if not counter_dict:
+        return
+    rollup_dict = dict(((getattr(obj, field), obj.user_id, obj.campaign_id,
+                         obj.disposition), obj.id)
+        for obj in model.objects.filter(**{'%s__in' % field:
+                list(set([key[0] for key in counter_dict]))}))
+    new_list = []
+    for key, (count, duration, billsec) in counter_dict.iteritems():
+        if key in rollup_dict:
+            model.objects.filter(id=rollup_dict[key])\
+                .update(call_count=F('call_count') + count,
+                        duration_sum=F('duration_sum') + duration,
+                        billsec_sum=F('billsec_sum') + billsec)
+        else:
+            new_list.append(model(**{field: key[0],
+                                     'user_id': key[1],
+                                     'campaign_id': key[2],
+                                     'disposition': key[3],
+                                     'call_count': count,
+                                     'duration_sum': duration,
+                                     'billsec_sum': billsec}))
+    bulk_create_chunk(model, new_list)
+
+
+def rollup_voipcall_list(queryset):
+    """Count the VoIPCalls of queryset in the rollups, return their IDs"""
+    hourly_dict = {}
+    daily_dict = {}
+    id_list = []
+    for voipcall_id, user_id, campaign_id, disposition, duration, billsec, \
+            starting_date in queryset\
+            .values_list('id', 'user', 'callrequest__campaign',
+                         'disposition', 'duration', 'billsec',
+                         'starting_date').iterator():
+        count_voipcall(hourly_dict, 'hour', (user_id, campaign_id),
+                       disposition, duration, billsec, starting_date)
+        count_voipcall(daily_dict, 'day', (user_id, campaign_id),
+                       disposition, duration, billsec, starting_date)
+        id_list.append(voipcall_id)
+    add_rollup('hour', hourly_dict)
+    add_rollup('day', daily_dict)
+    return id_list
+
+
+@transaction.commit_on_success
+def rollup_voipcall_range(start_id, stop_id):
+    """Count the VoIPCalls of the IDs above start_id up to stop_id, return
+    their number
+
+    The IDs of the range without VoIPCall are kept as gaps, see
+    rollup_voipcall_gap.
+    """
+    id_set = set(rollup_voipcall_list(VoIPCall.objects\
+        .filter(id__gt=start_id, id__lte=stop_id)))
+    bulk_create_chunk(VoIPCallRollupGap,
+                      [VoIPCallRollupGap(voipcall_id=voipcall_id)
+                       for voipcall_id in xrange(start_id + 1, stop_id + 1)
+                       if voipcall_id not in id_set])
+    VoIPCallRollupState.objects.filter(pk=1)\
+        .update(last_voipcall_id=stop_id, updated_date=datetime.now())
+    return len(id_set)
+
+
+@transaction.commit_on_success
+def rollup_voipcall_gap():
+    """Count the VoIPCalls committed in the gaps of the previous rollups,
+    return their number
+
+    The gaps older than ROLLUP_GAP_EXPIRE seconds are dropped, their
+    transactions were rolled back.
+    """
+    VoIPCallRollupGap.objects.filter(created_date__lt=datetime.now() - \
+        timedelta(seconds=settings.ROLLUP_GAP_EXPIRE)).delete()
+    id_list = rollup_voipcall_list(VoIPCall.objects.filter(
+        id__in=VoIPCallRollupGap.objects.values('voipcall_id')))
+    for id_chunk in chunk_list(id_list):
+        VoIPCallRollupGap.objects.filter(voipcall_id__in=id_chunk).delete()
+    return len(id_list)
+
+
+def rollup_voipcall(chunk_size=None):
+    """Count the VoIPCalls inserted since the last rollup, by chunks of
+    chunk_size IDs, return their number or None if a rollup is running
+
+    The VoIPCalls of the last ROLLUP_DELAY seconds are left to the next
+    rollup, so the ones of the transactions not committed yet are not
+    skipped. The ones committed later still are counted with the gaps,
+    see rollup_voipcall_gap.
+    """
+    chunk_size = chunk_size or settings.ROLLUP_CHUNK_SIZE
+    if not cache.add(ROLLUP_LOCK_KEY, 'true', ROLLUP_LOCK_EXPIRE):
+        return None
+    try:
+        state, created = VoIPCallRollupState.objects.get_or_create(pk=1)
+        count = rollup_voipcall_gap()
+        max_id = VoIPCall.objects\
+            .filter(id__gt=state.last_voipcall_id,
+                    starting_date__lte=datetime.now() - \
+                        timedelta(seconds=settings.ROLLUP_DELAY))\
+            .aggregate(Max('id'))['id__max']
+        start_id = state.last_voipcall_id
+        while max_id and start_id < max_id:
+            stop_id = min(start_id + chunk_size, max_id)
+            count += rollup_voipcall_range(start_id, stop_id)
+            start_id = stop_id
+        return count
+    finally:
+        cache.delete(ROLLUP_LOCK_KEY)
+
+
+def voipcall_rollup_report(period, start_date=None, end_date=None,
+                           user=None, campaign=None, disposition=None,
+                           by_disposition=False):
+    """Return the calls per hour or per day, the earliest first
+
+    **Attributes**:
+
+        * ``period`` - 'hour' or 'day'
+        * ``start_date``, ``end_date`` - Range of starting_date, the first
+          period is counted in full
+        * ``user``, ``campaign``, ``disposition`` - Calls selected, all
+          when None
+        * ``by_disposition`` - Count the calls per disposition too
+
+    The rows have the keys of the former grouping of the VoIPCalls :
+    starting_date, the period formatted as a SUBSTR of starting_date,
+    starting_date__count, duration__sum, duration__avg, billsec__sum,
+    billsec__avg and disposition with by_disposition.
+    """
+    model, field, date_format = ROLLUP_PERIOD[period]
+    rollup_kwargs = {}
+    voipcall_kwargs = {}
+    if start_date:
+        rollup_kwargs['%s__gte' % field] = truncate_date(start_date, period)
+        voipcall_kwargs['starting_date__gte'] = start_date
+    if end_date:
+        rollup_kwargs['%s__lte' % field] = end_date
+        voipcall_kwargs['starting_date__lte'] = end_date
+    for name, value in (('user', user), ('campaign', campaign),
+                        ('disposition', disposition)):
+        if value is not None:
+            rollup_kwargs[name] = value
+            voipcall_kwargs[name] = value
+    if campaign is not None:
+        del voipcall_kwargs['campaign']
+        voipcall_kwargs['callrequest__campaign'] = campaign
+
+    last_voipcall_id = VoIPCallRollupState.objects.filter(pk=1)\
+        .values_list('last_voipcall_id', flat=True)
+    last_voipcall_id = last_voipcall_id and last_voipcall_id[0] or 0
+    group_list = [field]
+    if by_disposition:
+        group_list.append('disposition')
+    counter_dict = {}
+    for row in model.objects.filter(**rollup_kwargs).values(*group_list)\
+            .annotate(Sum('call_count'), Sum('duration_sum'),
+                      Sum('billsec_sum')):
+        counter = counter_dict.setdefault(
+            (row[field], row.get('disposition')), [0, 0, 0])
+        counter[0] += row['call_count__sum']
+        counter[1] += row['duration_sum__sum']
+        counter[2] += row['billsec_sum__sum']
+
+    # the VoIPCalls not counted yet in the rollup
+    for disposition, duration, billsec, starting_date in VoIPCall.objects\
+            .filter(Q(id__gt=last_voipcall_id) | Q(id__in=VoIPCallRollupGap\
+                        .objects.values('voipcall_id')), **voipcall_kwargs)\
+            .values_list('disposition', 'duration', 'billsec',
+                         'starting_date'):
+        if by_disposition:
+            key = (truncate_date(starting_date, period), disposition or '')
+        else:
+            key = (truncate_date(starting_date, period), None)
+        counter = counter_dict.setdefault(key, [0, 0, 0])
+        counter[0] += 1
+        counter[1] += duration or 0
+        counter[2] += billsec or 0
+
+    report_list = []
+    for key in sorted(counter_dict.keys()):
+        count, duration, billsec = counter_dict[key]
+        row = {'starting_date': key[0].strftime(date_format),
+               'starting_date__count': count,
+               'duration__sum': duration,
+               'duration__avg': float(duration) / count,
+               'billsec__sum': billsec,
+               'billsec__avg': float(billsec) / count}
+        if by_disposition:
+            row['disposition'] = key[1]
+        report_list.append(row)
+    return report_list
+
+
+def voipcall_daily_report(kwargs):
+    """Return the calls per day of the VoIPCall filter kwargs of the
+    reports, the latest day first, and their totals
+
+    kwargs holds the starting_date__range, __gte or __lte, the
+    disposition__exact, the user and the callrequest__campaign of the
+    calls.
+    """
+    start_date, end_date = kwargs.get('starting_date__range',
+        (kwargs.get('starting_date__gte'), kwargs.get('starting_date__lte')))
+    total_data = voipcall_rollup_report('day', start_date, end_date,
+        user=kwargs.get('user'),
+        campaign=kwargs.get('callrequest__campaign'),
+        disposition=kwargs.get('disposition__exact'))
+    total_data.reverse()
+
+    # Following code will count total voip calls, duration
+    if total_data:
+        max_duration = max([x['duration__sum'] for x in total_data])
+        total_duration = sum([x['duration__sum'] for x in total_data])
+        total_calls = sum([x['starting_date__count'] for x in total_data])
+        total_avg_duration = \
+            sum([x['duration__avg'] for x in total_data]) / len(total_data)
+    else:
+        max_duration = 0
+        total_duration = 0
+        total_calls = 0
+        total_avg_duration = 0
+    return {
+        'total_data': total_data,
+        'total_duration': total_duration,
+        'total_calls': total_calls,
+        'total_avg_duration': total_avg_duration,
+        'max_duration': max_duration,
+    }
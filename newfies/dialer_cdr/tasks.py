@@ -14,18 +14,27 @@
 
 from celery.task import Task, PeriodicTask
 from celery.decorators import task, periodic_task
+from celery.contrib.batches import Batches
 from django.conf import settings
 from django.core.cache import cache
-from dialer_campaign.models import Campaign, CampaignSubscriber
+from django.db import connection, transaction
+from django.db.models import Count
+from dialer_campaign.models import CampaignSubscriber
 from dialer_campaign.function_def import user_dialer_setting
-from dialer_cdr.models import Callrequest, VoIPCall
-from dialer_gateway.utils import phonenumber_change_prefix
+from dialer_cdr.models import Callrequest, VoIPCall, get_context_list
+from dialer_cdr.rollup import rollup_voipcall
+from dialer_gateway.models import Gateway
+from dialer_gateway.capacity import GatewaySaturated, acquire_least_loaded, \
+                                    release_gateway, set_gateway_in_use
+from common_functions import chunk_list
 from datetime import datetime, timedelta
 from time import sleep
 from uuid import uuid1
 
 
 LOCK_EXPIRE = 60 * 1  # Lock expires in 1 minute
+# Failover gateways followed from the gateways of a call
+FAILOVER_DEPTH = 3
 
 
 def single_instance_task(timeout):
@@ -73,6 +82,257 @@ def callrequest_pending(*args, **kwargs):
 """
 
 
+def reserve_gateway(obj_callrequest, campaign):
+    """Take a line on the least loaded active gateway of the call request
+
+    The gateways are those of the campaign's gateway group, or the A-Leg
+    gateway of the call request, then their failover gateways when they
+    are down or saturated. Return the ID and the dial settings of the
+    gateway, raise ValueError when there is no active gateway and
+    GatewaySaturated when they are all at their maximum_call.
+    """
+    if campaign['aleg_gatewaygroup']:
+        gatewaygroup = get_context_list(
+            [('gatewaygroup', campaign['aleg_gatewaygroup'])],
+            skip_missing=True)[0]
+        gateway_id_list = gatewaygroup and gatewaygroup['gateway_list'] or []
+    else:
+        gateway_id_list = [obj_callrequest.aleg_gateway_id]
+
+    gateway_dict = {}
+    gateway_tier_list = []
+    depth = 0
+    while gateway_id_list and depth <= FAILOVER_DEPTH:
+        tier = []
+        failover_list = []
+        for gateway_id, gateway in zip(gateway_id_list, get_context_list(
+                [('gateway', gateway_id) for gateway_id in gateway_id_list],
+                skip_missing=True)):
+            if gateway is None or gateway_id in gateway_dict:
+                continue
+            gateway_dict[gateway_id] = gateway
+            if gateway['status'] == 1:
+                tier.append((gateway_id, gateway['maximum_call']))
+            if gateway['failover']:
+                failover_list.append(gateway['failover'])
+        if tier:
+            gateway_tier_list.append(tier)
+        gateway_id_list = failover_list
+        depth += 1
+
+    if not gateway_tier_list:
+        if not gateway_dict:
+            raise ValueError('No A-Leg gateway')
+        raise ValueError('Gateway not Active: %s' % \
+            ', '.join([str(gateway_id) for gateway_id in gateway_dict]))
+    gateway_id = acquire_least_loaded(gateway_tier_list)
+    return gateway_id, gateway_dict[gateway_id]
+
+
+def get_call_param(obj_callrequest, campaign_id):
+    """Return the parameters of the originate of a call request, built from
+    the dial settings cached in the process, see get_context_list
+
+    A line is taken on the gateway of the call, which is set on the
+    aleg_gateway_id of obj_callrequest, see reserve_gateway.
+    """
+    campaign, user = get_context_list([('campaign', campaign_id),
+                                       ('user', obj_callrequest.user_id)])
+    gateway_id, gateway = reserve_gateway(obj_callrequest, campaign)
+    obj_callrequest.aleg_gateway_id = gateway_id
+
+    if settings.DIALERDEBUG:
+        dialout_phone_number = settings.DIALERDEBUG_PHONENUMBER
+    else:
+        dialout_phone_number = gateway['dialplan']\
+            .rewrite(obj_callrequest.phone_number)
+
+    if campaign['content_type__app_label'] == 'survey':
+        #Use Survey Statemachine
+        answer_url = settings.PLIVO_DEFAULT_SURVEY_ANSWER_URL
+    else:
+        answer_url = settings.PLIVO_DEFAULT_ANSWER_URL
+
+    originate_dial_string = gateway['originate_dial_string']
+    if user['accountcode'] and user['accountcode'] > 0:
+        originate_dial_string = originate_dial_string + \
+            ',accountcode=' + str(user['accountcode'])
+
+    return {
+        'callerid': obj_callrequest.callerid,
+        'phone_number': dialout_phone_number,
+        'Gateways': gateway['gateways'],
+        'GatewayCodecs': gateway['gateway_codecs'],
+        'GatewayTimeouts': gateway['gateway_timeouts'],
+        'GatewayRetries': gateway['gateway_retries'],
+        'ExtraDialString': originate_dial_string,
+        'AnswerUrl': answer_url,
+        'HangupUrl': settings.PLIVO_DEFAULT_HANGUP_URL,
+        'TimeLimit': str(campaign['callmaxduration']),
+    }
+
+
+def originate_call(call_param, logger):
+    """Send the call to the dialer engine, return the RequestUUID"""
+    engine = settings.NEWFIES_DIALER_ENGINE.lower()
+    if engine == 'dummy':
+        #Use Dummy TestCall, the RequestUUID is given to it so the worker
+        #doesn't wait for the task
+        result = {'RequestUUID': str(uuid1())}
+        dummy_testcall.delay(callerid=call_param['callerid'],
+                             phone_number=call_param['phone_number'],
+                             gateway=call_param['Gateways'],
+                             request_uuid=result['RequestUUID'])
+    elif engine == 'plivo':
+        #Request Call via the Plivo client of the worker
+        from telefonyhelper import call_plivo
+        result = call_plivo(**call_param)
+    else:
+        raise ValueError('No other method supported, use one of these '
+                         'options : dummy ; plivo')
+    logger.info(result)
+    return result['RequestUUID']
+
+
+def originate_call_list(call_param_list, logger):
+    """Send a batch of calls to the dialer engine, return the RequestUUID
+    of each call, or the exception of the calls which failed"""
+    if settings.NEWFIES_DIALER_ENGINE.lower() == 'plivo':
+        #One BulkCall request, or parallel requests, on kept alive
+        #connections
+        from telefonyhelper import bulk_call_plivo
+        return bulk_call_plivo(call_param_list)
+
+    result_list = []
+    for call_param in call_param_list:
+        try:
+            result_list.append(originate_call(call_param, logger))
+        except Exception, e:
+            result_list.append(e)
+    return result_list
+
+
+def prepare_callrequest(obj_callrequest, campaign_id, logger):
+    """Return the originate parameters of a call request, None if the call
+    can't be sent or False if it's postponed"""
+    try:
+        call_param = get_call_param(obj_callrequest, campaign_id)
+    except IndexError:
+        logger.error("Can't find the campaign : %s" % campaign_id)
+        return None
+    except GatewaySaturated, e:
+        logger.info("Postpone the callrequest %s : %s" % \
+                        (obj_callrequest.id, e))
+        postpone_callrequest(obj_callrequest)
+        return False
+    except ValueError, e:
+        logger.error("Can't init the callrequest %s : %s" % \
+                        (obj_callrequest.id, e))
+        fail_callrequest(obj_callrequest)
+        return None
+    logger.info("dialout_phone_number : %s" % call_param['phone_number'])
+    return call_param
+
+
+def complete_callrequest(obj_callrequest, request_uuid, logger):
+    """Record the result of the originate of a call request
+
+    The dial settings come from the process cache, so the call request is
+    written once, after the originate, with its RequestUUID. Return the
+    CampaignSubscriber ID to count an attempt for, None if there is none,
+    or False if the call failed.
+    """
+    if isinstance(request_uuid, Exception):
+        logger.error('error : originate_call %s' % request_uuid)
+        release_gateway(obj_callrequest.aleg_gateway_id)
+        fail_callrequest(obj_callrequest)
+        return False
+    logger.info('Received RequestUUID :> ' + str(request_uuid))
+
+    Callrequest.objects.filter(id=obj_callrequest.id)\
+        .update(status=7, request_uuid=request_uuid,
+                aleg_gateway=obj_callrequest.aleg_gateway_id)  # Process
+    return obj_callrequest.campaign_subscriber_id
+
+
+def postpone_callrequest(obj_callrequest):
+    """Send the call request again once its gateways have free lines
+
+    The call request is due again after GATEWAY_SATURATED_DELAY seconds,
+    it's claimed with the retries of its campaign on a tick of the pacer,
+    see dialer_campaign.tasks.dispatch_retry_call, so a saturated gateway
+    doesn't queue a message per call.
+    """
+    call_time = datetime.now() + \
+                timedelta(seconds=settings.GATEWAY_SATURATED_DELAY)
+    Callrequest.objects.filter(id=obj_callrequest.id)\
+        .update(status=3, call_time=call_time)  # Update to Retry
+
+
+def fail_callrequest(obj_callrequest):
+    """Mark the call request and its subscriber as failed"""
+    Callrequest.objects.filter(id=obj_callrequest.id)\
+        .update(status=2)  # Update to Failure
+    if obj_callrequest.campaign_subscriber_id:
+        CampaignSubscriber.objects\
+            .filter(id=obj_callrequest.campaign_subscriber_id)\
+            .update(status=4)  # Fail
+
+
+def count_subscriber_attempt(subscriber_list):
+    """Count one more attempt for the CampaignSubscribers, in one query per
+    chunk"""
+    if not subscriber_list:
+        return
+    cursor = connection.cursor()
+    for subscriber_chunk in chunk_list(list(subscriber_list)):
+        cursor.execute(
+            "UPDATE dialer_campaign_subscriber "
+            "SET count_attempt = COALESCE(count_attempt, 0) + 1, "
+            "last_attempt = %%s WHERE id IN (%s)" % \
+                ', '.join(['%s'] * len(subscriber_chunk)),
+            [datetime.now()] + subscriber_chunk)
+    transaction.commit_unless_managed()
+
+
+def complete_callrequest_list(result_list):
+    """Write the RequestUUID and the gateway of the originated call
+    requests, result_list holds (callrequest_id, request_uuid, gateway_id),
+    in one query per chunk"""
+    cursor = connection.cursor()
+    for result_chunk in chunk_list(result_list, 200):
+        uuid_param_list = []
+        gateway_param_list = []
+        for callrequest_id, request_uuid, gateway_id in result_chunk:
+            uuid_param_list += [callrequest_id, str(request_uuid)]
+            gateway_param_list += [callrequest_id, gateway_id]
+        case = ' '.join(['WHEN %s THEN %s'] * len(result_chunk))
+        cursor.execute(
+            "UPDATE dialer_callrequest SET status = 7, "
+            "request_uuid = CASE id %s END, "
+            "aleg_gateway_id = CASE id %s END WHERE id IN (%s)" % \
+                (case, case, ', '.join(['%s'] * len(result_chunk))),
+            uuid_param_list + gateway_param_list + \
+                [item[0] for item in result_chunk])
+    transaction.commit_unless_managed()
+
+
+def fail_callrequest_list(callrequest_list):
+    """Mark the call requests and their subscribers as failed, their
+    gateway lines are given back"""
+    for obj_callrequest in callrequest_list:
+        release_gateway(obj_callrequest.aleg_gateway_id)
+    for callrequest_chunk in chunk_list(callrequest_list):
+        Callrequest.objects\
+            .filter(id__in=[obj.id for obj in callrequest_chunk])\
+            .update(status=2)  # Update to Failure
+        CampaignSubscriber.objects\
+            .filter(id__in=[obj.campaign_subscriber_id
+                            for obj in callrequest_chunk
+                            if obj.campaign_subscriber_id])\
+            .update(status=4)  # Fail
+
+
 @task()
 def init_callrequest(callrequest_id, campaign_id):
     """This task outbounds the call
@@ -80,137 +340,181 @@ def init_callrequest(callrequest_id, campaign_id):
     **Attributes**:
 
         * ``callrequest_id`` - Callrequest ID
+        * ``campaign_id`` - Campaign ID
     """
     logger = init_callrequest.get_logger()
-    obj_callrequest = Callrequest.objects.get(id=callrequest_id)
-    obj_callrequest.status = 7  # Update to Process
-    obj_callrequest.save()
-    logger.info("TASK :: init_callrequest - status = %s" %
-                                        str(obj_callrequest.status))
+    try:
+        obj_callrequest = Callrequest.objects.get(id=callrequest_id)
+    except Callrequest.DoesNotExist:
+        logger.error("Can't find the callrequest : %s" % callrequest_id)
+        return False
+    logger.info("TASK :: init_callrequest - %s" % callrequest_id)
 
+    call_param = prepare_callrequest(obj_callrequest, campaign_id, logger)
+    if not call_param:
+        return False
     try:
-        obj_campaign = Campaign.objects.get(id=campaign_id)
-    except:
-        logger.error("Can't find the campaign : %s" % campaign_id)
+        request_uuid = originate_call(call_param, logger)
+    except Exception, e:
+        request_uuid = e
+    subscriber_id = complete_callrequest(obj_callrequest, request_uuid,
+                                         logger)
+    if subscriber_id is False:
         return False
+    if subscriber_id:
+        count_subscriber_attempt([subscriber_id])
+    return True
 
-    if obj_callrequest.aleg_gateway:
-        id_aleg_gateway = obj_callrequest.aleg_gateway.id
-        dialout_phone_number = phonenumber_change_prefix(
-                                                obj_callrequest.phone_number,
-                                                id_aleg_gateway)
-    else:
-        dialout_phone_number = obj_callrequest.phone_number
-    logger.info("dialout_phone_number : %s" % dialout_phone_number)
 
-    if settings.DIALERDEBUG:
-        dialout_phone_number = settings.DIALERDEBUG_PHONENUMBER
+@task()
+def init_callrequest_batch(callrequest_list, campaign_id):
+    """This task outbounds a batch of calls of a campaign, it's sent once
+    per time slot by check_campaign_pendingcall
 
-    #Retrieve the Gateway for the A-Leg
-    gateways = obj_callrequest.aleg_gateway.gateways
-    gateway_codecs = obj_callrequest.aleg_gateway.gateway_codecs
-    gateway_timeouts = obj_callrequest.aleg_gateway.gateway_timeouts
-    gateway_retries = obj_callrequest.aleg_gateway.gateway_retries
-    originate_dial_string = obj_callrequest.aleg_gateway.originate_dial_string
-    callmaxduration = obj_campaign.callmaxduration
+    The call requests are read in one query, originated together and the
+    attempts of their subscribers are counted in one query, so a call
+    costs a single write of its call request.
 
-    #Sanitize gateways
-    gateways = gateways.strip()
-    if gateways[-1] != '/':
-        gateways = gateways + '/'
+    **Attributes**:
 
-    if obj_campaign.content_type.app_label == 'survey':
-        #Use Survey Statemachine
-        answer_url = settings.PLIVO_DEFAULT_SURVEY_ANSWER_URL
-    else:
-        answer_url = settings.PLIVO_DEFAULT_ANSWER_URL
+        * ``callrequest_list`` - List of Callrequest ID
+        * ``campaign_id`` - Campaign ID
+    """
+    logger = init_callrequest_batch.get_logger()
+    logger.info("TASK :: init_callrequest_batch - %d calls" % \
+                    len(callrequest_list))
+    ready_list = []
+    call_param_list = []
+    for obj_callrequest in Callrequest.objects\
+            .filter(id__in=callrequest_list).order_by('id'):
+        call_param = prepare_callrequest(obj_callrequest, campaign_id,
+                                         logger)
+        if call_param:
+            ready_list.append(obj_callrequest)
+            call_param_list.append(call_param)
+    if not call_param_list:
+        return True
 
-    originate_dial_string = obj_callrequest.aleg_gateway.originate_dial_string
-    if obj_callrequest.user.userprofile.accountcode and \
-        obj_callrequest.user.userprofile.accountcode > 0:
-        originate_dial_string = originate_dial_string + \
-            ',accountcode=' + str(obj_callrequest.user.userprofile.accountcode)
+    try:
+        result_list = originate_call_list(call_param_list, logger)
+    except Exception, e:
+        result_list = [e] * len(call_param_list)
+    subscriber_list = []
+    for obj_callrequest, request_uuid in zip(ready_list, result_list):
+        #a failing call doesn't stop the rest of the batch
+        try:
+            subscriber_id = complete_callrequest(obj_callrequest,
+                                                 request_uuid, logger)
+        except Exception, e:
+            logger.error("Error to init the callrequest %s : %s" % \
+                            (obj_callrequest.id, e))
+            continue
+        if subscriber_id:
+            subscriber_list.append(subscriber_id)
+    count_subscriber_attempt(subscriber_list)
+    return True
+
+
+class gateway_in_use_reconcile(PeriodicTask):
+    """A periodic task that resets the calls in use of the gateways to the
+    call requests in progress, it corrects the counters of the hangups
+    which never came and records count_in_use on the gateways
 
-    #Send Call to API
-    #http://ask.github.com/celery/userguide/remote-tasks.html
+    **Usage**:
 
+        gateway_in_use_reconcile.delay()
     """
-    #this could be needed if we want to call a different API / Twilio
-    import httplib, urllib
-    params = urllib.urlencode({'From': '900900000', 'To': '1000',})
-    headers = {"Content-type": "application/x-www-form-urlencoded",
-           "Accept": "text/plain"}
-    conn = httplib.HTTPConnection("127.0.0.1:8000")
-    conn.request("POST", "/api/dialer_cdr/testcall/", params, headers)
-    response = conn.getresponse()
-    print response.status, response.reason
-    data = response.read()
-    conn.close()
+    run_every = timedelta(seconds=60)
+
+    def run(self, **kwargs):
+        logger = self.get_logger()
+        in_use_dict = dict((gateway_id, 0) for gateway_id in
+                           Gateway.objects.values_list('id', flat=True))
+        for item in Callrequest.objects.filter(status__in=[7, 8])\
+                .values('aleg_gateway').annotate(in_use=Count('id')):
+            if item['aleg_gateway']:
+                in_use_dict[item['aleg_gateway']] = item['in_use']
+        set_gateway_in_use(in_use_dict)
+        for gateway_id, in_use in in_use_dict.items():
+            # update() doesn't reset the dial settings of the gateway
+            Gateway.objects.filter(id=gateway_id)\
+                .exclude(count_in_use=in_use).update(count_in_use=in_use)
+        logger.info("TASK :: gateway_in_use_reconcile - %d gateways" % \
+                        len(in_use_dict))
+        return True
+
+
+class voipcall_rollup(PeriodicTask):
+    """A periodic task that counts the new VoIPCalls in the hourly and
+    daily rollups read by the reports, see dialer_cdr.rollup
+
+    **Usage**:
+
+        voipcall_rollup.delay()
     """
-    if settings.NEWFIES_DIALER_ENGINE.lower() == 'dummy':
-        #Use Dummy TestCall
-        res = dummy_testcall.delay(callerid=obj_callrequest.callerid,
-                                   phone_number=dialout_phone_number,
-                                   gateway=gateways)
-        result = res.get()
-        logger.info(result)
-        logger.error('Received RequestUUID :> ' + str(result['RequestUUID']))
-
-    elif settings.NEWFIES_DIALER_ENGINE.lower() == 'plivo':
-        try:
-            #Request Call via Plivo
-            from telefonyhelper import call_plivo
-            result = call_plivo(
-                        callerid=obj_callrequest.callerid,
-                        phone_number=dialout_phone_number,
-                        Gateways=gateways,
-                        GatewayCodecs=gateway_codecs,
-                        GatewayTimeouts=gateway_timeouts,
-                        GatewayRetries=gateway_retries,
-                        ExtraDialString=originate_dial_string,
-                        AnswerUrl=answer_url,
-                        HangupUrl=settings.PLIVO_DEFAULT_HANGUP_URL,
-                        TimeLimit=str(callmaxduration))
-        except:
-            logger.error('error : call_plivo')
-            obj_callrequest.status = 2  # Update to Failure
-            obj_callrequest.save()
-            if obj_callrequest.campaign_subscriber \
-                and obj_callrequest.campaign_subscriber.id:
-                obj_subscriber = CampaignSubscriber.objects.get(
-                            id=obj_callrequest.campaign_subscriber.id)
-                obj_subscriber.status = 4  # Fail
-
-                obj_subscriber.save()
+    run_every = timedelta(seconds=60)
+
+    def run(self, **kwargs):
+        logger = self.get_logger()
+        count = rollup_voipcall()
+        if count is None:
+            logger.info("TASK :: voipcall_rollup - already running")
             return False
-        logger.info(result)
-        logger.error('Received RequestUUID :> ' + str(result['RequestUUID']))
+        logger.info("TASK :: voipcall_rollup - %d calls" % count)
+        return True
 
-    else:
-        logger.error('No other method supported, use one of these options :'\
-                     'dummy ; plivo')
-        return False
 
-    #Update CampaignSubscriber
-    if obj_callrequest.campaign_subscriber \
-        and obj_callrequest.campaign_subscriber.id:
-        obj_subscriber = CampaignSubscriber.objects.get(
-                    id=obj_callrequest.campaign_subscriber.id)
-        if obj_subscriber.count_attempt == None \
-            or not obj_subscriber.count_attempt >= 0:
-            obj_subscriber.count_attempt = 1
-        else:
-            obj_subscriber.count_attempt = obj_subscriber.count_attempt + 1
-        obj_subscriber.last_attempt = datetime.now()
-        obj_subscriber.save()
-
-    #Update CallRequest Object
-    obj_callrequest.request_uuid = result['RequestUUID']
-    obj_callrequest.save()
+@task(base=Batches, flush_every=settings.HANGUP_QUEUE_FLUSH_EVERY,
+      flush_interval=settings.HANGUP_QUEUE_FLUSH_INTERVAL)
+def hangupcall_batch(requests):
+    """This task records the hangups queued by the hangupcall webhook with
+    HANGUP_QUEUE, they are buffered by the worker and recorded together,
+    see api.hangupcall_api.hangupcall_list
 
-    #lock to limit running process, do so per campaign
-    #http://ask.github.com/celery/cookbook/tasks.html
+    When the batch fails, its hangups are recorded one by one, and the
+    ones failing again are queued again, see requeue_hangupcall.
+
+    **Attributes**:
 
+        * ``requests`` - Buffered requests, their arguments are the
+          parameters of the Plivo callback and the number of retries
+    """
+    logger = hangupcall_batch.get_logger()
+    from api.hangupcall_api import hangupcall_list
+    try:
+        count = hangupcall_list([request.args[0] for request in requests])
+    except Exception, exc:
+        logger.error("TASK :: hangupcall_batch - batch failed : %s" % exc)
+        count = 0
+        for request in requests:
+            try:
+                count += hangupcall_list([request.args[0]])
+            except Exception, exc:
+                requeue_hangupcall(request, exc, logger)
+    logger.info("TASK :: hangupcall_batch - %d hangups" % count)
+
+
+def requeue_hangupcall(request, exc, logger):
+    """Queue again the hangup of a request of hangupcall_batch which
+    failed, after HANGUP_QUEUE_RETRY_DELAY seconds
+
+    Its key of the webhook is cleared, so a callback sent again by Plivo
+    is queued, even when the hangup is dropped after
+    HANGUP_QUEUE_MAX_RETRY retries. A hangup queued twice is recorded
+    once.
+    """
+    from api.webhooks import HANGUP_QUEUE_KEY
+    post = request.args[0]
+    retry = len(request.args) > 1 and request.args[1] or 0
+    cache.delete(HANGUP_QUEUE_KEY % post.get('RequestUUID'))
+    if retry >= settings.HANGUP_QUEUE_MAX_RETRY:
+        logger.error("TASK :: hangupcall_batch - hangup dropped - uuid:%s"
+                     " : %s" % (post.get('RequestUUID'), exc))
+        return False
+    logger.warning("TASK :: hangupcall_batch - hangup queued again - "
+                   "uuid:%s : %s" % (post.get('RequestUUID'), exc))
+    hangupcall_batch.apply_async(args=[post, retry + 1],
+                                 countdown=settings.HANGUP_QUEUE_RETRY_DELAY)
     return True
 
 
@@ -224,7 +528,7 @@ Tasks :
 
 
 @task()
-def dummy_testcall(callerid, phone_number, gateway):
+def dummy_testcall(callerid, phone_number, gateway, request_uuid=None):
     """This is used for test purposes to simulate the behavior of Plivo
 
     **Attributes**:
@@ -232,6 +536,7 @@ def dummy_testcall(callerid, phone_number, gateway):
         * ``callerid`` - CallerID
         * ``phone_number`` - Phone Number to call
         * ``gateway`` - Gateway to use for the call
+        * ``request_uuid`` - RequestUUID of the call, a new one if None
 
     **Return**:
 
@@ -246,7 +551,7 @@ def dummy_testcall(callerid, phone_number, gateway):
     sleep(1)
     logger.info("Waiting 1 seconds...")
 
-    request_uuid = uuid1()
+    request_uuid = request_uuid or uuid1()
 
     #Trigger AnswerURL
     dummy_test_answerurl.delay(request_uuid)
@@ -14,6 +14,7 @@
 
 from django.template.defaultfilters import *
 from survey.views import survey_audio_recording
+from survey.function_def import call_result_list
 from dialer_campaign.models import CAMPAIGN_STATUS
 from dialer_cdr.models import LEG_TYPE
 from survey.models import APP_TYPE
@@ -69,32 +70,28 @@ def action_type_name(value):
 
 @register.filter()
 def que_res_string(val):
-    """Modify survey result string for display"""
+    """Modify survey result string for display, val is the JSON result of a
+    SurveyCallResult"""
     if not val:
         return ''
 
-    val_list = val.split("-|-")
     result_string = '<table class="table table-striped table-bordered '\
                     'table-condensed">'
 
-    for i in val_list:
-        if "*|**|*" in i:
-            que_audio = i.split("*|**|*")
-            if que_audio:
-                new_string = '<tr><td colspan="2">' + str(que_audio[0]) \
-                                + survey_audio_recording(str(que_audio[1])) \
-                                + '</td></tr>'
-                result_string += new_string.encode('utf-8')
+    for question, response, record_file in call_result_list(val):
+        if record_file:
+            new_string = u'<tr><td colspan="2">' + question \
+                            + survey_audio_recording(record_file) \
+                            + u'</td></tr>'
         else:
-            que_res = i.split("*|*")
-            result_string += '<tr><td>' + que_res[0].encode('utf-8') \
-                                + '</td><td class="survey_result_key">' \
-                                + que_res[1].encode('utf-8') + '</td></tr>'
+            new_string = u'<tr><td>' + question \
+                            + u'</td><td class="survey_result_key">' \
+                            + response + u'</td></tr>'
+        result_string += new_string.encode('utf-8')
 
     result_string += '</table>'
     return result_string
 
-
 register.filter('contact_status', contact_status)
 register.filter('campaign_status', campaign_status)
 register.filter('leg_type_name', leg_type_name)
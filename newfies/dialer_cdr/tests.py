@@ -12,9 +12,51 @@
 # Arezqui Belaid <info@star2billing.com>
 #
 
+from django.conf import settings
+from django.db import DatabaseError
 from django.contrib.auth.models import User
-from django.test import TestCase, Client
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase, TransactionTestCase, Client
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.core.cache import cache
 from common.test_utils import build_test_suite_from
+from dialer_campaign.models import Campaign, CampaignSubscriber, Contact
+from dialer_campaign.tasks import dispatch_retry_call
+from dialer_cdr.models import Callrequest, VoIPCall, get_call_context
+from dialer_cdr import tasks
+from dialer_cdr.retry import schedule_retry_list, get_retry_policy, \
+                             retry_delay
+from dialer_cdr.models import VoIPCallHourly, VoIPCallDaily, \
+                              VoIPCallRollupGap
+from dialer_cdr.rollup import rollup_voipcall, voipcall_rollup_report, \
+                              voipcall_daily_report
+from survey.models import SurveyApp, SurveyQuestion, SurveyResponse, \
+                          SurveyCampaignResult, SurveyCallResult
+from survey.function_def import call_result_list, call_result_dict
+from survey.graph import get_survey_graph
+from survey.views import survey_finestatemachine
+from survey.session import SurveySession
+from survey.results import flush_survey_session, store_survey_result, \
+                           sweep_survey_session
+from common_functions import iter_values_chunk, csv_stream
+from api import webhooks
+from api.hangupcall_api import hangupcall_list
+from api.cdr_ingest import CdrSpool, CDR_NOT_FOUND_DIGEST_KEY
+from dialer_cdr.originate_worker import OriginateWorker
+from dialer_cdr.plivo_stub import PlivoStubServer
+from dialer_gateway.models import Gateway, GatewayGroup
+from dialer_gateway.utils import DialPlan, phonenumber_change_prefix
+from dialer_gateway.capacity import GatewaySaturated, release_gateway, \
+                                    get_gateway_in_use, set_gateway_in_use
+from telefonyhelper import PlivoClient, AsyncPlivoClient, PlivoError, \
+                           CircuitOpen, plivo_call_params
+from datetime import datetime, timedelta
+from uuid import uuid1
+import logging
+import os
+import shutil
+import tempfile
 
 import base64
 import simplejson
@@ -129,6 +171,32 @@ class NewfiesTastypieApiTestCase(BaseAuthenticatedClient):
         data, content_type='application/json', **self.extra)
         self.assertEqual(response.status_code, 201)
 
+    def test_create_bulk_contact_records(self):
+        """Test Function to bulk create contact records, JSON and CSV"""
+        contact_list = [{"contact": "3410%04d" % i, "last_name": "Belaid",
+                         "email": "areski@gmail.com"} for i in range(1200)]
+        contact_list += [{"contact": "34100000"}, {"last_name": "Belaid"},
+                         {"contact": "34109999", "status": "active"}]
+        data = simplejson.dumps({"phonebook_id": "1",
+                                 "contacts": contact_list})
+        response = self.client.post('/api/v1/bulkcontact/',
+        data, content_type='application/json', **self.extra)
+        self.assertEqual(response.status_code, 201)
+        result = simplejson.loads(response.content)
+        self.assertEqual(result['created'], 1200)
+        self.assertEqual(result['duplicate'], 1)
+        self.assertEqual(result['invalid'], 2)
+        self.assertEqual(result['result'][1200]['status'], 'duplicate')
+        self.assertEqual(result['result'][1201]['status'], 'invalid')
+
+        data = "34100000,Belaid,Arezqui\n34200000,Belaid,Arezqui\n"
+        response = self.client.post('/api/v1/bulkcontact/?phonebook_id=1',
+        data, content_type='text/csv', **self.extra)
+        self.assertEqual(response.status_code, 201)
+        result = simplejson.loads(response.content)
+        self.assertEqual([item['status'] for item in result['result']],
+                         ['duplicate', 'created'])
+
     def test_create_campaign_subscriber(self):
         """Test Function to create a campaign subscriber"""
         data = simplejson.dumps({
@@ -517,8 +585,838 @@ class NewfiesCustomerInterfaceForgotPassTestCase(TestCase):
         'frontend/registration/password_reset_complete.html')
 
 
+class WebhookTestCase(TestCase):
+    """Test cases for the callbacks of Plivo"""
+    fixtures = ['gateway.json', 'auth_user', 'voiceapp', 'phonebook',
+                'dialer_setting', 'campaign', 'campaign_subscriber',
+                'callrequest']
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.data = {'RequestUUID': 'e8fee8f6-40dd-11e1-964f-000c296bd875',
+                     'HangupCause': 'NORMAL_CLEARING'}
+
+    def test_hangupcall(self):
+        """Test a hangup reads the call request once"""
+        request = self.factory.post('/api/v1/hangupcall/', self.data)
+        # the lookup, the subscriber, the call request and the CDR
+        with self.assertNumQueries(4):
+            response = webhooks.hangupcall(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('<Response><result>OK</result></Response>' in
+                        response.content)
+        self.assertEqual(Callrequest.objects.get(pk=1).status, 4)
+        # a repeated callback doesn't create another CDR
+        self.assertEqual(webhooks.hangupcall(request).status_code, 200)
+        self.assertEqual(VoIPCall.objects.filter(
+            request_uuid=self.data['RequestUUID']).count(), 1)
+
+    def test_hangupcall_queue(self):
+        """Test the queued hangups are recorded once"""
+        cache.clear()
+        queue = []
+        hangupcall_batch = webhooks.hangupcall_batch
+        webhooks.hangupcall_batch = type('Queue', (object, ),
+            {'delay': staticmethod(queue.append)})
+        settings = override_settings(HANGUP_QUEUE=True)
+        settings.enable()
+        try:
+            for i in range(2):
+                response = self.client.post('/api/v1/hangupcall/',
+                                            self.data)
+                self.assertEqual(response.status_code, 200)
+        finally:
+            settings.disable()
+            webhooks.hangupcall_batch = hangupcall_batch
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(Callrequest.objects.get(pk=1).status, 8)
+        # the consumer ignores the hangups it already recorded
+        self.assertEqual(hangupcall_list(queue * 2), 1)
+        self.assertEqual(hangupcall_list(queue), 0)
+        self.assertEqual(Callrequest.objects.get(pk=1).status, 4)
+        self.assertEqual(VoIPCall.objects.filter(
+            request_uuid=self.data['RequestUUID']).count(), 1)
+
+    def test_hangupcall_requeue(self):
+        """Test the hangups of a failed batch are queued again"""
+        from api import hangupcall_api
+        key = webhooks.HANGUP_QUEUE_KEY % self.data['RequestUUID']
+        cache.add(key, 1)
+        queue = []
+
+        def fail_hangup_list(post_list):
+            raise DatabaseError('could not serialize access')
+
+        record_hangup_list = hangupcall_api.record_hangup_list
+        hangupcall_api.record_hangup_list = fail_hangup_list
+        tasks.hangupcall_batch.apply_async = \
+            lambda args, countdown: queue.append(args)
+        Request = type('Request', (object, ), {})
+        request = Request()
+        request.args = [self.data]
+        try:
+            tasks.hangupcall_batch([request])
+            self.assertEqual(queue, [[self.data, 1]])
+            self.assertEqual(cache.get(key), None)
+            # the hangup is dropped after the last retry
+            request.args = [self.data, settings.HANGUP_QUEUE_MAX_RETRY]
+            tasks.hangupcall_batch([request])
+            self.assertEqual(len(queue), 1)
+        finally:
+            hangupcall_api.record_hangup_list = record_hangup_list
+            del tasks.hangupcall_batch.apply_async
+        request.args = queue[0]
+        tasks.hangupcall_batch([request])
+        self.assertEqual(Callrequest.objects.get(pk=1).status, 4)
+
+    def test_hangupcall_refused(self):
+        """Test the callbacks of unknown hosts and calls are refused"""
+        request = self.factory.post('/api/v1/hangupcall/', self.data,
+                                    REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(webhooks.hangupcall(request).status_code, 401)
+        self.data['RequestUUID'] = 'unknown'
+        response = self.client.post('/api/v1/hangupcall/', self.data)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/v1/dialcallback/', {})
+        self.assertEqual(response.status_code, 400)
+
+    def test_store_cdr_bulk(self):
+        """Test the CDRs of a bulk POST are stored in one batch"""
+        cdr = '<cdr><variables><plivo_request_uuid>%s</plivo_request_uuid>'\
+              '<duration>3</duration><hangup_cause>NORMAL_CLEARING'\
+              '</hangup_cause></variables></cdr>'
+        request_uuid = self.data['RequestUUID']
+        # the CDR repeated is stored once
+        request = self.factory.post('/api/v1/store_cdr_bulk/',
+            '<cdrs>%s%s</cdrs>' % (cdr % ('a_' + request_uuid),
+                                   cdr % request_uuid),
+            content_type='text/xml')
+        # the call requests, the CDRs already stored and the CDRs
+        with self.assertNumQueries(3):
+            response = webhooks.store_cdr_bulk(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('<stored>1</stored><not_found>0</not_found>' in
+                        response.content)
+        self.assertEqual(VoIPCall.objects.get(request_uuid=request_uuid)\
+                            .duration, 3)
+
+        # the batch sent again is skipped
+        response = webhooks.store_cdr_bulk(request)
+        self.assertTrue('<stored>0</stored><not_found>0</not_found>' in
+                        response.content)
+        self.assertEqual(VoIPCall.objects\
+                            .filter(request_uuid=request_uuid).count(), 1)
+
+        cache.clear()
+        response = self.client.post('/api/v1/store_cdr_bulk/',
+                                    {'cdr': cdr % 'unknown'})
+        self.assertTrue('<stored>0</stored><not_found>1</not_found>' in
+                        response.content)
+        self.assertTrue(cache.get(CDR_NOT_FOUND_DIGEST_KEY))
+
+        request = self.factory.post('/api/v1/store_cdr_bulk/', '<cdrs><cdr>',
+                                    content_type='text/xml')
+        self.assertEqual(webhooks.store_cdr_bulk(request).status_code, 400)
+
+    def test_cdr_spool(self):
+        """Test the CDR files of the spool are stored, then removed"""
+        spool_dir = tempfile.mkdtemp()
+        try:
+            cdr_file = open(os.path.join(spool_dir, 'a_1.cdr.xml'), 'w')
+            cdr_file.write('<?xml version="1.0"?><cdr><variables>'
+                '<plivo_request_uuid>a_%s</plivo_request_uuid>'
+                '<duration>3</duration></variables></cdr>' % \
+                    self.data['RequestUUID'])
+            cdr_file.close()
+            cdr_file = open(os.path.join(spool_dir, 'a_2.cdr.xml'), 'w')
+            cdr_file.write('<?xml version="1.0"?><cdr><variables>')
+            cdr_file.close()
+            spool = CdrSpool(spool_dir, min_age=0)
+            self.assertEqual(spool.ingest(), 2)
+            self.assertEqual((spool.stored, spool.failed), (1, 1))
+            self.assertEqual(os.listdir(spool_dir), ['failed'])
+            self.assertEqual(os.listdir(spool.failed_dir), ['a_2.cdr.xml'])
+            self.assertEqual(spool.ingest(), 0)
+        finally:
+            shutil.rmtree(spool_dir)
+
+
+class HangupRollbackTestCase(TransactionTestCase):
+    """Test cases for the hangups of a batch rolled back"""
+    fixtures = ['gateway.json', 'auth_user', 'voiceapp', 'phonebook',
+                'dialer_setting', 'campaign', 'campaign_subscriber',
+                'callrequest']
+
+    def test_hangup_rollback(self):
+        """Test a line is given back once when the batch is rolled back"""
+        from api import hangupcall_api
+        Callrequest.objects.filter(pk=1).update(aleg_gateway=1)
+        set_gateway_in_use({1: 2})
+        post = {'RequestUUID': 'e8fee8f6-40dd-11e1-964f-000c296bd875',
+                'HangupCause': 'NORMAL_CLEARING'}
+
+        def fail_bulk_create(model, obj_list):
+            raise DatabaseError('could not extend file')
+
+        bulk_create_chunk = hangupcall_api.bulk_create_chunk
+        hangupcall_api.bulk_create_chunk = fail_bulk_create
+        try:
+            self.assertRaises(DatabaseError, hangupcall_list, [post])
+        finally:
+            hangupcall_api.bulk_create_chunk = bulk_create_chunk
+        self.assertEqual(get_gateway_in_use([1]), {1: 2})
+        self.assertEqual(Callrequest.objects.get(pk=1).status, 8)
+        # the batch queued again
+        self.assertEqual(hangupcall_list([post]), 1)
+        self.assertEqual(get_gateway_in_use([1]), {1: 1})
+        self.assertEqual(hangupcall_list([post]), 0)
+        self.assertEqual(get_gateway_in_use([1]), {1: 1})
+
+
+class InitCallrequestTestCase(TestCase):
+    """Test cases for the originate of the call requests"""
+    fixtures = ['gateway.json', 'auth_user', 'voiceapp', 'phonebook',
+                'campaign', 'campaign_subscriber']
+
+    def setUp(self):
+        # the dialer engine is replaced, only the queries are measured
+        self.originate = (tasks.originate_call, tasks.originate_call_list)
+        tasks.originate_call = lambda call_param, logger: str(uuid1())
+        tasks.originate_call_list = lambda call_param_list, logger: \
+            [str(uuid1()) for call_param in call_param_list]
+        campaign = Campaign.objects.get(pk=1)
+        self.callrequest_list = []
+        for i in range(10):
+            # each call request has its own subscriber
+            contact = Contact.objects.create(phonebook_id=1,
+                                             contact='3400%04d' % i)
+            subscriber = CampaignSubscriber.objects.create(contact=contact,
+                duplicate_contact=contact.contact, status=6,
+                campaign=campaign)
+            self.callrequest_list.append(
+                Callrequest.objects.create(status=1, campaign=campaign,
+                    phone_number=contact.contact,
+                    aleg_gateway_id=campaign.aleg_gateway_id,
+                    content_type=campaign.content_type,
+                    object_id=campaign.object_id, user=campaign.user,
+                    campaign_subscriber=subscriber).id)
+
+    def tearDown(self):
+        tasks.originate_call, tasks.originate_call_list = self.originate
+
+    def test_init_callrequest_queries(self):
+        """Test a warm worker reads and writes a call request once"""
+        # the first call loads the dial settings in the process
+        self.assertTrue(tasks.init_callrequest(self.callrequest_list[0], 1))
+        # one read, one write and the attempt of the subscriber
+        self.assertNumQueries(3, tasks.init_callrequest,
+                              self.callrequest_list[1], 1)
+        # the batch reads the call requests and counts the attempts once
+        self.assertNumQueries(len(self.callrequest_list[2:]) + 2,
+                              tasks.init_callrequest_batch,
+                              self.callrequest_list[2:], 1)
+        self.assertEqual(Callrequest.objects\
+            .filter(id__in=self.callrequest_list, status=7).count(), 10)
+        # one attempt for the subscriber of each call
+        self.assertEqual(list(CampaignSubscriber.objects\
+            .filter(callrequest__in=self.callrequest_list)\
+            .values_list('count_attempt', flat=True)), [1] * 10)
+
+    def test_call_context_invalidation(self):
+        """Test a saved gateway is reloaded by the workers"""
+        gateway_id = Campaign.objects.get(pk=1).aleg_gateway_id
+        get_call_context(1, gateway_id, 1)
+        gateway = Gateway.objects.get(pk=gateway_id)
+        gateway.addprefix = '0099'
+        gateway.save()
+        self.assertEqual(get_call_context(1, gateway_id, 1)[1]['addprefix'],
+                         '0099')
+
+
+class GatewayCapacityTestCase(TestCase):
+    """Test cases for the calls in use of the gateways"""
+    fixtures = ['gateway.json', 'auth_user', 'voiceapp', 'phonebook',
+                'campaign', 'campaign_subscriber']
+
+    def setUp(self):
+        cache.clear()
+        self.settings = override_settings(ORIGINATE_WORKER=True)
+        self.settings.enable()
+        self.failover = Gateway.objects.create(name='failover',
+            gateways='user/', status=1, maximum_call=1)
+        self.gateway = Gateway.objects.get(pk=1)
+        self.gateway.maximum_call = 2
+        self.gateway.failover = self.failover
+        self.gateway.save()
+        self.campaign = Campaign.objects.get(pk=1)
+
+    def tearDown(self):
+        self.settings.disable()
+
+    def new_callrequest(self):
+        return Callrequest.objects.create(status=1, campaign=self.campaign,
+            phone_number='34000000', aleg_gateway_id=self.gateway.id,
+            content_type=self.campaign.content_type,
+            object_id=self.campaign.object_id, user=self.campaign.user)
+
+    def reserve(self):
+        obj_callrequest = self.new_callrequest()
+        return tasks.reserve_gateway(obj_callrequest,
+                                     {'aleg_gatewaygroup': None})[0]
+
+    def test_failover(self):
+        """Test a saturated gateway fails over, then the call waits"""
+        self.assertEqual([self.reserve() for i in range(3)],
+            [self.gateway.id, self.gateway.id, self.failover.id])
+        self.assertRaises(GatewaySaturated, self.reserve)
+        release_gateway(self.gateway.id)
+        self.assertEqual(self.reserve(), self.gateway.id)
+        # a gateway down fails over too
+        release_gateway(self.failover.id)
+        self.gateway.status = 0
+        self.gateway.save()
+        self.assertEqual(self.reserve(), self.failover.id)
+
+    def test_gatewaygroup(self):
+        """Test the calls of a group go to the least loaded gateway"""
+        group = GatewayGroup.objects.create(name='group')
+        other = Gateway.objects.create(name='other', gateways='user/',
+                                       status=1, maximum_call=4)
+        group.gateway.add(self.gateway, other)
+        context = {'aleg_gatewaygroup': group.id}
+        gateway_list = [tasks.reserve_gateway(self.new_callrequest(),
+                                              context)[0]
+                        for i in range(6)]
+        self.assertEqual(gateway_list.count(self.gateway.id), 2)
+        self.assertEqual(gateway_list.count(other.id), 4)
+        self.campaign.aleg_gatewaygroup = group
+        self.assertEqual(self.campaign.get_maximum_call(), 6)
+        # a gateway added to the group is used by the workers
+        group.gateway.add(self.failover)
+        self.assertEqual(tasks.reserve_gateway(self.new_callrequest(),
+                                               context)[0], self.failover.id)
+
+    def test_saturated_callrequest(self):
+        """Test a call request is postponed while its gateways are full"""
+        for i in range(3):
+            self.reserve()
+        obj_callrequest = self.new_callrequest()
+        self.assertFalse(tasks.init_callrequest(obj_callrequest.id, 1))
+        obj_callrequest = Callrequest.objects.get(pk=obj_callrequest.id)
+        self.assertEqual(obj_callrequest.status, 3)
+        self.assertTrue(obj_callrequest.call_time > datetime.now())
+        # claimed with the retries once it's due
+        claim_due_retry = Callrequest.objects.claim_due_retry
+        self.assertEqual(claim_due_retry(self.campaign.id, 10), [])
+        Callrequest.objects.filter(pk=obj_callrequest.id)\
+            .update(call_time=datetime.now())
+        self.assertEqual(claim_due_retry(self.campaign.id, 10),
+                         [obj_callrequest.id])
+        # the reconciliation counts the call requests in progress
+        Callrequest.objects.filter(pk=obj_callrequest.id).update(status=7)
+        tasks.gateway_in_use_reconcile().run()
+        self.assertEqual(get_gateway_in_use([self.gateway.id,
+                                             self.failover.id]),
+                         {self.gateway.id: 1, self.failover.id: 0})
+        self.assertEqual(Gateway.objects.get(pk=1).count_in_use, 1)
+
+
+class DialPlanTestCase(TestCase):
+    """Test cases for the compiled prefix rules of the gateways"""
+    fixtures = ['gateway.json']
+
+    def test_dialplan(self):
+        """Test the longest remove prefix is replaced"""
+        dialplan = DialPlan('0033, 0, 00', '33,0044,')
+        self.assertEqual(dialplan.rewrite_many(
+            ['0033612345678', '0612345678', '00441234', '612345678']),
+            ['33612345678', '0044612345678', '441234', '33612345678'])
+        self.assertEqual(DialPlan('0', '').rewrite('0612'), '612')
+        self.assertEqual(DialPlan('', '9').rewrite_many(['0612']), ['90612'])
+
+    def test_dialplan_invalidation(self):
+        """Test a saved gateway compiles its dial plan again"""
+        self.assertEqual(phonenumber_change_prefix('0612', 1), '0612')
+        gateway = Gateway.objects.get(pk=1)
+        gateway.removeprefix = '0'
+        gateway.addprefix = '0033'
+        gateway.save()
+        self.assertEqual(phonenumber_change_prefix('0612', 1), '0033612')
+        self.assertNumQueries(0, phonenumber_change_prefix, '0612', 1)
+        gateway.status = 0
+        gateway.save()
+        self.assertFalse(phonenumber_change_prefix('0612', 1))
+        self.assertFalse(phonenumber_change_prefix('0612', 99))
+
+
+class RetrySchedulerTestCase(TestCase):
+    """Test cases for the retries of the failed calls"""
+    fixtures = ['gateway.json', 'auth_user', 'voiceapp', 'phonebook',
+                'campaign', 'campaign_subscriber']
+
+    def setUp(self):
+        # the user has no dialer settings, the campaign decides
+        self.campaign = Campaign.objects.get(pk=1)
+        self.campaign.maxretry = 2
+        self.campaign.save()
+
+    def failed_callrequest(self, hangup_cause, num_attempt=0):
+        return Callrequest.objects.create(status=2, call_type=1,
+            campaign=self.campaign, phone_number='34000000',
+            hangup_cause=hangup_cause, num_attempt=num_attempt,
+            content_type=self.campaign.content_type,
+            object_id=self.campaign.object_id, user=self.campaign.user)
+
+    def test_retry_delay(self):
+        """Test the delay grows at each attempt, up to the maximum"""
+        with override_settings(RETRY_BACKOFF=2, RETRY_MAX_DELAY=3600):
+            policy = get_retry_policy('NO_ANSWER')
+            self.assertEqual([retry_delay(300, num_attempt, policy)
+                              for num_attempt in range(1, 6)],
+                             [300, 600, 1200, 2400, 3600])
+            policy = get_retry_policy('USER_BUSY')
+            self.assertEqual(retry_delay(300, 1, policy), 120)
+
+    def test_schedule_retry(self):
+        """Test the retries are queued per hangup cause"""
+        callrequest_list = [self.failed_callrequest('NO_ANSWER'),
+                            self.failed_callrequest('USER_BUSY', 1),
+                            self.failed_callrequest('UNALLOCATED_NUMBER'),
+                            self.failed_callrequest('NO_ANSWER', 2)]
+        start = datetime.now()
+        self.assertEqual(schedule_retry_list(callrequest_list), 2)
+        self.assertEqual(Callrequest.objects.filter(call_type=3).count(), 4)
+        retry_dict = dict((obj.parent_callrequest_id, obj)
+                          for obj in Callrequest.objects.filter(status=3))
+        self.assertEqual(sorted(retry_dict.keys()),
+                         [callrequest_list[0].id, callrequest_list[1].id])
+        retry = retry_dict[callrequest_list[0].id]
+        self.assertEqual(retry.num_attempt, 1)
+        self.assertTrue(retry.call_time >= start + timedelta(seconds=300))
+        # the second attempt of a busy subscriber waits 120 * 1.5 seconds
+        retry = retry_dict[callrequest_list[1].id]
+        self.assertEqual(retry.num_attempt, 2)
+        self.assertTrue(start + timedelta(seconds=180) <= retry.call_time <
+                        start + timedelta(seconds=300))
+
+    def test_dispatch_retry(self):
+        """Test the pacer sends the due retries within its budget"""
+        schedule_retry_list([self.failed_callrequest('NO_ANSWER')
+                             for i in range(3)])
+        logger = logging.getLogger('newfies.filelog')
+        with override_settings(ORIGINATE_WORKER=True):
+            self.assertEqual(dispatch_retry_call(self.campaign, 10, logger),
+                             0)
+            Callrequest.objects.filter(status=3)\
+                .update(call_time=datetime.now() - timedelta(seconds=1))
+            self.assertEqual(dispatch_retry_call(self.campaign, 2, logger),
+                             2)
+        self.assertEqual(Callrequest.objects.get_pending_callrequest()\
+                            .count(), 2)
+        self.assertEqual(Callrequest.objects.filter(status=3).count(), 1)
+
+
+class RollupTestCase(TestCase):
+    """Test cases for the rollups of the VoIPCalls"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('rollup', 'rollup@world.com',
+                                             'rollup')
+        self.today = datetime.now().replace(hour=10, minute=0, second=0,
+                                            microsecond=0)
+
+    def create_voipcall(self, disposition, duration, starting_date):
+        voipcall = VoIPCall.objects.create(user=self.user,
+            callid=str(uuid1()), callerid='123', phone_number='34000000',
+            disposition=disposition, duration=duration, billsec=duration)
+        # starting_date is set on the creation
+        VoIPCall.objects.filter(pk=voipcall.pk)\
+            .update(starting_date=starting_date)
+
+    def test_rollup(self):
+        """Test the reports count the rollups and the calls after them"""
+        for minute in (5, 10, 65):
+            self.create_voipcall('ANSWER', 60,
+                                 self.today + timedelta(minutes=minute))
+        self.create_voipcall('BUSY', 0, self.today + timedelta(minutes=20))
+        with override_settings(ROLLUP_DELAY=0):
+            self.assertEqual(rollup_voipcall(chunk_size=2), 4)
+            self.assertEqual(rollup_voipcall(), 0)
+        self.assertEqual(VoIPCallDaily.objects.count(), 2)
+        self.assertEqual(VoIPCallHourly.objects.count(), 3)
+
+        # this call is not counted by the rollup yet
+        self.create_voipcall('ANSWER', 30, self.today + timedelta(minutes=30))
+        report_list = voipcall_rollup_report('hour', user=self.user)
+        self.assertEqual([(row['starting_date'], row['starting_date__count'],
+                           row['duration__sum']) for row in report_list],
+            [(self.today.strftime('%Y-%m-%d %H'), 4, 150),
+             ((self.today + timedelta(hours=1)).strftime('%Y-%m-%d %H'), 1,
+              60)])
+        report_list = voipcall_rollup_report('day', disposition='ANSWER',
+                                             by_disposition=True)
+        self.assertEqual(len(report_list), 1)
+        self.assertEqual(report_list[0]['starting_date__count'], 4)
+        self.assertEqual(report_list[0]['duration__avg'], 52.5)
+
+        daily_data = voipcall_daily_report({
+            'starting_date__range': (self.today, self.today + \
+                                                 timedelta(hours=2)),
+            'user': self.user})
+        self.assertEqual(daily_data['total_calls'], 5)
+        self.assertEqual(daily_data['total_duration'], 210)
+
+    def test_rollup_late_voipcall(self):
+        """Test a call committed behind the rollup is counted once"""
+        for minute in range(3):
+            self.create_voipcall('ANSWER', 60,
+                                 self.today + timedelta(minutes=minute))
+        voipcall = VoIPCall.objects.order_by('id')[1]
+        voipcall_id = voipcall.id
+        # the transaction of the second call is not committed yet
+        voipcall.delete()
+        with override_settings(ROLLUP_DELAY=0):
+            self.assertEqual(rollup_voipcall(), 2)
+            self.assertEqual(VoIPCallRollupGap.objects.get().voipcall_id,
+                             voipcall_id)
+            voipcall.id = voipcall_id
+            voipcall.save(force_insert=True)
+            report_list = voipcall_rollup_report('day', user=self.user)
+            self.assertEqual(report_list[0]['starting_date__count'], 3)
+            self.assertEqual(rollup_voipcall(), 1)
+            self.assertEqual(rollup_voipcall(), 0)
+        self.assertEqual(VoIPCallRollupGap.objects.count(), 0)
+        self.assertEqual(VoIPCallDaily.objects.get().call_count, 3)
+
+    def test_export_stream(self):
+        """Test the calls are exported by chunks in a streamed CSV"""
+        for minute in range(5):
+            self.create_voipcall('ANSWER', minute, self.today)
+        chunk_list = list(iter_values_chunk(
+            VoIPCall.objects.filter(user=self.user), ['duration'],
+            chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunk_list], [2, 2, 1])
+        self.assertEqual([row[0] for chunk in chunk_list for row in chunk],
+                         [4, 3, 2, 1, 0])
+        csv_data = ''.join(csv_stream(['duration', 'disposition'],
+            [(4, 'ANSWER'), (3, None)], buffer_size=1))
+        self.assertEqual(csv_data.splitlines(),
+                         ['duration,disposition', '4,ANSWER', '3,'])
+
+
+class SurveyGraphTestCase(TestCase):
+    """Test cases for the compiled surveys"""
+    fixtures = ['gateway.json', 'auth_user', 'voiceapp', 'phonebook',
+                'campaign']
+
+    def setUp(self):
+        campaign = Campaign.objects.get(pk=1)
+        self.survey = SurveyApp.objects.create(name='fruit',
+                                               user=campaign.user)
+        self.question_list = [SurveyQuestion.objects.create(
+                surveyapp=self.survey, user=campaign.user,
+                question=question, message_type=2, type=type)
+            for question, type in (('Fruit?', 1), ('Why?', 3),
+                                   ('Thanks', 2))]
+        SurveyResponse.objects.create(surveyquestion=self.question_list[0],
+                                      key='1', keyvalue='Apple')
+        SurveyResponse.objects.create(surveyquestion=self.question_list[0],
+            key='2', keyvalue='Kiwi',
+            goto_surveyquestion=self.question_list[2])
+        self.callrequest = Callrequest.objects.create(status=7, call_type=1,
+            request_uuid=str(uuid1()), campaign=campaign,
+            phone_number='34000000', user=campaign.user,
+            content_type=ContentType.objects.get_for_model(SurveyApp),
+            object_id=self.survey.id)
+        self.call_uuid = str(uuid1())
+
+    def step(self, **data):
+        data.update(ALegRequestUUID=self.callrequest.request_uuid,
+                    CallUUID=self.call_uuid)
+        return survey_finestatemachine(RequestFactory().post(
+            '/survey_finestatemachine/', data)).content
+
+    def test_survey_step(self):
+        """Test a step reads the survey from its graph"""
+        html = self.step()
+        self.assertTrue('<GetDigits' in html and 'Fruit?' in html)
+        self.assertEqual(Callrequest.objects.get(pk=self.callrequest.id)\
+                            .status, 8)
+        # the results are kept with the session of the call
+        with self.assertNumQueries(0):
+            html = self.step(Digits='1')
+        self.assertTrue('<Record' in html and 'Why?' in html)
+        html = self.step(RecordFile='/tmp/why.wav', RecordingDuration='5')
+        self.assertTrue('<Hangup />' in html and 'Thanks' in html)
+        self.assertFalse(SurveyCampaignResult.objects.exists())
+        # stored at the hangup
+        self.assertEqual(flush_survey_session([self.call_uuid]), 2)
+        self.assertEqual(list(SurveyCampaignResult.objects\
+            .filter(callid=self.call_uuid).order_by('id')\
+            .values_list('question', 'response', 'record_file')),
+            [('Fruit?', 'Apple', ''), ('Why?', '', 'why.wav')])
+        self.assertEqual(SurveySession.load(self.call_uuid), None)
+        # one row per call for the reports
+        call_result = SurveyCallResult.objects\
+            .get(callrequest=self.callrequest)
+        self.assertEqual(call_result_dict(call_result.result),
+                         {'Fruit?': 'Apple', 'Why?': 'why.wav'})
+
+    def test_survey_result_dedupe(self):
+        """Test a result is stored once per call request and question"""
+        session = SurveySession(self.call_uuid,
+                                callrequest_id=self.callrequest.id,
+                                surveyapp_id=self.survey.id)
+        session.add_result('Fruit?', response='Apple')
+        session.add_result('Fruit?', response='Apple')
+        session.add_result('Why?', record_file='why.wav')
+        self.assertEqual(store_survey_result(session.result_list), 2)
+        self.assertEqual(store_survey_result(session.result_list), 0)
+        self.assertEqual(SurveyCampaignResult.objects.count(), 2)
+        session.add_result('Thanks', response='1')
+        self.assertEqual(store_survey_result(session.result_list), 1)
+        self.assertEqual(call_result_list(SurveyCallResult.objects\
+            .get(callrequest=self.callrequest).result),
+            [['Fruit?', 'Apple', ''], ['Why?', '', 'why.wav'],
+             ['Thanks', '1', '']])
+
+    def test_survey_call_result_race(self):
+        """Test the results are appended to a SurveyCallResult created
+        meanwhile by another flush of the call"""
+        from survey import results
+        session = SurveySession(self.call_uuid,
+                                callrequest_id=self.callrequest.id,
+                                surveyapp_id=self.survey.id)
+        session.add_result('Fruit?', response='Apple')
+        append_call_result = results.append_call_result
+
+        def concurrent_append_call_result(entry_dict):
+            append_call_result(entry_dict)
+            if not SurveyCallResult.objects.exists():
+                SurveyCallResult.objects.create(
+                    callrequest=self.callrequest, surveyapp=self.survey,
+                    callid=self.call_uuid, result='[["Why?", "", "a.wav"]]')
+
+        results.append_call_result = concurrent_append_call_result
+        try:
+            self.assertEqual(store_survey_result(session.result_list), 1)
+        finally:
+            results.append_call_result = append_call_result
+        self.assertEqual(call_result_list(SurveyCallResult.objects\
+            .get(callrequest=self.callrequest).result),
+            [['Why?', '', 'a.wav'], ['Fruit?', 'Apple', '']])
+
+    def test_survey_session_sweep(self):
+        """Test the results left in the sessions are stored by the sweep"""
+        cache.clear()
+        self.step()
+        self.step(Digits='1')
+        self.assertEqual(sweep_survey_session(), 0)
+        # the results of the call in progress are due
+        with override_settings(SURVEY_RESULT_FLUSH_INTERVAL=0):
+            self.assertEqual(sweep_survey_session(), 1)
+        self.assertEqual(len(SurveySession.load(self.call_uuid).result_list),
+                         1)
+        # the hangup of the call was lost
+        Callrequest.objects.filter(pk=self.callrequest.id).update(status=2)
+        self.step(RecordFile='/tmp/why.wav', RecordingDuration='5')
+        self.assertEqual(sweep_survey_session(), 1)
+        self.assertEqual(SurveySession.load(self.call_uuid), None)
+        self.assertEqual(SurveyCampaignResult.objects\
+                            .filter(callid=self.call_uuid).count(), 2)
+        self.assertEqual(sweep_survey_session(), 0)
+
+    def test_survey_session(self):
+        """Test the state of the call is kept until its timelimit"""
+        self.callrequest.timelimit = 600
+        self.callrequest.save()
+        with override_settings(SURVEY_SESSION_MARGIN=60):
+            self.step()
+        session = SurveySession.load(self.call_uuid)
+        self.assertEqual((session.state, session.prev_qt,
+                          session.callrequest_id, session.surveyapp_id,
+                          session.timeout),
+                         (1, self.question_list[0].id, self.callrequest.id,
+                          self.survey.id, 660))
+        self.step(Digits='1')
+        session = SurveySession.load(self.call_uuid)
+        self.assertEqual((session.state, session.prev_qt, session.timeout),
+                         (2, self.question_list[1].id, 660))
+
+    def test_survey_goto(self):
+        """Test a response goes to its question"""
+        self.step()
+        html = self.step(Digits='2')
+        self.assertTrue('Thanks' in html)
+        flush_survey_session([self.call_uuid])
+        self.assertEqual(SurveyCampaignResult.objects\
+                            .get(callid=self.call_uuid).response, 'Kiwi')
+
+    def test_survey_graph_invalidation(self):
+        """Test an edited survey compiles its graph again"""
+        survey_graph = get_survey_graph(self.survey.id)
+        self.assertEqual([state.question for state in survey_graph],
+                         ['Fruit?', 'Why?', 'Thanks'])
+        self.assertEqual(survey_graph[0].next('2'), ('Kiwi', 2))
+        self.assertEqual(survey_graph[0].next('3'), ('3', None))
+        self.assertNumQueries(0, get_survey_graph, self.survey.id)
+        self.question_list[1].delete()
+        survey_graph = get_survey_graph(self.survey.id)
+        self.assertEqual(len(survey_graph), 2)
+        self.assertEqual(survey_graph[0].next('2'), ('Kiwi', 1))
+
+
+class PlivoClientTestCase(TestCase):
+    """Test cases for the Plivo client against a local stub of Plivo"""
+
+    def setUp(self):
+        self.server_list = []
+        self.call_params_list = [
+            plivo_call_params(callerid='1000', phone_number='3400%04d' % i,
+                              Gateways='user/', AnswerUrl='http://answer/')
+            for i in range(10)]
+
+    def tearDown(self):
+        for server in self.server_list:
+            server.stop()
+
+    def start_server(self, **kwargs):
+        server = PlivoStubServer(**kwargs)
+        server.start()
+        self.server_list.append(server)
+        return server
+
+    def test_keep_alive(self):
+        """Test the originates share one kept alive connection"""
+        server = self.start_server()
+        client = PlivoClient(server.url)
+        for call_params in self.call_params_list:
+            self.assertTrue(client.call(call_params)['RequestUUID'])
+        self.assertEqual(server.counter['request_Call'], 10)
+        self.assertEqual(server.counter['connection'], 1)
+
+    def test_bulk_call(self):
+        """Test a batch is sent in one BulkCall request"""
+        server = self.start_server()
+        client = PlivoClient(server.url)
+        result_list = client.bulk_call(self.call_params_list)
+        self.assertEqual(len(set(result_list)), 10)
+        self.assertEqual(server.counter['request_BulkCall'], 1)
+        self.assertEqual(server.counter['call'], 10)
+
+    def test_bulk_call_fallback(self):
+        """Test a batch is sent in parallel calls without BulkCall"""
+        server = self.start_server(bulk=False)
+        client = PlivoClient(server.url, concurrency=4)
+        result_list = client.bulk_call(self.call_params_list)
+        self.assertEqual(len(set(result_list)), 10)
+        self.assertFalse(client.bulk_supported)
+        self.assertEqual(server.counter['request_Call'], 10)
+        # the failed BulkCall and the parallel connections
+        self.assertTrue(server.counter['connection'] <= 5)
+
+    def test_circuit_breaker(self):
+        """Test a slow media server opens the circuit"""
+        server = self.start_server(latency=0.5)
+        client = PlivoClient(server.url, timeout=0.1, failure_threshold=2,
+                             reset_timeout=60)
+        for i in range(2):
+            self.assertRaises(PlivoError, client.call,
+                              self.call_params_list[0])
+        self.assertRaises(CircuitOpen, client.call, self.call_params_list[0])
+        self.assertEqual(server.counter['request_Call'], 2)
+        result_list = client.bulk_call(self.call_params_list)
+        self.assertTrue(isinstance(result_list[0], CircuitOpen))
+
+    def test_async_framing(self):
+        """Test the async client reads the chunked answers and the answers
+        ended by the close of the connection"""
+        for framing in ('chunked', 'close'):
+            server = self.start_server(framing=framing)
+            client = AsyncPlivoClient(server.url, concurrency=2)
+            result_list = []
+            for call_params in self.call_params_list[:4]:
+                client.originate(call_params, lambda request_uuid, error:
+                                 result_list.append((request_uuid, error)))
+            while client.in_flight():
+                client.poll()
+            client.close()
+            self.assertEqual([error for request_uuid, error in result_list],
+                             [None] * 4)
+            self.assertEqual(len(set([request_uuid for request_uuid, error
+                                      in result_list])), 4)
+
+
+class OriginateWorkerTestCase(TestCase):
+    """Test cases for the originate worker against a local stub of Plivo"""
+    fixtures = ['gateway.json', 'auth_user', 'voiceapp', 'phonebook',
+                'campaign', 'campaign_subscriber']
+
+    def setUp(self):
+        self.server = PlivoStubServer()
+        self.server.start()
+        campaign = Campaign.objects.get(pk=1)
+        for i in range(12):
+            subscriber = CampaignSubscriber.objects.create(status=6,
+                campaign=campaign, duplicate_contact='3400%04d' % i,
+                count_attempt=0)
+            Callrequest.objects.create(status=1, campaign=campaign,
+                phone_number='3400%04d' % i,
+                # the last ones are not due yet
+                call_time=datetime.now() + timedelta(hours=i / 10),
+                aleg_gateway_id=campaign.aleg_gateway_id,
+                content_type=campaign.content_type,
+                object_id=campaign.object_id, user=campaign.user,
+                campaign_subscriber=subscriber)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_originate_worker(self):
+        """Test the due call requests are originated and recorded"""
+        client = AsyncPlivoClient(self.server.url, concurrency=4)
+        worker = OriginateWorker(client, logging.getLogger('newfies.test'),
+                                 batch_size=3)
+        worker.run(lambda: worker.originated + worker.failed >= 10)
+        self.assertEqual(worker.originated, 10)
+        self.assertEqual(self.server.counter['request_Call'], 10)
+        self.assertTrue(self.server.counter['connection'] <= 4)
+        originated = Callrequest.objects.filter(status=7)
+        self.assertEqual(originated.count(), 10)
+        self.assertEqual(len(set(originated.values_list('request_uuid',
+                                                        flat=True))), 10)
+        self.assertEqual(Callrequest.objects.filter(status=1).count(), 2)
+        self.assertEqual(CampaignSubscriber.objects\
+            .filter(duplicate_contact__startswith='3400', count_attempt=1)\
+            .count(), 10)
+
+    def test_release_stale_claim(self):
+        """Test the claims of a dead worker are pending again"""
+        claimed_list = Callrequest.objects.claim_pending_callrequest(4)
+        self.assertEqual(len(claimed_list), 4)
+        self.assertEqual(Callrequest.objects.release_stale_claim(60), 0)
+        Callrequest.objects.filter(id__in=[obj.id for obj in claimed_list])\
+            .update(updated_date=datetime.now() - timedelta(seconds=120))
+        # a call request whose originate was recorded is left alone
+        Callrequest.objects.filter(pk=claimed_list[0].id)\
+            .update(request_uuid=str(uuid1()))
+        self.assertEqual(Callrequest.objects.release_stale_claim(60), 3)
+        self.assertEqual(Callrequest.objects.get_pending_callrequest()\
+                            .count(), 9)
+
+
 test_cases = [
     NewfiesTastypieApiTestCase,
+    WebhookTestCase,
+    HangupRollbackTestCase,
+    InitCallrequestTestCase,
+    GatewayCapacityTestCase,
+    DialPlanTestCase,
+    RetrySchedulerTestCase,
+    RollupTestCase,
+    SurveyGraphTestCase,
+    PlivoClientTestCase,
+    OriginateWorkerTestCase,
     NewfiesAdminInterfaceTestCase,
     NewfiesCustomerInterfaceTestCase,
     NewfiesCustomerInterfaceForgotPassTestCase,
@@ -16,7 +16,6 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.http import HttpResponse
 from django.shortcuts import render_to_response
-from django.db.models import *
 from django.template.context import RequestContext
 from django.utils.translation import ugettext_lazy as _
 from django.utils import simplejson
@@ -25,9 +24,10 @@ from dialer_campaign.function_def import user_dialer_setting_msg
 from dialer_cdr.models import Callrequest, VoIPCall
 from dialer_cdr.forms import VoipSearchForm
 from dialer_cdr.function_def import voipcall_record_common_fun, get_disposition_name
+from dialer_cdr.rollup import voipcall_daily_report
 from common.common_functions import variable_value, current_view
+from common_functions import iter_values_chunk, csv_stream
 from datetime import datetime
-import csv
 import urllib
 import ast
 
@@ -166,7 +166,8 @@ def voipcall_report(request):
 
     **Important variable**:
 
-        * ``request.session['voipcall_record_qs']`` - stores voipcall query set
+        * ``request.session['voipcall_record_kwargs']`` - stores the voipcall
+          filters
     """
     kwargs = {}
     kwargs['user'] = User.objects.get(username=request.user)
@@ -189,40 +190,13 @@ def voipcall_report(request):
                                                tday.month,
                                                tday.day, 0, 0, 0, 0)
 
-    voipcall_list = \
-        VoIPCall.objects.filter(**kwargs).order_by('-starting_date')
-
     # Session variable is used to get record set with searched option
-    # into export file
-    request.session['voipcall_record_qs'] = voipcall_list
-
-    select_data = \
-        {"starting_date": "SUBSTR(CAST(starting_date as CHAR(30)),1,10)"}
-
-    # Get Total Rrecords from VoIPCall Report table for Daily Call Report
-    total_data = VoIPCall.objects.extra(select=select_data)\
-                 .values('starting_date')\
-                 .filter(**kwargs).annotate(Count('starting_date'))\
-                 .annotate(Sum('duration'))\
-                 .annotate(Avg('duration'))\
-                 .order_by('-starting_date')
-
-    # Following code will count total voip calls, duration
-    if total_data.count() != 0:
-        max_duration = \
-            max([x['duration__sum'] for x in total_data])
-        total_duration = \
-            sum([x['duration__sum'] for x in total_data])
-        total_calls = \
-            sum([x['starting_date__count'] for x in total_data])
-        total_avg_duration = \
-            (sum([x['duration__avg']\
-                for x in total_data])) / total_data.count()
-    else:
-        max_duration = 0
-        total_duration = 0
-        total_calls = 0
-        total_avg_duration = 0
+    # into export file, the filters are kept rather than the calls
+    request.session['voipcall_record_kwargs'] = \
+        dict((key, value) for key, value in kwargs.items() if key != 'user')
+
+    # Daily Call Report of the calls of the user, from the rollups
+    daily_data = voipcall_daily_report(dict(kwargs, user=request.user))
 
     template = 'frontend/report/voipcall_report.html'
     data = {
@@ -230,11 +204,11 @@ def voipcall_report(request):
         'from_date': from_date,
         'to_date': to_date,
         'disposition': disposition,
-        'total_data': total_data.reverse(),
-        'total_duration': total_duration,
-        'total_calls': total_calls,
-        'total_avg_duration': total_avg_duration,
-        'max_duration': max_duration,
+        'total_data': daily_data['total_data'],
+        'total_duration': daily_data['total_duration'],
+        'total_calls': daily_data['total_calls'],
+        'total_avg_duration': daily_data['total_avg_duration'],
+        'max_duration': daily_data['max_duration'],
         'module': current_view(request),
         'notice_count': notice_count(request),
         'dialer_setting_msg': user_dialer_setting_msg(request.user),
@@ -250,37 +224,36 @@ def export_voipcall_report(request):
 
     **Important variable**:
 
-        * ``request.session['voipcall_record_qs']`` - stores voipcall query set
+        * ``request.session['voipcall_record_kwargs']`` - stores the voipcall
+          filters
 
     **Exported fields**: [user, callid, callerid, phone_number, starting_date,
                           duration, disposition, used_gateway]
+
+    The calls are read by chunks and the CSV is streamed as it's written.
     """
-    # get the response object, this can be used as a stream.
-    response = HttpResponse(mimetype='text/csv')
+    kwargs = dict(request.session.get('voipcall_record_kwargs', {}),
+                  user=request.user)
+    voipcall_qs = VoIPCall.objects.filter(**kwargs)
+
+    def voipcall_row_iter():
+        for chunk in iter_values_chunk(voipcall_qs,
+                ['user__username', 'callid', 'callerid', 'phone_number',
+                 'starting_date', 'duration', 'billsec', 'disposition',
+                 'hangup_cause', 'hangup_cause_q850', 'used_gateway__name']):
+            for row in chunk:
+                row = list(row)
+                row[7] = get_disposition_name(row[7])
+                yield row
+
+    response = HttpResponse(csv_stream(['user', 'callid', 'callerid',
+                                        'phone_number', 'starting_date',
+                                        'duration', 'billsec',
+                                        'disposition', 'hangup_cause',
+                                        'hangup_cause_q850',
+                                        'used_gateway'],
+                                       voipcall_row_iter()),
+                            mimetype='text/csv')
     # force download.
     response['Content-Disposition'] = 'attachment;filename=export.csv'
-    # the csv writer
-    writer = csv.writer(response)
-
-    # super(VoIPCall_ReportAdmin, self).queryset(request)
-    qs = request.session['voipcall_record_qs']
-
-    writer.writerow(['user', 'callid', 'callerid', 'phone_number',
-                     'starting_date', 'duration', 'billsec',
-                     'disposition', 'hangup_cause', 'hangup_cause_q850',
-                     'used_gateway'])
-    for i in qs:
-        gateway_used = i.used_gateway.name if i.used_gateway else ''
-        writer.writerow([i.user,
-                         i.callid,
-                         i.callerid,
-                         i.phone_number,
-                         i.starting_date,
-                         i.duration,
-                         i.billsec,
-                         get_disposition_name(i.disposition),
-                         i.hangup_cause,
-                         i.hangup_cause_q850,
-                         gateway_used,
-                         ])
-    return response
\ No newline at end of file
+    return response
@@ -14,17 +14,7 @@
 
 from django.contrib import admin
 from django.utils.translation import ugettext_lazy as _
-from dialer_gateway.models import Gateway
-
-
-"""
-class GatewayGroupAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'description', 'created_date')
-    list_display_links = ('name', )
-    list_filter = ['metric']
-    ordering = ('id', )
-admin.site.register(GatewayGroup, GatewayGroupAdmin)
-"""
+from dialer_gateway.models import Gateway, GatewayGroup
 
 
 class GatewayAdmin(admin.ModelAdmin):
@@ -44,9 +34,21 @@ class GatewayAdmin(admin.ModelAdmin):
         }),
     )
     list_display = ('id', 'name', 'gateways', 'addprefix',
-                    'removeprefix', 'secondused', 'count_call', 'status',)
+                    'removeprefix', 'secondused', 'count_call',
+                    'count_in_use', 'maximum_call', 'status',)
     list_display_links = ('name', )
     list_filter = ['gateways']
     ordering = ('id', )
 
 admin.site.register(Gateway, GatewayAdmin)
+
+
+class GatewayGroupAdmin(admin.ModelAdmin):
+    """Allows the administrator to group the Gateways a campaign spreads
+    its calls over."""
+    list_display = ('id', 'name', 'description', 'created_date')
+    list_display_links = ('name', )
+    ordering = ('id', )
+    filter_horizontal = ('gateway',)
+
+admin.site.register(GatewayGroup, GatewayGroupAdmin)
@@ -0,0 +1,113 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+"""
+Gateway capacity
+
+The calls in use of each gateway are counted in the shared cache, a line
+is acquired when a call is originated and released when it hangs up or
+its originate fails. The counters are shared by all the workers and are
+reconciled with the call requests in progress by gateway_in_use_reconcile.
+"""
+
+from django.core.cache import cache
+
+GATEWAY_IN_USE_KEY = 'gateway_in_use_%s'
+# incr and decr don't extend the expiry, the reconciliation does
+GATEWAY_IN_USE_EXPIRE = 60 * 60 * 24 * 30
+
+
+class GatewaySaturated(Exception):
+    """All the gateways which can take the call are at their maximum_call"""
+    pass
+
+
+def gateway_load(in_use, maximum_call):
+    """Sort key of a gateway, the ratio of its lines in use, then the
+    number of calls in use for the gateways without maximum"""
+    if maximum_call:
+        return (float(in_use) / maximum_call, in_use)
+    return (0, in_use)
+
+
+def get_gateway_in_use(gateway_id_list):
+    """Return the calls in use per gateway ID, in one cache request"""
+    value_dict = cache.get_many(
+        [GATEWAY_IN_USE_KEY % gateway_id for gateway_id in gateway_id_list])
+    return dict((gateway_id,
+                 int(value_dict.get(GATEWAY_IN_USE_KEY % gateway_id) or 0))
+                for gateway_id in gateway_id_list)
+
+
+def acquire_gateway(gateway_id, maximum_call):
+    """Take a line on the gateway, return False if its maximum_call is
+    reached
+
+    The counter is incremented first, then given back when it went over
+    the maximum, so two workers never take the last line together.
+    """
+    key = GATEWAY_IN_USE_KEY % gateway_id
+    cache.add(key, 0, GATEWAY_IN_USE_EXPIRE)
+    try:
+        in_use = cache.incr(key)
+    except ValueError:
+        # evicted between add and incr
+        cache.add(key, 1, GATEWAY_IN_USE_EXPIRE)
+        in_use = 1
+    if maximum_call and in_use > maximum_call:
+        release_gateway(gateway_id)
+        return False
+    return True
+
+
+def release_gateway(gateway_id):
+    """Give back a line of the gateway"""
+    if not gateway_id:
+        return
+    key = GATEWAY_IN_USE_KEY % gateway_id
+    try:
+        if cache.decr(key) < 0:
+            cache.set(key, 0, GATEWAY_IN_USE_EXPIRE)
+    except ValueError:
+        # the counter is gone, the reconciliation sets it again
+        pass
+
+
+def acquire_least_loaded(gateway_tier_list):
+    """Take a line on the least loaded gateway and return its ID
+
+    gateway_tier_list holds lists of (gateway_id, maximum_call), the
+    gateways of a tier are tried from the least loaded, and the next tier,
+    their failover gateways, only when they are all saturated. Raise
+    GatewaySaturated when no gateway has a free line.
+    """
+    in_use_dict = get_gateway_in_use(
+        [gateway[0] for gateway_tier in gateway_tier_list
+         for gateway in gateway_tier])
+    for tier in gateway_tier_list:
+        tier = sorted(tier, key=lambda gateway: \
+                        gateway_load(in_use_dict[gateway[0]], gateway[1]))
+        for gateway_id, maximum_call in tier:
+            if acquire_gateway(gateway_id, maximum_call):
+                return gateway_id
+    raise GatewaySaturated('No free line on the gateways %s' % \
+        ', '.join([str(gateway[0]) for gateway_tier in gateway_tier_list
+                   for gateway in gateway_tier]))
+
+
+def set_gateway_in_use(in_use_dict):
+    """Reset the counters to the calls in use found in the database"""
+    cache.set_many(dict((GATEWAY_IN_USE_KEY % gateway_id, in_use)
+                        for gateway_id, in_use in in_use_dict.items()),
+                   GATEWAY_IN_USE_EXPIRE)
@@ -29,26 +29,6 @@ GATEWAY_PROTOCOL = (
     ('JINGLE', _('JINGLE')),
 )
 
-"""
-class GatewayGroup(Model):
-    name = models.CharField(max_length=90)
-    description = models.TextField(null=True, blank=True,
-                               help_text=_("Short description \
-                               about the Gateway Group"))
-
-    created_date = models.DateTimeField(auto_now_add=True, verbose_name='Date')
-    updated_date = models.DateTimeField(auto_now=True)
-
-    class Meta:
-        db_table = u'dialer_gateway_group'
-        verbose_name = _("Dialer Gateway Group")
-        verbose_name_plural = _("Dialer Gateway Groups")
-
-    def __unicode__(self):
-            return u"%s" % self.name
-"""
-
-
 class Gateway(Model):
     """This defines the trunk to deliver the Voip Calls.
     Each of the Gateways are routes that support different protocols and
@@ -87,9 +67,14 @@ class Gateway(Model):
     description = models.TextField(verbose_name=_('Description'), blank=True,
                                help_text=_("Gateway provider notes"))
     addprefix = models.CharField(verbose_name=_('Add prefix'),
-                max_length=60, blank=True)
+                max_length=60, blank=True,
+                help_text=_('Prefixes separated by comma, the Nth one '
+                            'replaces the Nth remove prefix, the first one '
+                            'is added to the other numbers'))
     removeprefix = models.CharField(verbose_name=_('Remove prefix'),
-                   max_length=60, blank=True)
+                   max_length=60, blank=True,
+                   help_text=_('Prefixes separated by comma, the longest '
+                               'one matching the number is removed'))
     gateways = models.CharField(max_length=500, verbose_name=_("Gateways"),
                 help_text=_('Example : "sofia/gateway/myprovider/" or 2 for failover "sofia/gateway/myprovider/, user/", # Gateway string to try dialing separated by comma. First in list will be tried first'))
 
@@ -127,3 +112,38 @@ class Gateway(Model):
 
     def __unicode__(self):
             return u"%s" % self.name
+
+
+class GatewayGroup(Model):
+    """This defines a group of Gateways, the calls of a campaign using the
+    group are spread over its gateways, the least loaded first.
+
+    **Attributes**:
+
+        * ``name`` - Gateway group name.
+        * ``description`` - Description about the Gateway group.
+
+    **Relationships**:
+
+        * ``gateway`` - Gateways of the group
+
+    **Name of DB table**: dialer_gateway_group
+    """
+    name = models.CharField(max_length=90, verbose_name=_('Name'))
+    description = models.TextField(null=True, blank=True,
+                               verbose_name=_('Description'),
+                               help_text=_("Short description \
+                               about the Gateway Group"))
+    gateway = models.ManyToManyField(Gateway, verbose_name=_('Gateways'),
+                               help_text=_("Gateways of the group"))
+
+    created_date = models.DateTimeField(auto_now_add=True, verbose_name='Date')
+    updated_date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = u'dialer_gateway_group'
+        verbose_name = _("Dialer Gateway Group")
+        verbose_name_plural = _("Dialer Gateway Groups")
+
+    def __unicode__(self):
+            return u"%s" % self.name
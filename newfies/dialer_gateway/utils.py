@@ -12,7 +12,73 @@
 # Arezqui Belaid <info@star2billing.com>
 #
 
-from dialer_gateway.models import Gateway
+import logging
+
+logger = logging.getLogger('newfies.filelog')
+
+
+def split_prefix(prefix):
+    """Return the prefixes of a comma separated prefix field"""
+    return [item.strip() for item in (prefix or '').split(',')]
+
+
+class DialPlan(object):
+    """Prefix rules of a gateway, compiled once for all its calls
+
+    removeprefix and addprefix hold prefixes separated by comma : the
+    longest removeprefix matching a number is replaced by the addprefix at
+    the same position, or by the first addprefix, and a number matching no
+    removeprefix gets the first addprefix. With one prefix in each field,
+    removeprefix is removed when the number starts with it and addprefix
+    is added.
+
+    **Attributes**:
+
+        * ``status`` - Gateway status, the calls go through an active one
+        * ``rule`` - addprefix per removeprefix
+        * ``length_list`` - Lengths of the removeprefixes, longest first
+    """
+
+    def __init__(self, removeprefix='', addprefix='', status=1):
+        self.status = status
+        add_list = split_prefix(addprefix)
+        self.default = add_list[0]
+        self.rule = {}
+        for index, prefix in enumerate(split_prefix(removeprefix)):
+            if prefix and prefix not in self.rule:
+                self.rule[prefix] = add_list[index] \
+                    if index < len(add_list) else self.default
+        self.length_list = sorted(set([len(prefix) for prefix in self.rule]),
+                                  reverse=True)
+
+    def rewrite(self, phone_number):
+        """Return the number to dial for phone_number"""
+        for length in self.length_list:
+            addprefix = self.rule.get(phone_number[:length])
+            if addprefix is not None:
+                return addprefix + phone_number[length:]
+        return self.default + phone_number
+
+    def rewrite_many(self, phone_number_list):
+        """Return the numbers to dial for a list of phone numbers"""
+        if not self.length_list:
+            return [self.default + phone_number
+                    for phone_number in phone_number_list]
+        return [self.rewrite(phone_number)
+                for phone_number in phone_number_list]
+
+
+def get_dialplan(gateway_id):
+    """Return the compiled dial plan of a gateway, None if it doesn't exist
+
+    The plan is compiled with the dial settings of the gateway, which are
+    kept per process, see dialer_cdr.models.get_context_list.
+    """
+    # dialer_cdr.models compiles the plans with DialPlan
+    from dialer_cdr.models import get_context_list
+    gateway = get_context_list([('gateway', gateway_id)],
+                               skip_missing=True)[0]
+    return gateway and gateway['dialplan']
 
 
 def phonenumber_change_prefix(phone_number, gateway_id):
@@ -42,23 +108,16 @@ def phonenumber_change_prefix(phone_number, gateway_id):
         * ``maximum_call`` -
         * ``status`` - Gateway status
     """
-    try:
-        obj_gateway = Gateway.objects.get(id=gateway_id)
-    except:
-        print 'Can\'t find this Gateway : %s' % gateway_id
+    obj_dialplan = get_dialplan(gateway_id)
+    if obj_dialplan is None:
+        logger.error('Can\'t find this Gateway : %s' % gateway_id)
         return False
 
     if not phone_number:
         return False
 
-    if obj_gateway.status != 1:
-        print 'Gateway not Active: %s' % gateway_id
+    if obj_dialplan.status != 1:
+        logger.error('Gateway not Active: %s' % gateway_id)
         return False
 
-    if len(obj_gateway.removeprefix) > 0 \
-        and phone_number.startswith(obj_gateway.removeprefix):
-        phone_number = phone_number[len(obj_gateway.removeprefix):]
-
-    phone_number = obj_gateway.addprefix + phone_number
-
-    return phone_number
+    return obj_dialplan.rewrite(phone_number)
@@ -0,0 +1,37 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.contrib import admin
+from dnc.models import DNC, DNCContact
+
+
+class DNCAdmin(admin.ModelAdmin):
+    """Allows the administrator to view and modify the DNC lists."""
+    list_display = ('id', 'name', 'user', 'dnc_contacts', 'created_date')
+    list_display_links = ('name', )
+    list_filter = ['user']
+    ordering = ('id', )
+
+admin.site.register(DNC, DNCAdmin)
+
+
+class DNCContactAdmin(admin.ModelAdmin):
+    """Allows the administrator to view and modify the DNC numbers."""
+    list_display = ('id', 'dnc', 'phone_number', 'match_prefix',
+                    'created_date')
+    list_filter = ['dnc', 'match_prefix']
+    search_fields = ('phone_number', )
+    ordering = ('id', )
+
+admin.site.register(DNCContact, DNCContactAdmin)
@@ -0,0 +1,72 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from dnc.models import DNCContact, clean_number, reset_dnc_version
+from common_functions import bulk_create_chunk
+import csv
+
+
+def import_dnc_chunk(obj_dnc, row_list):
+    """Insert the (phone_number, match_prefix) of row_list missing from the
+    DNC list, return the number of rows inserted"""
+    existing = set(DNCContact.objects\
+        .filter(dnc=obj_dnc.id,
+                phone_number__in=[row[0] for row in row_list])\
+        .values_list('phone_number', 'match_prefix'))
+    new_list = [DNCContact(dnc_id=obj_dnc.id, phone_number=phone_number,
+                           match_prefix=match_prefix)
+                for phone_number, match_prefix in set(row_list)
+                if (phone_number, match_prefix) not in existing]
+    bulk_create_chunk(DNCContact, new_list)
+    return len(new_list)
+
+
+def import_dnc_file(obj_dnc, dnc_file, chunk_size=500):
+    """Load a CSV file in a DNC list
+
+    The number is read from the first column, a number ending with '*' is
+    a prefix. The file is streamed and inserted by chunks.
+
+    **Return**:
+
+        * ``imported`` - Number of rows inserted
+        * ``duplicate`` - Number of rows already in the DNC list
+        * ``invalid`` - Number of rows without a number
+    """
+    result = {'imported': 0, 'duplicate': 0, 'invalid': 0}
+    row_list = []
+    for row in csv.reader(dnc_file):
+        if not row:
+            continue
+        phone_number = row[0].strip()
+        match_prefix = phone_number.endswith('*')
+        phone_number = clean_number(phone_number)
+        if not phone_number:
+            result['invalid'] += 1
+            continue
+        row_list.append((phone_number, match_prefix))
+        if len(row_list) >= chunk_size:
+            imported = import_dnc_chunk(obj_dnc, row_list)
+            result['imported'] += imported
+            result['duplicate'] += len(row_list) - imported
+            row_list = []
+
+    if row_list:
+        imported = import_dnc_chunk(obj_dnc, row_list)
+        result['imported'] += imported
+        result['duplicate'] += len(row_list) - imported
+
+    if result['imported']:
+        reset_dnc_version(obj_dnc.user_id)
+    return result
@@ -0,0 +1,74 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext_lazy as _
+from dnc.store import DNCStore, write_dnc_file
+from random import Random
+from tempfile import mkdtemp
+from time import time
+import os
+import shutil
+
+
+class Command(BaseCommand):
+    help = _("Build a DNC store of random numbers and measure its size, "
+             "the time to open it and the lookups per second")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--count', type='int', dest='count', default=10000000,
+                    help=_('Number of DNC numbers in the store')),
+        make_option('--prefix', type='int', dest='prefix', default=1000,
+                    help=_('Number of DNC prefixes in the store')),
+        make_option('--lookup', type='int', dest='lookup', default=200000,
+                    help=_('Number of phone numbers to check')),
+    )
+
+    def handle(self, *args, **options):
+        rand = Random(1)
+        count = options['count']
+        # 11 digits numbers spread over the whole range, keys are sorted
+        step = 10 ** 11 / count
+        exact_list = (int('1%011d' % (i * step + rand.randint(0, step - 1)))
+                      for i in xrange(count))
+        prefix_list = sorted(set([int('1%d' % rand.randint(3300, 3399999))
+                                  for i in range(options['prefix'])]))
+
+        directory = mkdtemp()
+        path = os.path.join(directory, 'dnc_benchmark.db')
+        try:
+            start = time()
+            write_dnc_file(path, 'benchmark', exact_list, prefix_list)
+            build_time = time() - start
+
+            start = time()
+            store = DNCStore(path)
+            open_time = time() - start
+
+            number_list = ['%011d' % rand.randint(0, 10 ** 11 - 1)
+                           for i in range(options['lookup'])]
+            start = time()
+            allowed_list = store.filter_allowed(number_list)
+            lookup_time = time() - start
+
+            print _("%(count)d numbers, %(prefix)d prefixes") %                 {'count': store.exact_count, 'prefix': len(store.prefix_set)}
+            print "%-20s %12.1f" % ('file size (MB)',
+                                    os.path.getsize(path) / 1048576.0)
+            print "%-20s %12.3f" % ('build (s)', build_time)
+            print "%-20s %12.3f" % ('open (s)', open_time)
+            print "%-20s %12.0f" % ('lookups/sec',
+                                    len(number_list) / lookup_time)
+            print "%-20s %12d" % ('blocked', len(number_list) - len(allowed_list))
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,41 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.translation import ugettext as _
+from dnc.models import DNC
+from dnc.function_def import import_dnc_file
+
+
+class Command(BaseCommand):
+    # Use : import_dnc 1 /tmp/dnc.csv
+    args = _('<dnc_id> <csv_file>')
+    help = _("Load the numbers of a CSV file in a DNC list, the number is "
+             "in the first column and a number ending with * is a prefix")
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError(_('Usage : import_dnc %s' % self.args))
+        dnc_id, csv_path = args
+        try:
+            obj_dnc = DNC.objects.get(id=dnc_id)
+        except DNC.DoesNotExist:
+            raise CommandError(_('Can\'t find this DNC : %s' % dnc_id))
+
+        dnc_file = open(csv_path, 'rb')
+        try:
+            result = import_dnc_file(obj_dnc, dnc_file)
+        finally:
+            dnc_file.close()
+        print _("%(imported)d imported, %(duplicate)d duplicate, "
+                "%(invalid)d invalid" % result)
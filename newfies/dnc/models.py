@@ -0,0 +1,137 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+from django.db.models.signals import post_save, post_delete
+from common.intermediate_model_base_class import Model
+from common_functions import reset_version
+import re
+
+
+DNC_VERSION_KEY = 'dnc_version_user_id_%s'
+
+NOT_DIGIT = re.compile(r'\D')
+
+
+def clean_number(phone_number):
+    """Keep the digits of a phone number"""
+    return NOT_DIGIT.sub('', phone_number or '')
+
+
+class DNC(Model):
+    """This defines the Do Not Call list
+
+    All the DNC lists of a user apply to all the campaigns of the user,
+    a contact matching one of them is neither spooled nor called.
+
+    **Attributes**:
+
+        * ``name`` - DNC list name.
+        * ``description`` - description about the DNC list.
+
+    **Relationships**:
+
+        * ``user`` - Foreign key relationship to the User model.\
+        Each DNC list is assigned to a User
+
+    **Name of DB table**: dialer_dnc
+    """
+    name = models.CharField(max_length=90, verbose_name=_('Name'))
+    description = models.TextField(null=True, blank=True,
+                  help_text=_("DNC list notes"))
+    user = models.ForeignKey('auth.User', related_name='DNC owner')
+    created_date = models.DateTimeField(auto_now_add=True,
+                                        verbose_name=_('Date'))
+    updated_date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = u'dialer_dnc'
+        verbose_name = _("Do Not Call list")
+        verbose_name_plural = _("Do Not Call lists")
+
+    def __unicode__(self):
+            return u"%s" % self.name
+
+    def dnc_contacts(self):
+        """This will return a count of the numbers in the DNC list"""
+        return DNCContact.objects.filter(dnc=self.id).count()
+    dnc_contacts.allow_tags = True
+    dnc_contacts.short_description = _('Numbers')
+
+
+class DNCContact(models.Model):
+    """This defines a number or a prefix of a Do Not Call list
+
+    **Attributes**:
+
+        * ``phone_number`` - Number, digits only
+        * ``match_prefix`` - Block all the numbers starting with phone_number
+
+    **Relationships**:
+
+        * ``dnc`` - Foreign key relationship to the DNC model.
+
+    **Name of DB table**: dialer_dnc_contact
+    """
+    dnc = models.ForeignKey(DNC, verbose_name=_('DNC list'))
+    phone_number = models.CharField(max_length=120, db_index=True,
+                   verbose_name=_('Phone number'))
+    match_prefix = models.BooleanField(default=False,
+                   verbose_name=_('Prefix'),
+                   help_text=_("Block all the numbers starting with it"))
+    created_date = models.DateTimeField(auto_now_add=True,
+                   verbose_name=_('Date'))
+
+    class Meta:
+        db_table = u'dialer_dnc_contact'
+        verbose_name = _("DNC number")
+        verbose_name_plural = _("DNC numbers")
+        unique_together = ['dnc', 'phone_number', 'match_prefix']
+
+    def save(self, *args, **kwargs):
+        """The numbers are stored with digits only"""
+        self.phone_number = clean_number(self.phone_number)
+        super(DNCContact, self).save(*args, **kwargs)
+
+    def __unicode__(self):
+        if self.match_prefix:
+            return u"%s*" % self.phone_number
+        return u"%s" % self.phone_number
+
+
+def reset_dnc_version(user_id):
+    """Tell all the processes the DNC store of a user has to be rebuilt"""
+    reset_version([DNC_VERSION_KEY % user_id])
+
+
+def post_change_dnc_contact(sender, **kwargs):
+    """A ``post_save`` / ``post_delete`` signal sent by DNCContact, the
+    bulk imports don't send it and reset the version themselves"""
+    obj = kwargs['instance']
+    try:
+        user_id = DNC.objects.values_list('user', flat=True)\
+                    .get(id=obj.dnc_id)
+    except DNC.DoesNotExist:
+        return
+    reset_dnc_version(user_id)
+
+
+def post_delete_dnc(sender, **kwargs):
+    """A ``post_delete`` signal sent by DNC"""
+    reset_dnc_version(kwargs['instance'].user_id)
+
+post_save.connect(post_change_dnc_contact, sender=DNCContact)
+post_delete.connect(post_change_dnc_contact, sender=DNCContact)
+post_delete.connect(post_delete_dnc, sender=DNC)
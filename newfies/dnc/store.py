@@ -0,0 +1,312 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+"""
+Compiled Do Not Call store
+
+The DNC numbers of a user are compiled in one file per user, holding two
+sorted arrays of unsigned 64 bits keys, the exact numbers then the
+prefixes::
+
+    header : magic (6s) | version (36s) | exact count (Q) | prefix count (Q)
+    exact numbers : count * Q
+    prefixes : count * Q
+
+A number is encoded as int('1' + digits), the leading '1' keeps the
+leading zeros, so 10 million numbers take 80MB. The file is memory-mapped
+and shared by all the processes of the host, an exact number is found by
+binary search in the mapped array, in O(log n) page reads, and the
+prefixes, which are few, are loaded in a set and checked with one lookup
+for each prefix length no longer than the number.
+
+A change of the DNC numbers of a user doesn't stop the dialer : the store
+is rebuilt in the background by one process per host, in a temporary file
+renamed over the previous one, which is served meanwhile.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from dnc.models import DNCContact, DNC_VERSION_KEY, clean_number
+from threading import Thread
+import logging
+import mmap
+import os
+import socket
+import struct
+
+logger = logging.getLogger('newfies.filelog')
+
+DNC_MAGIC = 'NFDNC1'
+HEADER = struct.Struct('<6s36sQQ')
+KEY = struct.Struct('<Q')
+# int('1' + 18 digits) still fits on 64 bits
+MAX_DIGITS = 18
+
+DNC_BUILD_LOCK_KEY = 'dnc_build_lock_host_%s_user_id_%s'
+DNC_BUILD_LOCK_EXPIRE = 60 * 30  # Lock expires in 30 minutes
+
+# DNCStore per user_id, for the running process
+_dnc_store = {}
+
+
+def number_key(phone_number):
+    """Encode a phone number as a 64 bits key, None if it can't be"""
+    digits = clean_number(phone_number)
+    if not digits or len(digits) > MAX_DIGITS:
+        return None
+    return int('1' + digits)
+
+
+def write_keys(dnc_file, key_list):
+    """Write the sorted keys, skipping the duplicates, return the count"""
+    count = 0
+    last_key = None
+    buffer = []
+    for key in key_list:
+        if key == last_key:
+            continue
+        if last_key is not None and key < last_key:
+            raise ValueError('DNC keys are not sorted')
+        last_key = key
+        buffer.append(key)
+        if len(buffer) >= 65536:
+            dnc_file.write(struct.pack('<%dQ' % len(buffer), *buffer))
+            count += len(buffer)
+            buffer = []
+    if buffer:
+        dnc_file.write(struct.pack('<%dQ' % len(buffer), *buffer))
+    return count + len(buffer)
+
+
+def write_dnc_file(path, version, exact_list, prefix_list):
+    """Write a DNC store file from the sorted keys of the exact numbers and
+    of the prefixes, the file is replaced atomically"""
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    dnc_file = open(tmp_path, 'wb')
+    try:
+        dnc_file.write(HEADER.pack(DNC_MAGIC, version or '', 0, 0))
+        exact_count = write_keys(dnc_file, exact_list)
+        prefix_count = write_keys(dnc_file, prefix_list)
+        dnc_file.seek(0)
+        dnc_file.write(HEADER.pack(DNC_MAGIC, version or '', exact_count,
+                                   prefix_count))
+    finally:
+        dnc_file.close()
+    os.rename(tmp_path, path)
+
+
+class DNCStore(object):
+    """Read only view of a DNC store file
+
+    **Attributes**:
+
+        * ``path`` - Path of the DNC store file, a missing file is an
+          empty store
+        * ``ready`` - False for the empty store given while the first file
+          of the user is built, the numbers can't be checked yet
+    """
+
+    def __init__(self, path=None, ready=True):
+        self.version = None
+        self.stamp = None
+        self.ready = ready
+        self.exact_count = 0
+        self.prefix_set = frozenset()
+        self.prefix_length = ()
+        self.map = None
+        if path and os.path.exists(path):
+            self.open(path)
+
+    def open(self, path):
+        dnc_file = open(path, 'rb')
+        try:
+            stat = os.fstat(dnc_file.fileno())
+            self.stamp = (stat.st_ino, stat.st_mtime)
+            magic, version, self.exact_count, prefix_count = \
+                HEADER.unpack(dnc_file.read(HEADER.size))
+            if magic != DNC_MAGIC:
+                raise ValueError('Not a DNC store : %s' % path)
+            self.version = version.rstrip('\0')
+            if self.exact_count or prefix_count:
+                self.map = mmap.mmap(dnc_file.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+        finally:
+            dnc_file.close()
+
+        if prefix_count:
+            offset = HEADER.size + self.exact_count * KEY.size
+            self.prefix_set = frozenset(struct.unpack_from(
+                '<%dQ' % prefix_count, self.map, offset))
+            # the lengths of prefix worth checking, len(str(key)) - 1 digits
+            self.prefix_length = sorted(set(
+                [len(str(key)) - 1 for key in self.prefix_set]))
+
+    def __len__(self):
+        return self.exact_count + len(self.prefix_set)
+
+    def has_exact(self, key):
+        """Binary search of the key in the mapped exact numbers, O(log n)
+        in the count of exact numbers"""
+        low, high = 0, self.exact_count - 1
+        unpack_from = KEY.unpack_from
+        while low <= high:
+            middle = (low + high) >> 1
+            value = unpack_from(self.map, HEADER.size + middle * KEY.size)[0]
+            if value < key:
+                low = middle + 1
+            elif value > key:
+                high = middle - 1
+            else:
+                return True
+        return False
+
+    def is_blocked(self, phone_number):
+        """Return True if the number is in the DNC store"""
+        digits = clean_number(phone_number)
+        if not digits or len(digits) > MAX_DIGITS:
+            return False
+        if self.exact_count and self.has_exact(int('1' + digits)):
+            return True
+        for length in self.prefix_length:
+            if length > len(digits):
+                break
+            if int('1' + digits[:length]) in self.prefix_set:
+                return True
+        return False
+
+    def filter_allowed(self, number_list):
+        """Return the numbers of number_list which are not blocked"""
+        if not len(self):
+            return list(number_list)
+        return [number for number in number_list
+                if not self.is_blocked(number)]
+
+
+def dnc_store_path(user_id):
+    return os.path.join(settings.DNC_STORE_DIR, 'dnc_%s.db' % user_id)
+
+
+def sorted_key_list(user_id, match_prefix):
+    """Keys of the DNC numbers of a user, sorted by the database
+
+    Ordering by length then by number gives the order of the keys, so the
+    numbers are streamed to the file without being loaded in memory.
+    """
+    phone_number_list = DNCContact.objects\
+        .filter(dnc__user=user_id, match_prefix=match_prefix)\
+        .extra(select={'length': 'LENGTH(dialer_dnc_contact.phone_number)'},
+               order_by=['length', 'phone_number'])\
+        .values_list('length', 'phone_number')
+    for length, phone_number in phone_number_list.iterator():
+        key = number_key(phone_number)
+        if key is not None:
+            yield key
+
+
+def build_dnc_store(user_id, version=None):
+    """Compile the DNC numbers of a user in his DNC store file"""
+    if not os.path.isdir(settings.DNC_STORE_DIR):
+        os.makedirs(settings.DNC_STORE_DIR)
+    path = dnc_store_path(user_id)
+    write_dnc_file(path, version,
+                   sorted_key_list(user_id, False),
+                   sorted_key_list(user_id, True))
+    logger.info("DNC store built for user %s" % user_id)
+    return path
+
+
+def file_stamp(path):
+    """Return the inode and the modification time of path, None if it
+    doesn't exist, a rebuilt file has another stamp"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime)
+
+
+def start_dnc_build(user_id, version):
+    """Rebuild the DNC store of a user in a background thread, return False
+    if a build of this store is already running on the host
+
+    Without DNC_STORE_BACKGROUND_BUILD, the store is built in the calling
+    process, under the same lock.
+    """
+    lock_id = DNC_BUILD_LOCK_KEY % (socket.gethostname(), user_id)
+    if not cache.add(lock_id, 'true', DNC_BUILD_LOCK_EXPIRE):
+        return False
+
+    def build():
+        try:
+            build_dnc_store(user_id, version)
+        except Exception:
+            logger.exception("DNC store build failed for user %s" % user_id)
+        finally:
+            cache.delete(lock_id)
+
+    if not settings.DNC_STORE_BACKGROUND_BUILD:
+        build()
+        return True
+
+    def build_thread():
+        try:
+            build()
+        finally:
+            # the thread has its own connection to the database
+            connection.close()
+    thread = Thread(target=build_thread, name='dnc_build_%s' % user_id)
+    thread.daemon = True
+    thread.start()
+    return True
+
+
+def get_dnc_store(user):
+    """Return the DNCStore of a user
+
+    The store is rebuilt on this host when its version differs from the
+    version in the shared cache, which is reset on any change of the DNC
+    numbers of the user. The build runs in the background, see
+    start_dnc_build, and the previous store is served until the new file
+    replaces it. A user whose first file is not built yet gets a store
+    which is not ``ready``.
+    """
+    user_id = getattr(user, 'id', user)
+    version = cache.get(DNC_VERSION_KEY % user_id)
+    store = _dnc_store.get(user_id)
+    if store is not None and (version is None or store.version == version):
+        return store
+
+    path = dnc_store_path(user_id)
+    if store is None or store.stamp != file_stamp(path):
+        # the file was built, or rebuilt by another process of the host
+        store = DNCStore(path)
+    if version is not None and store.version != version:
+        start_dnc_build(user_id, version)
+    elif store.stamp is None \
+        and DNCContact.objects.filter(dnc__user=user_id).exists():
+        # the cache lost the version and the file was never built
+        start_dnc_build(user_id, None)
+    else:
+        _dnc_store[user_id] = store
+        return store
+
+    if store.stamp != file_stamp(path):
+        # built meanwhile, or by the calling process
+        store = DNCStore(path)
+    if store.stamp is None:
+        # no file to serve until the first one is built
+        return DNCStore(ready=False)
+    _dnc_store[user_id] = store
+    return store
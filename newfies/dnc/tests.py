@@ -0,0 +1,112 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+from common.test_utils import build_test_suite_from
+from dnc.models import DNC, DNCContact, DNC_VERSION_KEY
+from dnc.function_def import import_dnc_file
+from dnc.store import get_dnc_store, build_dnc_store, DNC_BUILD_LOCK_KEY
+from StringIO import StringIO
+from tempfile import mkdtemp
+import shutil
+import socket
+
+
+class DNCStoreTestCase(TestCase):
+    """Test cases for the Do Not Call store"""
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        # the test database is not shared with the build thread
+        self.settings = override_settings(DNC_STORE_DIR=self.directory,
+                                          DNC_STORE_BACKGROUND_BUILD=False)
+        self.settings.enable()
+        self.user = User.objects.create_user('dnc', 'dnc@world.com', 'dnc')
+        self.dnc = DNC.objects.create(name='dnc', user=self.user)
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def test_import_dnc_file(self):
+        """Test the CSV import skips the duplicates and invalid rows"""
+        result = import_dnc_file(self.dnc, StringIO(
+            "34650 784 355\n34650784355\n4420*\nnumber\n34650784356\n"))
+        self.assertEqual(result,
+                         {'imported': 3, 'duplicate': 1, 'invalid': 1})
+        result = import_dnc_file(self.dnc, StringIO("4420*\n4420\n"))
+        self.assertEqual(result,
+                         {'imported': 1, 'duplicate': 1, 'invalid': 0})
+
+    def test_dnc_store(self):
+        """Test the exact numbers and the prefixes are blocked"""
+        import_dnc_file(self.dnc, StringIO("34650784355\n4420*\n0033*\n"))
+        store = get_dnc_store(self.user)
+        self.assertTrue(store.is_blocked('+34 650 784 355'))
+        self.assertFalse(store.is_blocked('34650784356'))
+        self.assertTrue(store.is_blocked('442071234567'))
+        self.assertTrue(store.is_blocked('0033612345678'))
+        self.assertFalse(store.is_blocked('33612345678'))
+        self.assertEqual(store.filter_allowed(['34650784355', '1234']),
+                         ['1234'])
+
+        # a change of the DNC list rebuilds the store
+        DNCContact.objects.create(dnc=self.dnc, phone_number='1234')
+        store = get_dnc_store(self.user)
+        self.assertEqual(store.filter_allowed(['34650784355', '1234']), [])
+
+
+    def test_dnc_store_rebuild(self):
+        """Test the previous store is served until the new one is built"""
+        import_dnc_file(self.dnc, StringIO("34650784355\n"))
+        self.assertTrue(get_dnc_store(self.user).is_blocked('34650784355'))
+
+        # another process of the host is rebuilding the store
+        lock_id = DNC_BUILD_LOCK_KEY % (socket.gethostname(), self.user.id)
+        cache.add(lock_id, 'true', 60)
+        try:
+            DNCContact.objects.create(dnc=self.dnc, phone_number='1234')
+            store = get_dnc_store(self.user)
+            self.assertTrue(store.ready)
+            self.assertTrue(store.is_blocked('34650784355'))
+            self.assertFalse(store.is_blocked('1234'))
+            # the new file replaces the previous one
+            build_dnc_store(self.user.id,
+                            cache.get(DNC_VERSION_KEY % self.user.id))
+        finally:
+            cache.delete(lock_id)
+        self.assertTrue(get_dnc_store(self.user).is_blocked('1234'))
+
+    def test_dnc_store_not_ready(self):
+        """Test a store is not ready until its first file is built"""
+        lock_id = DNC_BUILD_LOCK_KEY % (socket.gethostname(), self.user.id)
+        cache.add(lock_id, 'true', 60)
+        try:
+            DNCContact.objects.create(dnc=self.dnc, phone_number='1234')
+            self.assertFalse(get_dnc_store(self.user).ready)
+        finally:
+            cache.delete(lock_id)
+        store = get_dnc_store(self.user)
+        self.assertTrue(store.ready)
+        self.assertTrue(store.is_blocked('1234'))
+
+test_cases = [
+    DNCStoreTestCase,
+]
+
+
+def suite():
+    return build_test_suite_from(test_cases)
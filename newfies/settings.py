@@ -196,6 +196,7 @@ INSTALLED_APPS = (
     'dialer_campaign',
     'dialer_cdr',
     'dialer_settings',
+    'dnc',
     'user_profile',
     'common',
     'djcelery',
@@ -418,11 +419,96 @@ PLIVO_DEFAULT_DIALCALLBACK_URL = 'http://127.0.0.1:8000/api/v1/dialcallback/'
 PLIVO_DEFAULT_SURVEY_ANSWER_URL = 'http://127.0.0.1:8000/' \
                                   'survey_finestatemachine/'
 
+#Plivo REST API, the connections are kept alive and shared per worker
+PLIVO_REST_API_URL = 'http://127.0.0.1:8088'
+PLIVO_API_VERSION = 'v0.1'
+PLIVO_SID = 'XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX'
+PLIVO_AUTH_TOKEN = 'YYYYYYYYYYYYYYYYYYYYYYYYYYYYYYYY'
+#Seconds to wait for the answer of the Plivo REST API
+PLIVO_TIMEOUT = 5
+#Concurrent requests, and kept alive connections, per worker
+PLIVO_CONCURRENCY = 4
+#The circuit opens after PLIVO_CIRCUIT_FAILURE consecutive failures,
+#then the originates fail fast during PLIVO_CIRCUIT_RESET seconds
+PLIVO_CIRCUIT_FAILURE = 5
+PLIVO_CIRCUIT_RESET = 30
+
+#The call requests are originated by the originate_worker command instead
+#of the celery tasks, with ORIGINATE_WORKER_CONCURRENCY calls in flight
+ORIGINATE_WORKER = False
+ORIGINATE_WORKER_CONCURRENCY = 1000
+#A call request claimed by an originate worker which died before recording
+#its originate is pending again after ORIGINATE_CLAIM_TIMEOUT seconds
+ORIGINATE_CLAIM_TIMEOUT = 300
+
+#Seconds to wait before sending again a call when the gateways of the
+#campaign are all at their maximum_call
+GATEWAY_SATURATED_DELAY = 10
+
+#The retries of the failed calls wait in the database until they are due,
+#then the campaign pacer sends them before the new calls. The
+#intervalretry of the campaign is multiplied by RETRY_BACKOFF at each
+#attempt, up to RETRY_MAX_DELAY seconds. RETRY_POLICY overrides the
+#maxretry, intervalretry or backoff per hangup cause
+RETRY_BACKOFF = 2
+RETRY_MAX_DELAY = 60 * 60 * 24
+RETRY_POLICY = {
+    #the number can't be reached
+    'UNALLOCATED_NUMBER': {'maxretry': 0},
+    'NO_ROUTE_DESTINATION': {'maxretry': 0},
+    'INVALID_NUMBER_FORMAT': {'maxretry': 0},
+    'NUMBER_CHANGED': {'maxretry': 0},
+    #the subscriber is on the phone, call back soon
+    'USER_BUSY': {'intervalretry': 120, 'backoff': 1.5},
+    #no free line on the network
+    'NORMAL_CIRCUIT_CONGESTION': {'intervalretry': 60},
+}
+
+#The hangupcall webhook only queues the hangups, the hangupcall_batch task
+#records them by HANGUP_QUEUE_FLUSH_EVERY or every
+#HANGUP_QUEUE_FLUSH_INTERVAL seconds. Its worker needs
+#CELERYD_PREFETCH_MULTIPLIER = 0 to buffer the hangups
+HANGUP_QUEUE = False
+HANGUP_QUEUE_FLUSH_EVERY = 200
+HANGUP_QUEUE_FLUSH_INTERVAL = 0.5
+#A hangup which can't be recorded, on a database error, is queued again
+#after HANGUP_QUEUE_RETRY_DELAY seconds, up to HANGUP_QUEUE_MAX_RETRY times
+HANGUP_QUEUE_RETRY_DELAY = 30
+HANGUP_QUEUE_MAX_RETRY = 5
+
+#The bulk store_cdr callback and the ingest_cdr_spool command store the
+#CDRs by CDR_INGEST_BATCH, the CDRs without call request are notified to
+#the superusers at most every CDR_NOT_FOUND_DIGEST_INTERVAL seconds
+CDR_INGEST_BATCH = 1000
+CDR_NOT_FOUND_DIGEST_INTERVAL = 600
+#log-dir of mod_xml_cdr read by the ingest_cdr_spool command
+CDR_SPOOL_DIR = '/var/log/freeswitch/xml_cdr/'
+
+#The reports read the calls per hour and per day counted by the
+#voipcall_rollup task, by chunks of ROLLUP_CHUNK_SIZE CDRs. The CDRs of the
+#last ROLLUP_DELAY seconds are counted on the next run. The IDs missing
+#from a rollup are checked again by the next ones during ROLLUP_GAP_EXPIRE
+#seconds, to count the CDRs of the transactions committed late
+ROLLUP_CHUNK_SIZE = 50000
+ROLLUP_DELAY = 30
+ROLLUP_GAP_EXPIRE = 60 * 60
+
 FS_RECORDING_PATH = '/usr/share/newfies/usermedia/recording/'
 
 #Time to wait between menu / questions in survey
 MENU_TIMEOUT = '5'
 
+#The state of a call in its survey is kept SURVEY_SESSION_MARGIN seconds
+#after the timelimit of the call, SURVEY_SESSION_TIMEOUT without timelimit
+SURVEY_SESSION_MARGIN = 300
+SURVEY_SESSION_TIMEOUT = 21600
+
+#The survey results of a call are stored at its hangup, or by a task when
+#the call holds SURVEY_RESULT_FLUSH_EVERY results or results older than
+#SURVEY_RESULT_FLUSH_INTERVAL seconds, see survey.results
+SURVEY_RESULT_FLUSH_EVERY = 10
+SURVEY_RESULT_FLUSH_INTERVAL = 120
+
 # ADD 'dummy','plivo','twilio'
 NEWFIES_DIALER_ENGINE = 'plivo'
 
@@ -529,6 +615,36 @@ LOGGING = {
 #======
 MAX_CALLS_PER_SECOND = 20  # By default configured to 20 calls per second
 
+# Seconds between two pacing ticks of the running campaigns, on each tick
+# the campaign pacer decides how many calls are sent
+PACING_TICK = 10
+
+# Contacts spooled in campaign subscribers per INSERT ... SELECT
+SPOOL_CHUNK_SIZE = 10000
+
+# Contact ids below the watermark of a phonebook import which each spool
+# reads again, the contacts of a transaction committed after a higher id
+# are spooled if they are within this margin.
+# The missing ids are not tracked: the contacts of an import committed
+# after more than SPOOL_RESCAN_MARGIN newer contacts of the same phonebook
+# are not spooled until they are saved again. Raise it above the size of
+# the contact imports running at the same time on one phonebook.
+SPOOL_RESCAN_MARGIN = 1000
+
+# Directory of the CSV files of the contact imports. The web server writes
+# the uploaded files there, the celery workers read them and write the
+# error files the web server sends back: when they don't run on the same
+# host, this directory has to be on a storage shared by all of them (NFS).
+CONTACT_IMPORT_DIR = APPLICATION_DIR + '/database/contact_import'
+
+# Directory of the compiled Do Not Call store files, one file per user
+DNC_STORE_DIR = APPLICATION_DIR + '/database/dnc'
+
+# Rebuild the DNC store of a user in a background thread when the DNC list
+# changes, the previous store is served meanwhile. Without it, the process
+# which sees the change first rebuilds the store before going on.
+DNC_STORE_BACKGROUND_BUILD = True
+
 
 # Frontend widget values
 CHANNEL_TYPE_VALUE = 1  # 0-Keep original, 1-Mono, 2-Stereo
@@ -13,6 +13,7 @@
 #
 
 from django.utils.translation import ugettext as _
+from django.utils import simplejson as json
 from audiofield.models import AudioFile
 
 
@@ -27,31 +28,17 @@ def field_list(name, user=None):
     return ((l.id, l.name) for l in list)
 
 
-def export_question_result(val, column_question):
-    """Modify survey result string for export"""
-    if not val:
-        return ''
-    val_list = val.split("-|-")
-
-    for i in val_list:
-        if not i:
-            continue
-
-        if i.find("*|**|*") > 0:
-            que_audio = i.split("*|**|*")
-            try:
-                # check audio que
-                if str(column_question) == str(que_audio[0]):
-                    return str(que_audio[1].replace(',', ' '))
-            except:
-                pass
-        else:
-            que_res = i.split("*|*")
-            try:
-                # check normal que
-                if str(column_question) == str(que_res[0]):
-                    return str(que_res[1].replace(',', ' '))
-            except:
-                pass
-
-    return ''
+def call_result_list(result):
+    """Return the [question, response, record_file] of the JSON result of
+    a SurveyCallResult"""
+    if not result:
+        return []
+    return json.loads(result)
+
+
+def call_result_dict(result):
+    """Return the answer per question of the JSON result of a
+    SurveyCallResult, the record file of the recordings"""
+    return dict((question, response or record_file)
+                for question, response, record_file
+                in call_result_list(result))
@@ -0,0 +1,176 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+"""
+Compiled surveys
+
+The questions of a survey, their responses and the RESTXML of each
+question are compiled once in a SurveyGraph, so a step of
+survey_finestatemachine reads no question, response or audio file. The
+graphs are kept per process and compiled again when the survey, one of
+its questions or responses, or an audio file is saved, see
+survey.models.reset_survey_graph.
+"""
+
+from django.conf import settings
+from survey.models import SurveyQuestion, SurveyResponse, \
+                          SURVEY_GRAPH_VERSION_KEY
+from common_functions import VersionedCache
+
+HANGUP_HTML = '<Response><Hangup/></Response>'
+
+
+def render_question(question):
+    """Return the RESTXML of a SurveyQuestion"""
+    #retrieve the basename of the url
+    url = settings.PLIVO_DEFAULT_SURVEY_ANSWER_URL
+    url_basename = '/'.join(url.split('/')[:3])
+
+    audio_file_url = False
+    if question.message_type == 1 and question.audio_message:
+        try:
+            audio_file_url = question.audio_message.audio_file.url
+        except ValueError:
+            # no file
+            audio_file_url = False
+
+    if audio_file_url:
+        #Audio file
+        play = "<Play>%s%s</Play>" % (url_basename, audio_file_url)
+    else:
+        #Text2Speech
+        play = "<Speak>%s</Speak>" % question.question
+
+    #Menu
+    if question.type == 1:
+        return \
+            '<Response>\n' \
+            '   <GetDigits action="%s" method="GET" numDigits="1" ' \
+            'retries="1" validDigits="0123456789" timeout="%s" ' \
+            'finishOnKey="#">\n' \
+            '       %s\n' \
+            '   </GetDigits>\n' \
+            '   <Redirect>%s</Redirect>\n' \
+            '</Response>' % (
+                settings.PLIVO_DEFAULT_SURVEY_ANSWER_URL,
+                settings.MENU_TIMEOUT,
+                play,
+                settings.PLIVO_DEFAULT_SURVEY_ANSWER_URL)
+    #Recording
+    elif question.type == 3:
+        return \
+            '<Response>\n' \
+            '   %s\n' \
+            '   <Record maxLength="120" finishOnKey="*#" action="%s" ' \
+            'method="GET" filePath="%s" timeout="%s"/>' \
+            '</Response>' % (
+                play,
+                settings.PLIVO_DEFAULT_SURVEY_ANSWER_URL,
+                settings.FS_RECORDING_PATH,
+                settings.MENU_TIMEOUT)
+    # Hangup
+    return \
+        '<Response>\n' \
+        '   %s\n' \
+        '   <Hangup />' \
+        '</Response>' % play
+
+
+class SurveyState(object):
+    """A question of a compiled survey
+
+    **Attributes**:
+
+        * ``id`` - SurveyQuestion id
+        * ``question`` - Text of the question, stored with its results
+        * ``type`` - APP_TYPE of the question
+        * ``html`` - RESTXML of the question
+        * ``transition`` - (response value, index of the next state or
+          None) per DTMF, the response value is the keyvalue, or the DTMF
+    """
+    __slots__ = ('id', 'question', 'type', 'html', 'transition')
+
+    def __init__(self, id, question, type, html, transition):
+        self.id = id
+        self.question = question
+        self.type = type
+        self.html = html
+        self.transition = transition
+
+    def next(self, dtmf):
+        """Return the response value of the DTMF and the index of the
+        state it goes to, None for the next question"""
+        return self.transition.get(dtmf, (dtmf, None))
+
+    def ends_call(self):
+        """The state hangs up, it's neither a menu nor a recording"""
+        return self.type not in (1, 3)
+
+
+class SurveyGraph(object):
+    """Questions of a survey in their order, see SurveyState"""
+
+    def __init__(self, state_list):
+        self.state_list = tuple(state_list)
+        self.index = dict((state.id, index)
+                          for index, state in enumerate(self.state_list))
+
+    def __len__(self):
+        return len(self.state_list)
+
+    def __getitem__(self, index):
+        return self.state_list[index]
+
+    def get_state(self, question_id):
+        """Return the state of a question, None if it's not in the graph"""
+        index = self.index.get(question_id)
+        if index is None:
+            return None
+        return self.state_list[index]
+
+
+def load_survey_graph(surveyapp_id):
+    """Compile the questions and the responses of a survey"""
+    question_list = list(SurveyQuestion.objects\
+        .filter(surveyapp=surveyapp_id).select_related('audio_message')\
+        .order_by('order'))
+    index_dict = dict((question.id, index)
+                      for index, question in enumerate(question_list))
+    transition_dict = dict((question.id, {}) for question in question_list)
+    for question_id, key, keyvalue, goto_id in SurveyResponse.objects\
+            .filter(surveyquestion__surveyapp=surveyapp_id)\
+            .values_list('surveyquestion', 'key', 'keyvalue',
+                         'goto_surveyquestion'):
+        if question_id in transition_dict:
+            transition_dict[question_id][key] = (keyvalue or key,
+                                                 index_dict.get(goto_id))
+    return SurveyGraph([SurveyState(question.id,
+                                    question.question,
+                                    question.type,
+                                    render_question(question),
+                                    transition_dict[question.id])
+                        for question in question_list])
+
+
+# Compiled graphs per survey for the running process
+_survey_graph = VersionedCache(SURVEY_GRAPH_VERSION_KEY, load_survey_graph)
+
+
+def get_survey_graph(surveyapp_id):
+    """Return the compiled graph of a survey
+
+    The graph is kept per process and compiled again when the survey is
+    edited, see survey.models.reset_survey_graph.
+    """
+    return _survey_graph.get(surveyapp_id)
@@ -0,0 +1,108 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from optparse import make_option
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.client import RequestFactory
+from django.utils.translation import gettext_lazy as _
+from dialer_cdr.models import Callrequest
+from survey.models import SurveyApp
+from survey.graph import get_survey_graph
+from survey.views import survey_finestatemachine
+from common_functions import bulk_create_chunk
+from time import time
+
+
+class Command(BaseCommand):
+    # Use : benchmark_survey --survey 1 --count 1000
+    help = _("Load test of survey_finestatemachine : new calls of the "
+             "survey, removed at the end, answer each question in turn, "
+             "the first key of the menus and a file to the recordings. "
+             "Report the requests per second and the queries per request "
+             "of each state.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--survey', type='int', dest='survey',
+                    help=_('Survey answered')),
+        make_option('--count', type='int', dest='count', default=1000,
+                    help=_('Number of calls')),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            surveyapp = SurveyApp.objects.get(id=options['survey'])
+        except SurveyApp.DoesNotExist:
+            raise CommandError(_('Can\'t find this Survey : %s' %
+                                 options['survey']))
+        survey_graph = get_survey_graph(surveyapp.id)
+        prefix = 'benchmark-%d-' % int(time() * 1000)
+        uuid_list = ['%s%06d' % (prefix, i) for i in range(options['count'])]
+        content_type = ContentType.objects.get_for_model(SurveyApp)
+        bulk_create_chunk(Callrequest, [
+            Callrequest(status=7, call_type=2, request_uuid=request_uuid,
+                        phone_number='34000000',
+                        content_type_id=content_type.id,
+                        object_id=surveyapp.id,
+                        user_id=surveyapp.user_id)
+            for request_uuid in uuid_list])
+        transaction.commit_unless_managed()
+
+        factory = RequestFactory()
+        # the queries are counted with DEBUG off
+        connection.use_debug_cursor = True
+        print "%-6s %-10s %8s %10s %12s %12s" % ('state', 'type',
+            'requests', 'seconds', 'requests/sec', 'queries/req')
+        try:
+            data = {}
+            index = 0
+            # a goto back to a question would loop
+            for step in range(len(survey_graph)):
+                if index >= len(survey_graph):
+                    break
+                state = survey_graph[index]
+                connection.queries = []
+                start = time()
+                for request_uuid in uuid_list:
+                    data.update(ALegRequestUUID=request_uuid,
+                                CallUUID=request_uuid)
+                    response = survey_finestatemachine(factory.post(
+                        '/survey_finestatemachine/', data))
+                    if response.status_code != 200:
+                        raise CommandError(response.content)
+                elapsed = time() - start
+                print "%-6d %-10s %8d %10.3f %12.0f %12.2f" % (index,
+                    state.type, len(uuid_list), elapsed,
+                    len(uuid_list) / elapsed,
+                    float(len(connection.queries)) / len(uuid_list))
+                transaction.commit_unless_managed()
+                if state.ends_call():
+                    break
+                # the answer of this state, sent with the next request
+                index += 1
+                if state.type == 3:
+                    data = {'RecordFile': '/tmp/benchmark.wav',
+                            'RecordingDuration': '5'}
+                else:
+                    data = {'Digits': '1'}
+                    goto_state = state.next('1')[1]
+                    if goto_state is not None:
+                        index = goto_state
+        finally:
+            connection.use_debug_cursor = None
+            # the results are deleted with their call requests
+            Callrequest.objects.filter(request_uuid__startswith=prefix)\
+                .delete()
+            transaction.commit_unless_managed()
@@ -13,6 +13,7 @@
 #
 
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.utils.translation import ugettext_lazy as _
 from tagging.fields import TagField
 from dialer_campaign.models import Campaign
@@ -20,6 +21,7 @@ from dialer_gateway.models import Gateway
 from dialer_cdr.models import Callrequest
 from audiofield.models import AudioFile
 from adminsortable.models import Sortable
+from common_functions import reset_version
 
 from south.modelsinspector import add_introspection_rules
 add_introspection_rules([], ["^tagging.fields.TagField"])
@@ -235,3 +237,77 @@ class SurveyCampaignResult(models.Model):
 
     def __unicode__(self):
         return '[%s] %s = %s' % (self.id, self.question, self.response)
+
+
+class SurveyCallResult(models.Model):
+    """This gives the survey results of a call
+
+    The results of a call request in survey_campaign_result are kept
+    together, in the order of the answers, so the reports read one row
+    per call instead of concatenating the results of each call.
+
+    **Attributes**:
+
+        * ``callid`` - VoIP Call-ID
+        * ``result`` - JSON list of the [question, response, record_file]
+          of the call, see survey.function_def.call_result_list
+
+    **Relationships**:
+
+        * ``callrequest`` - One to one relationship to the Callrequest
+        * ``campaign`` - Foreign key relationship to the Campaign model
+        * ``surveyapp`` - Foreign key relationship to the SurveyApp model
+
+    **Name of DB table**: survey_call_result
+    """
+    callrequest = models.OneToOneField(Callrequest,
+                    related_name='survey_call_result')
+    campaign = models.ForeignKey(Campaign, null=True, blank=True,
+                    related_name='+', verbose_name=_("Campaign"))
+    surveyapp = models.ForeignKey(SurveyApp, related_name='+')
+    callid = models.CharField(max_length=120, help_text=_("VoIP Call-ID"),
+                    verbose_name=_("Call-ID"))
+    result = models.TextField(blank=True, default='[]',
+                    verbose_name=_("Result"))
+    updated_date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'survey_call_result'
+
+    def __unicode__(self):
+        return '[%s] %s' % (self.id, self.callid)
+
+
+SURVEY_GRAPH_VERSION_KEY = 'survey_graph_version_%s'
+
+
+def reset_survey_graph(sender, **kwargs):
+    """A ``post_save`` and ``post_delete`` signal sent by SurveyApp,
+    SurveyQuestion, SurveyResponse and AudioFile, it invalidates the
+    compiled graph of the surveys in all the processes, see
+    survey.graph.get_survey_graph"""
+    instance = kwargs['instance']
+    if sender == SurveyApp:
+        surveyapp_list = [instance.id]
+    elif sender == SurveyQuestion:
+        surveyapp_list = [instance.surveyapp_id]
+    elif sender == SurveyResponse:
+        # the question is gone when it's deleted with its responses
+        surveyapp_list = SurveyQuestion.objects\
+            .filter(id=instance.surveyquestion_id)\
+            .values_list('surveyapp', flat=True)
+    else:
+        surveyapp_list = SurveyQuestion.objects\
+            .filter(audio_message=instance.id)\
+            .values_list('surveyapp', flat=True).distinct()
+    reset_version([SURVEY_GRAPH_VERSION_KEY % surveyapp_id
+                   for surveyapp_id in surveyapp_list])
+
+post_save.connect(reset_survey_graph, sender=SurveyApp)
+post_save.connect(reset_survey_graph, sender=SurveyQuestion)
+post_save.connect(reset_survey_graph, sender=SurveyResponse)
+post_save.connect(reset_survey_graph, sender=AudioFile)
+post_delete.connect(reset_survey_graph, sender=SurveyApp)
+post_delete.connect(reset_survey_graph, sender=SurveyQuestion)
+post_delete.connect(reset_survey_graph, sender=SurveyResponse)
+post_delete.connect(reset_survey_graph, sender=AudioFile)
@@ -0,0 +1,247 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+"""
+Buffered survey results
+
+survey_finestatemachine doesn't write the results of a call : they are
+kept in the session of the call, written to the cache at each step
+anyway, and inserted together with bulk_create :
+
+    * at the hangup of the call, see api.hangupcall_api, the calls of a
+      batch of hangups together with HANGUP_QUEUE,
+    * by the survey_result_flush task, when a call holds
+      SURVEY_RESULT_FLUSH_EVERY results or results older than
+      SURVEY_RESULT_FLUSH_INTERVAL seconds,
+    * by the survey_session_sweep task, for the calls which hung up
+      without storing their results, or hold results due without a step
+      to hand them, see sweep_survey_session.
+
+The results leave a session once they are committed or handed to the
+task, so a result is stored at least once, and a result already stored
+for its call request and question is skipped. The results of a call are
+added to its SurveyCallResult too, the row read by the reports.
+"""
+
+from django.core.cache import cache
+from django.db import transaction, IntegrityError
+from django.utils import simplejson as json
+from dialer_cdr.models import Callrequest
+from survey.models import SurveyCampaignResult, SurveyCallResult
+from survey.function_def import call_result_list
+from survey.session import SurveySession, SURVEY_SESSION_KEY, \
+                           SURVEY_PENDING_COUNT_KEY, \
+                           SURVEY_PENDING_SLOT_KEY, \
+                           SURVEY_PENDING_SLOT_EXPIRE, \
+                           register_pending_session
+from common_functions import chunk_list, bulk_create_chunk
+from datetime import datetime
+import logging
+
+logger = logging.getLogger('newfies.filelog')
+
+# Attempts to create the SurveyCallResults of the calls, see add_call_result
+CALL_RESULT_ATTEMPT = 3
+
+SURVEY_SWEEP_CURSOR_KEY = 'survey_sweep_cursor'
+SURVEY_SWEEP_LOCK_KEY = 'survey_sweep_lock'
+SURVEY_SWEEP_LOCK_EXPIRE = 60 * 30
+
+
+@transaction.commit_on_success
+def store_survey_result(result_list):
+    """Insert the results of result_list, see SurveySession.add_result,
+    return the number of results inserted
+
+    A result is stored once per call request and question.
+    """
+    stored_set = set()
+    for id_chunk in chunk_list(list(set([result[0]
+                                         for result in result_list]))):
+        stored_set.update(SurveyCampaignResult.objects\
+            .filter(callrequest__in=id_chunk)\
+            .values_list('callrequest', 'question'))
+    new_list = []
+    for callrequest_id, campaign_id, surveyapp_id, callid, question, \
+            response, record_file, recording_duration in result_list:
+        if (callrequest_id, question) in stored_set:
+            continue
+        stored_set.add((callrequest_id, question))
+        new_list.append(SurveyCampaignResult(
+            callrequest_id=callrequest_id,
+            campaign_id=campaign_id,
+            surveyapp_id=surveyapp_id,
+            callid=callid,
+            question=question,
+            response=response,
+            record_file=record_file,
+            recording_duration=recording_duration))
+    bulk_create_chunk(SurveyCampaignResult, new_list)
+    add_call_result(new_list)
+    return len(new_list)
+
+
+def add_call_result(result_list):
+    """Append the SurveyCampaignResults of result_list to the
+    SurveyCallResult of their call request, created for the first ones
+
+    A SurveyCallResult created meanwhile by another flush of the call
+    makes the insert fail, the results are appended to it on the next
+    attempt.
+    """
+    entry_dict = {}
+    for obj in result_list:
+        entry_dict.setdefault(obj.callrequest_id, []).append(obj)
+    for attempt in range(CALL_RESULT_ATTEMPT):
+        append_call_result(entry_dict)
+        if not entry_dict:
+            return
+        sid = transaction.savepoint()
+        try:
+            bulk_create_chunk(SurveyCallResult, [
+                SurveyCallResult(callrequest_id=callrequest_id,
+                                 campaign_id=obj_list[0].campaign_id,
+                                 surveyapp_id=obj_list[0].surveyapp_id,
+                                 callid=obj_list[0].callid,
+                                 result=json.dumps(
+                                    [[obj.question, obj.response,
+                                      obj.record_file]
+                                     for obj in obj_list]))
+                for callrequest_id, obj_list in entry_dict.items()])
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+            if attempt == CALL_RESULT_ATTEMPT - 1:
+                raise
+            continue
+        transaction.savepoint_commit(sid)
+        return
+
+
+def append_call_result(entry_dict):
+    """Append the SurveyCampaignResults of entry_dict, per call request,
+    to the existing SurveyCallResults, and remove them from entry_dict"""
+    for id_chunk in chunk_list(entry_dict.keys()):
+        for call_result in SurveyCallResult.objects.select_for_update()\
+                .filter(callrequest__in=id_chunk).only('id', 'callrequest',
+                                                       'result'):
+            entry_list = call_result_list(call_result.result) + \
+                [[obj.question, obj.response, obj.record_file]
+                 for obj in entry_dict.pop(call_result.callrequest_id)]
+            SurveyCallResult.objects.filter(id=call_result.id)\
+                .update(result=json.dumps(entry_list),
+                        updated_date=datetime.now())
+
+
+def queue_survey_result(session):
+    """Hand the results of the session to the survey_result_flush task
+    when they are due, see SurveySession.flush_due, the session is saved
+    by the caller"""
+    if not session.flush_due():
+        return
+    from survey.tasks import survey_result_flush
+    try:
+        survey_result_flush.delay(session.result_list)
+    except Exception, e:
+        # kept for the next step or the hangup
+        logger.error('Error queue survey results - uuid:%s : %s' % \
+                        (session.call_uuid, e))
+        return
+    session.result_list = []
+    session.result_time = None
+
+
+def flush_survey_session(call_uuid_list):
+    """Store the results of the sessions of the calls, at their hangup,
+    and remove the sessions, return the number of results inserted"""
+    key_list = [SURVEY_SESSION_KEY % call_uuid
+                for call_uuid in call_uuid_list if call_uuid]
+    if not key_list:
+        return 0
+    session_dict = cache.get_many(key_list)
+    result_list = []
+    for key, data in session_dict.items():
+        result_list += SurveySession(None, *data).result_list
+    count = store_survey_result(result_list)
+    # removed after the commit, a failed hangup stores them again
+    cache.delete_many(session_dict.keys())
+    return count
+
+
+def sweep_survey_session(chunk_size=500):
+    """Store the results left in the sessions registered since the last
+    sweep, see register_pending_session, return the number of results
+    inserted or None if a sweep is running
+
+    The session of a call which is not in progress anymore is stored and
+    removed, as at the hangup. The results of a call in progress are
+    stored when they are due, see SurveySession.flush_due, and the
+    session is registered again while it holds results. They stay in the
+    session, which is written by the steps of the call only, and are
+    skipped when they are stored again.
+    """
+    if not cache.add(SURVEY_SWEEP_LOCK_KEY, 'true', SURVEY_SWEEP_LOCK_EXPIRE):
+        return None
+    try:
+        count = cache.get(SURVEY_PENDING_COUNT_KEY) or 0
+        cursor = cache.get(SURVEY_SWEEP_CURSOR_KEY) or 0
+        if cursor > count:
+            # the counter expired and started again
+            cursor = 0
+        call_uuid_set = set()
+        for slot_chunk in chunk_list(range(cursor + 1, count + 1),
+                                     chunk_size):
+            call_uuid_set.update(cache.get_many(
+                [SURVEY_PENDING_SLOT_KEY % slot for slot in slot_chunk])\
+                .values())
+        inserted = 0
+        for uuid_chunk in chunk_list(list(call_uuid_set), chunk_size):
+            inserted += sweep_session_list(uuid_chunk)
+        cache.set(SURVEY_SWEEP_CURSOR_KEY, count, SURVEY_PENDING_SLOT_EXPIRE)
+        return inserted
+    finally:
+        cache.delete(SURVEY_SWEEP_LOCK_KEY)
+
+
+def sweep_session_list(call_uuid_list):
+    """Store the results of the sessions of call_uuid_list, see
+    sweep_survey_session, return the number of results inserted"""
+    session_dict = cache.get_many([SURVEY_SESSION_KEY % call_uuid
+                                   for call_uuid in call_uuid_list])
+    session_list = []
+    for call_uuid in call_uuid_list:
+        data = session_dict.get(SURVEY_SESSION_KEY % call_uuid)
+        if data is None:
+            # stored at the hangup, or expired with its call
+            continue
+        session_list.append(SurveySession(call_uuid, *data))
+    in_progress_set = set(Callrequest.objects\
+        .filter(id__in=[session.callrequest_id for session in session_list],
+                status=8)\
+        .values_list('id', flat=True))  # IN-PROGRESS
+    ended_list = []
+    result_list = []
+    for session in session_list:
+        if session.callrequest_id not in in_progress_set:
+            ended_list.append(session)
+            result_list += session.result_list
+        elif session.flush_due():
+            result_list += session.result_list
+    count = store_survey_result(result_list)
+    # removed after the commit, as at the hangup
+    cache.delete_many([SURVEY_SESSION_KEY % session.call_uuid
+                       for session in ended_list])
+    for session in session_list:
+        if session.callrequest_id in in_progress_set and session.result_list:
+            register_pending_session(session.call_uuid)
+    return count
@@ -0,0 +1,127 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.conf import settings
+from django.core.cache import cache
+from time import time
+
+SURVEY_SESSION_KEY = 'survey_session_%s'
+# Sessions with pending results, numbered by a counter, see
+# register_pending_session
+SURVEY_PENDING_COUNT_KEY = 'survey_pending_count'
+SURVEY_PENDING_COUNT_EXPIRE = 60 * 60 * 24 * 30
+SURVEY_PENDING_SLOT_KEY = 'survey_pending_slot_%s'
+SURVEY_PENDING_SLOT_EXPIRE = 60 * 60 * 24
+
+
+def register_pending_session(call_uuid):
+    """Add the session of a call to the sessions with pending results,
+    read by survey.results.sweep_survey_session"""
+    try:
+        slot = cache.incr(SURVEY_PENDING_COUNT_KEY)
+    except ValueError:
+        cache.add(SURVEY_PENDING_COUNT_KEY, 0, SURVEY_PENDING_COUNT_EXPIRE)
+        slot = cache.incr(SURVEY_PENDING_COUNT_KEY)
+    cache.set(SURVEY_PENDING_SLOT_KEY % slot, call_uuid,
+              SURVEY_PENDING_SLOT_EXPIRE)
+
+
+def session_timeout(timelimit):
+    """Return the seconds a session is kept for a call of timelimit
+    seconds, SURVEY_SESSION_TIMEOUT without timelimit"""
+    if not timelimit:
+        return settings.SURVEY_SESSION_TIMEOUT
+    return timelimit + settings.SURVEY_SESSION_MARGIN
+
+
+class SurveySession(object):
+    """State of a call in its survey
+
+    The session is kept in one cache key as a tuple, it's read and written
+    once per step of survey_finestatemachine. It expires with the call :
+    after its timelimit and SURVEY_SESSION_MARGIN.
+
+    **Attributes**:
+
+        * ``call_uuid`` - CallUUID of the call
+        * ``state`` - Index of the question to play
+        * ``prev_qt`` - SurveyQuestion id of the question played, 0 before
+          the first one
+        * ``callrequest_id``, ``campaign_id``, ``surveyapp_id`` - Call
+          request of the call, its campaign and survey
+        * ``timeout`` - Seconds the session is kept
+        * ``result_list`` - Results of the call not stored yet, see
+          survey.results
+        * ``result_time`` - Time of the oldest of these results
+        * ``pending`` - The session got its first pending result, it's
+          registered when it's saved, see register_pending_session
+    """
+    __slots__ = ('call_uuid', 'state', 'prev_qt', 'callrequest_id',
+                 'campaign_id', 'surveyapp_id', 'timeout', 'result_list',
+                 'result_time', 'pending')
+
+    def __init__(self, call_uuid, state=0, prev_qt=0, callrequest_id=None,
+                 campaign_id=None, surveyapp_id=None, timeout=None,
+                 result_list=None, result_time=None):
+        self.call_uuid = call_uuid
+        self.state = state
+        self.prev_qt = prev_qt
+        self.callrequest_id = callrequest_id
+        self.campaign_id = campaign_id
+        self.surveyapp_id = surveyapp_id
+        self.timeout = timeout or settings.SURVEY_SESSION_TIMEOUT
+        self.result_list = result_list or []
+        self.result_time = result_time
+        self.pending = False
+
+    @classmethod
+    def load(cls, call_uuid):
+        """Return the session of a call, None if it has none"""
+        data = cache.get(SURVEY_SESSION_KEY % call_uuid)
+        if data is None:
+            return None
+        return cls(call_uuid, *data)
+
+    def save(self):
+        cache.set(SURVEY_SESSION_KEY % self.call_uuid,
+                  (self.state, self.prev_qt, self.callrequest_id,
+                   self.campaign_id, self.surveyapp_id, self.timeout,
+                   self.result_list, self.result_time),
+                  self.timeout)
+        if self.pending:
+            register_pending_session(self.call_uuid)
+            self.pending = False
+
+    def add_result(self, question, response='', record_file='',
+                   recording_duration=None):
+        """Keep the result of a question until it's stored"""
+        if not self.result_list:
+            self.result_time = time()
+            self.pending = True
+        self.result_list.append((self.callrequest_id, self.campaign_id,
+                                 self.surveyapp_id, self.call_uuid,
+                                 question, response, record_file,
+                                 recording_duration))
+
+    def flush_due(self):
+        """Return True when the results kept are SURVEY_RESULT_FLUSH_EVERY,
+        or older than SURVEY_RESULT_FLUSH_INTERVAL seconds"""
+        if not self.result_list:
+            return False
+        return len(self.result_list) >= settings.SURVEY_RESULT_FLUSH_EVERY \
+            or time() - self.result_time >= \
+                settings.SURVEY_RESULT_FLUSH_INTERVAL
+
+    def delete(self):
+        cache.delete(SURVEY_SESSION_KEY % self.call_uuid)
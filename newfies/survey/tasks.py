@@ -0,0 +1,56 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2012 Star2Billing S.L.
+#
+# The Initial Developer of the Original Code is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from celery.task import PeriodicTask
+from celery.decorators import task
+from survey.results import store_survey_result, sweep_survey_session
+from datetime import timedelta
+
+
+@task(default_retry_delay=10, max_retries=5)
+def survey_result_flush(result_list):
+    """This task stores the results handed by survey_finestatemachine, see
+    survey.results
+
+    **Attributes**:
+
+        * ``result_list`` - Results of a call, see SurveySession.add_result
+    """
+    logger = survey_result_flush.get_logger()
+    try:
+        count = store_survey_result(result_list)
+    except Exception, exc:
+        # the results are only in the message, they are not lost
+        survey_result_flush.retry(exc=exc)
+    logger.info("TASK :: survey_result_flush - %d results" % count)
+
+
+class survey_session_sweep(PeriodicTask):
+    """A periodic task that stores the survey results left in the sessions
+    of the calls, see survey.results.sweep_survey_session
+
+    **Usage**:
+
+        survey_session_sweep.delay()
+    """
+    run_every = timedelta(seconds=60)
+
+    def run(self, **kwargs):
+        logger = self.get_logger()
+        count = sweep_survey_session()
+        if count is None:
+            logger.info("TASK :: survey_session_sweep - already running")
+            return False
+        logger.info("TASK :: survey_session_sweep - %d results" % count)
+        return True
@@ -18,27 +18,32 @@ from django.contrib.sites.models import Site
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponseRedirect, HttpResponse
 from django.shortcuts import render_to_response
-from django.db.models import Sum, Avg, Count
+from django.db.models import Count
 from django.template.context import RequestContext
 from django.utils.translation import ugettext as _
 from django.utils import simplejson
+from django.utils.encoding import smart_str
 from django.views.decorators.csrf import csrf_exempt
-from django.core.cache import cache
 from dialer_campaign.models import Campaign
 from dialer_campaign.views import notice_count, update_style, \
                         delete_style, grid_common_function
 from survey.models import SurveyApp, SurveyQuestion, \
-                        SurveyResponse, SurveyCampaignResult
+                        SurveyResponse, SurveyCampaignResult, \
+                        SurveyCallResult
 from survey.forms import SurveyForm, \
                         SurveyQuestionForm, \
                         SurveyResponseForm, \
                         SurveyDetailReportForm
-from survey.function_def import export_question_result
+from survey.function_def import call_result_dict
+from survey.graph import get_survey_graph, HANGUP_HTML
+from survey.session import SurveySession, session_timeout
+from survey.results import queue_survey_result
 from dialer_cdr.models import Callrequest, VoIPCall
+from dialer_cdr.rollup import voipcall_daily_report
 from common.common_functions import variable_value, current_view
+from common_functions import iter_values_chunk, csv_stream
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-import csv
 import os.path
 
 
@@ -48,9 +53,12 @@ def survey_finestatemachine(request):
 
     **Model**: SurveyQuestion
 
+    The questions are read from the compiled graph of the survey, see
+    survey.graph, and the state of the call from its session, see
+    survey.session. The results are kept in the session and stored
+    together, see survey.results.
     """
     current_state = None
-    next_state = None
     testdebug = False
     delcache = False
 
@@ -80,57 +88,40 @@ def survey_finestatemachine(request):
                 content="Error : missing parameter ALegRequestUUID",
                 status=400)
 
-    #Create the keys to store the cache
-    key_state = "%s_state" % opt_CallUUID
-    key_prev_qt = "%s_prev_qt" % opt_CallUUID  # Previous question
-    key_surveyapp = "%s_surveyapp_id" % opt_CallUUID
-
     if testdebug and delcache:
-        cache.delete(key_state)
-        cache.delete(key_surveyapp)
-
-    #Retrieve the values of the keys
-    current_state = cache.get(key_state)
-    surveyapp_id = cache.get(key_surveyapp)
-    obj_prev_qt = False
-
-    if not current_state:
-        cache.set(key_state, 0, 21600)  # 21600 seconds = 6 hours
-        cache.set(key_prev_qt, 0, 21600)  # 21600 seconds = 6 hours
-        current_state = 0
-    else:
-        prev_qt = cache.get(key_prev_qt)
-        if prev_qt:
-            #print "\nPREVIOUS QUESTION ::> %d" % prev_qt
-            #Get previous Question
-            try:
-                obj_prev_qt = SurveyQuestion.objects.get(id=prev_qt)
-            except:
-                obj_prev_qt = False
-    try:
-        obj_callrequest = Callrequest.objects\
-                .get(request_uuid=opt_ALegRequestUUID)
-    except:
-        return HttpResponse(
-            content="Error : retrieving Callrequest with the ALegRequestUUID",
-            status=400)
-
-    surveyapp_id = obj_callrequest.object_id
-    cache.set(key_surveyapp, surveyapp_id, 21600)  # 21600 seconds = 6 hours
-
-    if current_state == 0:
+        SurveySession(opt_CallUUID).delete()
+
+    #Retrieve the state of the call
+    session = SurveySession.load(opt_CallUUID)
+    if not session or not session.state:
+        callrequest_data = Callrequest.objects\
+            .filter(request_uuid=opt_ALegRequestUUID)\
+            .values_list('id', 'campaign', 'object_id', 'timelimit')
+        if not callrequest_data:
+            return HttpResponse(
+                content="Error : retrieving Callrequest with the " \
+                        "ALegRequestUUID",
+                status=400)
+        callrequest_id, campaign_id, surveyapp_id, timelimit = \
+            callrequest_data[0]
+        session = SurveySession(opt_CallUUID,
+                                callrequest_id=callrequest_id,
+                                campaign_id=campaign_id,
+                                surveyapp_id=surveyapp_id,
+                                timeout=session_timeout(timelimit),
+                                result_list=session and session.result_list)
         #TODO : use constant
-        obj_callrequest.status = 8  # IN-PROGRESS
-        obj_callrequest.aleg_uuid = opt_CallUUID
-        obj_callrequest.save()
+        Callrequest.objects.filter(id=callrequest_id)\
+            .update(status=8, aleg_uuid=opt_CallUUID)  # IN-PROGRESS
+    current_state = session.state
 
     #print "current_state = %s" % str(current_state)
 
-    #Load the questions
-    list_question = SurveyQuestion.objects\
-                        .filter(surveyapp=surveyapp_id).order_by('order')
+    #Load the questions, compiled with their responses
+    survey_graph = get_survey_graph(session.surveyapp_id)
+    prev_state = current_state and survey_graph.get_state(session.prev_qt)
 
-    if obj_prev_qt and obj_prev_qt.type == 3:
+    if prev_state and prev_state.type == 3:
         #Previous Recording
         if testdebug:
             RecordFile = request.GET.get('RecordFile')
@@ -142,130 +133,34 @@ def survey_finestatemachine(request):
             RecordFile = os.path.split(RecordFile)[1]
         except:
             RecordFile = ''
-        new_surveycampaignresult = SurveyCampaignResult(
-                campaign=obj_callrequest.campaign,
-                surveyapp_id=surveyapp_id,
-                callid=opt_CallUUID,
-                question=obj_prev_qt,
-                record_file=RecordFile,
-                recording_duration=RecordingDuration,
-                callrequest=obj_callrequest)
-        new_surveycampaignresult.save()
+        session.add_result(prev_state.question, record_file=RecordFile,
+                           recording_duration=RecordingDuration)
     #Check if we receive a DTMF for the previous question then store the result
-    elif DTMF and len(DTMF) > 0 and current_state > 0:
-        #find the response for this key pressed
-        try:
-            #Get list of responses of the previous Question
-            surveyresponse = SurveyResponse.objects.get(
-                            key=DTMF,
-                            surveyquestion=obj_prev_qt)
-            if not surveyresponse or not surveyresponse.keyvalue:
-                response_value = DTMF
-            else:
-                response_value = surveyresponse.keyvalue
-
-            #if there is a response for this DTMF then reset the current_state
-            if surveyresponse and surveyresponse.goto_surveyquestion:
-                l = 0
-                for question in list_question:
-                    if question.id == surveyresponse.goto_surveyquestion.id:
-                        current_state = l
-                        #print "Found it (%d) (l=%d)!" % (question.id, l)
-                        break
-                    l = l + 1
-        except:
-            #It's possible that this response is not accepted
-            response_value = DTMF
-        try:
-            new_surveycampaignresult = SurveyCampaignResult(
-                    campaign=obj_callrequest.campaign,
-                    surveyapp_id=surveyapp_id,
-                    callid=opt_CallUUID,
-                    question=obj_prev_qt,
-                    response=response_value,
-                    callrequest=obj_callrequest)
-            new_surveycampaignresult.save()
-
-        except IndexError:
-            # error index
-            html = '<Response><Hangup/></Response>'
-            return HttpResponse(html)
-
-    #Transition go to next state
-    next_state = current_state + 1
-
-    cache.set(key_state, next_state, 21600)
-    #print "Saved state in Cache (%s = %s)" % (key_state, next_state)
+    elif DTMF and len(DTMF) > 0 and current_state > 0 and prev_state:
+        #find the response for this key pressed, it's possible that this
+        #response is not accepted
+        response_value, goto_state = prev_state.next(DTMF)
+        #if there is a response for this DTMF then reset the current_state
+        if goto_state is not None:
+            current_state = goto_state
+        session.add_result(prev_state.question, response=response_value)
 
-    try:
-        list_question[current_state]
-        #set previous question
-        prev_qt = list_question[current_state].id
-        cache.set(key_prev_qt, prev_qt, 21600)
-    except IndexError:
-        html = '<Response><Hangup/></Response>'
-        return HttpResponse(html)
-
-    #retrieve the basename of the url
-    url = settings.PLIVO_DEFAULT_SURVEY_ANSWER_URL
-    slashparts = url.split('/')
-    url_basename = '/'.join(slashparts[:3])
-
-    audio_file_url = False
-    if list_question[current_state].message_type == 1:
-        try:
-            audio_file_url = list_question[current_state]\
-                                    .audio_message.audio_file.url
-        except:
-            audio_file_url = False
+    #the results are stored later, see survey.results
+    queue_survey_result(session)
 
-    if audio_file_url:
-        #Audio file
-        question = "<Play>%s%s</Play>" % (
-                    url_basename,
-                    list_question[current_state].audio_message.audio_file.url)
-    else:
-        #Text2Speech
-        question = "<Speak>%s</Speak>" % list_question[current_state].question
-
-    #Menu
-    if list_question[current_state].type == 1:
-        html = \
-            '<Response>\n' \
-            '   <GetDigits action="%s" method="GET" numDigits="1" ' \
-            'retries="1" validDigits="0123456789" timeout="%s" ' \
-            'finishOnKey="#">\n' \
-            '       %s\n' \
-            '   </GetDigits>\n' \
-            '   <Redirect>%s</Redirect>\n' \
-            '</Response>' % (
-                settings.PLIVO_DEFAULT_SURVEY_ANSWER_URL,
-                settings.MENU_TIMEOUT,
-                question,
-                settings.PLIVO_DEFAULT_SURVEY_ANSWER_URL)
-    #Recording
-    elif list_question[current_state].type == 3:
-        html = \
-            '<Response>\n' \
-            '   %s\n' \
-            '   <Record maxLength="120" finishOnKey="*#" action="%s" ' \
-            'method="GET" filePath="%s" timeout="%s"/>' \
-            '</Response>' % (
-                question,
-                settings.PLIVO_DEFAULT_SURVEY_ANSWER_URL,
-                settings.FS_RECORDING_PATH,
-                settings.MENU_TIMEOUT)
-    # Hangup
-    else:
-        html = \
-            '<Response>\n' \
-            '   %s\n' \
-            '   <Hangup />' \
-            '</Response>' % (question)
-        next_state = current_state
-        cache.set(key_state, next_state, 21600)
+    if current_state >= len(survey_graph):
+        session.save()
+        return HttpResponse(HANGUP_HTML)
+    state = survey_graph[current_state]
+
+    #Transition go to next state, set previous question
+    session.state = current_state + 1
+    if state.ends_call():
+        session.state = current_state
+    session.prev_qt = state.id
+    session.save()
 
-    return HttpResponse(html)
+    return HttpResponse(state.html)
 
 
 @login_required
@@ -685,51 +580,9 @@ def survey_change(request, object_id):
         context_instance=RequestContext(request))
 
 
-def survey_cdr_daily_report(kwargs, from_query, select_group_query):
-    """Get survey voip call daily report"""
-    max_duration = 0
-    total_duration = 0
-    total_calls = 0
-    total_avg_duration = 0
-
-    # Daily Survey VoIP call report
-    select_data =\
-        {"starting_date": "SUBSTR(CAST(starting_date as CHAR(30)),1,10)"}
-
-    # Get Total from VoIPCall table for Daily Call Report
-    total_data = VoIPCall.objects.extra(select=select_data)\
-        .values('starting_date')\
-        .filter(**kwargs).annotate(Count('starting_date'))\
-        .annotate(Sum('duration'))\
-        .annotate(Avg('duration'))\
-        .order_by('-starting_date')\
-        .extra(
-            select={
-                'question_response': select_group_query + from_query,
-                },
-        )
-
-    # Following code will count total voip calls, duration
-    if total_data.count() != 0:
-        max_duration =\
-            max([x['duration__sum'] for x in total_data])
-        total_duration =\
-            sum([x['duration__sum'] for x in total_data])
-        total_calls =\
-            sum([x['starting_date__count'] for x in total_data])
-        total_avg_duration =\
-            (sum([x['duration__avg']\
-                for x in total_data])) / total_data.count()
-
-    survey_cdr_daily_data = {
-        'total_data': total_data,
-        'total_duration': total_duration,
-        'total_calls': total_calls,
-        'total_avg_duration': total_avg_duration,
-        'max_duration': max_duration,
-        }
-
-    return survey_cdr_daily_data
+def survey_cdr_daily_report(kwargs):
+    """Get survey voip call daily report, from the rollups"""
+    return voipcall_daily_report(kwargs)
 
 
 def get_survey_result(survey_result_kwargs):
@@ -797,7 +650,7 @@ def survey_report(request):
             request.session['session_from_date'] = ''
             request.session['session_to_date'] = ''
             request.session['session_campaign_id'] = ''
-            request.session['session_surveycalls'] = ''
+            request.session['session_surveycall_kwargs'] = {}
             request.session['session_survey_result'] = ''
             request.session['session_survey_cdr_daily_data'] = {}
 
@@ -847,7 +700,7 @@ def survey_report(request):
         request.session['session_from_date'] = from_date
         request.session['session_to_date'] = to_date
         request.session['session_campaign_id'] = ''
-        request.session['session_surveycalls'] = ''
+        request.session['session_surveycall_kwargs'] = {}
         request.session['session_survey_result'] = ''
         request.session['session_search_tag'] = search_tag
 
@@ -904,32 +757,32 @@ def survey_report(request):
             else:
                 col_name_with_order['sort_field'] = sort_field
 
-        # List of Survey VoIP call report
-        from_query =\
-            'FROM survey_surveycampaignresult '\
-            'WHERE survey_surveycampaignresult.callrequest_id = '\
-            'dialer_callrequest.id '
-        select_group_query = 'SELECT group_concat(CONCAT_WS("*|*", question, response, record_file) SEPARATOR "-|-") '
-
+        # List of Survey VoIP call report, the results of each call are
+        # read from its SurveyCallResult
         rows = VoIPCall.objects\
                 .only('starting_date', 'phone_number', 'duration', 'disposition')\
                 .filter(**kwargs)\
                 .extra(
                     select={
-                        'question_response': select_group_query + from_query
+                        'question_response':
+                            'SELECT result FROM survey_call_result '
+                            'WHERE survey_call_result.callrequest_id = '
+                            'dialer_cdr.callrequest_id'
                         },
                 ).order_by(sort_field)
 
-        request.session['session_surveycalls'] = rows
+        # the filters of the calls are kept for the export, not the calls
+        surveycall_kwargs = dict(kwargs)
+        del surveycall_kwargs['user']
+        surveycall_kwargs['callrequest__campaign'] = campaign_obj.id
+        request.session['session_surveycall_kwargs'] = surveycall_kwargs
 
         # Get daily report from session while using pagination & sorting
         if request.GET.get('page') or request.GET.get('sort_by'):
             survey_cdr_daily_data = \
                 request.session['session_survey_cdr_daily_data']
         else:
-            survey_cdr_daily_data = survey_cdr_daily_report(kwargs,
-                                                            from_query,
-                                                    select_group_query)
+            survey_cdr_daily_data = survey_cdr_daily_report(kwargs)
             request.session['session_survey_cdr_daily_data'] = \
                 survey_cdr_daily_data
     except:
@@ -972,45 +825,46 @@ def export_surveycall_report(request):
 
     **Important variable**:
 
-        * ``request.session['surveycall_record_qs']`` - stores survey voipcall
-            query set
+        * ``request.session['session_surveycall_kwargs']`` - stores the
+            filters of the survey voipcalls
 
     **Exported fields**: ['starting_date', 'phone_number', 'duration',
                           'disposition', 'survey results']
-    """
-
-    # get the response object, this can be used as a stream.
-    response = HttpResponse(mimetype='text/csv')
-    # force download.
-    response['Content-Disposition'] = 'attachment;filename=export.csv'
-    # the csv writer
-    writer = csv.writer(response)
-
-    qs = request.session['session_surveycalls']
 
+    The calls are read by chunks, with the results of a chunk in one query,
+    and the CSV is streamed as it's written.
+    """
+    kwargs = dict(request.session.get('session_surveycall_kwargs') or {})
+    kwargs['user'] = request.user
     campaign_id = request.session['session_campaign_id']
-    campaign_obj = Campaign.objects.get(pk=campaign_id)
+    campaign_obj = Campaign.objects.get(pk=campaign_id, user=request.user)
+    kwargs['callrequest__campaign'] = campaign_obj.id
     column_list = ['starting_date', 'destination', 'duration',
                    'disposition']
 
+    question_list = []
     if str(campaign_obj.content_type) == 'Survey':
-        survey_que = SurveyQuestion.objects\
-                .filter(surveyapp_id=int(campaign_obj.object_id))
-        for i in survey_que:
-            column_list.append(str(i.question.replace(',', ' ')))
-
-    writer.writerow(column_list)
-    for i in qs:
-        result_row_list = [
-                            i.starting_date,
-                            i.phone_number,
-                            i.duration,
-                            i.disposition,
-                          ]
-
-        for que in survey_que:
-            result_row_list.append(
-                export_question_result(str(i.question_response),
-                                       str(que.question)))
-        writer.writerow(result_row_list)
+        question_list = list(SurveyQuestion.objects\
+                .filter(surveyapp_id=int(campaign_obj.object_id))\
+                .values_list('question', flat=True))
+        for question in question_list:
+            column_list.append(smart_str(question.replace(',', ' ')))
+
+    def surveycall_row_iter():
+        for chunk in iter_values_chunk(VoIPCall.objects.filter(**kwargs),
+                ['starting_date', 'phone_number', 'duration', 'disposition',
+                 'callrequest']):
+            result_dict = dict(SurveyCallResult.objects\
+                .filter(callrequest__in=set([row[4] for row in chunk]))\
+                .values_list('callrequest', 'result'))
+            for row in chunk:
+                answer_dict = call_result_dict(result_dict.get(row[4]))
+                yield list(row[:4]) + [
+                    smart_str(answer_dict.get(question, '')).replace(',', ' ')
+                    for question in question_list]
+
+    response = HttpResponse(csv_stream(column_list, surveycall_row_iter()),
+                            mimetype='text/csv')
+    # force download.
+    response['Content-Disposition'] = 'attachment;filename=export.csv'
     return response
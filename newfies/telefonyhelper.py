@@ -11,78 +11,611 @@
 # The Initial Developer of the Original Code is
 # Arezqui Belaid <info@star2billing.com>
 #
-import plivohelper
 
-REST_API_URL = 'http://127.0.0.1:8088'
-API_VERSION = 'v0.1'
+"""
+Plivo REST client
 
-# Sid and AuthToken
-SID = 'XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX'
-AUTH_TOKEN = 'YYYYYYYYYYYYYYYYYYYYYYYYYYYYYYYY'
+The originates of a worker go through one PlivoClient, which keeps its
+HTTP/1.1 connections alive and shares them between the calls instead of
+opening a connection per call. A batch of originates is sent in one
+request to the BulkCall endpoint of Plivo, or in parallel requests to the
+Call endpoint when the server doesn't provide it.
 
+A slow or down media server opens the circuit of the client : after
+PLIVO_CIRCUIT_FAILURE consecutive failures, the originates fail at once
+during PLIVO_CIRCUIT_RESET seconds instead of waiting for the timeout,
+then one request is let through to probe the server.
+"""
 
-def call_plivo(callerid=None, phone_number=None, Gateways=None,
-               GatewayCodecs="'PCMA,PCMU'", GatewayTimeouts="60",
-               GatewayRetries='1', ExtraDialString=None,
-               AnswerUrl=None, HangupUrl=None, TimeLimit="3600"):
-    # URL of the Plivo REST service
+from django.conf import settings
+from django.utils import simplejson as json
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+from Queue import Queue, Empty, Full
+from urlparse import urlparse
+from time import time, sleep
+import asyncore
+import base64
+import errno
+import httplib
+import os
+import socket
+import sys
+import urllib
 
-    # Define Channel Variable -
-    # http://wiki.freeswitch.org/wiki/Channel_Variables
-    extra_dial_string = "bridge_early_media=true,hangup_after_bridge=true"
-    if len(ExtraDialString) > 0:
-        extra_dial_string = extra_dial_string + ',' + ExtraDialString
+# Channel variables added to the originates
+# http://wiki.freeswitch.org/wiki/Channel_Variables
+EXTRA_DIAL_STRING = "bridge_early_media=true,hangup_after_bridge=true"
 
-    if not phone_number:
-        print "Error : Phone Number needs to be defined!"
-        return False
+# Separator of the originates in a BulkCall request
+BULK_DELIMITER = '>'
+# Parameters of a BulkCall which are given for each originate, the others
+# are shared by all the originates of the request
+BULK_PARAM = ('To', 'Gateways', 'GatewayCodecs', 'GatewayTimeouts',
+              'GatewayRetries')
+
+# PlivoClient per process id, the connections are not shared by a fork
+_plivo_client = {}
+
+
+class PlivoError(Exception):
+    """The Plivo REST API failed or refused a request"""
 
-    if not callerid:
-        callerid = '8888888888'
+    def __init__(self, message, status=None):
+        Exception.__init__(self, message)
+        self.status = status
 
-    if not GatewayCodecs:
-        GatewayCodecs = "'PCMA,PCMU'"
 
-    if not GatewayTimeouts:
-        GatewayTimeouts = "1800"
+class CircuitOpen(PlivoError):
+    """The media server is failing, the request is not sent"""
 
-    if not GatewayRetries:
-        GatewayRetries = "1"
 
-    if not TimeLimit:
-        TimeLimit = "3600"
+def plivo_call_params(callerid=None, phone_number=None, Gateways=None,
+                      GatewayCodecs="'PCMA,PCMU'", GatewayTimeouts="60",
+                      GatewayRetries='1', ExtraDialString=None,
+                      AnswerUrl=None, HangupUrl=None, TimeLimit="3600"):
+    """Return the parameters of the Call endpoint for an originate"""
+    if not phone_number:
+        raise PlivoError('Phone Number needs to be defined!')
 
-    # Create a REST object
-    plivo = plivohelper.REST(REST_API_URL, SID, AUTH_TOKEN, API_VERSION)
+    extra_dial_string = EXTRA_DIAL_STRING
+    if ExtraDialString:
+        extra_dial_string = extra_dial_string + ',' + ExtraDialString
 
-    # Initiate a new outbound call to user/1000 using a HTTP POST
-    call_params = {
-        'From': callerid,  # Caller Id
+    return {
+        'From': callerid or '8888888888',  # Caller Id
         'To': phone_number,  # User Number to Call
-        'Gateways': Gateways,  # Gateway string to try dialing separated by comma. First in list will be tried first
-        'GatewayCodecs': GatewayCodecs,  # Codec string as needed by FS for each gateway separated by comma
-        'GatewayTimeouts': GatewayTimeouts,  # Seconds to timeout in string for each gateway separated by comma
-        'GatewayRetries': GatewayRetries,  # Retry String for Gateways separated by comma, on how many times each gateway should be retried
+        # Gateway string to try dialing separated by comma.
+        # First in list will be tried first
+        'Gateways': Gateways,
+        # Codec string as needed by FS for each gateway separated by comma
+        'GatewayCodecs': GatewayCodecs or "'PCMA,PCMU'",
+        # Seconds to timeout in string for each gateway separated by comma
+        'GatewayTimeouts': GatewayTimeouts or "1800",
+        # Retry String for Gateways separated by comma,
+        # on how many times each gateway should be retried
+        'GatewayRetries': GatewayRetries or "1",
         'ExtraDialString': extra_dial_string,
-        #TODO : Remove this
-        #'AnswerUrl': 'http://localhost/~areski/django/MyProjects/plivohelper-php/examples/test.php',
-        #'AnswerUrl': 'http://192.168.1.11:8000/api/dialer_cdr/answercall/',
         'AnswerUrl': AnswerUrl,
         'HangupUrl': HangupUrl,
         #TODO : Fix TimeLimit on Plivo
         #'TimeLimit': TimeLimit,
     }
 
-    print call_params
 
-    #Perform the Call on the Rest API
-    try:
-        result = plivo.call(call_params)
-        if result:
-            print "RESULT FROM PLIVO HELPER : " + result['RequestUUID']
-            return result
-    except Exception, e:
-        print e
-        raise
+def is_stale_connection(error):
+    """True if a kept alive connection was closed by the server while idle,
+    the request was not received and can be sent again"""
+    if isinstance(error, httplib.BadStatusLine):
+        return True
+    return isinstance(error, socket.error) \
+        and not isinstance(error, socket.timeout) \
+        and error.errno in (errno.ECONNRESET, errno.EPIPE)
+
+
+class PlivoClient(object):
+    """Client of the Plivo REST API, shared by the originates of a worker
+
+    **Attributes**:
+
+        * ``url`` - URL of the Plivo REST API
+        * ``auth_id`` / ``auth_token`` - Plivo SID and AuthToken
+        * ``timeout`` - Seconds to wait for a connection or an answer
+        * ``concurrency`` - Parallel requests, and connections kept alive
+        * ``failure_threshold`` - Consecutive failures opening the circuit
+        * ``reset_timeout`` - Seconds the circuit stays open
+    """
+
+    def __init__(self, url, auth_id='', auth_token='', api_version='v0.1',
+                 timeout=5, concurrency=4, failure_threshold=5,
+                 reset_timeout=30):
+        parsed_url = urlparse(url)
+        if parsed_url.scheme == 'https':
+            self.connection_class = httplib.HTTPSConnection
+        else:
+            self.connection_class = httplib.HTTPConnection
+        self.host = parsed_url.netloc
+        self.path = parsed_url.path.rstrip('/') + '/' + api_version
+        self.headers = {
+            'Authorization': 'Basic %s' % \
+                base64.b64encode('%s:%s' % (auth_id, auth_token)),
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Connection': 'keep-alive',
+        }
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.bulk_supported = True
+        self.idle = Queue(concurrency)
+        self.lock = Lock()
+        self.failure = 0
+        self.open_until = 0
+        self.connection_count = 0
+        self.pool = None
+
+    def check_circuit(self):
+        """Raise CircuitOpen while the media server is failing"""
+        self.lock.acquire()
+        try:
+            if self.failure < self.failure_threshold:
+                return
+            now = time()
+            if now < self.open_until:
+                raise CircuitOpen('Plivo is failing, circuit open for %ds' % \
+                                    (self.open_until - now))
+            # this request probes the server, the others still fail fast
+            self.open_until = now + self.reset_timeout
+        finally:
+            self.lock.release()
+
+    def record(self, success):
+        """Count the consecutive failures, open the circuit at the threshold"""
+        self.lock.acquire()
+        try:
+            if success:
+                self.failure = 0
+            else:
+                self.failure += 1
+                if self.failure >= self.failure_threshold:
+                    self.open_until = time() + self.reset_timeout
+        finally:
+            self.lock.release()
+
+    def get_connection(self):
+        """Return an idle connection, or a new one, and if it was reused"""
+        try:
+            return self.idle.get_nowait(), True
+        except Empty:
+            self.lock.acquire()
+            self.connection_count += 1
+            self.lock.release()
+            return self.connection_class(self.host, timeout=self.timeout), \
+                   False
+
+    def put_connection(self, connection):
+        """Keep a connection alive for the next request"""
+        try:
+            self.idle.put_nowait(connection)
+        except Full:
+            connection.close()
+
+    def close(self):
+        """Close the idle connections"""
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except Empty:
+                break
+
+    def request(self, endpoint, params):
+        """POST the parameters to an endpoint of the API, return the
+        decoded answer, raise PlivoError on failure"""
+        self.check_circuit()
+        body = self.encode(params)
+        path = '%s/%s/' % (self.path, endpoint)
+        while True:
+            connection, reused = self.get_connection()
+            try:
+                if connection.sock is None:
+                    connection.connect()
+                    # small requests, don't wait for the delayed ACKs
+                    connection.sock.setsockopt(socket.IPPROTO_TCP,
+                                               socket.TCP_NODELAY, 1)
+                connection.request('POST', path, body, self.headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error), e:
+                connection.close()
+                if reused and is_stale_connection(e):
+                    continue
+                self.record(False)
+                raise PlivoError('%s : %s' % (endpoint, e or repr(e)))
+            break
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.put_connection(connection)
+        return self.read_answer(endpoint, response.status, data)
+
+    def encode(self, params):
+        """Body of a request, the parameters without value are left out"""
+        return urllib.urlencode(dict(
+            [(name, unicode(value).encode('utf-8'))
+             for name, value in params.items() if value is not None]))
+
+    def read_answer(self, endpoint, status, data):
+        """Decode the answer of the API, count the failures of the server"""
+        if status >= 500:
+            self.record(False)
+        else:
+            self.record(True)
+        if status >= 300:
+            raise PlivoError('%s : HTTP %d' % (endpoint, status), status)
+        try:
+            return json.loads(data)
+        except ValueError:
+            raise PlivoError('%s : invalid answer %r' % (endpoint, data[:80]))
+
+    def read_call(self, result):
+        """Check the answer of the Call endpoint"""
+        if not result.get('Success'):
+            raise PlivoError(result.get('Message', 'Call failed'))
+        return result
+
+    def call(self, call_params):
+        """Originate a call, return the answer of Plivo with its
+        RequestUUID"""
+        return self.read_call(self.request('Call', call_params))
+
+    def call_result(self, call_params):
+        """Originate a call, return its RequestUUID or its PlivoError"""
+        try:
+            return self.call(call_params)['RequestUUID']
+        except PlivoError, e:
+            return e
+
+    def call_many(self, call_params_list):
+        """Originate the calls in parallel requests to the Call endpoint,
+        return the RequestUUID or the PlivoError of each call"""
+        if len(call_params_list) == 1 or self.concurrency <= 1:
+            return map(self.call_result, call_params_list)
+        if self.pool is None:
+            self.pool = ThreadPool(self.concurrency)
+        return self.pool.map(self.call_result, call_params_list)
+
+    def bulk_request(self, call_params_list):
+        """Originate the calls in one BulkCall request, return the
+        RequestUUID or the PlivoError of each call, or None if the server
+        doesn't provide BulkCall"""
+        params = dict(call_params_list[0])
+        params['Delimiter'] = BULK_DELIMITER
+        for name in BULK_PARAM:
+            params[name] = BULK_DELIMITER.join(
+                [unicode(call_params.get(name) or '')
+                 for call_params in call_params_list])
+        try:
+            result = self.request('BulkCall', params)
+        except PlivoError, e:
+            if e.status in (404, 405):
+                self.bulk_supported = False
+                return None
+            return [e] * len(call_params_list)
+
+        uuid_list = result.get('RequestUUID') or []
+        if not result.get('Success') \
+            or len(uuid_list) != len(call_params_list):
+            error = PlivoError(result.get('Message', 'BulkCall failed'))
+            return [error] * len(call_params_list)
+        return uuid_list
+
+    def bulk_call(self, call_params_list):
+        """Originate a list of calls, return the RequestUUID or the
+        PlivoError of each call, in the order of the list
+
+        The calls sharing their callerid, urls and dial string are sent in
+        one BulkCall request.
+        """
+        result_list = [None] * len(call_params_list)
+        group_dict = {}
+        for index, call_params in enumerate(call_params_list):
+            shared = tuple(sorted([(name, value)
+                for name, value in call_params.items()
+                if name not in BULK_PARAM]))
+            group_dict.setdefault(shared, []).append(index)
+
+        for index_list in group_dict.values():
+            group = [call_params_list[index] for index in index_list]
+            group_result = None
+            if self.bulk_supported and len(group) > 1:
+                group_result = self.bulk_request(group)
+            if group_result is None:
+                group_result = self.call_many(group)
+            for index, result in zip(index_list, group_result):
+                result_list[index] = result
+        return result_list
+
+
+def read_chunked(body):
+    """Return the data of a body sent with the chunked transfer encoding,
+    None while it's not received in full"""
+    data_list = []
+    offset = 0
+    while True:
+        line_end = body.find('\r\n', offset)
+        if line_end < 0:
+            return None
+        size = int(body[offset:line_end].split(';', 1)[0].strip(), 16)
+        offset = line_end + 2
+        if size == 0:
+            # the trailers, if any, end with an empty line
+            if body.find('\r\n\r\n', offset - 2) < 0:
+                return None
+            return ''.join(data_list)
+        if len(body) < offset + size + 2:
+            return None
+        data_list.append(body[offset:offset + size])
+        offset += size + 2
+
+
+class AsyncPlivoConnection(asyncore.dispatcher):
+    """A kept alive connection of the AsyncPlivoClient, it sends one request
+    at a time"""
+
+    def __init__(self, client):
+        asyncore.dispatcher.__init__(self, map=client.socket_map)
+        self.client = client
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connect(client.address)
+        self.request = None
+        self.deadline = None
+        self.served = 0
+        self.out_buffer = ''
+        self.in_buffer = ''
+
+    def start(self, request):
+        """Send a request, (endpoint, body, callback, retried)"""
+        self.request = request
+        self.deadline = time() + self.client.timeout
+        self.out_buffer = self.client.request_message(request[0], request[1])
+        self.in_buffer = ''
+
+    def writable(self):
+        return not self.connected or bool(self.out_buffer)
+
+    def handle_connect(self):
+        pass
+
+    def handle_write(self):
+        sent = self.send(self.out_buffer)
+        self.out_buffer = self.out_buffer[sent:]
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if data:
+            self.in_buffer += data
+            self.read_response()
+
+    def read_response(self, closed=False):
+        """Answer the request once the whole response is received, return
+        True when it's answered
+
+        The body is framed by its Content-Length, by the chunked transfer
+        encoding or, without both, by the close of the connection, given
+        by ``closed``.
+        """
+        header_end = self.in_buffer.find('\r\n\r\n')
+        if header_end < 0:
+            return False
+        line_list = self.in_buffer[:header_end].split('\r\n')
+        version, status = line_list[0].split(' ', 2)[:2]
+        status = int(status)
+        headers = dict([[part.strip() for part in line.split(':', 1)]
+                        for line in line_list[1:] if ':' in line])
+        headers = dict([(name.lower(), value)
+                        for name, value in headers.items()])
+        body = self.in_buffer[header_end + 4:]
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            data = read_chunked(body)
+            if data is None:
+                return False
+        elif 'content-length' in headers:
+            length = int(headers['content-length'])
+            if len(body) < length:
+                return False
+            data = body[:length]
+        elif status in (204, 304) or status < 200:
+            data = ''
+        elif closed:
+            data = body
+        else:
+            # the body ends with the connection
+            return False
+        keep_alive = not closed and version == 'HTTP/1.1' \
+            and headers.get('connection', '').lower() != 'close'
+
+        request = self.request
+        self.request = None
+        self.served += 1
+        self.client.release(self, keep_alive)
+        if not keep_alive:
+            self.close()
+        self.client.answer(request, status, data)
+        return True
+
+    def fail(self, error):
+        """Close the connection and fail its request, a request lost by an
+        idle connection closed by the server is sent again"""
+        request = self.request
+        self.request = None
+        self.client.release(self, False)
+        self.close()
+        if request is None:
+            return
+        if self.served and not self.in_buffer and not request[3]:
+            self.client.pending.appendleft(request[:3] + (True,))
+        else:
+            self.client.record(False)
+            request[2](None, PlivoError('%s : %s' % (request[0], error)))
+
+    def handle_close(self):
+        if self.request is not None and self.read_response(closed=True):
+            return
+        self.fail('connection closed')
+
+    def handle_error(self):
+        self.fail(sys.exc_info()[1])
+
+
+class AsyncPlivoClient(PlivoClient):
+    """Plivo client driven by an asyncore loop
+
+    Up to ``concurrency`` originates are in flight at once, on as many kept
+    alive connections, without a thread per request. The requests are
+    queued by originate and their callbacks are called by poll, which runs
+    the loop. Only plain HTTP is supported.
+    """
+
+    def __init__(self, *args, **kwargs):
+        PlivoClient.__init__(self, *args, **kwargs)
+        if self.connection_class != httplib.HTTPConnection:
+            raise ValueError('AsyncPlivoClient only supports http')
+        host, port = (self.host.split(':') + ['80'])[:2]
+        self.address = (host, int(port))
+        self.socket_map = {}
+        self.pending = deque()
+        self.busy = set()
+        self.idle_list = []
+
+    def in_flight(self):
+        """Number of requests queued or waiting for their answer"""
+        return len(self.pending) + len(self.busy)
+
+    def request_message(self, endpoint, body):
+        header = ['POST %s/%s/ HTTP/1.1' % (self.path, endpoint),
+                  'Host: %s' % self.host,
+                  'Content-Length: %d' % len(body)]
+        header += ['%s: %s' % item for item in self.headers.items()]
+        return '\r\n'.join(header) + '\r\n\r\n' + body
+
+    def send_request(self, endpoint, params, callback):
+        """Queue a request, callback(result, error) is called by poll"""
+        try:
+            self.check_circuit()
+        except CircuitOpen, e:
+            callback(None, e)
+            return
+        self.pending.append((endpoint, self.encode(params), callback, False))
+
+    def originate(self, call_params, callback):
+        """Queue an originate, callback(request_uuid, error) is called by
+        poll"""
+        def read_call(result, error):
+            if error is None:
+                try:
+                    result = self.read_call(result)['RequestUUID']
+                except PlivoError, e:
+                    result, error = None, e
+            callback(result, error)
+        self.send_request('Call', call_params, read_call)
+
+    def answer(self, request, status, data):
+        try:
+            result = self.read_answer(request[0], status, data)
+        except PlivoError, e:
+            request[2](None, e)
+        else:
+            request[2](result, None)
+
+    def release(self, connection, keep_alive):
+        self.busy.discard(connection)
+        if not keep_alive:
+            if connection in self.idle_list:
+                self.idle_list.remove(connection)
+        elif len(self.idle_list) < self.concurrency:
+            self.idle_list.append(connection)
+        else:
+            connection.close()
+
+    def dispatch(self):
+        """Send the queued requests on the free connections"""
+        while self.pending and \
+            (self.idle_list or len(self.busy) < self.concurrency):
+            if self.idle_list:
+                connection = self.idle_list.pop()
+            else:
+                self.connection_count += 1
+                connection = AsyncPlivoConnection(self)
+            self.busy.add(connection)
+            connection.start(self.pending.popleft())
+
+    def poll(self, timeout=0.05):
+        """Run the loop once, fail the requests waiting for too long"""
+        self.dispatch()
+        if self.socket_map:
+            asyncore.loop(timeout, use_poll=True, map=self.socket_map,
+                          count=1)
+        else:
+            sleep(timeout)
+        now = time()
+        for connection in list(self.busy):
+            if connection.deadline < now:
+                connection.fail('timed out')
+        self.dispatch()
+
+    def close(self):
+        for connection in list(self.socket_map.values()):
+            connection.close()
+        self.idle_list = []
+        self.busy = set()
+
+
+def get_plivo_client():
+    """Return the PlivoClient of the running process"""
+    client = _plivo_client.get(os.getpid())
+    if client is None:
+        _plivo_client.clear()
+        client = PlivoClient(settings.PLIVO_REST_API_URL,
+                             settings.PLIVO_SID, settings.PLIVO_AUTH_TOKEN,
+                             settings.PLIVO_API_VERSION,
+                             timeout=settings.PLIVO_TIMEOUT,
+                             concurrency=settings.PLIVO_CONCURRENCY,
+                             failure_threshold=settings.PLIVO_CIRCUIT_FAILURE,
+                             reset_timeout=settings.PLIVO_CIRCUIT_RESET)
+        _plivo_client[os.getpid()] = client
+    return client
+
+
+def call_plivo(callerid=None, phone_number=None, Gateways=None,
+               GatewayCodecs="'PCMA,PCMU'", GatewayTimeouts="60",
+               GatewayRetries='1', ExtraDialString=None,
+               AnswerUrl=None, HangupUrl=None, TimeLimit="3600"):
+    """Originate a call through the PlivoClient of the process, return the
+    answer of Plivo with its RequestUUID"""
+    return get_plivo_client().call(plivo_call_params(callerid=callerid,
+        phone_number=phone_number, Gateways=Gateways,
+        GatewayCodecs=GatewayCodecs, GatewayTimeouts=GatewayTimeouts,
+        GatewayRetries=GatewayRetries, ExtraDialString=ExtraDialString,
+        AnswerUrl=AnswerUrl, HangupUrl=HangupUrl, TimeLimit=TimeLimit))
+
 
-    return False
+def bulk_call_plivo(call_param_list):
+    """Originate a batch of calls, each item holds the arguments of
+    call_plivo, return the RequestUUID or the PlivoError of each call"""
+    result_list = [None] * len(call_param_list)
+    index_list = []
+    params_list = []
+    for index, call_param in enumerate(call_param_list):
+        try:
+            params_list.append(plivo_call_params(**call_param))
+            index_list.append(index)
+        except PlivoError, e:
+            result_list[index] = e
+    if params_list:
+        for index, result in zip(index_list,
+                                 get_plivo_client().bulk_call(params_list)):
+            result_list[index] = result
+    return result_list
@@ -87,6 +87,11 @@ js_info_dict = {
 urlpatterns = patterns('',
     (r'^logout/$', 'dialer_campaign.views.logout_view'),
     (r'^admin/', include(admin.site.urls)),
+    # callbacks of Plivo, ahead of their tastypie resources
+    (r'^api/v1/answercall/$', 'api.webhooks.answercall'),
+    (r'^api/v1/hangupcall/$', 'api.webhooks.hangupcall'),
+    (r'^api/v1/dialcallback/$', 'api.webhooks.dialcallback'),
+    (r'^api/v1/store_cdr_bulk/$', 'api.webhooks.store_cdr_bulk'),
     (r'^api/', include(tastypie_api.urls)),
     (r'^i18n/', include('django.conf.urls.i18n')),
     (r'^jsi18n/$', 'django.views.i18n.javascript_catalog', js_info_dict),